@@ -8,24 +8,27 @@ from __future__ import print_function
 
 # Standard library imports
 import os
+import random
 import signal
-from pprint import pprint
 from optparse import OptionParser, OptionGroup
 
 # Six imports
 from six.moves import range # pylint: disable=redefined-builtin
 
 # PyXT imports
+# Only the devices every machine has are imported here, optional subsystems are imported in main() when configured.
 from pyxt.constants import SIXTY_FOUR_KB, BIOS_LOCATION
 from pyxt.cpu import CPU
 from pyxt.debugger import Debugger
+from pyxt.checkpoint import DEFAULT_CHECKPOINT_INTERVAL
+from pyxt.breakpoints import WATCH_CHANGE
 from pyxt.bus import SystemBus
 from pyxt.memory import RAM, ROM
 from pyxt.chargen import CharacterGeneratorMDA_CGA_ROM
 from pyxt.mda import MonochromeDisplayAdapter, MDA_START_ADDRESS, MONO_PALETTES
-from pyxt.cga import ColorGraphicsAdapter, CGA_START_ADDRESS
-from pyxt.cpi import CharacterGeneratorCPI, CPI_MDA_SIZE, CPI_CGA_SIZE
 from pyxt.ui import PygameManager
+from pyxt.scheduler import Scheduler, TICK_FREQUENCY
+from pyxt.throttle import Throttle
 
 from pyxt.fdc import FloppyDisketteController, FloppyDisketteDrive, FIVE_INCH_360_KB
 from pyxt.dma import DmaController
@@ -42,6 +45,18 @@ log = logging.getLogger("pyxt")
 DEFAULT_DIP_SWITCHES = (SWITCHES_NORMAL_BOOT | SWITCHES_MEMORY_BANKS_FOUR | SWITCHES_VIDEO_MDA_HERC | SWITCHES_DISKETTES_TWO)
 DEFAULT_RAM_SIZE_KB = 640
 
+# CPU cycles to run between calls to the Pygame machine (about 200 us).
+SLICE_CYCLES = 1000
+
+# Longest stretch of idle time to skip before checking the keyboard and display again (10 ms).
+IDLE_SLICE_TICKS = TICK_FREQUENCY // 100
+
+# Seconds between metrics samples, matches pyxt.metrics.DEFAULT_INTERVAL without importing its HTTP server.
+DEFAULT_METRICS_INTERVAL = 5.0
+
+# CPU cycles between profile samples, matches pyxt.profiler.DEFAULT_INTERVAL without importing the profiler.
+DEFAULT_PROFILE_INTERVAL = 4773
+
 # Functions
 def parse_cmdline():
     """ Parse the command line arguments. """
@@ -54,6 +69,8 @@ def parse_cmdline():
                             help = "DIP switch byte to use.", default = DEFAULT_DIP_SWITCHES)
     system_group.add_option("--ram-size", action = "store", dest = "ram_size", default = DEFAULT_RAM_SIZE_KB, type = "int",
                             help = "Amount of RAM to add to the system in KB, default: 640.")
+    system_group.add_option("--seed", action = "store", type = "int", dest = "seed",
+                            help = "Seed for the random contents of video RAM at power on.")
     parser.add_option_group(system_group)
     
     diskette_group = OptionGroup(parser, "Diskette Options")
@@ -85,20 +102,68 @@ def parse_cmdline():
                              help = "Codepage to use in CPI file.")
     parser.add_option_group(chargen_group)
     
+    speed_group = OptionGroup(parser, "Speed Options")
+    speed_group.add_option("--speed", action = "store", type = "float", dest = "speed", default = 1.0,
+                           help = "Run at a multiple of the 4.77 MHz 8088 clock, default: 1.0.")
+    speed_group.add_option("--turbo", action = "store_const", const = None, dest = "speed",
+                           help = "Run as fast as possible instead of holding the emulated clock speed.")
+    parser.add_option_group(speed_group)
+    
     optimization_group = OptionGroup(parser, "Optimization Options")
     optimization_group.add_option("--skip-memory-test", action = "store_true", dest = "skip_memory_test",
                                   help = "Set the flag to skip the POST memory test.")
     optimization_group.add_option("--no-collapse-delay-loops", action = "store_false", dest = "collapse_delay_loops", default = True,
                                   help = "Set this flag to use the proper LOOP handler that doesn't optimize LOOP back to itself.")
+    optimization_group.add_option("--no-idle-fast-forward", action = "store_false", dest = "idle_fast_forward", default = True,
+                                  help = "Set this flag to run every clock tick while halted or spinning in an idle loop.")
+    optimization_group.add_option("--no-collapse-busy-waits", action = "store_false", dest = "collapse_busy_waits", default = True,
+                                  help = "Set this flag to run every iteration of loops that spin reading a status port.")
+    optimization_group.add_option("--no-fuse-instructions", action = "store_false", dest = "fuse_instructions", default = True,
+                                  help = "Set this flag to run common instruction pairs like CMP and Jcc one instruction at a time.")
+    optimization_group.add_option("--no-elide-refresh", action = "store_false", dest = "elide_refresh", default = True,
+                                  help = "Set this flag to clock every DRAM refresh through the timer and DMA controller.")
+    optimization_group.add_option("--hle-video", action = "store_true", dest = "hle_video",
+                                  help = "Service INT 10h teletype and scroll calls natively instead of in the ROM BIOS.")
     parser.add_option_group(optimization_group)
                   
     debugging_group = OptionGroup(parser, "Debugging Options")
     debugging_group.add_option("--debug", action = "store_true", dest = "debug",
                                help = "Enable DEBUG log level.")
+    debugging_group.add_option("--gdb", action = "store", dest = "gdb", metavar = "PORT|SOCKET",
+                               help = "Serve the GDB remote protocol on this localhost port or Unix socket path.")
+    debugging_group.add_option("--watch", action = "append", dest = "watchpoints", default = [], metavar = "ADDRESS[:KIND]",
+                               help = "Stop in the debugger when a byte of memory is accessed, KIND is read, write or change (default).")
+    debugging_group.add_option("--checkpoint-interval", action = "store", type = "int", dest = "checkpoint_interval",
+                               default = DEFAULT_CHECKPOINT_INTERVAL,
+                               help = "Instructions between the debugger's checkpoints for reverse-step, 0 to disable, default: %d." % DEFAULT_CHECKPOINT_INTERVAL)
     debugging_group.add_option("--log-file", action = "store", dest = "log_file",
                                help = "File to output debugging log.")
     debugging_group.add_option("--log-filter", action = "store", dest = "log_filter",
                                help = "Log filter to apply to stderr handler.")
+    debugging_group.add_option("--metrics-log", action = "store_true", dest = "metrics_log",
+                               help = "Periodically log the instruction rate and device activity counters.")
+    debugging_group.add_option("--metrics-port", action = "store", type = "int", dest = "metrics_port",
+                               help = "Serve the instruction rate and device activity counters as JSON on this localhost port.")
+    debugging_group.add_option("--metrics-interval", action = "store", type = "float", dest = "metrics_interval",
+                               default = DEFAULT_METRICS_INTERVAL, help = "Seconds between metrics samples, default: 5.")
+    debugging_group.add_option("--record", action = "store", dest = "record",
+                               help = "Record the keyboard and display inputs to this file so the run can be replayed.")
+    debugging_group.add_option("--replay", action = "store", dest = "replay",
+                               help = "Replay the inputs recorded in this file, unthrottled, then carry on live.")
+    debugging_group.add_option("--trace", action = "store", dest = "trace",
+                               help = "Record every instruction to this binary trace file, decode it with python -m pyxt.trace.")
+    debugging_group.add_option("--no-trace-compression", action = "store_false", dest = "trace_compression", default = True,
+                               help = "Set this flag to write the trace blocks uncompressed.")
+    debugging_group.add_option("--profile", action = "store", dest = "profile",
+                               help = "Sample the guest's call stack and write collapsed stacks to this file on exit.")
+    debugging_group.add_option("--profile-interval", action = "store", type = "int", dest = "profile_interval",
+                               default = DEFAULT_PROFILE_INTERVAL, help = "CPU cycles between profile samples, default: %d." % DEFAULT_PROFILE_INTERVAL)
+    debugging_group.add_option("--profile-map", action = "append", dest = "profile_maps", default = [],
+                               help = "MAP file to name profile frames with, as FILE or FILE@SEGMENT to relocate it.")
+    debugging_group.add_option("--profile-far-frames", action = "store_true", dest = "profile_far_frames",
+                               help = "Set this flag if the guest program uses far calls (large memory model).")
+    debugging_group.add_option("--profile-instructions", action = "store_true", dest = "profile_instructions",
+                               help = "Set this flag to add the sampled instruction, disassembled, to each stack.")
     parser.add_option_group(debugging_group)
     
     return parser.parse_args()
@@ -122,6 +187,17 @@ def main():
     if options.log_file:
         log.addHandler(logging.FileHandler(options.log_file))
         
+    # A replay takes the video RAM seed from its log, a recording picks one so it can be replayed.
+    seed = options.seed
+    replay_header = replay_events = None
+    if options.replay:
+        from pyxt.replay import read_replay_log
+        with open(options.replay, "r") as fileptr:
+            replay_header, replay_events = read_replay_log(fileptr)
+        seed = replay_header["seed"]
+    elif options.record and seed is None:
+        seed = random.randrange(0x100000000)
+        
     # The PIC and DMA controller are integral to the ISA/XT bus and need to be part of the bus.
     # They will also be installed below so they can be configured via I/O ports.
     pic = ProgrammableInterruptController(0x020)
@@ -149,20 +225,24 @@ def main():
         if options.mda_cga_rom:
             char_generator = CharacterGeneratorMDA_CGA_ROM(options.mda_cga_rom, CharacterGeneratorMDA_CGA_ROM.MDA_FONT)
         elif options.cpi_file and options.cpi_codepage:
+            from pyxt.cpi import CharacterGeneratorCPI, CPI_MDA_SIZE
             char_generator = CharacterGeneratorCPI(options.cpi_file, options.cpi_codepage, CPI_MDA_SIZE, width_override = 9)
         else:
             raise ValueError("No character ROM provided for the MonochromeDisplayAdapter.")
             
-        video_card = MonochromeDisplayAdapter(char_generator, randomize = True, palette = MONO_PALETTES[options.mono_palette])
+        video_card = MonochromeDisplayAdapter(char_generator, randomize = True, palette = MONO_PALETTES[options.mono_palette],
+                                              seed = seed)
         bus.install_device(MDA_START_ADDRESS, video_card)
     elif options.display == "cga":
+        from pyxt.cga import ColorGraphicsAdapter
         if options.mda_cga_rom:
             char_generator = CharacterGeneratorMDA_CGA_ROM(options.mda_cga_rom, CharacterGeneratorMDA_CGA_ROM.CGA_WIDE_FONT)
         elif options.cpi_file and options.cpi_codepage:
+            from pyxt.cpi import CharacterGeneratorCPI, CPI_CGA_SIZE
             char_generator = CharacterGeneratorCPI(options.cpi_file, options.cpi_codepage, CPI_CGA_SIZE)
         else:
             raise ValueError("No character ROM provided for the ColorGraphicsAdapter.")
-        video_card = ColorGraphicsAdapter(char_generator, randomize = True)
+        video_card = ColorGraphicsAdapter(char_generator, randomize = True, seed = seed)
         # Use MDA start address until devices can be installed on non-64k boundaries.
         bus.install_device(MDA_START_ADDRESS, video_card)
     else:
@@ -191,6 +271,7 @@ def main():
     pit.channels[1].gate = True
     pit.channels[2].gate = True
     bus.install_device(None, pit)
+    pit.elide_refresh(options.elide_refresh)
     
     ppi = ProgrammablePeripheralInterface(0x060)
     ppi.dip_switches = options.dip_switches
@@ -198,6 +279,7 @@ def main():
     bus.install_device(None, ppi)
     
     if options.debug:
+        from pprint import pprint
         print("\nSYSTEM BUS:")
         pprint(bus.devices)
         pprint(bus.io_decoder)
@@ -208,28 +290,154 @@ def main():
     # Select the desired LOOP instruction handler.
     cpu.collapse_delay_loops(options.collapse_delay_loops)
     
+    # Halt in idle loops so the time until the next interrupt can be skipped.
+    cpu.detect_idle_loops(options.idle_fast_forward)
+    cpu.collapse_busy_waits(options.collapse_busy_waits)
+    
+    # Superinstructions, the debugger (for breakpoints too), GDB and the tracer need to see every instruction.
+    debugging = options.debug or args or options.watchpoints or options.gdb or options.trace
+    fuse_instructions = bool(options.fuse_instructions and not debugging)
+    cpu.fuse_instructions(fuse_instructions)
+    
+    clocked_devices = [pit, dma_controller]
+    
+    # The video card works out its retrace status from emulated time.
+    if video_card is not None:
+        clocked_devices.append(video_card)
+        
+    # Optional sampling profiler, it is clocked with the devices so it costs nothing unless it's used.
+    profiler = None
+    if options.profile:
+        from pyxt.profiler import SamplingProfiler, SymbolMap
+        symbols = SymbolMap()
+        for map_file in options.profile_maps:
+            filename, _, segment = map_file.partition("@")
+            symbols.load(filename, int(segment, 16) if segment else 0)
+        disassembler = None
+        if options.profile_instructions:
+            from pyxt.disassembler import Disassembler
+            disassembler = Disassembler(bus)
+        profiler = SamplingProfiler(cpu, options.profile_interval, symbols, far_frames = options.profile_far_frames,
+                                    disassembler = disassembler)
+        clocked_devices.append(profiler)
+        
+    scheduler = Scheduler(cpu, clocked_devices)
+    bus.scheduler = scheduler
+    
+    # Optionally handle the BIOS video services natively.
+    if options.hle_video and video_card:
+        from pyxt.hle import VideoBiosHLE
+        VideoBiosHLE(bus, video_card).install(cpu)
+        
     debugger = Debugger(cpu, bus)
     for breakpoint in args:
         (cs, ip) = breakpoint.split(":")
-        debugger.breakpoints.append((int(cs, 16), int(ip, 16)))
+        debugger.breakpoints.add(int(cs, 16), int(ip, 16))
+    for watchpoint in options.watchpoints:
+        address, _, kind = watchpoint.partition(":")
+        debugger.watchpoints.add(int(address, 0), kind = kind or WATCH_CHANGE)
         
     if options.debug:
         signal.signal(signal.SIGINT, debugger.break_signal)
+        
+        # Snapshots so the debugger can step backwards, the idle time must be skipped the same way as below.
+        if options.checkpoint_interval:
+            debugger.enable_checkpoints(scheduler, IDLE_SLICE_TICKS, options.checkpoint_interval)
+            
+        fetch = debugger.fetch
+    elif len(debugger.breakpoints) or len(debugger.watchpoints):
+        # Breakpoints without the rest of the debugger's work on every instruction.
+        signal.signal(signal.SIGINT, debugger.break_signal)
+        fetch = debugger.armed(cpu.fetch)
+    else:
+        fetch = cpu.fetch
+        
+    # Remote debugging, nothing changes until a client connects.
+    gdb_stub = None
+    if options.gdb:
+        from pyxt.gdbstub import GdbStub, parse_address as parse_gdb_address
+        gdb_stub = GdbStub(cpu, bus, fetch, parse_gdb_address(options.gdb))
+        gdb_stub.start()
     
-    cpu_or_debugger = debugger if options.debug else cpu
+    # Optional binary trace of every instruction.
+    tracer = None
+    if options.trace:
+        from pyxt.trace import BinaryTracer
+        tracer = BinaryTracer(cpu, open(options.trace, "wb"), options.trace_compression)
+        fetch = tracer.traced(fetch)
+        
+    # Everything the machine does is determined by its inputs from the host, these can be recorded or replayed.
+    session = None
+    if options.record or options.replay:
+        from pyxt.replay import InputRecorder, InputReplayer, SessionKeyboard, SessionDisplay, file_digest
+        machine = {
+            "bios" : file_digest(options.bios),
+            "diskettes" : [file_digest(options.diskette), file_digest(options.diskette2)],
+            "display" : options.display,
+            "ram_size" : options.ram_size,
+            "dip_switches" : options.dip_switches,
+            "skip_memory_test" : options.skip_memory_test,
+            "collapse_delay_loops" : options.collapse_delay_loops,
+            "idle_fast_forward" : options.idle_fast_forward,
+            "collapse_busy_waits" : options.collapse_busy_waits,
+            "fuse_instructions" : fuse_instructions,
+            "elide_refresh" : options.elide_refresh,
+            "hle_video" : options.hle_video,
+        }
+        
+    if options.record:
+        session = InputRecorder(cpu, ppi, video_card, open(options.record, "w"), seed = seed, machine = machine)
+    elif options.replay:
+        for key, value in sorted(replay_header["machine"].items()):
+            if machine.get(key) != value:
+                log.warning("Replay was recorded with %s = %r, not %r, it will probably diverge.", key, value, machine.get(key))
+        session = InputReplayer(cpu, ppi, video_card, replay_events)
+        
+    if session is not None:
+        pygame_manager = PygameManager(SessionKeyboard(session), SessionDisplay(session), debugger if options.debug else None)
+    else:
+        pygame_manager = PygameManager(ppi, video_card, debugger if options.debug else None)
+        
+    throttle = Throttle(None if options.replay else options.speed)
     
-    pygame_manager = PygameManager(ppi, video_card, debugger if options.debug else None)
+    # Optional sampling of the activity counters.
+    metrics = None
+    if options.metrics_log or options.metrics_port:
+        from pyxt.metrics import Metrics, MetricsServer
+        metrics = Metrics(cpu, bus, pic, dma_controller, diskette_controller, video_card,
+                          interval = options.metrics_interval, log_samples = options.metrics_log)
+        if options.metrics_port:
+            MetricsServer(metrics, options.metrics_port).start()
+            
+    # A GDB client swaps in a fetch() that checks its breakpoints.
+    slice_fetch = fetch
     
     try:
         while True:
+            if session is not None:
+                session.poll()
             pygame_manager.poll()
             
-            # Run 50 iterations of PyXT between calls to the Pygame machine.
-            for _ in range(50):
-                pit.clock()
-                dma_controller.clock()
-                cpu_or_debugger.fetch()
+            if gdb_stub is not None and gdb_stub.attention:
+                gdb_stub.poll()
+                slice_fetch = gdb_stub.fetch if gdb_stub.attached else fetch
+                
+            # Run a slice of CPU cycles between calls to the Pygame machine.
+            scheduler.run(slice_fetch, SLICE_CYCLES)
+            
+            # While the CPU waits for an interrupt skip ahead to the next device event.
+            if cpu.hlt:
+                if options.idle_fast_forward or cpu.busy_wait:
+                    scheduler.idle(IDLE_SLICE_TICKS)
+                else:
+                    scheduler.idle(SLICE_CYCLES)
+                    
+            # Sleep off any time the emulated machine is ahead of the wall clock.
+            throttle.pace(cpu.cycles)
             
+            if metrics is not None:
+                metrics.poll()
+                
     except Exception:
         debugger.dump_all(logging.ERROR)
         log.exception("Unhandled exception at CS:IP 0x%04x:0x%04x", cpu.regs.CS, cpu.regs.IP)
@@ -238,6 +446,16 @@ def main():
         if options.debug:
             debugger.enter_debugger()
             
+    finally:
+        if options.record:
+            session.close()
+        if tracer is not None:
+            tracer.close()
+        if profiler is not None:
+            profiler.save(options.profile)
+        if gdb_stub is not None:
+            gdb_stub.close()
+            
 if __name__ == "__main__":
     if os.environ.get("PYXT_PROFILING"):
         import cProfile
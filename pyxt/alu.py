@@ -0,0 +1,186 @@
+"""
+pyxt.alu - Precomputed flag tables for the 8-bit ALU.
+
+The flags an 8-bit operation leaves behind only depend on its operands (and the carry flag coming in), so
+they are worked out once here and packed into a word with the same layout as the FLAGS register.  The CPU
+looks the packed word up and hands it to FLAGS, which turns it into its separate flags with one tuple
+assignment from FLAG_VALUES.
+
+ADD_FLAGS_8 and SUB_FLAGS_8 are indexed by carry_in << 16 | operand_a << 8 | operand_b, ADD/SUB use a
+carry in of zero and INC/DEC use an operand_b of 1.  The results themselves are a single add or subtract
+so they are not stored.  Shifts and rotates do need the result, their tables hold result << 12 | flags.
+
+Working the 128K entries out one at a time would add most of a tenth of a second to startup, so the
+arithmetic tables are built with every entry as a 16 bit lane of one big integer and the flags are
+calculated for all of them at once with shifts and masks.
+"""
+
+# Standard library imports
+import sys
+import array
+from binascii import hexlify, unhexlify
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.helpers import *
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# Bits of the packed flags, these match the FLAGS register.
+PACKED_CARRY = 0x0001
+PACKED_PARITY = 0x0004
+PACKED_ADJUST = 0x0010
+PACKED_ZERO = 0x0040
+PACKED_SIGN = 0x0080
+PACKED_OVERFLOW = 0x0800
+
+# Shift and rotate sub-opcodes of the 0xD0 - 0xD3 group that have tables.
+SHIFT_ROL = 0x00
+SHIFT_ROR = 0x01
+SHIFT_RCL = 0x02
+SHIFT_RCR = 0x03
+SHIFT_SHL = 0x04
+SHIFT_SHR = 0x05
+SHIFT_SAR = 0x07
+
+# The packed flags are in the low 12 bits of a shift table entry and the result is above them.
+SHIFT_RESULT_SHIFT = 12
+SHIFT_FLAGS_MASK = 0x0FFF
+
+# Functions
+def build_flag_values():
+    """ Returns a list of (carry, parity, adjust, zero, sign, overflow) for every packed flags word. """
+    return [(
+        packed & PACKED_CARRY != 0,
+        packed & PACKED_PARITY != 0,
+        packed & PACKED_ADJUST != 0,
+        packed & PACKED_ZERO != 0,
+        packed & PACKED_SIGN != 0,
+        packed & PACKED_OVERFLOW != 0,
+    ) for packed in range(PACKED_OVERFLOW << 1)]
+    
+def build_result_flags_8():
+    """
+    Returns the packed CF, PF, ZF and SF for every 9 bit result, bit 8 being the carry (or borrow).
+    
+    Negative results from a subtraction index this masked with 0x1FF.
+    """
+    return array.array("H", [
+        (PACKED_CARRY if result & 0x100 else 0) |
+        (PACKED_PARITY if count_bits_fast(result & 0xFF) % 2 == 0 else 0) |
+        (PACKED_ZERO if result & 0xFF == 0 else 0) |
+        (result & PACKED_SIGN)
+        for result in range(0x200)
+    ])
+    
+def words_to_lanes(words):
+    """ Pack an array of words into an integer, the first word in the most significant lane. """
+    words = array.array("H", words)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return int(hexlify(words.tobytes() if hasattr(words, "tobytes") else words.tostring()), 16)
+    
+def lanes_to_words(lanes, count):
+    """ Unpack count words from an integer built by words_to_lanes(). """
+    words = array.array("H", unhexlify("%0*x" % (count * 4, lanes)))
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words
+    
+def packed_flags_lanes(operand_a, operand_b, result, ones):
+    """ Returns the packed flags in each lane given the operands and 9 bit result in each lane. """
+    low = result & (ones * 0xFF)
+    
+    # Bit n of a ^ b ^ result is the carry (or borrow) into bit n, bit 8 is the carry out of bit 7.
+    carries = operand_a ^ operand_b ^ result
+    
+    # Fold the low byte down to its parity in bit 0, bits from the next lane only reach bits 9 and up.
+    parity = low ^ (low >> 4)
+    parity ^= parity >> 2
+    parity ^= parity >> 1
+    
+    # Adding 0xFF to a byte only carries into bit 8 if it isn't zero.
+    not_zero = ((low + ones * 0xFF) >> 8) & ones
+    
+    return (
+        ((result >> 8) & ones) |
+        (((parity & ones) ^ ones) << 2) |
+        (carries & (ones * PACKED_ADJUST)) |
+        ((not_zero ^ ones) << 6) |
+        (result & (ones * PACKED_SIGN)) |
+        ((((carries >> 7) ^ (carries >> 8)) & ones) << 11)
+    )
+    
+def build_arithmetic_flags_8():
+    """ Returns the ADD_FLAGS_8 and SUB_FLAGS_8 tables, indexed as described at the top of the module. """
+    count = 0x20000
+    ones = ((1 << (count * 16)) - 1) // 0xFFFF
+    
+    rows = array.array("H")
+    for operand_a in range(0x100):
+        rows.extend(array.array("H", [operand_a]) * 0x100)
+    operand_a = words_to_lanes(rows * 2)
+    operand_b = words_to_lanes(array.array("H", range(0x100)) * 0x200)
+    carry_in = words_to_lanes(array.array("H", [0]) * 0x10000 + array.array("H", [1]) * 0x10000)
+    
+    # Subtract from a + 0x200 so no lane goes negative and borrows from the next one.
+    add_result = operand_a + operand_b + carry_in
+    sub_result = (operand_a + ones * 0x200 - operand_b - carry_in) & (ones * 0x1FF)
+    return (
+        lanes_to_words(packed_flags_lanes(operand_a, operand_b, add_result, ones), count),
+        lanes_to_words(packed_flags_lanes(operand_a, operand_b, sub_result, ones), count),
+    )
+    
+def shift_8(operation, value, carry_in, count):
+    """ Returns the result and carry flag of an 8-bit shift or rotate by a count of at least 1. """
+    if operation == SHIFT_ROL:
+        return rotate_left_8_bits(value, count)
+    elif operation == SHIFT_ROR:
+        return rotate_right_8_bits(value, count)
+    elif operation == SHIFT_RCL:
+        return rotate_thru_carry_left_8_bits(value, carry_in, count)
+    elif operation == SHIFT_RCR:
+        return rotate_thru_carry_right_8_bits(value, carry_in, count)
+    elif operation == SHIFT_SHL:
+        return (value << count) & 0xFF, (value << count) & 0x100 == 0x100
+    elif operation == SHIFT_SHR:
+        return value >> count, (value >> (count - 1)) & 0x01 == 0x01
+    elif operation == SHIFT_SAR:
+        return shift_arithmetic_right_8_bits(value, count)
+    raise ValueError("No shift table for operation %r." % operation)
+    
+def build_shift_table_8(operation, count):
+    """
+    Returns the table for one shift or rotate and count, indexed by carry_in << 8 | value.
+    
+    ZF, SF and PF follow the result and CF is the last bit shifted out.  Only a SHL by 1 sets OF.
+    """
+    table = array.array("L")
+    for carry_in in (0, 1):
+        for value in range(0x100):
+            result, carry = shift_8(operation, value, carry_in, count)
+            packed = (RESULT_FLAGS_8[result] & ~PACKED_CARRY) | (PACKED_CARRY if carry else 0)
+            if operation == SHIFT_SHL and count == 1 and (value ^ result) & 0x80:
+                packed |= PACKED_OVERFLOW
+            table.append(result << SHIFT_RESULT_SHIFT | packed)
+    return table
+    
+def get_shift_table_8(operation, count):
+    """ Returns the table for a shift or rotate by count, building it the first time it is used. """
+    table = SHIFT_TABLES_8[operation][count]
+    if table is None:
+        table = SHIFT_TABLES_8[operation][count] = build_shift_table_8(operation, count)
+    return table
+    
+FLAG_VALUES = build_flag_values()
+RESULT_FLAGS_8 = build_result_flags_8()
+ADD_FLAGS_8, SUB_FLAGS_8 = build_arithmetic_flags_8()
+
+# A program only uses a few counts so the shift tables are built as they are needed, [operation][count].
+SHIFT_TABLES_8 = [[None] * 0x100 for _ in range(8)]
@@ -0,0 +1,6 @@
+"""
+pyxt.bench - Benchmarks for PyXT.
+
+Run "python -m pyxt.bench" to time the microbenchmarks, see pyxt.bench.__main__ for saving the results as
+JSON and comparing them against an earlier run.
+"""
@@ -0,0 +1,117 @@
+"""
+pyxt.bench.__main__ - Command line for the benchmarks.
+
+"python -m pyxt.bench --save results.json" times every benchmark and saves the results, then after a change
+"python -m pyxt.bench --compare results.json" reports how each one moved and exits with status 1 if any
+got slower than the threshold.  With --macro the end to end workloads in pyxt.bench.macro are measured
+instead, their wall time, instruction rate and peak memory are saved and compared the same way.
+"""
+
+from __future__ import print_function
+
+# Standard library imports
+import os
+import sys
+from optparse import OptionParser
+
+# Pygame prints a banner when imported by the display benchmarks.
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+# PyXT imports
+from pyxt.bench.runner import (run_benchmarks, save_results, load_results, compare_results, print_comparison,
+                               DEFAULT_REPEAT, DEFAULT_MIN_TIME, DEFAULT_THRESHOLD)
+from pyxt.bench.micro import get_benchmarks
+from pyxt.bench.macro import (run_workloads, workload_available, add_image_options, WORKLOAD_NAMES,
+                              DEFAULT_REPEAT as DEFAULT_MACRO_REPEAT)
+
+# Functions
+def parse_cmdline():
+    """ Parse the command line options. """
+    parser = OptionParser(usage = "python -m pyxt.bench [options] [NAME_FILTER...]")
+    parser.add_option("--list", action = "store_true", dest = "list",
+                      help = "List the benchmarks and exit.")
+    parser.add_option("--macro", action = "store_true", dest = "macro",
+                      help = "Run the end to end workloads instead of the microbenchmarks.")
+    parser.add_option("--repeat", action = "store", type = "int", dest = "repeat",
+                      help = "Times to repeat each benchmark, the fastest is kept, default: %d (%d with --macro)." % (
+                          DEFAULT_REPEAT, DEFAULT_MACRO_REPEAT))
+    parser.add_option("--min-time", action = "store", type = "float", dest = "min_time", default = DEFAULT_MIN_TIME,
+                      help = "Minimum seconds for each repetition, default: %s." % DEFAULT_MIN_TIME)
+    parser.add_option("--save", action = "store", dest = "save",
+                      help = "Write the results to this JSON file.")
+    parser.add_option("--compare", action = "store", dest = "compare",
+                      help = "Compare the results against a JSON file from an earlier run.")
+    parser.add_option("--threshold", action = "store", type = "float", dest = "threshold",
+                      default = DEFAULT_THRESHOLD * 100,
+                      help = "Percentage slower than the baseline that counts as a regression, default: %d." % (DEFAULT_THRESHOLD * 100))
+    add_image_options(parser)
+    return parser.parse_args()
+    
+def run_micro(options, name_filters):
+    """ Time the microbenchmarks, returning the results document or None if they were only listed. """
+    benchmarks = [benchmark for benchmark in get_benchmarks()
+                  if not name_filters or any(name_filter in benchmark.name for name_filter in name_filters)]
+    if options.list:
+        for benchmark in benchmarks:
+            print(benchmark.name)
+        return None
+        
+    def _progress(name, seconds):
+        print("%-40s %12.1f ns" % (name, seconds * 1e9))
+        sys.stdout.flush()
+        
+    return run_benchmarks(benchmarks, options.repeat or DEFAULT_REPEAT, options.min_time, _progress)
+    
+def run_macro(options, name_filters):
+    """ Measure the workloads, returning the results document or None if they were only listed. """
+    names = [name for name in WORKLOAD_NAMES
+             if not name_filters or any(name_filter in name for name_filter in name_filters)]
+    if options.list:
+        for name in names:
+            print(name)
+        return None
+        
+    for name in names:
+        if not workload_available(name, options):
+            print("%-12s skipped, it needs --bios and --diskette" % name)
+    names = [name for name in names if workload_available(name, options)]
+    
+    def _progress(name, measurement):
+        print("%-12s %10.1f ms %12.0f instructions/s %10s KB peak" % (
+            name, measurement["wall_time_ms"], measurement["instructions_per_second"],
+            measurement.get("peak_rss_kb", "?")))
+        fusion = measurement.get("fusion", {})
+        if fusion:
+            # Each superinstruction saves at least one fetch().
+            started = sum(fusion.values())
+            print("%-12s %10d superinstructions, %.1f%% of instructions: %s" % (
+                "", started, 100.0 * started / measurement["instructions"],
+                ", ".join("%s %d" % (name, fusion[name]) for name in sorted(fusion))))
+        sys.stdout.flush()
+        
+    return run_workloads(names, options, options.repeat or DEFAULT_MACRO_REPEAT, _progress)
+    
+def main():
+    """ Run the benchmarks named on the command line, or all of them. """
+    options, name_filters = parse_cmdline()
+    
+    baseline = load_results(options.compare) if options.compare and not options.list else None
+    
+    document = run_macro(options, name_filters) if options.macro else run_micro(options, name_filters)
+    if document is None:
+        return
+        
+    if options.save:
+        save_results(document, options.save)
+        
+    if baseline is not None:
+        comparison, regressions = compare_results(baseline, document, options.threshold / 100.0)
+        heading = "Result" if options.macro else "Benchmark (ns per operation)"
+        print("\n%-40s %12s %12s %9s" % (heading, "Baseline", "Now", "Change"))
+        print_comparison(comparison, regressions)
+        if regressions:
+            print("\n%d of %d benchmarks are more than %s%% slower." % (len(regressions), len(comparison), options.threshold))
+            sys.exit(1)
+            
+if __name__ == "__main__":
+    main()
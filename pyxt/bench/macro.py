@@ -0,0 +1,371 @@
+"""
+pyxt.bench.macro - End to end workloads run on a whole machine with no window.
+
+Each workload builds the same machine as pyxt.__main__, with the MDA drawing to an off screen surface, and
+runs it to a fixed end point:
+
+    codegolf    files/codegolf (the program demo.py runs) run several times from a clean slate.
+    testbios    The POST-style ROM from pyxt.bench.testbios: memory test, timer, DMA and diskette.
+    freedos     A BIOS and a boot diskette supplied with --bios and --diskette, booted to the prompt where
+                a script of keystrokes is typed.
+                
+Workloads are measured in a fresh interpreter each ("python -m pyxt.bench.macro NAME" prints the measurement
+as JSON) so the peak memory of one doesn't hide another's.
+"""
+
+from __future__ import print_function
+
+# Standard library imports
+import os
+import sys
+import json
+import array
+import subprocess
+import timeit
+from optparse import OptionParser
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# Pygame prints a banner when imported by the display code.
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+# PyXT imports
+from pyxt.bench.runner import results_document
+from pyxt.bench.micro import FILES_DIRECTORY, load_font
+from pyxt.bench.testbios import build_test_bios, DEFAULT_MEMORY_SEGMENTS, DEFAULT_TIMER_TICKS
+from pyxt.constants import SIXTY_FOUR_KB, BIOS_LOCATION
+from pyxt.bus import SystemBus
+from pyxt.memory import RAM, ROM
+from pyxt.cpu import CPU
+from pyxt.mda import MonochromeDisplayAdapter, MDA_START_ADDRESS, MDA_RESOLUTION, MDA_COLUMNS, MDA_ROWS
+from pyxt.fdc import FloppyDisketteController, FloppyDisketteDrive, FIVE_INCH_360_KB
+from pyxt.dma import DmaController
+from pyxt.nmi_mask import NMIMaskRegister
+from pyxt.ppi import *
+from pyxt.timer import ProgrammableIntervalTimer
+from pyxt.pic import ProgrammableInterruptController
+from pyxt.scheduler import Scheduler, TICK_FREQUENCY
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+DIP_SWITCHES = (SWITCHES_NORMAL_BOOT | SWITCHES_MEMORY_BANKS_FOUR | SWITCHES_VIDEO_MDA_HERC | SWITCHES_DISKETTES_TWO)
+RAM_SIZE_KB = 640
+
+# The same slices as pyxt.__main__.
+SLICE_CYCLES = 1000
+IDLE_SLICE_TICKS = TICK_FREQUENCY // 100
+
+# How often a workload's end condition is checked, in emulated time (10 ms).
+CHECK_INTERVAL_CYCLES = TICK_FREQUENCY // 100
+
+# The keyboard answers a reset with its self test code this long after (500 ms, like PygameManager).
+KEYBOARD_RESET_CYCLES = TICK_FREQUENCY // 2
+
+# Time between the make and break of a typed key, and between keys (50 ms).
+KEY_CYCLES = TICK_FREQUENCY // 20
+
+CODEGOLF_FILE = os.path.join(FILES_DIRECTORY, "codegolf")
+CODEGOLF_RUNS = 25
+CODEGOLF_STACK = 0x0100
+
+# Emulated seconds a workload may run (or each step of a script wait) before it's considered stuck.
+DEFAULT_TIMEOUT = 60
+
+# Wait for the prompt, type VER and wait for the prompt to come back.
+FREEDOS_SCRIPT = (
+    ("wait", "A:\\>"),
+    ("type", "ver\r"),
+    ("wait", "A:\\>"),
+)
+
+DEFAULT_REPEAT = 3
+
+# Functions
+def run_codegolf(options, runs = CODEGOLF_RUNS):
+    """ Run the codegolf program until it halts, runs times over. """
+    with open(CODEGOLF_FILE, "rb") as fileptr:
+        program = bytearray(fileptr.read())
+        
+    machine = HeadlessMachine()
+    cpu = machine.cpu
+    memory = machine.bus.devices[0]
+    blank = array.array("B", bytearray(SIXTY_FOUR_KB))
+    for _ in range(runs):
+        memory.contents[:] = blank
+        memory.contents[:len(program)] = array.array("B", program)
+        cpu.hlt = False
+        cpu.regs.CS = cpu.regs.DS = cpu.regs.ES = cpu.regs.SS = 0x0000
+        cpu.regs.IP = 0x0000
+        cpu.regs.SP = CODEGOLF_STACK
+        if not machine.run():
+            raise RuntimeError("codegolf didn't halt.")
+            
+    return machine
+    
+def run_test_bios(options, memory_segments = DEFAULT_MEMORY_SEGMENTS, timer_ticks = DEFAULT_TIMER_TICKS):
+    """ Boot the test BIOS until it halts, with a diskette of a repeating byte pattern in drive A:. """
+    machine = HeadlessMachine(rom = build_test_bios(memory_segments, timer_ticks))
+    drive = machine.drives[0]
+    drive.contents = array.array("B", bytearray(range(256)) * (drive.size_in_bytes // 256))
+    if not machine.run():
+        raise RuntimeError("The test BIOS didn't halt.")
+        
+    return machine
+    
+def run_freedos(options, script = FREEDOS_SCRIPT):
+    """ Boot a BIOS image from a diskette image and follow a script of waits for text and keys to type. """
+    with open(options.bios, "rb") as fileptr:
+        machine = HeadlessMachine(rom = fileptr.read())
+        
+    # Like --skip-memory-test, the test BIOS workload covers a memory test.
+    machine.bus.mem_write_word(0x0472, 0x1234)
+    machine.drives[0].load_diskette(options.diskette, write_protect = True)
+    
+    for action, text in script:
+        if action == "wait":
+            seen = machine.screen_text().count(text)
+            if not machine.run(lambda: machine.screen_text().count(text) > seen, options.timeout):
+                raise RuntimeError("Timed out waiting for %r, the screen shows:\n%s" % (text, machine.screen_text()))
+        elif action == "type":
+            machine.type_text(text)
+        else:
+            raise ValueError("Unknown script action: %r" % action)
+            
+    return machine
+    
+def peak_rss_kb():
+    """ Return the peak resident set size of this process in KB, or None where it can't be measured. """
+    try:
+        import resource
+    except ImportError:
+        return None
+        
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    # Linux reports KB, macOS bytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+    
+def measure_workload(name, options):
+    """
+    Run a workload in this process and return its measurement.
+    
+    The wall time includes building the machine, the instruction rate is only over the time spent running.  The
+    fusion counts are how many times each superinstruction was started.
+    """
+    start = timeit.default_timer()
+    machine = WORKLOADS[name][0](options)
+    wall_time = timeit.default_timer() - start
+    
+    measurement = {
+        "wall_time_ms" : wall_time * 1000.0,
+        "instructions" : machine.cpu.instruction_count,
+        "instructions_per_second" : machine.cpu.instruction_count / machine.run_time,
+        "fusion" : dict(machine.cpu.fusion_counts),
+    }
+    peak = peak_rss_kb()
+    if peak is not None:
+        measurement["peak_rss_kb"] = peak
+    return measurement
+    
+def workload_available(name, options):
+    """ Return True if everything a workload needs was supplied. """
+    _run, needs_images = WORKLOADS[name]
+    return not needs_images or bool(options.bios and options.diskette)
+    
+def run_workload(name, options):
+    """ Measure a workload in a new interpreter, returning the measurement. """
+    command = [sys.executable, "-m", "pyxt.bench.macro", name, "--timeout", str(options.timeout)]
+    if options.bios:
+        command.extend(["--bios", options.bios])
+    if options.diskette:
+        command.extend(["--diskette", options.diskette])
+        
+    output = subprocess.check_output(command)
+    return json.loads(output.decode("utf-8"))
+    
+def run_workloads(names, options, repeat = DEFAULT_REPEAT, progress = None):
+    """
+    Measure each workload, keeping the fastest of repeat runs, and return the results document.
+    
+    The results are named macro.<workload>.<metric>, progress(name, measurement) is called after each.
+    """
+    results = {}
+    for name in names:
+        measurements = [run_workload(name, options) for _ in range(repeat)]
+        measurement = min(measurements, key = lambda measurement: measurement["wall_time_ms"])
+        for metric in ("wall_time_ms", "instructions_per_second", "peak_rss_kb"):
+            if metric in measurement:
+                results["macro.%s.%s" % (name, metric)] = measurement[metric]
+                
+        if progress is not None:
+            progress(name, measurement)
+            
+    return results_document(results)
+    
+def add_image_options(parser):
+    """ Add the options for the files the workloads use. """
+    parser.add_option("--bios", action = "store", dest = "bios",
+                      help = "ROM BIOS image for the freedos workload.")
+    parser.add_option("--diskette", action = "store", dest = "diskette",
+                      help = "Boot diskette image for the freedos workload.")
+    parser.add_option("--timeout", action = "store", type = "int", dest = "timeout", default = DEFAULT_TIMEOUT,
+                      help = "Emulated seconds a workload may wait for something, default: %d." % DEFAULT_TIMEOUT)
+                      
+def main():
+    """ Measure one workload and print the measurement as JSON. """
+    parser = OptionParser(usage = "python -m pyxt.bench.macro [options] WORKLOAD")
+    add_image_options(parser)
+    options, args = parser.parse_args()
+    if len(args) != 1 or args[0] not in WORKLOADS:
+        parser.error("Expected one of: %s" % ", ".join(WORKLOAD_NAMES))
+        
+    print(json.dumps(measure_workload(args[0], options), sort_keys = True))
+    
+# Classes
+class HeadlessMachine(object):
+    """
+    A PC/XT wired up like pyxt.__main__ with an MDA, but no window or Pygame event loop.
+    
+    The keyboard's reset is answered after emulated rather than wall clock time and keys can be typed from a
+    string, so a run goes the same way every time.
+    """
+    def __init__(self, rom = None, ram_size = RAM_SIZE_KB):
+        import pygame
+        
+        self.pic = ProgrammableInterruptController(0x020)
+        self.dma_controller = DmaController(0x0000, (0x087, 0x083, 0x081, 0x082))
+        self.bus = SystemBus(self.pic, self.dma_controller)
+        
+        for index in range((ram_size + 63) // 64):
+            self.bus.install_device(index * SIXTY_FOUR_KB, RAM(SIXTY_FOUR_KB))
+            
+        if rom is not None:
+            bios = ROM(SIXTY_FOUR_KB)
+            bios.contents[:len(rom)] = array.array("B", bytearray(rom))
+            self.bus.install_device(BIOS_LOCATION, bios)
+            
+        self.video_card = MonochromeDisplayAdapter(load_font(), randomize = True, seed = 0)
+        self.video_card.screen = pygame.Surface(MDA_RESOLUTION)
+        self.bus.install_device(MDA_START_ADDRESS, self.video_card)
+        
+        self.diskette_controller = FloppyDisketteController(0x3F0)
+        self.bus.install_device(None, self.diskette_controller)
+        self.drives = [FloppyDisketteDrive(FIVE_INCH_360_KB), FloppyDisketteDrive(FIVE_INCH_360_KB)]
+        for number, drive in enumerate(self.drives):
+            self.diskette_controller.attach_drive(drive, number)
+            
+        self.bus.install_device(None, self.dma_controller)
+        self.bus.install_device(None, NMIMaskRegister(0x0A0))
+        self.bus.install_device(None, self.pic)
+        
+        self.pit = ProgrammableIntervalTimer(0x0040)
+        for channel in self.pit.channels:
+            channel.gate = True
+        self.bus.install_device(None, self.pit)
+        self.pit.elide_refresh(True)
+        
+        self.ppi = ProgrammablePeripheralInterface(0x060)
+        self.ppi.dip_switches = DIP_SWITCHES
+        self.ppi.signal_keyboard_reset = self.signal_keyboard_reset
+        self.bus.install_device(None, self.ppi)
+        
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.cpu.collapse_delay_loops(True)
+        self.cpu.detect_idle_loops(True)
+        self.cpu.collapse_busy_waits(True)
+        self.cpu.fuse_instructions(True)
+        
+        self.scheduler = Scheduler(self.cpu, [self.pit, self.dma_controller, self.video_card])
+        self.bus.scheduler = self.scheduler
+        
+        # Seconds spent in run().
+        self.run_time = 0.0
+        
+        # (cycle count, scancodes) to deliver to the keyboard, in order.
+        self.keyboard_events = []
+        
+    def signal_keyboard_reset(self):
+        """ Stands in for the PPI's, which needs a Pygame timer. """
+        self.keyboard_events.append((self.cpu.cycles + KEYBOARD_RESET_CYCLES, None))
+        self.keyboard_events.sort(key = lambda event: event[0])
+        
+    def type_text(self, text):
+        """ Queue the keys to type some text, only the keys that don't need shift can be typed. """
+        from pyxt.ui import PYGAME_KEY_TO_XT_SCANCODES
+        
+        cycles = max([self.cpu.cycles] + [event[0] for event in self.keyboard_events])
+        for character in text:
+            scancode = PYGAME_KEY_TO_XT_SCANCODES.get(ord(character.lower()))
+            if scancode is None:
+                raise ValueError("Can't type %r." % character)
+                
+            cycles += KEY_CYCLES
+            self.keyboard_events.append((cycles, scancode.make_codes))
+            cycles += KEY_CYCLES
+            self.keyboard_events.append((cycles, scancode.break_codes))
+            
+    def deliver_keyboard_events(self):
+        """ Hand the keyboard anything that is due. """
+        events = self.keyboard_events
+        while events and events[0][0] <= self.cpu.cycles:
+            _cycles, scancodes = events.pop(0)
+            if scancodes is None:
+                self.ppi.self_test_complete()
+            else:
+                self.ppi.key_pressed(scancodes)
+                
+    def screen_text(self):
+        """ Return the characters on the MDA's screen, a line per row. """
+        characters = bytearray(self.video_card.video_ram[0:MDA_COLUMNS * MDA_ROWS * 2:2]).decode("cp437")
+        return "\n".join(characters[row * MDA_COLUMNS:(row + 1) * MDA_COLUMNS] for row in range(MDA_ROWS))
+        
+    def run(self, until = None, timeout = DEFAULT_TIMEOUT):
+        """
+        Run until until() returns True, or without until() until the CPU halts with interrupts off.
+        
+        Returns False if that didn't happen within timeout seconds of emulated time, or the CPU stopped for
+        good before until() was satisfied.
+        """
+        cpu = self.cpu
+        scheduler = self.scheduler
+        fetch = cpu.fetch
+        deadline = cpu.cycles + timeout * TICK_FREQUENCY
+        next_check = cpu.cycles
+        
+        start = timeit.default_timer()
+        try:
+            while cpu.cycles < deadline:
+                scheduler.run(fetch, SLICE_CYCLES)
+                if cpu.hlt:
+                    if not cpu.flags.interrupt_enable and not cpu.busy_wait:
+                        return until is None or until()
+                    scheduler.idle(IDLE_SLICE_TICKS)
+                    
+                if self.keyboard_events:
+                    self.deliver_keyboard_events()
+                    
+                if until is not None and cpu.cycles >= next_check:
+                    if until():
+                        return True
+                    next_check = cpu.cycles + CHECK_INTERVAL_CYCLES
+                    
+            return False
+        finally:
+            self.run_time += timeit.default_timer() - start
+            
+# Name: (function, needs --bios and --diskette).
+WORKLOADS = {
+    "codegolf" : (run_codegolf, False),
+    "testbios" : (run_test_bios, False),
+    "freedos" : (run_freedos, True),
+}
+WORKLOAD_NAMES = ("codegolf", "testbios", "freedos")
+
+if __name__ == "__main__":
+    main()
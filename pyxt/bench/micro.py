@@ -0,0 +1,309 @@
+"""
+pyxt.bench.micro - Microbenchmarks of the CPU, bus, timers and display code.
+
+The CPU benchmarks run a 64 KB code segment filled with copies of one instruction, so each covers one
+family of the opcode vector table (or one of the branches of fetch() for the opcodes not in it yet).
+"""
+
+# Standard library imports
+import os
+from binascii import unhexlify
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.bench.runner import Benchmark
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.bus import SystemBus
+from pyxt.memory import RAM
+from pyxt.cpu import CPU
+from pyxt.timer import ProgrammableIntervalTimer
+from pyxt.dma import DmaController
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+CODE_SEGMENT = 0x1000
+DATA_SEGMENT = 0x2000
+
+# Instructions run per loop of a CPU benchmark, and accesses per loop of the others.
+INSTRUCTION_COUNT = 1024
+ACCESS_COUNT = 1024
+
+# Bytes moved per loop by the string benchmarks.
+STRING_LENGTH = 4096
+
+# Characters drawn per loop by the glyph benchmark.
+GLYPH_COUNT = 256
+
+FILES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "files")
+CPI_FILE = os.path.join(FILES_DIRECTORY, "cpidos11", "BIN", "CPI", "ega.cpi")
+CPI_CODEPAGE = 437
+
+# Name and encoding of an instruction from each family.  Registers are reset before each loop so divides
+# don't overflow and branches always go the same way.
+INSTRUCTIONS = (
+    ("mov_r8_imm8", "b034"),                # mov al,0x34
+    ("mov_r16_imm16", "b83412"),            # mov ax,0x1234
+    ("mov_r16_r16", "8bc3"),                # mov ax,bx
+    ("mov_r16_mem", "8b4702"),              # mov ax,[bx+0x2]
+    ("mov_mem_r16", "894702"),              # mov [bx+0x2],ax
+    ("mov_r16_mem_override", "268b07"),     # mov ax,[es:bx]
+    ("mov_ax_moffs16", "a13412"),           # mov ax,[0x1234]
+    ("mov_sreg_r16", "8ec0"),               # mov es,ax
+    ("xchg_r16_ax", "93"),                  # xchg ax,bx
+    ("lea", "8d4702"),                      # lea ax,[bx+0x2]
+    ("alu_r16_r16", "01d8"),                # add ax,bx
+    ("alu_r8_mem", "0207"),                 # add al,[bx]
+    ("alu_al_imm8", "0401"),                # add al,0x1
+    ("alu_rm16_imm8", "83c301"),            # add bx,0x1
+    ("cmp_r16_r16", "39d8"),                # cmp ax,bx
+    ("test_r16_r16", "85c0"),               # test ax,ax
+    ("inc_r16", "40"),                      # inc ax
+    ("inc_rm8", "fe07"),                    # inc byte [bx]
+    ("push_r16", "50"),                     # push ax
+    ("pop_r16", "58"),                      # pop ax
+    ("shift_rm16_1", "d1e0"),               # shl ax,1
+    ("shift_rm8_cl", "d2e0"),               # shl al,cl
+    ("mul_rm16", "f7e3"),                   # mul bx
+    ("div_rm16", "f7f3"),                   # div bx
+    ("cbw", "98"),                          # cbw
+    ("flag_clc", "f8"),                     # clc
+    ("jcc_taken", "7500"),                  # jnz short $+2
+    ("jcc_not_taken", "7400"),              # jz short $+2
+    ("jmp_short", "eb00"),                  # jmp short $+2
+    ("loop", "e200"),                       # loop $+2
+    ("call_near", "e80000"),                # call $+3
+    ("lodsb", "ac"),                        # lodsb
+    ("stosw", "ab"),                        # stosw
+    ("xlat", "d7"),                         # xlat
+    ("nop", "90"),                          # nop
+)
+
+# ModRM encodings decoded by the ModRM benchmarks, each followed by its displacement.
+MODRM_FORMS = (
+    ("register", "c3"),                     # ax,bx
+    ("base_index", "00"),                   # [bx+si]
+    ("base_disp8", "4610"),                 # [bp+0x10]
+    ("base_index_disp16", "813412"),        # [bx+di+0x1234]
+    ("direct", "063412"),                   # [0x1234]
+)
+
+# REP string instructions.
+STRING_INSTRUCTIONS = (
+    ("rep_movsb", "f3a4"),
+    ("rep_movsw", "f3a5"),
+    ("rep_stosb", "f3aa"),
+    ("rep_lodsb", "f3ac"),
+    ("repe_cmpsb", "f3a6"),
+    ("repne_scasb", "f2ae"),
+)
+
+# Functions
+def make_machine():
+    """ Return a CPU and bus with RAM for the code and data segments. """
+    bus = SystemBus()
+    for address in (0x00000, CODE_SEGMENT << 4, DATA_SEGMENT << 4):
+        bus.install_device(address, RAM(SIXTY_FOUR_KB))
+        
+    cpu = CPU()
+    bus.install_cpu(cpu)
+    reset_registers(cpu)
+    return cpu, bus
+    
+def reset_registers(cpu):
+    """ Put the registers back to where every benchmark starts from. """
+    regs = cpu.regs
+    regs.AX = 0x1234
+    regs.BX = 0x0100
+    regs.CX = 0x4000
+    regs.DX = 0x0000
+    regs.SI = 0x0200
+    regs.DI = 0x0300
+    regs.BP = 0x0400
+    regs.SP = 0xFFFE
+    regs.CS = CODE_SEGMENT
+    regs.IP = 0x0000
+    regs.DS = regs.ES = regs.SS = DATA_SEGMENT
+    cpu.flags.value = 0x0000
+    
+def load_code(bus, code, count):
+    """ Fill the code segment with count copies of some code, given in hex. """
+    data = bytearray(unhexlify(code))
+    for index, value in enumerate(data * count):
+        bus.mem_write_byte((CODE_SEGMENT << 4) + index, value)
+        
+def instruction_benchmark(name, code):
+    """ Benchmark one instruction, run INSTRUCTION_COUNT times in a row. """
+    def _setup():
+        cpu, bus = make_machine()
+        load_code(bus, code, INSTRUCTION_COUNT)
+        fetch = cpu.fetch
+        loops = range(INSTRUCTION_COUNT)
+        
+        def _run():
+            reset_registers(cpu)
+            for _ in loops:
+                fetch()
+        return _run
+        
+    return Benchmark("cpu.%s" % name, _setup, INSTRUCTION_COUNT)
+    
+def modrm_benchmark(name, code):
+    """ Benchmark decoding one ModRM form, ACCESS_COUNT times in a row. """
+    def _setup():
+        cpu, bus = make_machine()
+        load_code(bus, code, ACCESS_COUNT)
+        get_modrm_operands = cpu.get_modrm_operands
+        loops = range(ACCESS_COUNT)
+        
+        def _run():
+            cpu.regs.IP = 0x0000
+            for _ in loops:
+                cpu.segment_override = None
+                get_modrm_operands(16)
+        return _run
+        
+    return Benchmark("modrm.%s" % name, _setup, ACCESS_COUNT)
+    
+def string_benchmark(name, code):
+    """ Benchmark a REP string instruction over STRING_LENGTH bytes or words. """
+    def _setup():
+        cpu, bus = make_machine()
+        load_code(bus, code, 1)
+        
+        def _run():
+            reset_registers(cpu)
+            cpu.regs.CX = STRING_LENGTH
+            cpu.regs.SI = 0x0000
+            cpu.regs.DI = 0x8000
+            
+            # Scanning for a byte that isn't there and comparing equal memory both run the whole length.
+            cpu.regs.AX = 0x00FF
+            cpu.fetch()
+        return _run
+        
+    return Benchmark("rep.%s" % name, _setup, STRING_LENGTH)
+    
+def bus_benchmark(name, *values):
+    """ Benchmark a bus memory method, called for ACCESS_COUNT addresses in a row with any values given. """
+    def _setup():
+        _cpu, bus = make_machine()
+        method = getattr(bus, name)
+        addresses = range(DATA_SEGMENT << 4, (DATA_SEGMENT << 4) + ACCESS_COUNT)
+        
+        def _run():
+            for address in addresses:
+                method(address, *values)
+        return _run
+        
+    return Benchmark("bus.%s" % name, _setup, ACCESS_COUNT)
+    
+def setup_io_read():
+    """ Read the PIT's channel 0 count through the bus. """
+    _cpu, bus = make_machine()
+    bus.install_device(None, ProgrammableIntervalTimer(0x040))
+    for port, value in ((0x043, 0x36), (0x040, 0x00), (0x040, 0x00)):
+        bus.io_write_byte(port, value)
+        
+    io_read_byte = bus.io_read_byte
+    loops = range(ACCESS_COUNT)
+    
+    def _run():
+        for _ in loops:
+            io_read_byte(0x040)
+    return _run
+    
+def setup_pit_clock():
+    """ Clock the PIT programmed the way the BIOS leaves it, channel 1 requesting DRAM refresh. """
+    dma = DmaController(0x000, (0x087, 0x083, 0x081, 0x082))
+    bus = SystemBus(None, dma)
+    pit = ProgrammableIntervalTimer(0x040)
+    bus.install_device(None, pit)
+    for port, value in ((0x043, 0x36), (0x040, 0x00), (0x040, 0x00), (0x043, 0x54), (0x041, 18)):
+        bus.io_write_byte(port, value)
+        
+    clock = pit.clock
+    loops = range(ACCESS_COUNT)
+    
+    def _run():
+        for _ in loops:
+            clock()
+    return _run
+    
+def setup_dma_clock():
+    """ Clock the DMA controller with the DRAM refresh channel running. """
+    dma = DmaController(0x000, (0x087, 0x083, 0x081, 0x082))
+    bus = SystemBus(None, dma)
+    bus.install_device(None, dma)
+    
+    # Channel 0 single mode, auto-init, read, 64K refresh cycles, then enable the controller.
+    for port, value in ((0x00B, 0x58), (0x001, 0xFF), (0x001, 0xFF), (0x00A, 0x00), (0x008, 0x00)):
+        bus.io_write_byte(port, value)
+        
+    clock = dma.clock
+    loops = range(ACCESS_COUNT)
+    
+    def _run():
+        for _ in loops:
+            bus.dma_request(0, 0, None)
+            clock()
+    return _run
+    
+def load_font():
+    """ Return a character generator with the MDA sized code page 437 font from the CPI file in the repo. """
+    from pyxt.cpi import CharacterGeneratorCPI, CPI_MDA_SIZE
+    return CharacterGeneratorCPI(CPI_FILE, CPI_CODEPAGE, CPI_MDA_SIZE, width_override = 9)
+    
+def setup_cpi_load():
+    """ Load a font from a CPI file, storing each glyph in the character generator. """
+    return load_font
+    
+def setup_glyph_blit():
+    """ Draw characters with alternating attributes onto an MDA sized surface. """
+    import pygame
+    from pyxt.mda import MDA_RESOLUTION, PALETTE_GREEN
+    
+    char_generator = load_font()
+    surface = pygame.Surface(MDA_RESOLUTION)
+    blit_character = char_generator.blit_character
+    colors = ((PALETTE_GREEN.on, PALETTE_GREEN.off), (PALETTE_GREEN.off, PALETTE_GREEN.on))
+    characters = [((index % 80) * char_generator.char_width, (index // 80) * char_generator.char_height, index,
+                   colors[index & 1]) for index in range(GLYPH_COUNT)]
+                   
+    def _run():
+        for x, y, index, (foreground, background) in characters:
+            blit_character(surface, (x, y), index, foreground, background)
+    return _run
+    
+def setup_mda_redraw():
+    """ Redraw a full MDA screen of text. """
+    import pygame
+    from pyxt.mda import MonochromeDisplayAdapter, MDA_RESOLUTION
+    
+    mda = MonochromeDisplayAdapter(load_font(), randomize = True, seed = 0)
+    mda.screen = pygame.Surface(MDA_RESOLUTION)
+    return mda.redraw
+    
+def get_benchmarks():
+    """ Return all of the microbenchmarks. """
+    benchmarks = [instruction_benchmark(name, code) for name, code in INSTRUCTIONS]
+    benchmarks.extend(modrm_benchmark(name, code) for name, code in MODRM_FORMS)
+    benchmarks.extend(string_benchmark(name, code) for name, code in STRING_INSTRUCTIONS)
+    benchmarks.extend([
+        bus_benchmark("mem_read_byte"),
+        bus_benchmark("mem_read_word"),
+        bus_benchmark("mem_write_byte", 0x55),
+        bus_benchmark("mem_write_word", 0x55AA),
+        Benchmark("bus.io_read_byte", setup_io_read, ACCESS_COUNT),
+        Benchmark("pit.clock", setup_pit_clock, ACCESS_COUNT),
+        Benchmark("dma.clock_refresh", setup_dma_clock, ACCESS_COUNT),
+        Benchmark("cpi.load_font", setup_cpi_load),
+        Benchmark("chargen.blit_character", setup_glyph_blit, GLYPH_COUNT),
+        Benchmark("mda.redraw", setup_mda_redraw, 80 * 25),
+    ])
+    return benchmarks
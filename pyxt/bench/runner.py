@@ -0,0 +1,153 @@
+"""
+pyxt.bench.runner - Timing benchmarks and comparing the results between runs.
+
+Each benchmark is timed like timeit does: the number of loops is doubled until one repetition takes long
+enough to measure, then the fastest of several repetitions is kept as the least disturbed by everything
+else on the machine.  Results are the time per operation (an instruction, a bus access, a character, etc)
+so they read the same however many operations a benchmark does per loop.
+"""
+
+# Standard library imports
+import gc
+import sys
+import json
+import platform
+import timeit
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+RESULTS_FORMAT = 1
+
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.05
+
+# A benchmark this much slower than the baseline (as a fraction) is reported as a regression.
+DEFAULT_THRESHOLD = 0.10
+
+# Functions
+def time_loops(run, loops):
+    """ Return the seconds taken to call run() loops times, with the garbage collector off like timeit. """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timeit.default_timer()
+        for _ in range(loops):
+            run()
+        return timeit.default_timer() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+            
+def time_benchmark(benchmark, repeat = DEFAULT_REPEAT, min_time = DEFAULT_MIN_TIME):
+    """ Return the fastest time per operation of a benchmark in seconds. """
+    run = benchmark.setup()
+    loops = 1
+    elapsed = time_loops(run, loops)
+    while elapsed < min_time:
+        loops *= 2
+        elapsed = time_loops(run, loops)
+        
+    times = [elapsed] + [time_loops(run, loops) for _ in range(repeat - 1)]
+    return min(times) / (loops * benchmark.operations)
+    
+def run_benchmarks(benchmarks, repeat = DEFAULT_REPEAT, min_time = DEFAULT_MIN_TIME, progress = None):
+    """ Time each benchmark, returning the results document. progress(name, seconds) is called after each. """
+    results = {}
+    for benchmark in benchmarks:
+        seconds = time_benchmark(benchmark, repeat, min_time)
+        results[benchmark.name] = seconds * 1e9
+        if progress is not None:
+            progress(benchmark.name, seconds)
+            
+    document = results_document(results)
+    document["units"] = "ns"
+    return document
+    
+def results_document(results):
+    """ Return a results document for some results, recording what they were run on. """
+    return {
+        "format" : RESULTS_FORMAT,
+        "python" : platform.python_version(),
+        "implementation" : platform.python_implementation(),
+        "platform" : platform.platform(),
+        "results" : results,
+    }
+    
+def is_rate(name):
+    """ Return True if a result is a rate (its name ends in _per_second) so bigger is better. """
+    return name.endswith("_per_second")
+    
+def save_results(document, filename):
+    """ Write a results document to a JSON file. """
+    with open(filename, "w") as fileptr:
+        json.dump(document, fileptr, indent = 2, sort_keys = True)
+        fileptr.write("\n")
+        
+def load_results(filename):
+    """ Read a results document written by save_results(). """
+    with open(filename, "r") as fileptr:
+        document = json.load(fileptr)
+        
+    if document.get("format") != RESULTS_FORMAT:
+        raise ValueError("%s isn't a version %d benchmark results file." % (filename, RESULTS_FORMAT))
+    return document
+    
+def compare_results(baseline, document, threshold = DEFAULT_THRESHOLD):
+    """
+    Compare a run against a baseline run.
+    
+    Returns a list of (name, baseline time, new time, change) for the benchmarks in both, where change is the
+    fractional change in time (positive is slower), and the list of names that are slower than the threshold.
+    Rates are compared by the time they imply, so a rate that halves is a change of +100% like a time that
+    doubles.
+    """
+    comparison = []
+    regressions = []
+    old_results = baseline["results"]
+    for name, new in sorted(document["results"].items()):
+        old = old_results.get(name)
+        if old is None:
+            continue
+            
+        if is_rate(name):
+            change = (old - new) / new
+        else:
+            change = (new - old) / old
+        comparison.append((name, old, new, change))
+        if change > threshold:
+            regressions.append(name)
+            
+    if baseline.get("python") != document.get("python") or baseline.get("platform") != document.get("platform"):
+        log.warning("The baseline was run on %s %s, this is %s %s.", baseline.get("python"), baseline.get("platform"),
+                    document.get("python"), document.get("platform"))
+                    
+    return comparison, regressions
+    
+def print_comparison(comparison, regressions, output = sys.stdout):
+    """ Print a comparison from compare_results() as a table. """
+    for name, old, new, change in comparison:
+        output.write("%-40s %12.1f %12.1f %+8.1f%%%s\n" % (name, old, new, change * 100,
+                                                            "  REGRESSION" if name in regressions else ""))
+                                                            
+# Classes
+class Benchmark(object):
+    """
+    A named benchmark.
+    
+    setup() is called once and returns a function that is timed, each call does operations of whatever the
+    benchmark measures.
+    """
+    def __init__(self, name, setup, operations = 1):
+        self.name = name
+        self.setup = setup
+        self.operations = operations
+        
+    def __repr__(self):
+        return "<%s(%r)>" % (self.__class__.__name__, self.name)
@@ -0,0 +1,404 @@
+"""
+pyxt.bench.testbios - A small POST-style ROM for the macrobenchmarks.
+
+There's no assembler in the tree so the ROM is assembled here from hex, with the source alongside each line,
+by just enough of an assembler to resolve labels.  It programs the DMA controller, timer, interrupt
+controller and diskette controller the way a BIOS power on self test does, tests some memory, reads a
+track from drive A: by DMA, prints a message on the MDA and then waits for some timer ticks before halting
+with interrupts off.  The outcome is left in low memory for the tests to check.
+"""
+
+# Standard library imports
+from binascii import unhexlify
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.constants import SIXTY_FOUR_KB
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+ROM_SEGMENT = 0xF000
+CODE_OFFSET = 0xE000
+RESET_VECTOR_OFFSET = 0xFFF0
+
+# The memory test fills and checks 64 KB segments starting from here.
+MEMORY_TEST_SEGMENT = 0x1000
+DEFAULT_MEMORY_SEGMENTS = 4
+
+# Timer ticks (about 18.2 per second) to wait before halting.
+DEFAULT_TIMER_TICKS = 18
+
+# The first track of drive A: is read here.
+DISKETTE_SEGMENT = 0x5000
+TRACK_SIZE = 9 * 512
+
+# Where the ROM leaves its results, the BIOS data area locations are the same as the IBM BIOS uses.
+TIMER_COUNT_ADDRESS = 0x046C
+DISKETTE_STATUS_ADDRESS = 0x043E
+DISKETTE_RESULT_ADDRESS = 0x0442
+RESULT_ADDRESS = 0x0500
+CHECKSUM_ADDRESS = 0x0502
+
+RESULT_PASSED = 0x00
+RESULT_MEMORY_ERROR = 0x01
+RESULT_DISKETTE_ERROR = 0x02
+
+MESSAGE = "PyXT test BIOS"
+
+# Functions
+def diskette_checksum(data):
+    """ Return the checksum the ROM calculates over the track it reads, the 16 bit sum of its words. """
+    data = bytearray(data[:TRACK_SIZE])
+    return sum(data[index] | (data[index + 1] << 8) for index in range(0, len(data), 2)) & 0xFFFF
+    
+def assemble_test_bios(memory_segments = DEFAULT_MEMORY_SEGMENTS, timer_ticks = DEFAULT_TIMER_TICKS):
+    """ Return the code of the test BIOS, assembled to run at F000:E000. """
+    if not 1 <= memory_segments <= 4:
+        raise ValueError("The memory test can only cover 1-4 segments, not %d." % memory_segments)
+        
+    asm = Assembler(CODE_OFFSET)
+    
+    asm.label("reset")
+    asm.emit("fa")                                  # cli
+    asm.emit("fc")                                  # cld
+    asm.emit("31c0")                                # xor ax,ax
+    asm.emit("8ed8")                                # mov ds,ax
+    asm.emit("8ec0")                                # mov es,ax
+    asm.emit("8ed0")                                # mov ss,ax
+    asm.emit("bc007c")                              # mov sp,0x7c00
+    
+    # DMA channel 0 refreshes memory, started by timer channel 1 every 18 clocks (15 us).
+    asm.emit("e60d")                                # out 0x0d,al           ; master clear
+    asm.emit("b058")                                # mov al,0x58
+    asm.emit("e60b")                                # out 0x0b,al           ; channel 0 single, autoinit, read
+    asm.emit("b0ff")                                # mov al,0xff
+    asm.emit("e601")                                # out 0x01,al
+    asm.emit("e601")                                # out 0x01,al           ; count 0xffff
+    asm.emit("30c0")                                # xor al,al
+    asm.emit("e60a")                                # out 0x0a,al           ; unmask channel 0
+    asm.emit("e608")                                # out 0x08,al           ; enable the controller
+    asm.emit("b054")                                # mov al,0x54
+    asm.emit("e643")                                # out 0x43,al           ; timer 1, LSB, mode 2
+    asm.emit("b012")                                # mov al,18
+    asm.emit("e641")                                # out 0x41,al
+    
+    # Timer channel 0 at 18.2 Hz.
+    asm.emit("b036")                                # mov al,0x36
+    asm.emit("e643")                                # out 0x43,al           ; timer 0, LSB/MSB, mode 3
+    asm.emit("30c0")                                # xor al,al
+    asm.emit("e640")                                # out 0x40,al
+    asm.emit("e640")                                # out 0x40,al           ; count 0x10000
+    
+    # Interrupt controller, vectors from 08h, only the timer and diskette interrupts unmasked.
+    asm.emit("b013")                                # mov al,0x13
+    asm.emit("e620")                                # out 0x20,al           ; ICW1 edge, single, ICW4
+    asm.emit("b008")                                # mov al,0x08
+    asm.emit("e621")                                # out 0x21,al           ; ICW2 vector base
+    asm.emit("b009")                                # mov al,0x09
+    asm.emit("e621")                                # out 0x21,al           ; ICW4 buffered, 8086
+    asm.emit("b0be")                                # mov al,0xbe
+    asm.emit("e621")                                # out 0x21,al           ; OCW1 mask
+    
+    asm.address("c7062000", "timer_interrupt")      # mov word [0x0020],timer_interrupt
+    asm.emit("c706220000f0")                        # mov word [0x0022],0xf000
+    asm.address("c7063800", "diskette_interrupt")   # mov word [0x0038],diskette_interrupt
+    asm.emit("c7063a0000f0")                        # mov word [0x003a],0xf000
+    asm.emit("c7066c040000")                        # mov word [0x046c],0
+    asm.emit("c6063e0400")                          # mov byte [0x043e],0
+    asm.emit("fb")                                  # sti
+    
+    # Fill each segment with a pattern and read it back.
+    asm.emit("bb%04x" % swap(MEMORY_TEST_SEGMENT))  # mov bx,MEMORY_TEST_SEGMENT
+    asm.label("memory_segment")
+    asm.emit("8ec3")                                # mov es,bx
+    asm.emit("b8aa55")                              # mov ax,0x55aa
+    asm.emit("31ff")                                # xor di,di
+    asm.emit("b90080")                              # mov cx,0x8000
+    asm.emit("f3ab")                                # rep stosw
+    asm.emit("1e")                                  # push ds
+    asm.emit("06")                                  # push es
+    asm.emit("1f")                                  # pop ds
+    asm.emit("31f6")                                # xor si,si
+    asm.emit("b90080")                              # mov cx,0x8000
+    asm.label("memory_check")
+    asm.emit("ad")                                  # lodsw
+    asm.emit("3daa55")                              # cmp ax,0x55aa
+    asm.short("75", "memory_error")                 # jne memory_error
+    asm.short("e2", "memory_check")                 # loop memory_check
+    asm.emit("1f")                                  # pop ds
+    asm.emit("80c710")                              # add bh,0x10
+    asm.emit("80ff%02x" % ((MEMORY_TEST_SEGMENT >> 8) + (memory_segments << 4)))
+                                                    # cmp bh,MEMORY_TEST_SEGMENT/0x100+memory_segments*0x10
+    asm.short("72", "memory_segment")               # jb memory_segment
+    asm.short("eb", "memory_passed")                # jmp short memory_passed
+    asm.label("memory_error")
+    asm.emit("1f")                                  # pop ds
+    asm.emit("c6060005%02x" % RESULT_MEMORY_ERROR)  # mov byte [0x0500],RESULT_MEMORY_ERROR
+    asm.near("e9", "halt")                          # jmp halt
+    asm.label("memory_passed")
+    
+    # Reset the diskette controller with drive A:'s motor on and DMA and interrupts enabled.
+    asm.emit("baf203")                              # mov dx,0x03f2
+    asm.emit("30c0")                                # xor al,al
+    asm.emit("ee")                                  # out dx,al
+    asm.emit("b01c")                                # mov al,0x1c
+    asm.emit("ee")                                  # out dx,al
+    asm.near("e8", "wait_diskette")                 # call wait_diskette
+    asm.emit("b008")                                # mov al,0x08
+    asm.near("e8", "fdc_write")                     # call fdc_write        ; sense interrupt status
+    asm.near("e8", "fdc_result")                    # call fdc_result
+    asm.emit("b003")                                # mov al,0x03
+    asm.near("e8", "fdc_write")                     # call fdc_write        ; specify
+    asm.emit("b0df")                                # mov al,0xdf
+    asm.near("e8", "fdc_write")                     # call fdc_write
+    asm.emit("b002")                                # mov al,0x02
+    asm.near("e8", "fdc_write")                     # call fdc_write        ; DMA mode
+    asm.emit("b007")                                # mov al,0x07
+    asm.near("e8", "fdc_write")                     # call fdc_write        ; recalibrate
+    asm.emit("30c0")                                # xor al,al
+    asm.near("e8", "fdc_write")                     # call fdc_write        ; drive 0
+    asm.near("e8", "wait_diskette")                 # call wait_diskette
+    asm.emit("b008")                                # mov al,0x08
+    asm.near("e8", "fdc_write")                     # call fdc_write        ; sense interrupt status
+    asm.near("e8", "fdc_result")                    # call fdc_result
+    
+    # DMA channel 2 writes the track to memory.
+    asm.emit("b046")                                # mov al,0x46
+    asm.emit("e60b")                                # out 0x0b,al           ; channel 2 single, write
+    asm.emit("e60c")                                # out 0x0c,al           ; clear the byte flip-flop
+    asm.emit("30c0")                                # xor al,al
+    asm.emit("e604")                                # out 0x04,al
+    asm.emit("e604")                                # out 0x04,al           ; address 0x0000
+    asm.emit("b0%02x" % (DISKETTE_SEGMENT >> 12))   # mov al,DISKETTE_SEGMENT/0x1000
+    asm.emit("e681")                                # out 0x81,al           ; page
+    asm.emit("b0%02x" % ((TRACK_SIZE - 1) & 0xFF))  # mov al,(TRACK_SIZE-1)&0xff
+    asm.emit("e605")                                # out 0x05,al
+    asm.emit("b0%02x" % ((TRACK_SIZE - 1) >> 8))    # mov al,(TRACK_SIZE-1)>>8
+    asm.emit("e605")                                # out 0x05,al           ; count
+    asm.emit("b002")                                # mov al,0x02
+    asm.emit("e60a")                                # out 0x0a,al           ; unmask channel 2
+    
+    # Read data: MFM, drive 0 head 0, C=0 H=0 R=1 N=2 (512 bytes), EOT=9, GPL=0x2a, DTL=0xff.
+    for value in (0x46, 0x00, 0x00, 0x00, 0x01, 0x02, 0x09, 0x2A, 0xFF):
+        asm.emit("b0%02x" % value)                  # mov al,value
+        asm.near("e8", "fdc_write")                 # call fdc_write
+    asm.near("e8", "wait_diskette")                 # call wait_diskette
+    asm.near("e8", "fdc_result")                    # call fdc_result
+    asm.emit("f6064204c0")                          # test byte [0x0442],0xc0
+    asm.short("74", "diskette_passed")              # jz diskette_passed
+    asm.near("e9", "diskette_error")                # jmp diskette_error
+    asm.label("diskette_passed")
+    
+    # Checksum the track.
+    asm.emit("1e")                                  # push ds
+    asm.emit("b8%04x" % swap(DISKETTE_SEGMENT))     # mov ax,DISKETTE_SEGMENT
+    asm.emit("8ed8")                                # mov ds,ax
+    asm.emit("31f6")                                # xor si,si
+    asm.emit("31db")                                # xor bx,bx
+    asm.emit("b9%04x" % swap(TRACK_SIZE // 2))      # mov cx,TRACK_SIZE/2
+    asm.label("checksum")
+    asm.emit("ad")                                  # lodsw
+    asm.emit("01c3")                                # add bx,ax
+    asm.short("e2", "checksum")                     # loop checksum
+    asm.emit("1f")                                  # pop ds
+    asm.emit("891e0205")                            # mov [0x0502],bx
+    
+    # Print the message at the top left of the MDA.
+    asm.emit("b800b0")                              # mov ax,0xb000
+    asm.emit("8ec0")                                # mov es,ax
+    asm.emit("31ff")                                # xor di,di
+    asm.address("be", "message")                    # mov si,message
+    asm.emit("1e")                                  # push ds
+    asm.emit("0e")                                  # push cs
+    asm.emit("1f")                                  # pop ds
+    asm.emit("b407")                                # mov ah,0x07
+    asm.label("print")
+    asm.emit("ac")                                  # lodsb
+    asm.emit("84c0")                                # test al,al
+    asm.short("74", "printed")                      # jz printed
+    asm.emit("ab")                                  # stosw
+    asm.short("eb", "print")                        # jmp short print
+    asm.label("printed")
+    asm.emit("1f")                                  # pop ds
+    
+    # Let some time pass.
+    asm.emit("fa")                                  # cli
+    asm.emit("c7066c040000")                        # mov word [0x046c],0
+    asm.emit("fb")                                  # sti
+    asm.label("wait_ticks")
+    asm.emit("813e6c04%04x" % swap(timer_ticks))    # cmp word [0x046c],timer_ticks
+    asm.short("73", "passed")                       # jae passed
+    asm.emit("f4")                                  # hlt
+    asm.short("eb", "wait_ticks")                   # jmp short wait_ticks
+    
+    asm.label("passed")
+    asm.emit("c6060005%02x" % RESULT_PASSED)        # mov byte [0x0500],RESULT_PASSED
+    asm.short("eb", "halt")                         # jmp short halt
+    asm.label("diskette_error")
+    asm.emit("c6060005%02x" % RESULT_DISKETTE_ERROR)
+                                                    # mov byte [0x0500],RESULT_DISKETTE_ERROR
+    asm.label("halt")
+    asm.emit("fa")                                  # cli
+    asm.emit("f4")                                  # hlt
+    asm.short("eb", "halt")                         # jmp short halt
+    
+    # Wait for the diskette interrupt handler to set bit 7 of the status byte, then clear it.
+    asm.label("wait_diskette")
+    asm.emit("fb")                                  # sti
+    asm.emit("f6063e0480")                          # test byte [0x043e],0x80
+    asm.short("75", "diskette_ready")               # jnz diskette_ready
+    asm.emit("f4")                                  # hlt
+    asm.short("eb", "wait_diskette")                # jmp short wait_diskette
+    asm.label("diskette_ready")
+    asm.emit("80263e047f")                          # and byte [0x043e],0x7f
+    asm.emit("c3")                                  # ret
+    
+    # Write AL to the diskette controller once it's ready for it.
+    asm.label("fdc_write")
+    asm.emit("50")                                  # push ax
+    asm.emit("baf403")                              # mov dx,0x03f4
+    asm.label("fdc_write_wait")
+    asm.emit("ec")                                  # in al,dx
+    asm.emit("24c0")                                # and al,0xc0
+    asm.emit("3c80")                                # cmp al,0x80
+    asm.short("75", "fdc_write_wait")               # jne fdc_write_wait
+    asm.emit("58")                                  # pop ax
+    asm.emit("42")                                  # inc dx
+    asm.emit("ee")                                  # out dx,al
+    asm.emit("c3")                                  # ret
+    
+    # Read result bytes into [0x0442] for as long as the controller has them.
+    asm.label("fdc_result")
+    asm.emit("bf4204")                              # mov di,0x0442
+    asm.emit("baf403")                              # mov dx,0x03f4
+    asm.label("fdc_result_next")
+    asm.emit("ec")                                  # in al,dx
+    asm.emit("24c0")                                # and al,0xc0
+    asm.emit("3cc0")                                # cmp al,0xc0
+    asm.short("75", "fdc_result_done")              # jne fdc_result_done
+    asm.emit("42")                                  # inc dx
+    asm.emit("ec")                                  # in al,dx
+    asm.emit("8805")                                # mov [di],al
+    asm.emit("47")                                  # inc di
+    asm.emit("4a")                                  # dec dx
+    asm.short("eb", "fdc_result_next")              # jmp short fdc_result_next
+    asm.label("fdc_result_done")
+    asm.emit("c3")                                  # ret
+    
+    asm.label("timer_interrupt")
+    asm.emit("1e")                                  # push ds
+    asm.emit("50")                                  # push ax
+    asm.emit("31c0")                                # xor ax,ax
+    asm.emit("8ed8")                                # mov ds,ax
+    asm.emit("ff066c04")                            # inc word [0x046c]
+    asm.short("eb", "end_of_interrupt")             # jmp short end_of_interrupt
+    
+    asm.label("diskette_interrupt")
+    asm.emit("1e")                                  # push ds
+    asm.emit("50")                                  # push ax
+    asm.emit("31c0")                                # xor ax,ax
+    asm.emit("8ed8")                                # mov ds,ax
+    asm.emit("800e3e0480")                          # or byte [0x043e],0x80
+    asm.label("end_of_interrupt")
+    asm.emit("b020")                                # mov al,0x20
+    asm.emit("e620")                                # out 0x20,al           ; non-specific EOI
+    asm.emit("58")                                  # pop ax
+    asm.emit("1f")                                  # pop ds
+    asm.emit("cf")                                  # iret
+    
+    asm.label("message")
+    asm.data(MESSAGE.encode("ascii") + b"\x00")     # db "PyXT test BIOS",0
+    
+    return asm.assemble()
+    
+def build_test_bios(memory_segments = DEFAULT_MEMORY_SEGMENTS, timer_ticks = DEFAULT_TIMER_TICKS):
+    """ Return a 64 KB ROM image of the test BIOS, to be installed at 0xF0000. """
+    image = bytearray(b"\xFF" * SIXTY_FOUR_KB)
+    code = assemble_test_bios(memory_segments, timer_ticks)
+    image[CODE_OFFSET:CODE_OFFSET + len(code)] = code
+    
+    # jmp far F000:E000
+    vector = bytearray(unhexlify("ea%04x%04x" % (swap(CODE_OFFSET), swap(ROM_SEGMENT))))
+    image[RESET_VECTOR_OFFSET:RESET_VECTOR_OFFSET + len(vector)] = vector
+    return image
+    
+def swap(word):
+    """ Return a word with its bytes swapped, so "%04x" % swap(word) is its little endian hex. """
+    return ((word & 0x00FF) << 8) | (word >> 8)
+    
+# Classes
+class Assembler(object):
+    """
+    Lays out hand assembled code, filling in the addresses of labels.
+    
+    Code is given in hex, the branches and addresses that refer to labels are patched once all of the labels
+    are known by assemble().
+    """
+    def __init__(self, origin = 0x0000):
+        self.origin = origin
+        self.code = bytearray()
+        self.labels = {}
+        
+        # (position, label, kind) of each reference to a label.
+        self.fixups = []
+        
+    def emit(self, code):
+        """ Add some code, given in hex. """
+        self.code.extend(unhexlify(code))
+        
+    def data(self, data):
+        """ Add some bytes. """
+        self.code.extend(bytearray(data))
+        
+    def label(self, name):
+        """ Define a label at the current position. """
+        if name in self.labels:
+            raise ValueError("Label %r is defined twice." % name)
+        self.labels[name] = self.origin + len(self.code)
+        
+    def short(self, opcode, label):
+        """ Add a branch with an 8 bit displacement to a label (Jcc, JMP SHORT, LOOP, JCXZ). """
+        self.emit(opcode)
+        self.fixups.append((len(self.code), label, "short"))
+        self.code.append(0x00)
+        
+    def near(self, opcode, label):
+        """ Add a branch with a 16 bit displacement to a label (CALL, JMP NEAR). """
+        self.emit(opcode)
+        self.fixups.append((len(self.code), label, "near"))
+        self.code.extend(b"\x00\x00")
+        
+    def address(self, code, label):
+        """ Add an instruction that ends with the offset of a label as a 16 bit immediate. """
+        self.emit(code)
+        self.fixups.append((len(self.code), label, "address"))
+        self.code.extend(b"\x00\x00")
+        
+    def assemble(self):
+        """ Return the code with every reference to a label filled in. """
+        code = bytearray(self.code)
+        for position, label, kind in self.fixups:
+            if label not in self.labels:
+                raise ValueError("Undefined label: %r" % label)
+            target = self.labels[label]
+            
+            if kind == "short":
+                displacement = target - (self.origin + position + 1)
+                if not -128 <= displacement <= 127:
+                    raise ValueError("Short branch to %r is out of range (%d bytes)." % (label, displacement))
+                code[position] = displacement & 0xFF
+            else:
+                if kind == "near":
+                    value = (target - (self.origin + position + 2)) & 0xFFFF
+                else:
+                    value = target
+                code[position] = value & 0xFF
+                code[position + 1] = value >> 8
+                
+        return code
@@ -0,0 +1,300 @@
+"""
+pyxt.breakpoints - Breakpoints and memory watchpoints for the debugger.
+
+Breakpoints are kept in a dictionary keyed by physical address, so checking for one before an instruction is a
+single lookup and they can be left set while running at full speed (see Debugger.armed()).  Conditions are
+compiled once when the breakpoint is set.
+
+Watchpoints hook the memory methods of only the devices in the 64 KB bus blocks they cover, accesses to the
+rest of memory go through the bus exactly as they would without any watchpoints.
+"""
+
+# Standard library imports
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.constants import BLOCK_PREFIX_SHIFT, BLOCK_OFFSET_MASK
+from pyxt.cpu import WordRegs, ByteRegs
+from pyxt.helpers import segment_offset_to_address
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# Names that can be used in a breakpoint condition, registers can be in either case.
+REGISTER_NAMES = frozenset(name for name, _ in WordRegs._fields_ + ByteRegs._fields_) # pylint: disable=protected-access
+FLAG_NAMES = {
+    "cf" : "carry",
+    "pf" : "parity",
+    "af" : "adjust",
+    "zf" : "zero",
+    "sf" : "sign",
+    "tf" : "trap",
+    "df" : "direction",
+    "of" : "overflow",
+}
+
+# Conditions can only see the names above, not Python's builtins.
+CONDITION_GLOBALS = {"__builtins__" : {}}
+
+WATCH_READ = "read"
+WATCH_WRITE = "write"
+WATCH_CHANGE = "change"
+WATCH_KINDS = (WATCH_READ, WATCH_WRITE, WATCH_CHANGE)
+
+# Device methods replaced while a block has watchpoints.
+MEMORY_METHODS = ("mem_read_byte", "mem_read_word", "mem_write_byte", "mem_write_word")
+
+# Classes
+class ConditionNamespace(object):
+    """ Looks up the names in a breakpoint condition: registers, flags, and byte()/word() to read memory. """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        
+    def __getitem__(self, name):
+        upper = name.upper()
+        if upper in REGISTER_NAMES:
+            return getattr(self.cpu.regs, upper)
+        if name in FLAG_NAMES:
+            return int(getattr(self.cpu.flags, FLAG_NAMES[name]))
+        if name == "flags":
+            return self.cpu.flags.value
+        if name == "byte":
+            return self.cpu.bus.mem_read_byte
+        if name == "word":
+            return self.cpu.bus.mem_read_word
+        raise KeyError(name)
+        
+class Breakpoint(object):
+    """ A breakpoint at segment:offset, optionally only when a Python expression is true. """
+    def __init__(self, segment, offset, condition = None):
+        self.segment = segment
+        self.offset = offset
+        self.address = segment_offset_to_address(segment, offset)
+        self.condition = condition
+        
+        # Compiling here also catches syntax errors when the breakpoint is set rather than when it's reached.
+        self.code = None
+        if condition is not None:
+            self.code = compile(condition, "<breakpoint %04x:%04x>" % (segment, offset), "eval")
+            
+    def __str__(self):
+        if self.condition is None:
+            return "%04x:%04x" % (self.segment, self.offset)
+        return "%04x:%04x if %s" % (self.segment, self.offset, self.condition)
+        
+class BreakpointSet(object):
+    """ The debugger's breakpoints, indexed by physical address. """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.namespace = ConditionNamespace(cpu)
+        
+        # Physical address to the breakpoints there, the same dictionary is kept for the life of the set.
+        self.addresses = {}
+        
+    def __len__(self):
+        return sum(len(breakpoints) for breakpoints in self.addresses.values())
+        
+    def __iter__(self):
+        for address in sorted(self.addresses):
+            for breakpoint in self.addresses[address]:
+                yield breakpoint
+                
+    def add(self, segment, offset, condition = None):
+        """ Add a breakpoint, returning it. """
+        breakpoint = Breakpoint(segment, offset, condition)
+        self.addresses.setdefault(breakpoint.address, []).append(breakpoint)
+        return breakpoint
+        
+    def remove(self, segment, offset):
+        """ Remove the breakpoints at segment:offset, returning False if there weren't any. """
+        address = segment_offset_to_address(segment, offset)
+        breakpoints = self.addresses.get(address, [])
+        remaining = [breakpoint for breakpoint in breakpoints
+                     if (breakpoint.segment, breakpoint.offset) != (segment, offset)]
+        if len(remaining) == len(breakpoints):
+            return False
+            
+        if remaining:
+            self.addresses[address] = remaining
+        else:
+            del self.addresses[address]
+        return True
+        
+    def clear(self):
+        """ Remove all breakpoints. """
+        self.addresses.clear()
+        
+    def check(self):
+        """ Return True if there is a breakpoint at CS:IP whose condition, if any, is true. """
+        regs = self.cpu.regs
+        breakpoints = self.addresses.get(segment_offset_to_address(regs.CS, regs.IP))
+        if breakpoints is None:
+            return False
+            
+        for breakpoint in breakpoints:
+            if breakpoint.code is None:
+                return True
+                
+            try:
+                if eval(breakpoint.code, CONDITION_GLOBALS, self.namespace): # pylint: disable=eval-used
+                    return True
+            except Exception as err: # pylint: disable=broad-except
+                log.warning("Error in condition for breakpoint %s, stopping: %s", breakpoint, err)
+                return True
+                
+        return False
+        
+class Watchpoint(object):
+    """ Watches a range of physical memory for reads, writes, or writes that change its value. """
+    def __init__(self, address, length = 1, kind = WATCH_CHANGE):
+        if kind not in WATCH_KINDS:
+            raise ValueError("Unknown watchpoint kind: %r" % kind)
+            
+        self.address = address
+        self.length = length
+        self.kind = kind
+        
+    def __str__(self):
+        if self.length == 1:
+            return "%s 0x%05x" % (self.kind, self.address)
+        return "%s 0x%05x-0x%05x" % (self.kind, self.address, self.address + self.length - 1)
+        
+class WatchpointSet(object):
+    """
+    The debugger's watchpoints.
+    
+    The devices in the blocks that are being watched have their memory methods replaced, on_hit is called
+    with the watchpoint, physical address, the byte's value before the access and its value after.
+    """
+    def __init__(self, bus, on_hit):
+        self.bus = bus
+        self.on_hit = on_hit
+        self.watchpoints = []
+        
+        # Set to False to ignore hits, while the debugger is running code again to go backwards.
+        self.enabled = True
+        
+        # Bus block to {offset : [watchpoints]}, and the original methods of each hooked device.
+        self.blocks = {}
+        self.saved_methods = {}
+        
+    def __len__(self):
+        return len(self.watchpoints)
+        
+    def __iter__(self):
+        return iter(self.watchpoints)
+        
+    def add(self, address, length = 1, kind = WATCH_CHANGE):
+        """ Add a watchpoint, returning it. """
+        for block in range(address >> BLOCK_PREFIX_SHIFT, ((address + length - 1) >> BLOCK_PREFIX_SHIFT) + 1):
+            if self.bus.devices[block] is None:
+                raise ValueError("No memory to watch at 0x%05x." % (block << BLOCK_PREFIX_SHIFT))
+                
+        watchpoint = Watchpoint(address, length, kind)
+        self.watchpoints.append(watchpoint)
+        for watched in range(address, address + length):
+            block = watched >> BLOCK_PREFIX_SHIFT
+            if block not in self.blocks:
+                self.hook_block(block)
+            self.blocks[block].setdefault(watched & BLOCK_OFFSET_MASK, []).append(watchpoint)
+        return watchpoint
+        
+    def remove(self, address):
+        """ Remove the watchpoints starting at a physical address, returning False if there weren't any. """
+        remaining = [watchpoint for watchpoint in self.watchpoints if watchpoint.address != address]
+        if len(remaining) == len(self.watchpoints):
+            return False
+            
+        self.clear()
+        for watchpoint in remaining:
+            self.add(watchpoint.address, watchpoint.length, watchpoint.kind)
+        return True
+        
+    def clear(self):
+        """ Remove all watchpoints and put the devices back to normal. """
+        for block in list(self.blocks):
+            self.unhook_block(block)
+        del self.watchpoints[:]
+        
+    def hook_block(self, block):
+        """ Replace the memory methods of the device in a block with ones that check the watched offsets. """
+        device = self.bus.devices[block]
+        self.saved_methods[block] = dict((name, vars(device).get(name)) for name in MEMORY_METHODS)
+        
+        offsets = {}
+        self.blocks[block] = offsets
+        base = block << BLOCK_PREFIX_SHIFT
+        
+        read_byte = device.mem_read_byte
+        read_word = device.mem_read_word
+        write_byte = device.mem_write_byte
+        write_word = device.mem_write_word
+        check = self.check
+        
+        def _mem_read_byte(offset):
+            value = read_byte(offset)
+            if offset in offsets:
+                check(offsets[offset], WATCH_READ, base + offset, value, value)
+            return value
+            
+        def _mem_read_word(offset):
+            value = read_word(offset)
+            if offset in offsets:
+                check(offsets[offset], WATCH_READ, base + offset, value & 0xFF, value & 0xFF)
+            if offset + 1 in offsets:
+                check(offsets[offset + 1], WATCH_READ, base + offset + 1, value >> 8, value >> 8)
+            return value
+            
+        def _mem_write_byte(offset, value):
+            if offset not in offsets:
+                write_byte(offset, value)
+                return
+                
+            old_value = read_byte(offset)
+            write_byte(offset, value)
+            check(offsets[offset], WATCH_WRITE, base + offset, old_value, read_byte(offset))
+            
+        def _mem_write_word(offset, value):
+            if offset not in offsets and offset + 1 not in offsets:
+                write_word(offset, value)
+                return
+                
+            old_value = read_word(offset)
+            write_word(offset, value)
+            new_value = read_word(offset)
+            if offset in offsets:
+                check(offsets[offset], WATCH_WRITE, base + offset, old_value & 0xFF, new_value & 0xFF)
+            if offset + 1 in offsets:
+                check(offsets[offset + 1], WATCH_WRITE, base + offset + 1, old_value >> 8, new_value >> 8)
+                
+        device.mem_read_byte = _mem_read_byte
+        device.mem_read_word = _mem_read_word
+        device.mem_write_byte = _mem_write_byte
+        device.mem_write_word = _mem_write_word
+        self.bus.memory_map_changed()
+        
+    def unhook_block(self, block):
+        """ Put back the original memory methods of the device in a block. """
+        device = self.bus.devices[block]
+        for name, method in self.saved_methods.pop(block).items():
+            if method is None:
+                delattr(device, name)
+            else:
+                setattr(device, name, method)
+        del self.blocks[block]
+        self.bus.memory_map_changed()
+        
+    def check(self, watchpoints, access, address, old_value, new_value):
+        """ Called for each access to a watched byte, passes the ones the watchpoints care about to on_hit. """
+        if not self.enabled:
+            return
+            
+        for watchpoint in watchpoints:
+            if watchpoint.kind == access or (watchpoint.kind == WATCH_CHANGE and access == WATCH_WRITE and
+                                             old_value != new_value):
+                self.on_hit(watchpoint, address, old_value, new_value)
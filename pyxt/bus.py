@@ -4,6 +4,9 @@ pyxt.bus - System bus and component interface for PyXT.
 
 # Standard library imports
 
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
 # PyXT imports
 from pyxt.constants import BLOCK_PREFIX_SHIFT, BLOCK_OFFSET_MASK
 
@@ -12,6 +15,10 @@ import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# Constants
+# Pages of memory that are tracked for writes, see SystemBus.track_dirty_pages().
+PAGE_SHIFT = 12
+
 # Classes
 class Device(object):
     """ Base class for a devuce on the system bus. """
@@ -35,11 +42,35 @@ class Device(object):
         """
         pass
         
+    def ticks_until_event(self): # pylint: disable=no-self-use
+        """
+        Return the number of clock ticks until this device changes state on its own (raising an interrupt,
+        completing a DMA transfer, etc), or None if nothing is scheduled.
+        """
+        return None
+        
+    def fast_forward(self, ticks):
+        """
+        Advance the device by a number of clock ticks at once, used to skip over time while the CPU is idle.
+        
+        Devices with a clock input should override this with something faster than calling clock() in a loop.
+        """
+        for _unused in range(ticks):
+            self.clock()
+            
     # Memory bus.
     def get_memory_size(self): # pylint: disable=no-self-use
         """ Return the length of the memory mapped area of this device. """
         return 0
         
+    def get_code_window(self): # pylint: disable=no-self-use
+        """
+        Return a memoryview of the memory mapped area the CPU can fetch instructions from directly.
+        
+        This has to see every write to the device, devices that do anything on a read should return None.
+        """
+        return None
+        
     def mem_read_byte(self, offset):
         """ Read a byte from memory at the supplied offset from the device's base. """
         raise NotImplementedError("This device doesn't support memory mapping.")
@@ -88,10 +119,25 @@ class SystemBus(object):
         
         self.debugger = None
         
+        # When set the scheduler is synced before each I/O access so devices see the CPU's current time.
+        self.scheduler = None
+        
         self.pic = pic
         self.dma = dma
         self.cpu = None
         
+        # Bus activity counters, these let the CPU tell if a loop has any side effects.
+        self.mem_write_count = 0
+        self.io_read_count = 0
+        self.io_write_count = 0
+        
+        # Pages of memory written since pyxt.checkpoint last looked, None unless track_dirty_pages() was called.
+        self.dirty_pages = None
+        
+        # Accesses to each I/O port, for pyxt.metrics.
+        self.io_read_counts = [0] * 0x10000
+        self.io_write_counts = [0] * 0x10000
+        
     def install_cpu(self, cpu):
         """ Install the CPU into the system bus. """
         cpu.install_bus(self)
@@ -104,6 +150,7 @@ class SystemBus(object):
         # The memory bus uses a prefix to index to the correct device.
         if prefix is not None:
             self.devices[prefix >> BLOCK_PREFIX_SHIFT] = device
+            self.memory_map_changed()
             
         # The I/O bus uses a decoder (dictionary in our case).
         if len(device.get_ports_list()) > 0:
@@ -111,6 +158,11 @@ class SystemBus(object):
             for address in device.get_ports_list():
                 self.io_decoder[address] = device
                 
+    def memory_map_changed(self):
+        """ Call after replacing a device or its memory methods so the CPU stops fetching code from the old ones. """
+        if self.cpu is not None:
+            self.cpu.invalidate_code_window()
+            
     def mem_read_byte(self, address):
         """ Read a byte from the supplied physical memory address. """
         device = self.devices[address >> BLOCK_PREFIX_SHIFT]
@@ -129,19 +181,46 @@ class SystemBus(object):
             
     def mem_write_byte(self, address, value):
         """ Write a byte to the supplied physical memory address. """
+        self.mem_write_count += 1
         device = self.devices[address >> BLOCK_PREFIX_SHIFT]
         if device is not None:
             device.mem_write_byte(address & BLOCK_OFFSET_MASK, value)
             
     def mem_write_word(self, address, value):
         """ Write a word to the supplied physical memory address. """
+        self.mem_write_count += 1
         device = self.devices[address >> BLOCK_PREFIX_SHIFT]
         if device is not None:
             device.mem_write_word(address & BLOCK_OFFSET_MASK, value)
             
-            
+    def track_dirty_pages(self):
+        """
+        Start keeping a set of the pages of memory that have been written, for pyxt.checkpoint.
+        
+        The writes are only slowed down once this has been called.
+        """
+        self.dirty_pages = set()
+        self.mem_write_byte = self.mem_write_byte_tracked
+        self.mem_write_word = self.mem_write_word_tracked
+        
+    def mem_write_byte_tracked(self, address, value):
+        """ Write a byte and mark its page as dirty. """
+        self.dirty_pages.add(address >> PAGE_SHIFT)
+        SystemBus.mem_write_byte(self, address, value)
+        
+    def mem_write_word_tracked(self, address, value):
+        """ Write a word and mark its pages as dirty. """
+        self.dirty_pages.add(address >> PAGE_SHIFT)
+        self.dirty_pages.add((address + 1) >> PAGE_SHIFT)
+        SystemBus.mem_write_word(self, address, value)
+        
     def io_read_byte(self, port):
         """ Read a byte from the supplied port. """
+        self.io_read_count += 1
+        self.io_read_counts[port] += 1
+        if self.scheduler is not None:
+            self.scheduler.sync()
+            
         device = self.io_decoder.get(port, None)
         if device is not None:
             return device.io_read_byte(port)
@@ -156,12 +235,21 @@ class SystemBus(object):
         
     def io_write_byte(self, port, value):
         """ Write a byte to the supplied port. """
+        self.io_write_count += 1
+        self.io_write_counts[port] += 1
+        if self.scheduler is not None:
+            self.scheduler.sync()
+            
         device = self.io_decoder.get(port, None)
         if device is not None:
             device.io_write_byte(port, value)
         else:
             log.warning("No handler for writing I/O port: 0x%03x. Tried to write 0x%02x", port, value)
             
+        # The write may have programmed a timer or started a DMA transfer.
+        if self.scheduler is not None:
+            self.scheduler.reschedule()
+            
     def io_write_word(self, port, value):
         """ Write a word to the supplied port. """
         raise NotImplementedError("TODO: Support words on the I/O bus.")
@@ -185,4 +273,9 @@ class SystemBus(object):
         # First, and only, DMA controller on the XT.
         if self.dma and 0 <= channel <= 3:
             self.dma.dma_request(channel, port, terminal_count_callback)
+            
+    def dma_refresh(self, period):
+        """ Signals the DMA controller that DRAM refresh runs every period ticks, None if the timer requests it. """
+        if self.dma:
+            self.dma.dma_refresh(period)
             
\ No newline at end of file
@@ -24,6 +24,9 @@ from six.moves import range # pylint: disable=redefined-builtin
 
 # PyXT imports
 from pyxt.bus import Device
+from pyxt.crtc import RasterTiming, POLLING_LINES
+from pyxt.helpers import random_bytes
+from pyxt.scheduler import TICK_FREQUENCY
 from pyxt.chargen import CharacterGeneratorMDA_CGA_ROM
 
 # Pygame Imports
@@ -77,6 +80,14 @@ STATUS_REG_PORT = 0x3DA
 STATUS_REG_RAM_ACCESS_SAFE = 0x01
 STATUS_REG_VERTICAL_RETRACE = 0x08
 
+# 6845 timing: 912 dot lines of the 14.318 MHz dot clock (three dots per CPU cycle) and 262 line frames (59.9 Hz).
+# 640 dots of 200 lines are displayed and vertical sync is 16 lines long from line 224.
+CGA_TIMING = RasterTiming(TICK_FREQUENCY * 3, 912, 262)
+CGA_DISPLAY_DOTS = 640
+CGA_DISPLAY_LINES = 200
+CGA_VSYNC_START = 224
+CGA_VSYNC_END = 240
+
 CGA_ATTR_FG_BLUE =   0x01
 CGA_ATTR_FG_GREEN =  0x02
 CGA_ATTR_FG_RED =    0x04
@@ -171,7 +182,7 @@ class Cursor(object):
                 self.interval = self.SLOW_BLINK_RATE
                 
 class ColorGraphicsAdapter(Device):
-    def __init__(self, char_generator, randomize = False, double = False):
+    def __init__(self, char_generator, randomize = False, double = False, seed = None):
         super(ColorGraphicsAdapter, self).__init__()
         
         self.char_generator = char_generator
@@ -179,12 +190,11 @@ class ColorGraphicsAdapter(Device):
         self.control_reg = 0x00
         self.data_reg_index = 0x00
         
-        self.video_ram = array.array("B", (0,) * CGA_RAM_SIZE)
+        self.video_ram = array.array("B", [0]) * CGA_RAM_SIZE
         
-        # If desired, randomize the contents of video memory at startup for effect.
+        # If desired, randomize the contents of video memory at startup for effect, a seed makes it repeatable.
         if randomize:
-            for index in range(CGA_RAM_SIZE):
-                self.video_ram[index] = random.randint(0, 255)
+            self.video_ram = array.array("B", random_bytes(random.Random(seed), CGA_RAM_SIZE))
                 
         # Handle to the Pygame display object.
         self.window = None # Actual window overscan res scaled up 2x.
@@ -195,10 +205,14 @@ class ColorGraphicsAdapter(Device):
         # Flag to indicate if we have updated the bitmap and need to display it.
         self.needs_draw = True
         
-        # Every other call to draw() will flip the vertical retrace.
-        self.vertical_retrace = False
-        # Every other call to get the status register should flip the "snow" bit.
-        self.horizontal_retrace = False
+        # Number of times the display has been updated, for pyxt.metrics.
+        self.redraw_count = 0
+        
+        # Ticks the card has been clocked for, the status register works the beam position out from these.
+        self.ticks = 0
+        
+        # When the status register was last read, see ticks_until_event().
+        self.status_read_ticks = None
         
         # Used to simulate the pixel on bit when the status register is being read.
         self.current_pixel = [0, 0]
@@ -233,6 +247,35 @@ class ColorGraphicsAdapter(Device):
         # Now that we have a display draw whatever is currently in RAM.
         self.redraw()
         
+    def clock(self):
+        self.ticks += 1
+        
+    def fast_forward(self, ticks):
+        self.ticks += ticks
+        
+    def ticks_until_event(self):
+        """
+        Return the number of ticks until the status register next changes if a program is polling it.
+        
+        Nothing else depends on the beam, this only lets time skip straight to the retrace a busy wait is after.
+        """
+        polling_ticks = POLLING_LINES * CGA_TIMING.line_ticks
+        if self.status_read_ticks is None or self.ticks - self.status_read_ticks > polling_ticks:
+            return None
+            
+        line, dot = CGA_TIMING.position(self.ticks)
+        if line < CGA_DISPLAY_LINES:
+            if dot < CGA_DISPLAY_DOTS:
+                return CGA_TIMING.ticks_until(self.ticks, line, CGA_DISPLAY_DOTS)
+            elif line + 1 < CGA_DISPLAY_LINES:
+                return CGA_TIMING.ticks_until(self.ticks, line + 1, 0)
+            return CGA_TIMING.ticks_until(self.ticks, CGA_VSYNC_START, 0)
+        elif line < CGA_VSYNC_START:
+            return CGA_TIMING.ticks_until(self.ticks, CGA_VSYNC_START, 0)
+        elif line < CGA_VSYNC_END:
+            return CGA_TIMING.ticks_until(self.ticks, CGA_VSYNC_END, 0)
+        return CGA_TIMING.ticks_until(self.ticks, CGA_TIMING.frame_lines, 0)
+        
     def get_memory_size(self):
         return CGA_RAM_SIZE
         
@@ -286,14 +329,14 @@ class ColorGraphicsAdapter(Device):
             return self.control_reg
             
         elif port == STATUS_REG_PORT:
-            # Both the horizontal and vertical retrace must change state during the POST.
+            # Video RAM can be written without snow whenever the beam is outside the displayed area.
+            self.status_read_ticks = self.ticks
+            line, dot = CGA_TIMING.position(self.ticks)
             status = 0x00
-            if self.vertical_retrace:
-                status |= STATUS_REG_VERTICAL_RETRACE
-            if self.horizontal_retrace:
+            if line >= CGA_DISPLAY_LINES or dot >= CGA_DISPLAY_DOTS:
                 status |= STATUS_REG_RAM_ACCESS_SAFE
-                
-            self.horizontal_retrace = not self.horizontal_retrace
+            if CGA_VSYNC_START <= line < CGA_VSYNC_END:
+                status |= STATUS_REG_VERTICAL_RETRACE
             return status
             
         else:
@@ -369,7 +412,6 @@ class ColorGraphicsAdapter(Device):
     def draw(self):
         """ Update the "physical" display if necessary. """
         cursor = self.cursor
-        self.vertical_retrace = not self.vertical_retrace
         
         # Do not use the hardware cursor in graphics mode.
         if not self.graphics_mode:
@@ -425,6 +467,7 @@ class ColorGraphicsAdapter(Device):
                 self.window.blit(self.overscan, (0, 0))
             pygame.display.flip()
             self.needs_draw = False
+            self.redraw_count += 1
             
     def redraw(self):
         """ Does a full redraw of the display from RAM. """
@@ -437,6 +480,17 @@ class ColorGraphicsAdapter(Device):
                 
         self.needs_draw = True
         
+    def redraw_region(self, start, end):
+        """ Redraws the characters (or graphics bytes) in video RAM between the start and end offsets. """
+        if self.graphics_mode:
+            for offset in range(start, end):
+                self.draw_single_byte(offset)
+        else:
+            for offset in range(start & ~1, end, 2):
+                self.blit_single_char(offset)
+                
+        self.needs_draw = True
+        
     def blit_single_char(self, offset):
         """ Blits a single character to the display given the offset of the character. """
         if offset >= CGA_RAM_SIZE:
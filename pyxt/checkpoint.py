@@ -0,0 +1,395 @@
+"""
+pyxt.checkpoint - Periodic snapshots of the machine for running the debugger backwards.
+
+Every so many instructions the state of the CPU and the I/O devices is saved along with the pages of RAM
+written since the previous checkpoint, which the bus keeps track of.  Large buffers held by the devices (diskette
+images, video RAM) are saved a page at a time too, only the pages that differ from the last checkpoint.
+
+Going back to an earlier instruction restores the nearest checkpoint before it and runs forward again, the
+machine is deterministic so it ends up in the same state it was in the first time.
+"""
+
+# Standard library imports
+import copy
+import array
+from ctypes import Structure, Union, string_at, memmove, addressof, sizeof
+
+# Six imports
+import six
+
+# PyXT imports
+from pyxt.constants import BLOCK_PREFIX_SHIFT, BLOCK_OFFSET_MASK
+from pyxt.bus import Device, SystemBus, PAGE_SHIFT
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+DEFAULT_CHECKPOINT_INTERVAL = 100000
+
+# The oldest checkpoints are merged away beyond this many, so about the last 10M instructions can be reached.
+DEFAULT_MAX_CHECKPOINTS = 100
+
+PAGE_SIZE = 1 << PAGE_SHIFT
+
+PLAIN_TYPES = six.integer_types + six.string_types + (float, bool, bytes, type(None))
+
+# How a saved attribute is put back.
+STATE_VALUE = 0
+STATE_RAW = 1
+STATE_OBJECT = 2
+STATE_SEQUENCE = 3
+STATE_BUFFER = 4
+
+UNSUPPORTED = object()
+
+# Functions
+def is_owned_object(value):
+    """ True for helper objects that belong to a device (timer channels, drives, etc) and are saved with it. """
+    return (type(value).__module__.startswith("pyxt.") and hasattr(value, "__dict__") and
+            not isinstance(value, (Device, SystemBus, CPU)))
+            
+def is_large_buffer(value):
+    """ True for arrays of at least a page, which a CheckpointManager saves a page at a time. """
+    return isinstance(value, array.array) and len(value) * value.itemsize >= PAGE_SIZE
+    
+def capture_value(value, visited, buffers = None):
+    """ Return a saved copy of a value, or UNSUPPORTED for things that aren't machine state. """
+    if isinstance(value, PLAIN_TYPES):
+        return (STATE_VALUE, value)
+        
+    if buffers is not None and is_large_buffer(value):
+        # Only the buffer itself is kept here, its contents are saved by the caller.
+        buffers[id(value)] = value
+        return (STATE_BUFFER, value)
+        
+    if isinstance(value, array.array):
+        return (STATE_VALUE, array.array(value.typecode, value))
+        
+    if isinstance(value, (Structure, Union)):
+        return (STATE_RAW, string_at(addressof(value), sizeof(value)))
+        
+    if isinstance(value, (list, tuple)):
+        items = [capture_value(item, visited, buffers) for item in value]
+        if any(item is UNSUPPORTED for item in items):
+            return UNSUPPORTED
+        if all(item[0] == STATE_VALUE for item in items):
+            return (STATE_VALUE, copy.deepcopy(value))
+        return (STATE_SEQUENCE, items)
+        
+    if isinstance(value, dict):
+        items = [capture_value(item, visited) for item in value.values()]
+        if all(item is not UNSUPPORTED and item[0] == STATE_VALUE for item in items):
+            return (STATE_VALUE, copy.deepcopy(value))
+        return UNSUPPORTED
+        
+    if is_owned_object(value) and id(value) not in visited:
+        visited.add(id(value))
+        return (STATE_OBJECT, capture_state(value, visited, buffers))
+        
+    return UNSUPPORTED
+    
+def capture_state(obj, visited = None, buffers = None):
+    """
+    Save the attributes of an object that make up its state.
+    
+    If buffers is a dictionary large arrays aren't copied, they are added to it by id() for the caller to save.
+    """
+    if visited is None:
+        visited = set([id(obj)])
+        
+    state = {}
+    for name, value in vars(obj).items():
+        saved = capture_value(value, visited, buffers)
+        if saved is not UNSUPPORTED:
+            state[name] = saved
+    return state
+    
+def restore_value(current, saved):
+    """ Put a saved value back, in place where possible as other objects may hold references to it. """
+    kind, data = saved
+    if kind == STATE_RAW:
+        memmove(addressof(current), data, len(data))
+        return current
+        
+    if kind == STATE_OBJECT:
+        restore_state(current, data)
+        return current
+        
+    if kind == STATE_BUFFER:
+        return data
+        
+    if kind == STATE_SEQUENCE:
+        for index, item in enumerate(data):
+            value = restore_value(current[index], item)
+            if value is not current[index]:
+                current[index] = value
+        return current
+        
+    if isinstance(data, array.array):
+        if isinstance(current, array.array) and len(current) == len(data):
+            current[:] = data
+            return current
+        return array.array(data.typecode, data)
+        
+    if isinstance(data, list) and isinstance(current, list):
+        current[:] = copy.deepcopy(data)
+        return current
+        
+    if isinstance(data, dict) and isinstance(current, dict):
+        current.clear()
+        current.update(copy.deepcopy(data))
+        return current
+        
+    return copy.deepcopy(data)
+    
+def restore_state(obj, state):
+    """ Put back the attributes saved by capture_state(). """
+    for name, saved in state.items():
+        current = getattr(obj, name, None)
+        value = restore_value(current, saved)
+        if value is not current:
+            setattr(obj, name, value)
+            
+# Classes
+class Checkpoint(object):
+    """ The machine's state at one instruction count, pages are only those written since the last one. """
+    def __init__(self, instruction_count, cpu_state, device_states, scheduler_state, pages, buffer_pages):
+        self.instruction_count = instruction_count
+        self.cpu_state = cpu_state
+        self.device_states = device_states
+        self.scheduler_state = scheduler_state
+        self.pages = pages
+        
+        # Pages of the devices' large buffers, keyed by (id() of the buffer, page number).
+        self.buffer_pages = buffer_pages
+        
+class CheckpointManager(object):
+    """ Takes checkpoints as the machine runs and moves it back to earlier instructions. """
+    def __init__(self, cpu, bus, scheduler, idle_ticks, interval = DEFAULT_CHECKPOINT_INTERVAL,
+                 max_checkpoints = DEFAULT_MAX_CHECKPOINTS):
+        self.cpu = cpu
+        self.bus = bus
+        self.scheduler = scheduler
+        self.idle_ticks = idle_ticks
+        self.interval = interval
+        self.max_checkpoints = max_checkpoints
+        
+        self.checkpoints = []
+        self.next_instruction = 0
+        
+        # id() of each large buffer seen to (buffer, copy of it when it was last saved).
+        self.buffers = {}
+        
+        # The first checkpoint has every page of RAM so the later ones only need what changed.
+        bus.track_dirty_pages()
+        bus.dirty_pages.update(self.ram_pages())
+        self.checkpoint()
+        
+    def ram_pages(self):
+        """ Return the page numbers of all of the RAM on the bus. """
+        pages = []
+        for index, device in enumerate(self.bus.devices):
+            if isinstance(device, RAM):
+                first = (index << BLOCK_PREFIX_SHIFT) >> PAGE_SHIFT
+                pages.extend(range(first, first + (device.get_memory_size() >> PAGE_SHIFT)))
+        return pages
+        
+    def read_page(self, page):
+        """ Return a copy of a page of RAM, or None if it isn't RAM. """
+        address = page << PAGE_SHIFT
+        device = self.bus.devices[address >> BLOCK_PREFIX_SHIFT]
+        if not isinstance(device, RAM):
+            return None
+        offset = address & BLOCK_OFFSET_MASK
+        return device.contents[offset:offset + PAGE_SIZE]
+        
+    def write_page(self, page, contents):
+        """ Put back the contents of a page of RAM. """
+        address = page << PAGE_SHIFT
+        offset = address & BLOCK_OFFSET_MASK
+        self.bus.devices[address >> BLOCK_PREFIX_SHIFT].contents[offset:offset + PAGE_SIZE] = contents
+        
+    def changed_buffer_pages(self, key):
+        """ Return the page numbers of a large buffer that differ from when it was last saved. """
+        buffer, saved = self.buffers[key]
+        step = PAGE_SIZE // buffer.itemsize
+        return [start // step for start in range(0, len(buffer), step)
+                if buffer[start:start + step] != saved[start:start + step]]
+                
+    def save_buffer_pages(self, buffers):
+        """ Return the changed pages of large buffers, all of them for a buffer that hasn't been seen before. """
+        pages = {}
+        for key, buffer in buffers.items():
+            if key not in self.buffers:
+                self.buffers[key] = (buffer, array.array(buffer.typecode))
+                
+            saved = self.buffers[key][1]
+            step = PAGE_SIZE // buffer.itemsize
+            for page in self.changed_buffer_pages(key):
+                pages[key, page] = buffer[page * step:(page + 1) * step]
+            saved[:] = buffer
+        return pages
+        
+    def poll(self):
+        """ Called after each instruction, takes a checkpoint when one is due. """
+        if self.cpu.instruction_count >= self.next_instruction:
+            self.checkpoint()
+            
+    def checkpoint(self):
+        """ Save the machine's state now. """
+        pages = {}
+        for page in self.bus.dirty_pages:
+            contents = self.read_page(page)
+            if contents is not None:
+                pages[page] = contents
+        self.bus.dirty_pages.clear()
+        
+        buffers = {}
+        cpu_state = capture_state(self.cpu, buffers = buffers)
+        device_states = [capture_state(device, buffers = buffers) for device in self.bus.io_devices]
+        scheduler_state = capture_state(self.scheduler, buffers = buffers)
+        
+        self.checkpoints.append(Checkpoint(
+            self.cpu.instruction_count,
+            cpu_state,
+            device_states,
+            scheduler_state,
+            pages,
+            self.save_buffer_pages(buffers),
+        ))
+        self.next_instruction = self.cpu.instruction_count + self.interval
+        
+        # Fold the oldest checkpoint into the next one so it has every page.
+        if len(self.checkpoints) > self.max_checkpoints:
+            oldest = self.checkpoints.pop(0)
+            oldest.pages.update(self.checkpoints[0].pages)
+            self.checkpoints[0].pages = oldest.pages
+            oldest.buffer_pages.update(self.checkpoints[0].buffer_pages)
+            self.checkpoints[0].buffer_pages = oldest.buffer_pages
+            
+    def restore(self, index):
+        """ Put the machine back to a checkpoint, the ones after it are discarded. """
+        target = self.checkpoints[index]
+        
+        # Pages written since the checkpoint get the contents they had at the time.
+        changed = set(self.bus.dirty_pages)
+        for later in self.checkpoints[index + 1:]:
+            changed.update(later.pages)
+        for page in changed:
+            for earlier in reversed(self.checkpoints[:index + 1]):
+                if page in earlier.pages:
+                    self.write_page(page, earlier.pages[page])
+                    break
+                    
+        # Likewise for the large buffers, including pages changed since the latest checkpoint.
+        changed = set()
+        for later in self.checkpoints[index + 1:]:
+            changed.update(later.buffer_pages)
+        for key in self.buffers:
+            changed.update((key, page) for page in self.changed_buffer_pages(key))
+        for key, page in changed:
+            for earlier in reversed(self.checkpoints[:index + 1]):
+                if (key, page) in earlier.buffer_pages:
+                    buffer = self.buffers[key][0]
+                    contents = earlier.buffer_pages[key, page]
+                    start = page * (PAGE_SIZE // buffer.itemsize)
+                    buffer[start:start + len(contents)] = contents
+                    break
+                    
+        # Buffers first seen after the checkpoint aren't part of the machine any more.
+        kept = set(key for earlier in self.checkpoints[:index + 1] for key, _page in earlier.buffer_pages)
+        self.buffers = dict((key, self.buffers[key]) for key in kept)
+        for buffer, saved in self.buffers.values():
+            saved[:] = buffer
+            
+        restore_state(self.cpu, target.cpu_state)
+        self.cpu.regs.update_segment_bases()
+        self.cpu.invalidate_code_window()
+        self.cpu.attention = True
+        for device, state in zip(self.bus.io_devices, target.device_states):
+            restore_state(device, state)
+        restore_state(self.scheduler, target.scheduler_state)
+        
+        # The display's bitmap isn't part of its state, draw it again from video RAM.
+        for device in self.bus.io_devices:
+            if getattr(device, "screen", None) is not None and hasattr(device, "redraw"):
+                device.redraw()
+                
+        del self.checkpoints[index + 1:]
+        self.bus.dirty_pages.clear()
+        self.next_instruction = target.instruction_count + self.interval
+        
+    def run_to(self, instruction_count, before_instruction = None):
+        """
+        Run the CPU forward to an instruction count the same way the scheduler does.
+        
+        If given before_instruction() is called before each instruction is run.
+        """
+        cpu = self.cpu
+        scheduler = self.scheduler
+        scheduler.slice_end = cpu.cycles + (1 << 62)
+        scheduler.reschedule()
+        
+        while cpu.instruction_count < instruction_count:
+            if cpu.hlt:
+                scheduler.idle(self.idle_ticks)
+                scheduler.reschedule()
+                continue
+                
+            if before_instruction is not None:
+                before_instruction()
+            cpu.fetch()
+            self.poll()
+            
+            if cpu.cycles >= scheduler.deadline:
+                scheduler.sync()
+                scheduler.reschedule()
+                
+        # The cycle count has moved under the scheduler, let it end the slice it was running.
+        scheduler.sync()
+        scheduler.slice_end = scheduler.deadline = cpu.cycles
+        
+    def seek(self, instruction_count):
+        """ Move the machine to an earlier instruction count, returning False if it's too far back. """
+        for index in range(len(self.checkpoints) - 1, -1, -1):
+            if self.checkpoints[index].instruction_count <= instruction_count:
+                self.restore(index)
+                self.run_to(instruction_count)
+                return True
+        return False
+        
+    def reverse_continue(self, should_stop):
+        """
+        Move the machine back to the last point before now where should_stop() was True.
+        
+        Each stretch between checkpoints is run again, latest first, noting where should_stop() was True.
+        Returns False and leaves the machine at the oldest checkpoint if it never was.
+        """
+        cpu = self.cpu
+        end = cpu.instruction_count
+        index = len(self.checkpoints) - 1
+        while index >= 0 and self.checkpoints[index].instruction_count >= end:
+            index -= 1
+            
+        hits = []
+        def _check():
+            if should_stop():
+                hits.append(cpu.instruction_count)
+                
+        while index >= 0:
+            start = self.checkpoints[index].instruction_count
+            self.restore(index)
+            self.run_to(end, _check)
+            if hits:
+                return self.seek(hits[-1])
+                
+            end = start
+            index -= 1
+            
+        self.restore(0)
+        return False
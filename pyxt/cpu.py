@@ -3,16 +3,18 @@ pyxt.cpu - 8088-ish CPU module for PyXT.
 """
 
 # Standard library imports
-import struct
 import operator
-from ctypes import Structure, Union, c_ushort, c_ubyte
+from ctypes import Structure, Union, c_ushort, c_ubyte, string_at, addressof, sizeof
 
 # Six imports
 from six.moves import range # pylint: disable=redefined-builtin
 
 # PyXT imports
+from pyxt.constants import BLOCK_PREFIX_SHIFT, BLOCK_OFFSET_MASK
 from pyxt.exceptions import InvalidOpcodeException
 from pyxt.helpers import *
+from pyxt.timing import *
+from pyxt.alu import *
 
 # Logging setup
 import logging
@@ -33,12 +35,7 @@ REG_MASK = 0x38
 REG_SHIFT = 3
 RM_MASK = 0x07
 
-MODRM_LUT = []
-for modrm in range(256):
-    __mod = (modrm & MOD_MASK) >> MOD_SHIFT
-    __reg = (modrm & REG_MASK) >> REG_SHIFT
-    __rm = modrm & RM_MASK
-    MODRM_LUT.append((__mod, __reg, __rm))
+MODRM_LUT = [((modrm & MOD_MASK) >> MOD_SHIFT, (modrm & REG_MASK) >> REG_SHIFT, modrm & RM_MASK) for modrm in range(256)]
 
 UNKNOWN = 0
 ADDRESS = 1
@@ -52,6 +49,30 @@ REPEAT_REP_REPZ = 0xF3
 REPEAT_REPNZ = 0xF2
 
 INT_DIVIDE_ERROR = 0
+INT_SINGLE_STEP = 1
+
+# Jcc and JMP rel8, the short jumps that are checked for idle loops.
+SHORT_JUMP_OPCODES = list(range(0x70, 0x80)) + [0xEB]
+
+# The flags a Jcc can test, packed into the low bits of an index into CONDITION_TAKEN.
+CONDITION_CARRY = 0x01
+CONDITION_ZERO = 0x02
+CONDITION_SIGN = 0x04
+CONDITION_OVERFLOW = 0x08
+CONDITION_PARITY = 0x10
+CONDITION_FLAGS_BITS = 5
+
+# Superinstructions, see CPU.fuse_instructions().  Each pattern has a name, the opcodes that start it, and the
+# opcodes and lengths of the instructions that must follow for them to be run in the same fetch().  Only
+# instructions without a ModRM byte can follow, so the first one is still charged the right cycles.
+JCC_OPCODES = frozenset(range(0x70, 0x80))
+FUSION_PATTERNS = (
+    ("cmp-jcc", (0x38, 0x39, 0x3A, 0x3B, 0x3C, 0x3D), ((JCC_OPCODES, 2),)),
+    ("test-jcc", (0x84, 0x85, 0xA8, 0xA9), ((JCC_OPCODES, 2),)),
+    ("dec-jnz", tuple(range(0x48, 0x50)), ((frozenset([0x75]), 2),)),
+    ("lodsb-stosb", (0xAC,), ((frozenset([0xAA]), 1),)),
+    ("in-test-jcc", (0xE4, 0xEC), ((frozenset([0xA8]), 2), (JCC_OPCODES, 2))),
+)
 
 BYTE_REG = {
     0x00 : "AL",
@@ -82,27 +103,69 @@ SEGMENT_REG = {
     0x03 : "DS",
 }
 
+# Segment register numbers, these index UnionRegs.segment_bases and are what segment_override holds.
+SEGMENT_ES = 0x00
+SEGMENT_CS = 0x01
+SEGMENT_SS = 0x02
+SEGMENT_DS = 0x03
 
-# Functions
-SIGNED_DWORD = struct.Struct("<l")
-UNSIGNED_DWORD = struct.Struct("<L")
-SIGNED_WORD = struct.Struct("<h")
-UNSIGNED_WORD = struct.Struct("<H")
-SIGNED_BYTE = struct.Struct("<b")
-UNSIGNED_BYTE = struct.Struct("<B")
 
+# Functions
 def signed_dword(value):
     """ Interpret an unsigned double word as a signed double word. """
-    return SIGNED_DWORD.unpack(UNSIGNED_DWORD.pack(value))[0]
+    return ((value & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
     
 def signed_word(value):
     """ Interpret an unsigned word as a signed word. """
-    return SIGNED_WORD.unpack(UNSIGNED_WORD.pack(value))[0]
+    return ((value & 0xFFFF) ^ 0x8000) - 0x8000
     
 def signed_byte(value):
     """ Interpret an unsigned byte as a signed byte. """
-    return SIGNED_BYTE.unpack(UNSIGNED_BYTE.pack(value))[0]
+    return ((value & 0xFF) ^ 0x80) - 0x80
+    
+def condition_taken(condition, carry, zero, sign, overflow, parity):
+    """ Returns True if a Jcc with the given condition code, the low nibble of 0x70 - 0x7F, jumps. """
+    test = condition >> 1
+    if test == 0:
+        taken = overflow # JO
+    elif test == 1:
+        taken = carry # JC
+    elif test == 2:
+        taken = zero # JZ
+    elif test == 3:
+        taken = carry or zero # JNA
+    elif test == 4:
+        taken = sign # JS
+    elif test == 5:
+        taken = parity # JP
+    elif test == 6:
+        taken = sign != overflow # JL
+    else:
+        taken = zero or sign != overflow # JLE
+        
+    # Odd condition codes jump when the test fails.
+    return bool(taken) != bool(condition & 0x01)
     
+def build_condition_table():
+    """ Returns a bytearray indexed by condition << CONDITION_FLAGS_BITS | CONDITION_* flags, 1 if Jcc jumps. """
+    # The flags have to be bools, JL compares SF with OF.
+    return bytearray(
+        condition_taken(
+            condition,
+            flags & CONDITION_CARRY != 0,
+            flags & CONDITION_ZERO != 0,
+            flags & CONDITION_SIGN != 0,
+            flags & CONDITION_OVERFLOW != 0,
+            flags & CONDITION_PARITY != 0,
+        )
+        for condition in range(0x10) for flags in range(1 << CONDITION_FLAGS_BITS)
+    )
+    
+# Short jump displacements, sign extended.
+SIGNED_BYTES = [signed_byte(value) for value in range(0x100)]
+
+CONDITION_TAKEN = build_condition_table()
+
 def decode_seg_reg(value):
     """ Decode a segment register selector into the string register name. """
     return SEGMENT_REG[value & 0x03]
@@ -111,54 +174,72 @@ def decode_seg_reg(value):
 def supports_rep_prefix(func):
     """ Decorator to implement the REP prefix which repeats while CX != 0. """
     
-    def _repeated(self, *args):
+    def _repeated(self, opcode):
         """ Wrapper that implements REP. """
         if self.repeat_prefix == REPEAT_REP_REPZ:
+            start_cycles, iteration_cycles = REP_CYCLES[opcode]
+            iterations = self.regs.CX
             while self.regs.CX != 0:
                 # TODO: When interrupts are supported we will need to process them here.
                 self.regs.CX -= 1
-                func(self, *args)
+                func(self, opcode)
                 
+            self.cycles += start_cycles + (iterations * iteration_cycles)
+            
             # Clear the prefix so we can catch invalid combinations.
             self.repeat_prefix = REPEAT_NONE
             
         else:
-            func(self, *args)
+            func(self, opcode)
             
     return _repeated
     
 def supports_repz_repnz_prefix(func):
     """ Decorator to implement the REPZ/REPNZ prefixes which repeats while CX != 0 and the zero flag is in a given state. """
     
-    def _repeated(self, *args):
+    def _repeated(self, opcode):
         """ Wrapper that implements REPZ and REPNZ. """
         if self.repeat_prefix == REPEAT_REP_REPZ:
+            start_cycles, iteration_cycles = REP_CYCLES[opcode]
+            iterations = self.regs.CX
             while self.regs.CX != 0:
                 # TODO: When interrupts are supported we will need to process them here.
                 self.regs.CX -= 1
-                func(self, *args)
+                func(self, opcode)
                 if not self.flags.zero: # Need to test this after func() to avoid testing precondition.
                     break
                     
+            self.cycles += start_cycles + ((iterations - self.regs.CX) * iteration_cycles)
+            
             # Clear the prefix so we can catch invalid combinations.
             self.repeat_prefix = REPEAT_NONE
             
         elif self.repeat_prefix == REPEAT_REPNZ:
+            start_cycles, iteration_cycles = REP_CYCLES[opcode]
+            iterations = self.regs.CX
             while self.regs.CX != 0:
                 # TODO: When interrupts are supported we will need to process them here.
                 self.regs.CX -= 1
-                func(self, *args)
+                func(self, opcode)
                 if self.flags.zero: # Need to test this after func() to avoid testing precondition.
                     break
                     
+            self.cycles += start_cycles + ((iterations - self.regs.CX) * iteration_cycles)
+            
             # Clear the prefix so we can catch invalid combinations.
             self.repeat_prefix = REPEAT_NONE
             
         else:
-            func(self, *args)
+            func(self, opcode)
             
     return _repeated
 
+def effective_address_function(base, displacement):
+    """ Returns a function adding a ModRM base and displacement, masked to 16 bits for negative displacements. """
+    if displacement is None:
+        return lambda: base() & 0xFFFF
+    return lambda: (base() + displacement()) & 0xFFFF
+    
 # Classes
 class WordRegs(Structure):
     _fields_ = [
@@ -203,6 +284,10 @@ class UnionRegs(Union):
     def __init__(self):
         Union.__init__(self)
         
+        # Segment register values shifted left 4, indexed by the SEGMENT_* numbers.  Memory accesses add an
+        # offset to one of these instead of shifting the segment every time.
+        self.segment_bases = [0x0000, 0x0000, 0x0000, 0x0000]
+        
         # These are all initialized to zero by ctypes but this is done so PyLint isn't confused.
         # pylint: disable=invalid-name
         self.AX = 0x0000
@@ -240,6 +325,27 @@ class UnionRegs(Union):
     def __setitem__(self, key, value):
         setattr(self, key, value)
         
+    def update_segment_bases(self):
+        """ Recalculate the segment bases, for when the registers were written behind our back (memmove). """
+        self.segment_bases[:] = [getattr(self, name) << 4 for _, name in sorted(SEGMENT_REG.items())]
+        
+def segment_register_property(name, index):
+    """ Wrap the ctypes field for a segment register so writes also update UnionRegs.segment_bases. """
+    field = UnionRegs.__dict__[name]
+    
+    def get_segment(self):
+        return field.__get__(self, UnionRegs)
+        
+    def set_segment(self, value):
+        field.__set__(self, value)
+        self.segment_bases[index] = (value & 0xFFFF) << 4
+        
+    return property(get_segment, set_segment, doc = "%s register, writes update segment_bases." % name)
+    
+for _index, _name in SEGMENT_REG.items():
+    setattr(UnionRegs, _name, segment_register_property(_name, _index))
+del _index, _name
+    
 class FLAGS(object):
     """ 8086/8088 FLAGS register. """
     BLANK =       0x0000
@@ -293,16 +399,11 @@ class FLAGS(object):
         
     def set_from_alu_byte(self, value):
         """ Set ZF, SF, CF, and PF based the result of an ALU operation. """
-        self.zero = not (value & 0xFF)
-        self.sign = value & 0x80 == 0x80
-        self.carry = value & 0x100 == 0x100
-        self.parity = (count_bits_fast(value & 0x00FF) % 2) == 0
+        self.carry, self.parity, _adjust, self.zero, self.sign, _overflow = FLAG_VALUES[RESULT_FLAGS_8[value & 0x1FF]]
         
     def set_from_alu_no_carry_byte(self, value):
         """ Set ZF, SF, and PF based the result of an ALU operation. """
-        self.zero = not (value & 0xFF)
-        self.sign = value & 0x80 == 0x80
-        self.parity = (count_bits_fast(value & 0x00FF) % 2) == 0
+        _carry, self.parity, _adjust, self.zero, self.sign, _overflow = FLAG_VALUES[RESULT_FLAGS_8[value & 0xFF]]
         
     def set_from_alu(self, value, bits = 16, carry = True):
         """ Generic wrapper for set_from_alu_*. """
@@ -321,6 +422,23 @@ class FLAGS(object):
         """ The carry and overflow flags are cleared after a logical ALU operation. """
         self.carry = self.overflow = False
         
+    # Packed flags words come from the tables in pyxt.alu.
+    def set_from_packed(self, packed):
+        """ Set CF, PF, AF, ZF, SF, and OF from a packed flags word. """
+        self.carry, self.parity, self.adjust, self.zero, self.sign, self.overflow = FLAG_VALUES[packed]
+        
+    def set_from_packed_no_carry(self, packed):
+        """ Set PF, AF, ZF, SF, and OF from a packed flags word. """
+        _carry, self.parity, self.adjust, self.zero, self.sign, self.overflow = FLAG_VALUES[packed]
+        
+    def set_from_packed_logical(self, packed):
+        """ Set CF, PF, ZF, SF, and OF from a packed flags word, leaving AF alone. """
+        self.carry, self.parity, _adjust, self.zero, self.sign, self.overflow = FLAG_VALUES[packed]
+        
+    def set_from_packed_shift(self, packed):
+        """ Set CF, PF, ZF, and SF from a packed flags word, leaving AF and OF alone. """
+        self.carry, self.parity, _adjust, self.zero, self.sign, _overflow = FLAG_VALUES[packed]
+        
     @property
     def value(self):
         """ Return the FLAGS register as a word value. """
@@ -368,11 +486,24 @@ class CPU(object):
         # CPU halt flag.
         self.hlt = False
         
+        # Clocks run since power on, each instruction is charged from the tables in pyxt.timing.
+        self.cycles = 0
+        
+        # Instructions executed since power on, for pyxt.metrics.
+        self.instruction_count = 0
+        
+        # Last ModRM byte decoded, selects the column of INSTRUCTION_CYCLES for the current instruction.
+        self.modrm = 0
+        
+        # Set along with hlt when halted in a loop polling a device, the scheduler clears both after moving time on.
+        self.busy_wait = False
+        
         # Flags register.
         self.flags = FLAGS()
         
         # Normal registers.
         self.regs = UnionRegs()
+        self.segment_bases = self.regs.segment_bases
         
         # ALU vector table.
         self.alu_vector_table = {
@@ -384,12 +515,47 @@ class CPU(object):
             0x05 : self._alu_ax_imm16,
         }
         
+        # Byte operators for the immediate group (0x80 and 0x82) by sub-opcode, these all set the flags.
+        self.group_8x_byte_operators = (
+            self.alu_add_8,
+            self.alu_or_8,
+            self.alu_adc_8,
+            self.alu_sbb_8,
+            self.alu_and_8,
+            self.alu_sub_8,
+            self.alu_xor_8,
+            self.alu_sub_8,
+        )
+        
         # Prefix flags.
         self.repeat_prefix = REPEAT_NONE
         self.segment_override = None
         
-        # Input signals.
-        self.interrupt_signaled = False
+        # Memory the instruction stream is read from directly, see read_instruction_byte().  The window covers the
+        # linear addresses code_window_base up to code_window_base + code_window_limit.
+        self.code_window = None
+        self.code_window_base = 0
+        self.code_window_limit = 0
+        
+        # Input signals, the INTR line is read and written through interrupt_signaled.
+        self.intr = False
+        
+        # Set when something has to be handled before the next instruction: a possible interrupt, a single-step
+        # trap, a halt or a break request.  fetch() only has to test this one flag, see process_attention().
+        self.attention = False
+        
+        # The last instruction ran with the trap flag set, INT 1 is due before the next one.
+        self.trap_pending = False
+        
+        # Called before the next instruction after request_break(), the debugger installs itself here.
+        self.break_handler = None
+        self.break_requested = False
+        
+        # Native handlers for software interrupts, see install_interrupt_hook().
+        self.interrupt_hooks = {}
+        
+        # Cycle count the scheduler next needs control back at, superinstructions stop short of it.
+        self.deadline = float("inf")
         
         # Fast instruction decoding.
         self.opcode_vector = [
@@ -627,6 +793,28 @@ class CPU(object):
         while len(self.opcode_vector) < 256:
             self.opcode_vector.append(None)
             
+        self.opcode_vector[0xE4] = self.opcode_in_al_imm8
+        self.opcode_vector[0xEB] = self.opcode_jmp_rel8
+        self.opcode_vector[0xEC] = self.opcode_in_al_dx
+        
+        # Effective address function and default segment for each ModRM byte with a memory operand.
+        self.effective_address_vector = self.build_effective_address_vector()
+        
+        # Idle loop detection wraps the short jumps, keep the originals so it can be turned off.
+        self.short_jump_handlers = dict((opcode, self.opcode_vector[opcode]) for opcode in SHORT_JUMP_OPCODES)
+        self.idle_loop_detection = False
+        self.busy_wait_detection = False
+        self.idle_loop_state = None
+        self.idle_loop_io_read_count = 0
+        
+        # Superinstructions wrap the handlers for the first instruction of each pattern, keep the originals.
+        self.unfused_handlers = dict(
+            (opcode, self.opcode_vector[opcode]) for _name, opcodes, _following in FUSION_PATTERNS for opcode in opcodes
+        )
+        
+        # The number of times each superinstruction has been started.
+        self.fusion_counts = dict((name, 0) for name, _opcodes, _following in FUSION_PATTERNS)
+        
         # Set the default LOOP opcode handler.
         # TODO: This can be removed when LOOP is moved to the fancy new vector table.
         self.opcode_loop = self.opcode_loop_no_shortcuts
@@ -638,14 +826,58 @@ class CPU(object):
         
     def read_instruction_byte(self):
         """ Read a byte from CS:IP and increment IP to point at the next instruction. """
-        address = segment_offset_to_address(self.regs.CS, self.regs.IP)
-        self.regs.IP += 1
+        regs = self.regs
+        address = (self.segment_bases[SEGMENT_CS] + regs.IP) & 0xFFFFF
+        regs.IP += 1
+        offset = address - self.code_window_base
+        if 0 <= offset < self.code_window_limit:
+            return self.code_window[offset]
+        return self.read_code_byte_through_bus(address)
+        
+    def read_code_byte_through_bus(self, address):
+        """ Read an instruction byte outside of the code window, moving the window to its block if possible. """
+        block = address >> BLOCK_PREFIX_SHIFT
+        device = self.bus.devices[block]
+        window = device.get_code_window() if device is not None else None
+        if window is not None:
+            self.code_window = window
+            self.code_window_base = block << BLOCK_PREFIX_SHIFT
+            self.code_window_limit = min(len(window), BLOCK_OFFSET_MASK + 1)
         return self.mem_read_byte(address)
         
+    def invalidate_code_window(self):
+        """ Stop fetching from the code window, the next instruction byte is read through the bus. """
+        self.code_window = None
+        self.code_window_base = 0
+        self.code_window_limit = 0
+        
+    @property
+    def interrupt_signaled(self):
+        """ State of the INTR line from the PIC. """
+        return self.intr
+        
+    @interrupt_signaled.setter
+    def interrupt_signaled(self, value):
+        self.intr = value
+        if value:
+            self.attention = True
+            
+    def request_break(self):
+        """ Call break_handler before the next instruction, this is safe to call from a signal handler. """
+        self.break_requested = True
+        self.attention = True
+        
     def fetch(self):
         """ Fetch and execute one instruction. """
-        # Process any pending interrupts, including trap/single-step.
-        self.process_interrupts()
+        # Interrupts, the single-step trap, halts and break requests all go through one flag.
+        if self.attention:
+            self.process_attention()
+            
+            # A halted CPU does nothing until an interrupt wakes it up.
+            if self.hlt:
+                return
+                
+        self.instruction_count += 1
         
         # Clear all prefixes.
         self.repeat_prefix = REPEAT_NONE
@@ -663,23 +895,26 @@ class CPU(object):
             elif opcode == 0xF2:
                 self.repeat_prefix = REPEAT_REPNZ
             elif opcode == 0x26:
-                self.segment_override = "ES"
+                self.segment_override = SEGMENT_ES
             elif opcode == 0x2E:
-                self.segment_override = "CS"
+                self.segment_override = SEGMENT_CS
             elif opcode == 0x36:
-                self.segment_override = "SS"
+                self.segment_override = SEGMENT_SS
             elif opcode == 0x3E:
-                self.segment_override = "DS"
+                self.segment_override = SEGMENT_DS
             elif opcode == 0xF0:
                 # TODO: If PyXT ever runs in multiple threads the LOCK signal will need to be implemented.
                 pass
             else:
                 break
                 
+            self.cycles += PREFIX_CYCLES
+            
         # First check if the opcode is in the instruction decoding table.
         opcode_handler = self.opcode_vector[opcode]
         if opcode_handler is not None:
             opcode_handler(opcode)
+            self.cycles += INSTRUCTION_CYCLES[opcode][self.modrm]
             
             # HACK: Remove this and the return when all instructions are converted.
             if self.repeat_prefix != REPEAT_NONE:
@@ -730,8 +965,6 @@ class CPU(object):
             self.opcode_sti()
         elif opcode == 0xE9:
             self._jmp_rel16()
-        elif opcode == 0xEB:
-            self._jmp_rel8()
         elif opcode == 0xFE:
             self.opcode_group_fe()
         elif opcode == 0xFF:
@@ -740,10 +973,6 @@ class CPU(object):
             self._jmpf()
         elif opcode & 0xFC == 0xD0:
             self.opcode_group_rotate_and_shift(opcode)
-        elif opcode == 0xE4:
-            self.opcode_in_al_imm8()
-        elif opcode == 0xEC:
-            self.opcode_in_al_dx()
         elif opcode == 0xE6:
             self._out_imm8_al()
         elif opcode == 0xEE:
@@ -761,6 +990,8 @@ class CPU(object):
         else:
             self.signal_invalid_opcode(opcode, "Opcode not implemented.")
             
+        self.cycles += INSTRUCTION_CYCLES[opcode][self.modrm]
+        
         # The REP* prefixes will clear this after execution.  If it is still set at this point
         # it means that someone tried to REP an instruction that doesn't support it.
         if self.repeat_prefix != REPEAT_NONE:
@@ -789,7 +1020,8 @@ class CPU(object):
         rm_value = None
         
         # Get the mod r/m byte and decode it.
-        mod, reg, rm = MODRM_LUT[self.read_instruction_byte()]
+        modrm = self.modrm = self.read_instruction_byte()
+        mod, reg, rm = MODRM_LUT[modrm]
         
         if decode_register:
             if size == 8:
@@ -800,46 +1032,14 @@ class CPU(object):
             register = reg
             
         # Mod 00, 01, 10 - r/m is address (calculated base + displacement).
-        if mod in (0x00, 0x01, 0x02):
+        if mod != 0x03:
             rm_type = ADDRESS
             
-            # Determine the calculated base.
-            if rm == 0x00:
-                rm_value = self.regs.BX + self.regs.SI
-            elif rm == 0x01:
-                rm_value = self.regs.BX + self.regs.DI
-            elif rm == 0x02:
-                rm_value = self.regs.BP + self.regs.SI
-                if self.segment_override is None:
-                    self.segment_override = "SS"
-            elif rm == 0x03:
-                rm_value = self.regs.BP + self.regs.DI
-                if self.segment_override is None:
-                    self.segment_override = "SS"
-            elif rm == 0x04:
-                rm_value = self.regs.SI
-            elif rm == 0x05:
-                rm_value = self.regs.DI
-            elif rm == 0x06:
-                # Mod 00 / r/m 110 is absolute address.
-                if mod == 0x00:
-                    rm_value = self.get_word_immediate()
-                else:
-                    rm_value = self.regs.BP
-                    if self.segment_override is None:
-                        self.segment_override = "SS"
-            elif rm == 0x07:
-                rm_value = self.regs.BX
-                
-            # Determine the displacement.
-            displacement = 0
-            if mod == 0x01:
-                displacement = sign_extend_byte_to_word(self.get_byte_immediate())
-            elif mod == 0x02:
-                displacement = self.get_word_immediate()
-            
-            # Negative displacements do two's complement math, we need to mask this to 16 bits for it to work.
-            rm_value = (rm_value + displacement) & 0xFFFF
+            # BP based forms default to SS, the rest leave the override alone (DS unless prefixed).
+            effective_address, default_segment = self.effective_address_vector[modrm]
+            if self.segment_override is None:
+                self.segment_override = default_segment
+            rm_value = effective_address()
             
         # Mod 11 - r/m is a second register field.
         elif mod == 0x03:
@@ -863,6 +1063,70 @@ class CPU(object):
             
         return register, rm_type, rm_value
         
+    def build_effective_address_vector(self):
+        """
+        Returns a list of (function, default segment) for the memory forms of the ModRM byte (0x00 - 0xBF).
+        
+        Each function reads any displacement from the instruction stream and returns the 16 bit offset.
+        """
+        bases = (
+            (self._ea_bx_si, None),
+            (self._ea_bx_di, None),
+            (self._ea_bp_si, SEGMENT_SS),
+            (self._ea_bp_di, SEGMENT_SS),
+            (self._ea_si, None),
+            (self._ea_di, None),
+            (self._ea_bp, SEGMENT_SS),
+            (self._ea_bx, None),
+        )
+        displacements = (None, self._ea_displacement_8, self.get_word_immediate)
+        
+        vector = []
+        for modrm in range(0xC0):
+            mod, _reg, rm = MODRM_LUT[modrm]
+            base, default_segment = bases[rm]
+            displacement = displacements[mod]
+            if mod == 0x00 and rm == 0x06:
+                # Mod 00 / r/m 110 is absolute address.
+                vector.append((self.get_word_immediate, None))
+            elif displacement is None and rm >= 0x04:
+                # A single register can't overflow 16 bits.
+                vector.append((base, default_segment))
+            else:
+                vector.append((effective_address_function(base, displacement), default_segment))
+        return vector
+        
+    def _ea_bx_si(self):
+        regs = self.regs
+        return regs.BX + regs.SI
+        
+    def _ea_bx_di(self):
+        regs = self.regs
+        return regs.BX + regs.DI
+        
+    def _ea_bp_si(self):
+        regs = self.regs
+        return regs.BP + regs.SI
+        
+    def _ea_bp_di(self):
+        regs = self.regs
+        return regs.BP + regs.DI
+        
+    def _ea_si(self):
+        return self.regs.SI
+        
+    def _ea_di(self):
+        return self.regs.DI
+        
+    def _ea_bp(self):
+        return self.regs.BP
+        
+    def _ea_bx(self):
+        return self.regs.BX
+        
+    def _ea_displacement_8(self):
+        return sign_extend_byte_to_word(self.get_byte_immediate())
+        
     def get_immediate(self, word):
         """ Get either a byte or word immediate value from CS:IP. """
         if word:
@@ -872,6 +1136,16 @@ class CPU(object):
         
     def get_word_immediate(self):
         """ Get a word immediate value from CS:IP. """
+        regs = self.regs
+        ip = regs.IP
+        offset = ((self.segment_bases[SEGMENT_CS] + ip) & 0xFFFFF) - self.code_window_base
+        
+        # Both bytes have to be in the window and IP can't wrap around between them.
+        if 0 <= offset < self.code_window_limit - 1 and ip != 0xFFFF:
+            regs.IP = ip + 2
+            window = self.code_window
+            return window[offset + 1] << 8 | window[offset]
+            
         value = self.read_instruction_byte()
         value |= (self.read_instruction_byte() << 8)
         return value
@@ -1030,7 +1304,7 @@ class CPU(object):
         On 808x this pushes the new SP value, on 286+ this pushes the old SP value.
         """
         self.regs.SP -= 2
-        self.bus.mem_write_word(segment_offset_to_address(self.regs.SS, self.regs.SP), self.regs.SP)
+        self.bus.mem_write_word((self.segment_bases[SEGMENT_SS] + self.regs.SP) & 0xFFFFF, self.regs.SP)
         
     def opcode_pop_sp(self, opcode):
         """
@@ -1038,17 +1312,17 @@ class CPU(object):
         
         This needs to assign the top of the stack to SP, then increment it by 2.
         """
-        self.regs.SP = self.bus.mem_read_word(segment_offset_to_address(self.regs.SS, self.regs.SP))
+        self.regs.SP = self.bus.mem_read_word((self.segment_bases[SEGMENT_SS] + self.regs.SP) & 0xFFFFF)
         self.regs.SP += 2
         
     def internal_push(self, value):
         """ Decrement the stack pointer and push a word on to the stack. """
         self.regs.SP -= 2
-        self.bus.mem_write_word(segment_offset_to_address(self.regs.SS, self.regs.SP), value)
+        self.bus.mem_write_word((self.segment_bases[SEGMENT_SS] + self.regs.SP) & 0xFFFFF, value)
         
     def internal_pop(self):
         """ Pop a word off of the stack and incrementt the stack pointer. """
-        value = self.bus.mem_read_word(segment_offset_to_address(self.regs.SS, self.regs.SP))
+        value = self.bus.mem_read_word((self.segment_bases[SEGMENT_SS] + self.regs.SP) & 0xFFFFF)
         self.regs.SP += 2
         return value
         
@@ -1057,108 +1331,144 @@ class CPU(object):
         """ JC/JNAE/JB - Jump short if the carry flag is set. """
         distance = self.get_byte_immediate()
         if self.flags.carry:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jz(self, _opcode):
         """ JZ/JE - Jump short if the zero flag is set. """
         distance = self.get_byte_immediate()
         if self.flags.zero:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jnz(self, _opcode):
         """ JNZ/JNE - Jump short if the zero flag is clear. """
         distance = self.get_byte_immediate()
         if not self.flags.zero:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jna(self, _opcode):
         """ JNA/JBE - Jump short if zero or carry are set. """
         distance = self.get_byte_immediate()
         if self.flags.zero or self.flags.carry:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_ja(self, _opcode):
         """ JA/JNBE - Jump short if both zero and carry are clear. """
         distance = self.get_byte_immediate()
         if not self.flags.zero and not self.flags.carry:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jnc(self, _opcode):
         """ JNC/JAE/JNB - Jump short if the carry flag is clear. """
         distance = self.get_byte_immediate()
         if not self.flags.carry:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jnp(self, _opcode):
         """ JNP/JPO - Jump short if the parity flag is clear (odd parity). """
         distance = self.get_byte_immediate()
         if not self.flags.parity:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jp(self, _opcode):
         """ JP/JPE - Jump short if the parity flag is set (even parity). """
         distance = self.get_byte_immediate()
         if self.flags.parity:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jns(self, _opcode):
         """ JNS - Jump short if the sign flag is clear. """
         distance = self.get_byte_immediate()
         if not self.flags.sign:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_js(self, _opcode):
         """ JS - Jump short if the sign flag is set. """
         distance = self.get_byte_immediate()
         if self.flags.sign:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jno(self, _opcode):
         """ Jump short if the overflow flag is clear. """
         distance = self.get_byte_immediate()
         if not self.flags.overflow:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jo(self, _opcode):
         """ Jump short if the overflow flag is set. """
         distance = self.get_byte_immediate()
         if self.flags.overflow:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jl(self, _opcode):
         """ JL/JNGE - Jump short if the sign flag is not equal to the overflow flag. """
         distance = self.get_byte_immediate()
         if self.flags.sign != self.flags.overflow:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jnl(self, _opcode):
         """ JNL/JGE - Jump short if the sign flag is equal to the overflow flag. """
         distance = self.get_byte_immediate()
         if self.flags.sign == self.flags.overflow:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jle(self, _opcode):
         """ JLE/JNG - Jump short if the sign flag is not equal to the overflow flag or the zero flag is set. """
         distance = self.get_byte_immediate()
         if self.flags.zero or (self.flags.sign != self.flags.overflow):
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jnle(self, _opcode):
         """ JNLE/JG - Jump short if the sign flag equals the overflow flag and the zero flag is clear. """
         distance = self.get_byte_immediate()
         if not self.flags.zero and (self.flags.sign == self.flags.overflow):
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_jcxz(self):
         """ Jump short if the CX register == 0. """
         distance = self.get_byte_immediate()
         if self.regs.CX == 0:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     # ********** Interrupt opcodes. **********
     def opcode_int(self):
         """ Jump to the specified interrupt vector (imm8). """
-        self.internal_service_interrupt(self.get_byte_immediate())
+        interrupt = self.get_byte_immediate()
+        
+        # Give any native handler a chance to service the interrupt without running the vector.
+        hook = self.interrupt_hooks.get(interrupt)
+        if hook is not None and hook(self):
+            return
+            
+        self.internal_service_interrupt(interrupt)
+        
+    def install_interrupt_hook(self, interrupt, handler):
+        """
+        Install a native handler for a software interrupt.
+        
+        The handler is called with the CPU on INT and returns True if it serviced the call,
+        otherwise the interrupt vector is run as normal.  Passing None removes the hook.
+        """
+        if handler is None:
+            self.interrupt_hooks.pop(interrupt, None)
+        else:
+            self.interrupt_hooks[interrupt] = handler
         
     def opcode_iret(self):
         """ Return from interrupt, restoring IP, CS, and FLAGS. """
@@ -1166,12 +1476,46 @@ class CPU(object):
         self.regs.CS = self.internal_pop()
         self.flags.value = self.internal_pop()
         
+        # IF or TF may have been set.
+        self.attention = True
+        
+    def process_attention(self):
+        """
+        Handle whatever set attention before the next instruction is run.
+        
+        The flag is cleared and set again if a halt or the trap flag needs it checked before the next instruction
+        too.  An interrupt request that arrives with interrupts disabled waits for STI, POPF or IRET to set it.
+        """
+        self.attention = False
+        
+        if self.break_requested:
+            self.break_requested = False
+            if self.break_handler is not None:
+                self.break_handler()
+                
+        # The single-step trap is taken after the instruction that ran with TF set.
+        if self.trap_pending:
+            self.trap_pending = False
+            self.cycles += TRAP_CYCLES
+            self.internal_service_interrupt(INT_SINGLE_STEP)
+            
+        self.process_interrupts()
+        
+        if self.hlt:
+            self.attention = True
+        elif self.flags.trap:
+            self.trap_pending = True
+            self.attention = True
+            
     def process_interrupts(self):
         """ Process non-software interrupts. """
-        if self.interrupt_signaled and self.flags.interrupt_enable:
+        if self.intr and self.flags.interrupt_enable:
             assert self.bus.pic
             interrupt = self.bus.pic.interrupt_acknowledge()
             log.debug("External interrupt requested INT %02xh.", interrupt)
+            self.hlt = False
+            self.busy_wait = False
+            self.cycles += INTERRUPT_CYCLES
             self.internal_service_interrupt(interrupt)
             
     def internal_service_interrupt(self, interrupt):
@@ -1250,7 +1594,8 @@ class CPU(object):
         self.regs.CX = value
         
         if value != 0:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_loop_collapse_delay_loops(self):
         """
@@ -1266,8 +1611,11 @@ class CPU(object):
         self.regs.CX = value
         
         if value != 0 and distance != 0xFE: # Skip delay loops that only jump back to this instruction.
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
         elif distance == 0xFE:
+            # Charge for the skipped iterations so the delay still takes the right amount of emulated time.
+            self.cycles += self.regs.CX * LOOP_ITERATION_CYCLES
             self.regs.CX = 0
             
     def collapse_delay_loops(self, value):
@@ -1285,7 +1633,8 @@ class CPU(object):
         self.regs.CX = value
         
         if value != 0 and self.flags.zero:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     def opcode_loopnz(self):
         """ LOOPNZ/LOOPNE - Decrement CX and jump short if it is non-zero and the zero flag is clear. """
@@ -1295,7 +1644,8 @@ class CPU(object):
         self.regs.CX = value
         
         if value != 0 and self.flags.zero is False:
-            self.regs.IP += signed_byte(distance)
+            self.regs.IP += SIGNED_BYTES[distance]
+            self.cycles += BRANCH_TAKEN_CYCLES
             
     # ********** Arithmetic opcodes. **********
     def opcode_group_8x(self, opcode):
@@ -1318,45 +1668,41 @@ class CPU(object):
         if sign_extend and not word_imm:
             immediate = sign_extend_byte_to_word(immediate)
             
+        # The byte operators set all of the flags, sub-opcode 7 is CMP which doesn't store the result.
+        if not word_reg:
+            result = self.group_8x_byte_operators[sub_opcode](value, immediate)
+            if sub_opcode != 0x07:
+                self._set_rm8(rm_type, rm_value, result)
+            return
+            
         set_value = True
         logical = False
         if sub_opcode == 0x00:
-            result = value + immediate
+            result = self.operator_add_16(value, immediate)
         elif sub_opcode == 0x01:
             result = value | immediate
             logical = True
         elif sub_opcode == 0x02:
-            result = value + immediate + (1 if self.flags.carry else 0)
+            result = self.operator_adc_16(value, immediate)
         elif sub_opcode == 0x03:
-            if word_reg:
-                result = self.operator_sbb_16(value, immediate)
-            else:
-                result = self.operator_sbb_8(value, immediate)
+            result = self.operator_sbb_16(value, immediate)
         elif sub_opcode == 0x04:
             result = value & immediate
             logical = True
         elif sub_opcode == 0x05:
-            result = value - immediate
+            result = self.operator_sub_16(value, immediate)
         elif sub_opcode == 0x06:
             result = value ^ immediate
             logical = True
         elif sub_opcode == 0x07:
-            if word_reg:
-                result = self.operator_sub_16(value, immediate)
-            else:
-                result = self.operator_sub_8(value, immediate)
+            result = self.operator_sub_16(value, immediate)
             set_value = False
         else:
             raise NotImplementedError("sub_opcode = %r" % sub_opcode)
             
-        if word_reg:
-            self.flags.set_from_alu_word(result)
-            if set_value:
-                self._set_rm16(rm_type, rm_value, result)
-        else:
-            self.flags.set_from_alu_byte(result)
-            if set_value:
-                self._set_rm8(rm_type, rm_value, result)
+        self.flags.set_from_alu_word(result)
+        if set_value:
+            self._set_rm16(rm_type, rm_value, result)
             
         if logical:
             self.flags.clear_logical()
@@ -1364,24 +1710,49 @@ class CPU(object):
     # Bitwise opcodes.
     def opcode_group_or(self, opcode):
         """ Entry point for all OR opcodes. """
-        self.alu_vector_table[opcode & 0x07](operator.or_)
-        self.flags.clear_logical()
+        if opcode & 0x01:
+            self.alu_vector_table[opcode & 0x07](operator.or_)
+            self.flags.clear_logical()
+        else:
+            self.alu_vector_table[opcode & 0x07](self.alu_or_8)
+            
+    def alu_or_8(self, operand_a, operand_b):
+        """ Implements the 8-bit OR operation, clearing CF and OF like all logical operations. """
+        result = operand_a | operand_b
+        self.flags.set_from_packed_logical(RESULT_FLAGS_8[result])
+        return result
         
     def opcode_group_and(self, opcode):
         """ Entry point for all AND opcodes. """
-        self.alu_vector_table[opcode & 0x07](operator.and_)
-        self.flags.clear_logical()
+        if opcode & 0x01:
+            self.alu_vector_table[opcode & 0x07](operator.and_)
+            self.flags.clear_logical()
+        else:
+            self.alu_vector_table[opcode & 0x07](self.alu_and_8)
+            
+    def alu_and_8(self, operand_a, operand_b):
+        """ Implements the 8-bit AND operation, clearing CF and OF like all logical operations. """
+        result = operand_a & operand_b
+        self.flags.set_from_packed_logical(RESULT_FLAGS_8[result])
+        return result
         
     def opcode_group_xor(self, opcode):
         """ Entry point for all XOR opcodes. """
-        self.alu_vector_table[opcode & 0x07](operator.xor)
-        self.flags.clear_logical()
+        if opcode & 0x01:
+            self.alu_vector_table[opcode & 0x07](operator.xor)
+            self.flags.clear_logical()
+        else:
+            self.alu_vector_table[opcode & 0x07](self.alu_xor_8)
+            
+    def alu_xor_8(self, operand_a, operand_b):
+        """ Implements the 8-bit XOR operation, clearing CF and OF like all logical operations. """
+        result = operand_a ^ operand_b
+        self.flags.set_from_packed_logical(RESULT_FLAGS_8[result])
+        return result
         
     def opcode_test_al_imm8(self, _opcode):
         """ AND al with imm8, update the flags, but don't store the value. """
-        value = self.regs.AL & self.get_byte_immediate()
-        self.flags.set_from_alu_byte(value)
-        self.flags.clear_logical()
+        self.flags.set_from_packed_logical(RESULT_FLAGS_8[self.regs.AL & self.get_byte_immediate()])
         
     def opcode_test_ax_imm16(self, _opcode):
         """ AND ax with imm16, update the flags, but don't store the value. """
@@ -1393,8 +1764,7 @@ class CPU(object):
         """ AND an r/m8 value and a register value, update the flags, but don't store the value. """
         register, rm_type, rm_value = self.get_modrm_operands(8)
         value = self._get_rm8(rm_type, rm_value) & self.regs[register]
-        self.flags.set_from_alu_no_carry_byte(value)
-        self.flags.clear_logical()
+        self.flags.set_from_packed_logical(RESULT_FLAGS_8[value])
         
     def opcode_test_rm16_r16(self, _opcode):
         """ AND an r/m16 value and a register value, update the flags, but don't store the value. """
@@ -1405,12 +1775,11 @@ class CPU(object):
         
     # Generic ALU helper functions.
     def _alu_rm8_r8(self, operation):
-        """ Generic r/m8 r8 ALU processor. """
+        """ Generic r/m8 r8 ALU processor, the operation sets the flags. """
         register, rm_type, rm_value = self.get_modrm_operands(8)
         op1 = self._get_rm8(rm_type, rm_value)
         op2 = self.regs[register]
         op1 = operation(op1, op2)
-        self.flags.set_from_alu_byte(op1)
         self._set_rm8(rm_type, rm_value, op1 & 0xFF)
         
     def _alu_rm16_r16(self, operation):
@@ -1423,12 +1792,11 @@ class CPU(object):
         self._set_rm16(rm_type, rm_value, op1 & 0xFFFF)
         
     def _alu_r8_rm8(self, operation):
-        """ Generic r8 r/m8 ALU processor. """
+        """ Generic r8 r/m8 ALU processor, the operation sets the flags. """
         register, rm_type, rm_value = self.get_modrm_operands(8)
         op1 = self.regs[register]
         op2 = self._get_rm8(rm_type, rm_value)
         op1 = operation(op1, op2)
-        self.flags.set_from_alu_byte(op1)
         self.regs[register] = op1 & 0xFF
         
     def _alu_r16_rm16(self, operation):
@@ -1441,9 +1809,8 @@ class CPU(object):
         self.regs[register] = op1 & 0xFFFF
         
     def _alu_al_imm8(self, operation):
-        """ Generic al imm8 ALU processor. """
+        """ Generic al imm8 ALU processor, the operation sets the flags. """
         value = operation(self.regs.AL, self.get_byte_immediate())
-        self.flags.set_from_alu_byte(value)
         self.regs.AL = value & 0xFF
         
     def _alu_ax_imm16(self, operation):
@@ -1455,7 +1822,7 @@ class CPU(object):
     # ADD
     def opcode_group_add(self, opcode):
         """ Entry point for all ADD opcodes. """
-        self.alu_vector_table[opcode & 0x07](self.operator_add_16 if opcode & 0x01 else self.operator_add_8)
+        self.alu_vector_table[opcode & 0x07](self.operator_add_16 if opcode & 0x01 else self.alu_add_8)
         
     def operator_add_8(self, operand_a, operand_b):
         """ Implements the 8-bit add operation with overflow support. """
@@ -1464,6 +1831,11 @@ class CPU(object):
         self.flags.adjust = ((operand_a & 0x0F) + (operand_b & 0x0F)) & 0x10 == 0x10
         return result
         
+    def alu_add_8(self, operand_a, operand_b):
+        """ Add two bytes, setting all of the flags from the pyxt.alu tables. """
+        self.flags.set_from_packed(ADD_FLAGS_8[operand_a << 8 | operand_b])
+        return operand_a + operand_b
+        
     def operator_add_16(self, operand_a, operand_b):
         """ Implements the 16-bit add operation with overflow support. """
         result = operand_a + operand_b
@@ -1474,7 +1846,7 @@ class CPU(object):
     # SUB
     def opcode_group_sub(self, opcode):
         """ Entry point for all SUB opcodes. """
-        self.alu_vector_table[opcode & 0x07](self.operator_sub_16 if opcode & 0x01 else self.operator_sub_8)
+        self.alu_vector_table[opcode & 0x07](self.operator_sub_16 if opcode & 0x01 else self.alu_sub_8)
         
     def operator_sub_8(self, operand_a, operand_b):
         """ Implements the 8-bit sub operation with overflow support. """
@@ -1483,6 +1855,11 @@ class CPU(object):
         self.flags.adjust = (operand_a & 0x0F) < (operand_b & 0x0F)
         return result
         
+    def alu_sub_8(self, operand_a, operand_b):
+        """ Subtract two bytes, setting all of the flags from the pyxt.alu tables. """
+        self.flags.set_from_packed(SUB_FLAGS_8[operand_a << 8 | operand_b])
+        return operand_a - operand_b
+        
     def operator_sub_16(self, operand_a, operand_b):
         """ Implements the 16-bit sub operation with overflow support. """
         result = operand_a - operand_b
@@ -1499,6 +1876,12 @@ class CPU(object):
         self.flags.adjust = (operand_a & 0x0F) < ((operand_b & 0x0F) + carry_in)
         return result
         
+    def alu_sbb_8(self, operand_a, operand_b):
+        """ Subtract two bytes and CF, setting all of the flags from the pyxt.alu tables. """
+        carry_in = 1 if self.flags.carry else 0
+        self.flags.set_from_packed(SUB_FLAGS_8[carry_in << 16 | operand_a << 8 | operand_b])
+        return operand_a - operand_b - carry_in
+        
     def operator_sbb_16(self, operand_a, operand_b):
         """ Implements the 16-bit SBB operator which subtracts an extra 1 if CF is set. """
         carry_in = 1 if self.flags.carry else 0
@@ -1509,7 +1892,7 @@ class CPU(object):
         
     def opcode_group_sbb(self, opcode):
         """ Entry point for all SBB opcodes. """
-        self.alu_vector_table[opcode & 0x07](self.operator_sbb_16 if opcode & 0x01 else self.operator_sbb_8)
+        self.alu_vector_table[opcode & 0x07](self.operator_sbb_16 if opcode & 0x01 else self.alu_sbb_8)
         
     # ADC
     def operator_adc_8(self, operand_a, operand_b):
@@ -1520,6 +1903,12 @@ class CPU(object):
         self.flags.adjust = ((operand_a & 0x0F) + (operand_b & 0x0F) + carry_in) & 0x10 == 0x10
         return result
         
+    def alu_adc_8(self, operand_a, operand_b):
+        """ Add two bytes and CF, setting all of the flags from the pyxt.alu tables. """
+        carry_in = 1 if self.flags.carry else 0
+        self.flags.set_from_packed(ADD_FLAGS_8[carry_in << 16 | operand_a << 8 | operand_b])
+        return operand_a + operand_b + carry_in
+        
     def operator_adc_16(self, operand_a, operand_b):
         """ Implements the 16-bit ADC operator which adds an extra 1 if CF is set. """
         carry_in = 1 if self.flags.carry else 0
@@ -1530,7 +1919,7 @@ class CPU(object):
         
     def opcode_group_adc(self, opcode):
         """ Entry point for all ADC opcodes. """
-        self.alu_vector_table[opcode & 0x07](self.operator_adc_16 if opcode & 0x01 else self.operator_adc_8)
+        self.alu_vector_table[opcode & 0x07](self.operator_adc_16 if opcode & 0x01 else self.alu_adc_8)
         
     # CMP
     def opcode_cmp_rm8_r8(self, _opcode):
@@ -1538,8 +1927,7 @@ class CPU(object):
         register, rm_type, rm_value = self.get_modrm_operands(8)
         op1 = self._get_rm8(rm_type, rm_value)
         op2 = self.regs[register]
-        result = self.operator_sub_8(op1, op2)
-        self.flags.set_from_alu_byte(result)
+        self.alu_sub_8(op1, op2)
         
     def opcode_cmp_rm16_r16(self, _opcode):
         """ Subtract op2 from op1, update the flags, but don't store the value. """
@@ -1554,8 +1942,7 @@ class CPU(object):
         register, rm_type, rm_value = self.get_modrm_operands(8)
         op1 = self.regs[register]
         op2 = self._get_rm8(rm_type, rm_value)
-        result = self.operator_sub_8(op1, op2)
-        self.flags.set_from_alu_byte(result)
+        self.alu_sub_8(op1, op2)
         
     def opcode_cmp_r16_rm16(self, _opcode):
         """ Subtract op2 from op1, update the flags, but don't store the value. """
@@ -1567,8 +1954,7 @@ class CPU(object):
         
     def opcode_cmp_al_imm8(self, _opcode):
         """ Subtract immediate byte from AL, update the flags, but don't store the value. """
-        result = self.operator_sub_8(self.regs.AL, self.get_byte_immediate())
-        self.flags.set_from_alu_byte(result)
+        self.alu_sub_8(self.regs.AL, self.get_byte_immediate())
         
     def opcode_cmp_ax_imm16(self, _opcode):
         """ Subtract immediate word from AX, update the flags, but don't store the value. """
@@ -1729,17 +2115,19 @@ class CPU(object):
         sub_opcode, rm_type, rm_value = self.get_modrm_operands(8, decode_register = False)
         value = self._get_rm8(rm_type, rm_value)
         
+        # INC and DEC leave CF alone.
         if sub_opcode == 0: # INC
-            value = self.operator_add_8(value, 1)
+            self.flags.set_from_packed_no_carry(ADD_FLAGS_8[value << 8 | 1])
+            value += 1
             
         elif sub_opcode == 1: # DEC
-            value = self.operator_sub_8(value, 1)
+            self.flags.set_from_packed_no_carry(SUB_FLAGS_8[value << 8 | 1])
+            value -= 1
             
         else:
             raise NotImplementedError("sub_opcode = %r" % sub_opcode)
             
         self._set_rm8(rm_type, rm_value, value)
-        self.flags.set_from_alu_no_carry_byte(value)
         
     def opcode_group_ff(self):
         """ Opcode group "2" for r/m16. """
@@ -1786,6 +2174,7 @@ class CPU(object):
         count = 1
         if opcode & 0x02 == 0x02:
             count = self.regs.CL
+            self.cycles += count * SHIFT_COUNT_CYCLES
             
         # 0xD0 and 0xD2 work on bytes, 0xD1 and 0xD3 work on words.
         bits = 8
@@ -1802,6 +2191,21 @@ class CPU(object):
         if count == 0:
             return
             
+        # Bytes are shifted by table, there is one for each operation and count with the result and flags.
+        if bits == 8 and sub_opcode != 0x06:
+            table = SHIFT_TABLES_8[sub_opcode][count]
+            if table is None:
+                table = get_shift_table_8(sub_opcode, count)
+            entry = table[self.flags.carry << 8 | value]
+            
+            # A SHL by 1 also sets OF.
+            if sub_opcode == SHIFT_SHL and count == 1:
+                self.flags.set_from_packed_logical(entry & SHIFT_FLAGS_MASK)
+            else:
+                self.flags.set_from_packed_shift(entry & SHIFT_FLAGS_MASK)
+            self._set_rm8(rm_type, rm_value, entry >> SHIFT_RESULT_SHIFT)
+            return
+            
         if sub_opcode == 0x00: # ROL - Rotate left shifting bits back in on the right.
             if bits == 8:
                 value, self.flags.carry = rotate_left_8_bits(value, count)
@@ -1898,6 +2302,7 @@ class CPU(object):
     def opcode_sti(self):
         """ Enable interrupts. """
         self.flags.interrupt_enable = True
+        self.attention = True
         
     def opcode_sahf(self, _opcode):
         """ Copy AH into the lower byte of FLAGS (SF, ZF, AF, PF, CF). """
@@ -1915,30 +2320,202 @@ class CPU(object):
         """ Pops the FLAGS register off the stack. """
         self.flags.value = self.internal_pop()
         
+        # IF or TF may have been set.
+        self.attention = True
+        
     # ********** Miscellaneous opcodes. **********
     def opcode_nop(self, _opcode):
         """ Do nothing for one instruction. """
         
     def _hlt(self):
-        log.critical("HLT encountered!")
+        """ HLT - Stop executing instructions until an external interrupt arrives. """
         self.hlt = True
-        log.error("Game over at CS:IP 0x%04x:0x%04x", self.regs.CS, self.regs.IP)
-        
+        self.attention = True
+        if not self.flags.interrupt_enable:
+            log.critical("HLT with interrupts disabled, game over at CS:IP 0x%04x:0x%04x", self.regs.CS, self.regs.IP)
+            
     def _jmp_rel16(self):
         offset = signed_word(self.get_word_immediate())
         self.regs.IP += offset
         
-    def _jmp_rel8(self):
-        offset = signed_byte(self.get_byte_immediate())
+    def opcode_jmp_rel8(self, _opcode):
+        """ JMP - Jump short to a location relative to the current IP. """
+        offset = SIGNED_BYTES[self.get_byte_immediate()]
         self.regs.IP += offset
         
+    def detect_idle_loops(self, value):
+        """ API to enable/disable halting the CPU in tight polling loops until the next interrupt. """
+        self.idle_loop_detection = value
+        self.update_short_jump_handlers()
+        
+    def collapse_busy_waits(self, value):
+        """ API to enable/disable skipping ahead in loops that spin reading a status port. """
+        self.busy_wait_detection = value
+        self.update_short_jump_handlers()
+        
+    def update_short_jump_handlers(self):
+        """ Install the short jump handlers needed for the enabled loop detection. """
+        wrap = self.idle_loop_detection or self.busy_wait_detection
+        for opcode in SHORT_JUMP_OPCODES:
+            handler = self.short_jump_handlers[opcode]
+            self.opcode_vector[opcode] = self.idle_loop_wrapper(handler) if wrap else handler
+            
+        self.idle_loop_state = None
+        
+    def idle_loop_wrapper(self, handler):
+        """ Wrap a short jump handler so that taken backwards jumps are checked for idle loops. """
+        def _handler(opcode):
+            ip = self.regs.IP
+            handler(opcode)
+            if self.regs.IP < ip:
+                self.check_idle_loop()
+        return _handler
+        
+    def check_idle_loop(self):
+        """
+        Called after a taken backwards short jump.
+        
+        If the same jump is taken twice with identical registers and flags, and nothing was written to memory or
+        the I/O bus in between, the loop can't make progress until something outside the CPU changes:
+        
+        * With no port reads only an interrupt can break the loop, so the CPU is halted at the top of the loop
+          and the interrupt resumes it there.
+        * With port reads the loop is polling a device, so the CPU is halted in a busy wait and the scheduler
+          resumes it once time has been advanced to the next device event.
+        """
+        bus = self.bus
+        state = (
+            string_at(addressof(self.regs), sizeof(self.regs)),
+            self.flags.value,
+            bus.mem_write_count,
+            bus.io_write_count,
+        )
+        io_read_count = bus.io_read_count
+        
+        if state == self.idle_loop_state:
+            if io_read_count == self.idle_loop_io_read_count:
+                if self.idle_loop_detection and self.flags.interrupt_enable:
+                    self.hlt = True
+                    self.attention = True
+            elif self.busy_wait_detection:
+                self.hlt = True
+                self.busy_wait = True
+                self.attention = True
+                
+            self.idle_loop_state = None
+        else:
+            self.idle_loop_state = state
+            self.idle_loop_io_read_count = io_read_count
+            
+    # ********** Superinstructions. **********
+    def fuse_instructions(self, value):
+        """
+        API to enable/disable running the instruction patterns in FUSION_PATTERNS as superinstructions.
+        
+        The instructions after the first of a pattern are run without going through fetch(), so this needs to be
+        off while the debugger, GDB or the tracer need to see every instruction.
+        """
+        for name, opcodes, following in FUSION_PATTERNS:
+            for opcode in opcodes:
+                handler = self.unfused_handlers[opcode]
+                self.opcode_vector[opcode] = self.fused_handler(name, handler, following) if value else handler
+                
+    def fused_handler(self, name, handler, following):
+        """
+        Wrap the handler for the first instruction of a pattern so the rest of the pattern runs if it follows.
+        
+        Nothing more is run where fetch() would have done something else first: a REP prefix, attention set for an
+        interrupt, the trap flag or a break request, or reaching the scheduler's deadline.
+        """
+        regs = self.regs
+        segment_bases = self.segment_bases
+        flags = self.flags
+        counts = self.fusion_counts
+        next_opcodes = following[0][0]
+        
+        if len(following) > 1 or not next_opcodes <= JCC_OPCODES:
+            def _handler(opcode):
+                repeat_prefix = self.repeat_prefix
+                handler(opcode)
+                offset = ((segment_bases[SEGMENT_CS] + regs.IP) & 0xFFFFF) - self.code_window_base
+                if (0 <= offset < self.code_window_limit and self.code_window[offset] in next_opcodes and
+                        repeat_prefix == REPEAT_NONE and not self.attention):
+                    self.run_superinstruction(name, opcode, offset, following)
+                    
+            return _handler
+            
+        # The most common patterns end in a Jcc, it is run here with the branch taken from CONDITION_TAKEN.
+        def _jcc_handler(opcode):
+            repeat_prefix = self.repeat_prefix
+            handler(opcode)
+            ip = regs.IP
+            offset = ((segment_bases[SEGMENT_CS] + ip) & 0xFFFFF) - self.code_window_base
+            if not 0 <= offset < self.code_window_limit - 1:
+                return
+                
+            window = self.code_window
+            jcc_opcode = window[offset]
+            if (jcc_opcode not in next_opcodes or repeat_prefix != REPEAT_NONE or self.attention or ip >= 0xFFFE or
+                    self.cycles + INSTRUCTION_CYCLES[opcode][self.modrm] >= self.deadline):
+                return
+                
+            counts[name] += 1
+            self.instruction_count += 1
+            self.cycles += INSTRUCTION_CYCLES[jcc_opcode][self.modrm]
+            if CONDITION_TAKEN[
+                (jcc_opcode & 0x0F) << CONDITION_FLAGS_BITS | flags.carry | flags.zero << 1 | flags.sign << 2 |
+                flags.overflow << 3 | flags.parity << 4
+            ]:
+                regs.IP = ip + 2 + SIGNED_BYTES[window[offset + 1]]
+                self.cycles += BRANCH_TAKEN_CYCLES
+                
+                # The same test as idle_loop_wrapper(), against IP after the opcode byte.
+                if regs.IP < ip + 1 and (self.idle_loop_detection or self.busy_wait_detection):
+                    self.check_idle_loop()
+            else:
+                regs.IP = ip + 2
+                
+        return _jcc_handler
+        
+    def run_superinstruction(self, name, opcode, offset, following):
+        """ Run the rest of a pattern after its first instruction, offset is where it starts in the code window. """
+        regs = self.regs
+        window = self.code_window
+        
+        # Check the whole pattern is there before running any more of it.
+        end = offset
+        for opcodes, length in following:
+            if end + length > self.code_window_limit or window[end] not in opcodes:
+                return
+            end += length
+        if regs.IP + end - offset > 0xFFFF:
+            return
+            
+        # fetch() charges the first instruction when this returns, nothing after it changes the ModRM byte.
+        pending = INSTRUCTION_CYCLES[opcode][self.modrm]
+        if self.cycles + pending >= self.deadline:
+            return
+            
+        self.fusion_counts[name] += 1
+        for _opcodes, length in following:
+            next_opcode = window[offset]
+            self.instruction_count += 1
+            self.segment_override = None
+            regs.IP += 1
+            self.unfused_handlers.get(next_opcode, self.opcode_vector[next_opcode])(next_opcode)
+            self.cycles += INSTRUCTION_CYCLES[next_opcode][self.modrm]
+            
+            offset += length
+            if self.attention or self.cycles + pending >= self.deadline:
+                return
+                
     # ********** I/O port opcodes. **********
-    def opcode_in_al_imm8(self):
+    def opcode_in_al_imm8(self, _opcode):
         """ Read a byte from a port specified by an immediate byte and put it in AL. """
         port = self.get_byte_immediate()
         self.regs.AL = self.bus.io_read_byte(port)
         
-    def opcode_in_al_dx(self):
+    def opcode_in_al_dx(self, _opcode):
         """ Read a byte from a port specified by DX and put it in AL. """
         port = self.regs.DX
         self.regs.AL = self.bus.io_read_byte(port)
@@ -1957,13 +2534,13 @@ class CPU(object):
     @supports_rep_prefix
     def opcode_stosb(self, _opcode):
         """ Write the value in AL to ES:DI and increments or decrements DI. """
-        self.bus.mem_write_byte(segment_offset_to_address(self.regs.ES, self.regs.DI), self.regs.AL)
+        self.bus.mem_write_byte((self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF, self.regs.AL)
         self.regs.DI += -1 if self.flags.direction else 1
         
     @supports_rep_prefix
     def opcode_stosw(self, _opcode):
         """ Write the word in AX to ES:DI and increments or decrements DI by 2. """
-        self.bus.mem_write_word(segment_offset_to_address(self.regs.ES, self.regs.DI), self.regs.AX)
+        self.bus.mem_write_word((self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF, self.regs.AX)
         self.regs.DI += -2 if self.flags.direction else 2
         
     @supports_rep_prefix
@@ -1982,7 +2559,7 @@ class CPU(object):
     def opcode_movsb(self, _opcode):
         """ Reads a byte from DS:SI and writes it to ES:DI. """
         self.bus.mem_write_byte(
-            segment_offset_to_address(self.regs.ES, self.regs.DI),
+            (self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF,
             self.read_data_byte(self.regs.SI),
         )
         self.regs.SI += -1 if self.flags.direction else 1
@@ -1992,7 +2569,7 @@ class CPU(object):
     def opcode_movsw(self, _opcode):
         """ Reads a word from DS:SI and writes it to ES:DI. """
         self.bus.mem_write_word(
-            segment_offset_to_address(self.regs.ES, self.regs.DI),
+            (self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF,
             self.read_data_word(self.regs.SI),
         )
         self.regs.SI += -2 if self.flags.direction else 2
@@ -2001,11 +2578,10 @@ class CPU(object):
     @supports_repz_repnz_prefix
     def opcode_scasb(self, _opcode):
         """ Compare the byte at ES:DI with AL and update the flags. """
-        result = self.operator_sub_8(
+        self.alu_sub_8(
             self.regs.AL,
-            self.bus.mem_read_byte(segment_offset_to_address(self.regs.ES, self.regs.DI)),
+            self.bus.mem_read_byte((self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF),
         )
-        self.flags.set_from_alu_byte(result)
         self.regs.DI += -1 if self.flags.direction else 1
         
     @supports_repz_repnz_prefix
@@ -2013,7 +2589,7 @@ class CPU(object):
         """ Compare the word at ES:DI with AX and update the flags. """
         result = self.operator_sub_16(
             self.regs.AX,
-            self.bus.mem_read_word(segment_offset_to_address(self.regs.ES, self.regs.DI)),
+            self.bus.mem_read_word((self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF),
         )
         self.flags.set_from_alu_word(result)
         self.regs.DI += -2 if self.flags.direction else 2
@@ -2021,11 +2597,10 @@ class CPU(object):
     @supports_repz_repnz_prefix
     def opcode_cmpsb(self, _opcode):
         """ Compare the byte at ES:DI with the byte at DS:SI and update the flags. """
-        result = self.operator_sub_8(
-            self.bus.mem_read_byte(segment_offset_to_address(self.get_data_segment(), self.regs.SI)),
-            self.bus.mem_read_byte(segment_offset_to_address(self.regs.ES, self.regs.DI)),
+        self.alu_sub_8(
+            self.bus.mem_read_byte(self.get_data_address(self.regs.SI)),
+            self.bus.mem_read_byte((self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF),
         )
-        self.flags.set_from_alu_byte(result)
         self.regs.SI += -1 if self.flags.direction else 1
         self.regs.DI += -1 if self.flags.direction else 1
         
@@ -2033,8 +2608,8 @@ class CPU(object):
     def opcode_cmpsw(self, _opcode):
         """ Compare the word at ES:DI with the word at DS:SI and update the flags. """
         result = self.operator_sub_16(
-            self.bus.mem_read_word(segment_offset_to_address(self.get_data_segment(), self.regs.SI)),
-            self.bus.mem_read_word(segment_offset_to_address(self.regs.ES, self.regs.DI)),
+            self.bus.mem_read_word(self.get_data_address(self.regs.SI)),
+            self.bus.mem_read_word((self.segment_bases[SEGMENT_ES] + self.regs.DI) & 0xFFFFF),
         )
         self.flags.set_from_alu_word(result)
         self.regs.SI += -2 if self.flags.direction else 2
@@ -2043,23 +2618,28 @@ class CPU(object):
     # ********** Memory access helpers. **********
     def get_data_segment(self):
         """ Helper function to return the effective data segment. """
-        return self.regs[self.segment_override] if self.segment_override else self.regs.DS
+        return self.regs[SEGMENT_REG[self.segment_override]] if self.segment_override is not None else self.regs.DS
+        
+    def get_data_address(self, offset):
+        """ Returns the address of an offset in the effective data segment. """
+        segment = self.segment_override
+        return (self.segment_bases[SEGMENT_DS if segment is None else segment] + offset) & 0xFFFFF
         
     def write_data_word(self, offset, value):
         """ Write a word to data memory at the given offset.  Assume DS unless overridden by a prefix. """
-        self.bus.mem_write_word(segment_offset_to_address(self.get_data_segment(), offset), value)
+        self.bus.mem_write_word(self.get_data_address(offset), value)
         
     def read_data_word(self, offset):
         """ Read a word from data memory at the given offset.  Assume DS unless overridden by a prefix. """
-        return self.bus.mem_read_word(segment_offset_to_address(self.get_data_segment(), offset))
+        return self.bus.mem_read_word(self.get_data_address(offset))
         
     def write_data_byte(self, offset, value):
         """ Write a byte to data memory at the given offset.  Assume DS unless overridden by a prefix. """
-        self.bus.mem_write_byte(segment_offset_to_address(self.get_data_segment(), offset), value)
+        self.bus.mem_write_byte(self.get_data_address(offset), value)
         
     def read_data_byte(self, offset):
         """ Read a byte from data memory at the given offset.  Assume DS unless overridden by a prefix. """
-        return self.mem_read_byte(segment_offset_to_address(self.get_data_segment(), offset))
+        return self.mem_read_byte(self.get_data_address(offset))
         
     def _get_rm16(self, rm_type, rm_value):
         """ Helper for reading from a 16 bit r/m field. """
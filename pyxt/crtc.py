@@ -0,0 +1,51 @@
+"""
+pyxt.crtc - Beam position of the 6845 CRT controller on the MDA and CGA.
+
+Programs poll the status register of either card for the retrace, to write video RAM without snow or to pace
+themselves to the frame rate.  Both cards count the ticks (CPU cycles) they have been clocked for and work out
+where the beam is from those, so the status bits follow emulated time rather than how often the host draws.
+
+The timings are the ones the BIOS programs for the 80 column text modes, they aren't read back from the CRTC.
+"""
+
+# PyXT imports
+from pyxt.scheduler import TICK_FREQUENCY
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# A program that read a status register within this many lines is taken to be polling it.
+POLLING_LINES = 2
+
+# Classes
+class RasterTiming(object):
+    """ Converts ticks into a beam position given the dot clock and the dots in a line and lines in a frame. """
+    def __init__(self, dot_clock, line_dots, frame_lines):
+        self.dot_clock = dot_clock
+        self.line_dots = line_dots
+        self.frame_lines = frame_lines
+        self.frame_dots = line_dots * frame_lines
+        
+        # Rounded, only used to decide how long ago something happened.
+        self.line_ticks = line_dots * TICK_FREQUENCY // dot_clock
+        
+    def position(self, ticks):
+        """ Return the line and dot the beam is on after a number of ticks. """
+        return divmod((ticks * self.dot_clock // TICK_FREQUENCY) % self.frame_dots, self.line_dots)
+        
+    def ticks_until(self, ticks, line, dot):
+        """
+        Return the number of ticks after ticks until the beam next reaches a line and dot.
+        
+        The line may be frame_lines for the start of the next frame.
+        """
+        now = ticks * self.dot_clock // TICK_FREQUENCY
+        target = now - (now % self.frame_dots) + (line * self.line_dots) + dot
+        if target <= now:
+            target += self.frame_dots
+            
+        # The first tick that reaches the target dot.
+        return -(-target * TICK_FREQUENCY // self.dot_clock) - ticks
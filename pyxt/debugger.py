@@ -14,6 +14,8 @@ from six.moves import range, input # pylint: disable=redefined-builtin
 
 # PyXT imports
 from pyxt.helpers import segment_offset_to_address
+from pyxt.breakpoints import BreakpointSet, WatchpointSet, WATCH_KINDS, WATCH_CHANGE
+from pyxt.checkpoint import CheckpointManager, DEFAULT_CHECKPOINT_INTERVAL
 
 # Logging setup
 import logging
@@ -30,6 +32,9 @@ RETURN_OPCODES = (
     0xCA, # RETF imm16
 )
 
+# Instructions listed by the "u" command.
+DEFAULT_LIST_COUNT = 10
+
 # Classes
 class Debugger(object):
     """ Interactive debugger for PyXT. """
@@ -37,8 +42,10 @@ class Debugger(object):
         self.cpu = cpu
         self.bus = bus
         self.bus.debugger = self
+        self.cpu.break_handler = self.enter_debugger
         
-        self.breakpoints = []
+        self.breakpoints = BreakpointSet(cpu)
+        self.watchpoints = WatchpointSet(bus, self.watchpoint_hit)
         self.single_step = False
         self.debugger_shortcut = []
         self.dump_enabled = False
@@ -46,7 +53,22 @@ class Debugger(object):
         
         self.location_counter = Counter()
         self.instruction_counter = Counter()
-        self.trace_fileptr = None
+        self.tracer = None
+        
+        # Instruction listings, "u" carries on from where the last one ended.
+        self._disassembler = None
+        self.list_location = None
+        
+        # Periodic snapshots for going backwards, see enable_checkpoints().
+        self.checkpoints = None
+        
+    @property
+    def disassembler(self):
+        """ The disassembler for listings, pyxt.disassembler is only imported once one is needed. """
+        if self._disassembler is None:
+            from pyxt.disassembler import Disassembler
+            self._disassembler = Disassembler(self.bus)
+        return self._disassembler
         
     # ********** Debugger functions. **********
     def fetch(self):
@@ -56,25 +78,11 @@ class Debugger(object):
             
         next_instruction = self.peek_instruction_byte()
         if self.dump_enabled:
-            log.debug("next_instruction = 0x%02x", next_instruction)
+            log.debug("next_instruction = %s", self.disassembler.text(self.cpu.regs.CS, self.cpu.regs.IP))
+            
+        if self.tracer is not None and self.cpu.regs.CS >= 0xF000:
+            self.tracer.record(next_instruction)
             
-        if self.trace_fileptr:
-            if self.cpu.regs.CS >= 0xF000:
-                self.trace_fileptr.write("\t".join([
-                    "%04x:%04x" % (self.cpu.regs.CS, self.cpu.regs.IP),
-                    "0x%02x" % self.cpu.regs.AH,
-                    "0x%02x" % self.cpu.regs.AL,
-                    "%s" % (chr(self.cpu.regs.AL) if self.cpu.regs.AL >= 0x20 and self.cpu.regs.AL < 0x7F else "???"),
-                    "0x%04x" % self.cpu.regs.BX,
-                    "0x%04x" % self.cpu.regs.CX,
-                    "0x%04x" % self.cpu.regs.DX,
-                    "0x%04x" % self.cpu.regs.SI,
-                    "0x%04x" % self.cpu.regs.DI,
-                    "0x%04x" % self.cpu.regs.CS,
-                    "0x%04x" % self.cpu.regs.DS,
-                    "0x%04x" % self.cpu.regs.ES,
-                ]) + "\r\n")
-                
         # Check if we are trying to step out of a CALL-ed function.
         if self.step_out:
             if next_instruction in RETURN_OPCODES:
@@ -90,6 +98,66 @@ class Debugger(object):
         self.instruction_counter.update({next_instruction : 1})
         self.cpu.fetch()
         
+        if self.checkpoints is not None:
+            self.checkpoints.poll()
+            
+    def armed(self, fetch):
+        """
+        Return a fetch() that only checks for breakpoints and single stepping around the supplied one.
+        
+        This is for running at close to full speed with breakpoints and watchpoints set, the debugger's own
+        fetch() also does the dumps, counters and tracing.
+        """
+        regs = self.cpu.regs
+        addresses = self.breakpoints.addresses
+        
+        def _fetch():
+            if self.single_step or ((regs.CS << 4) + regs.IP) & 0xFFFFF in addresses:
+                if self.should_break():
+                    self.enter_debugger()
+            fetch()
+            
+        return _fetch
+        
+    def watchpoint_hit(self, watchpoint, address, old_value, new_value):
+        """ Called by the watchpoints, stops before the next instruction. """
+        print("Watchpoint %s hit at 0x%05x: 0x%02x -> 0x%02x, CS:IP = %04x:%04x" % (
+            watchpoint, address, old_value, new_value, self.cpu.regs.CS, self.cpu.regs.IP))
+        self.single_step = True
+        
+    def enable_checkpoints(self, scheduler, idle_ticks, interval = DEFAULT_CHECKPOINT_INTERVAL):
+        """ Start taking checkpoints every interval instructions so the debugger can go backwards. """
+        self.checkpoints = CheckpointManager(self.cpu, self.bus, scheduler, idle_ticks, interval)
+        
+    def reverse_step(self, count):
+        """ Go back by a number of instructions. """
+        target = max(self.cpu.instruction_count - count, 0)
+        self.watchpoints.enabled = False
+        try:
+            found = self.checkpoints.seek(target)
+        finally:
+            self.watchpoints.enabled = True
+            
+        if found:
+            self.dump_all()
+        else:
+            print("Instruction %d is before the oldest checkpoint." % target)
+            
+    def reverse_continue(self):
+        """ Go back to the last time a breakpoint was reached. """
+        regs = self.cpu.regs
+        self.watchpoints.enabled = False
+        try:
+            found = self.checkpoints.reverse_continue(self.breakpoints.check)
+        finally:
+            self.watchpoints.enabled = True
+            
+        if found:
+            print("Breakpoint at %04x:%04x, instruction %d." % (regs.CS, regs.IP, self.cpu.instruction_count))
+        else:
+            print("No breakpoint reached since the oldest checkpoint at instruction %d." % self.cpu.instruction_count)
+        self.dump_all()
+        
     def dump_all(self, level = logging.DEBUG):
         """ Dump all registers and flags. """
         self.dump_regs(level, "AX", "BX", "CX", "DX")
@@ -135,21 +203,23 @@ class Debugger(object):
             
     def should_break(self):
         """ Return True if we should break now. """
-        return self.single_step or (self.cpu.regs.CS, self.cpu.regs.IP) in self.breakpoints
+        return self.single_step or self.breakpoints.check()
         
     def peek_instruction_byte(self):
         """ Return at CS:IP, but do not increment IP. """
         return self.bus.mem_read_byte(segment_offset_to_address(self.cpu.regs.CS, self.cpu.regs.IP))
         
     def break_signal(self, _signum, _frame):
-        """ Control-C handler to enter single-step mode. """
+        """ Control-C handler to stop in the debugger before the next instruction. """
         print("Control-C")
-        self.single_step = True
+        self.cpu.request_break()
         
     def enter_debugger(self):
         """ Interactive debugger menu. """
+        self.list_location = None
         while True:
-            print("\nNext instruction: 0x%02x" % self.peek_instruction_byte())
+            print("\nNext instruction: %04x:%04x  %s" % (
+                self.cpu.regs.CS, self.cpu.regs.IP, self.disassembler.text(self.cpu.regs.CS, self.cpu.regs.IP)))
             if len(self.debugger_shortcut) != 0:
                 print("[%s] >" % " ".join(self.debugger_shortcut), end=" ")
             else:
@@ -187,6 +257,18 @@ class Debugger(object):
             self.single_step = True
             return True
             
+        elif len(cmd) in (1, 2) and cmd[0] in ("reverse-step", "rs"):
+            if self.checkpoints is None:
+                print("Checkpoints are not enabled.")
+            else:
+                self.reverse_step(int(cmd[1]) if len(cmd) == 2 else 1)
+                
+        elif len(cmd) == 1 and cmd[0] in ("reverse-continue", "rc"):
+            if self.checkpoints is None:
+                print("Checkpoints are not enabled.")
+            else:
+                self.reverse_continue()
+                
         elif len(cmd) == 1 and cmd[0] in ("quit", "q"):
             sys.exit(0)
             
@@ -205,13 +287,14 @@ class Debugger(object):
                     fileptr.write(self.bus.devices[index].contents.tostring())
                     
         elif len(cmd) == 2 and cmd[0] == "trace":
-            if cmd[1] == "on" and self.trace_fileptr is None:
-                self.trace_fileptr = open("trace.log", "wb")
-            elif cmd[1] == "off" and self.trace_fileptr is not None:
-                self.trace_fileptr.close()
-                self.trace_fileptr = None
+            if cmd[1] == "on" and self.tracer is None:
+                from pyxt.trace import BinaryTracer
+                self.tracer = BinaryTracer(self.cpu, open("trace.bin", "wb"))
+            elif cmd[1] == "off" and self.tracer is not None:
+                self.tracer.close()
+                self.tracer = None
             else:
-                print("Trace is %s." % ("off" if self.trace_fileptr is None else "on"))
+                print("Trace is %s." % ("off" if self.tracer is None else "on"))
                 
         elif len(cmd) == 1 and cmd[0] in ("step-out", "out"):
             # Set the step out flag and disable single stepping so we run to the next return.
@@ -234,6 +317,22 @@ class Debugger(object):
                 for instruction, count in self.instruction_counter.most_common(int(cmd[1])):
                     print("instruction = 0x%02x, count = %d" % (instruction, count))
                 
+        elif len(cmd) in (1, 2, 3) and cmd[0] in ("u", "unassemble"):
+            # u [CS:IP] [COUNT], without an address it carries on from the last listing or starts at CS:IP.
+            if len(cmd) >= 2:
+                (cs, ip) = cmd[1].split(":")
+                location = (int(cs, 16), int(ip, 16))
+            elif self.list_location is not None:
+                location = self.list_location
+            else:
+                location = (self.cpu.regs.CS, self.cpu.regs.IP)
+                
+            count = int(cmd[2]) if len(cmd) == 3 else DEFAULT_LIST_COUNT
+            lines, offset = self.disassembler.listing(location[0], location[1], count)
+            print("\n".join(lines))
+            self.list_location = (location[0], offset)
+            self.debugger_shortcut = ["u"]
+            
         elif len(cmd) == 1 and cmd[0] in ("vector", "vt"):
             for vector in range(0, 256):
                 ip = self.bus.mem_read_word(vector * 4)
@@ -244,24 +343,49 @@ class Debugger(object):
             self.debugger_shortcut = []
             if len(cmd) == 2 and cmd[1] in ("breakpoints", "break"):
                 print("Breakpoints:")
-                for index, breakpoint in enumerate(self.breakpoints):
-                    print("  %04x:%04x" % breakpoint)
+                for breakpoint in self.breakpoints:
+                    print("  %s" % breakpoint)
+            elif len(cmd) == 2 and cmd[1] in ("watchpoints", "watch"):
+                print("Watchpoints:")
+                for watchpoint in self.watchpoints:
+                    print("  %s" % watchpoint)
                     
-        elif len(cmd) == 2 and cmd[0] == "break":
+        elif len(cmd) >= 2 and cmd[0] == "break":
+            # break CS:IP [if CONDITION]
             self.debugger_shortcut = []
             (cs, ip) = cmd[1].split(":")
-            self.breakpoints.append((int(cs, 16), int(ip, 16)))
+            condition = None
+            if len(cmd) >= 4 and cmd[2] == "if":
+                condition = " ".join(cmd[3:])
+            self.breakpoints.add(int(cs, 16), int(ip, 16), condition)
             
         elif len(cmd) == 2 and cmd[0] == "clear":
             self.debugger_shortcut = []
             if cmd[1] == "all":
-                self.breakpoints = []
+                self.breakpoints.clear()
             elif cmd[1] == "dump":
                 self.dump_enabled = False
             else:
                 (cs, ip) = cmd[1].split(":")
-                self.breakpoints.remove((int(cs, 16), int(ip, 16)))
+                if not self.breakpoints.remove(int(cs, 16), int(ip, 16)):
+                    print("No breakpoint at %s." % cmd[1])
                     
+        elif len(cmd) in (2, 3, 4) and cmd[0] == "watch":
+            # watch ADDRESS [read|write|change] [LENGTH]
+            self.debugger_shortcut = []
+            kind = cmd[2] if len(cmd) >= 3 else WATCH_CHANGE
+            if kind not in WATCH_KINDS:
+                print("Watchpoints can be one of: %s." % ", ".join(WATCH_KINDS))
+            else:
+                self.watchpoints.add(int(cmd[1], 0), int(cmd[3], 0) if len(cmd) == 4 else 1, kind)
+                
+        elif len(cmd) == 2 and cmd[0] == "unwatch":
+            self.debugger_shortcut = []
+            if cmd[1] == "all":
+                self.watchpoints.clear()
+            elif not self.watchpoints.remove(int(cmd[1], 0)):
+                print("No watchpoint at %s." % cmd[1])
+                
         elif len(cmd) >= 1 and cmd[0] == "set":
             self.debugger_shortcut = []
             if len(cmd) == 2 and cmd[1] == "dump":
@@ -0,0 +1,412 @@
+"""
+pyxt.disassembler - 8088 disassembler for the debugger, trace and profiler.
+
+Instructions are decoded from a table of the 256 opcodes using the same ModRM and register tables as the
+CPU, into Intel syntax much like NASM's.  Decoding and formatting is far slower than running an instruction
+so the Disassembler caches the text by physical address.  Each entry keeps the bytes it was decoded from and
+is thrown away when they no longer match, that catches every kind of write (CPU, DMA, the debugger) without
+anything being added to the bus's write path.
+"""
+
+# Standard library imports
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.cpu import (MODRM_LUT, MOD_RM_IS_REG, MOD_8_BIT, MOD_16_BIT, BYTE_REG, WORD_REG, SEGMENT_REG,
+                      signed_byte, signed_word)
+from pyxt.helpers import segment_offset_to_address
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+BYTE_REG_NAMES = [BYTE_REG[index].lower() for index in range(8)]
+WORD_REG_NAMES = [WORD_REG[index].lower() for index in range(8)]
+SEGMENT_REG_NAMES = [SEGMENT_REG[index & 0x03].lower() for index in range(8)]
+
+# Memory operands for each r/m value when mod isn't 3.
+MODRM_BASES = ("bx+si", "bx+di", "bp+si", "bp+di", "si", "di", "bp", "bx")
+
+# There's no limit to the number of prefixes on the 8088, this stops a run of them being decoded forever.
+MAX_INSTRUCTION_LENGTH = 16
+
+# Most entries in the cache before it's cleared, about a megabyte of text.
+DEFAULT_CACHE_SIZE = 32768
+
+SEGMENT_PREFIXES = {0x26 : "es", 0x2E : "cs", 0x36 : "ss", 0x3E : "ds"}
+REPEAT_PREFIXES = {0xF2 : "repne", 0xF3 : "rep"}
+LOCK_PREFIXES = (0xF0, 0xF1)
+
+# Instructions where REP means REPE.
+COMPARE_STRING_OPCODES = (0xA6, 0xA7, 0xAE, 0xAF)
+
+ALU_MNEMONICS = ("add", "or", "adc", "sbb", "and", "sub", "xor", "cmp")
+JCC_MNEMONICS = ("jo", "jno", "jc", "jnc", "jz", "jnz", "jna", "ja", "js", "jns", "jpe", "jpo", "jl", "jnl", "jng", "jg")
+
+# Groups selected by the reg field of the ModRM byte, None is an invalid encoding.
+GROUP_ALU = ALU_MNEMONICS
+GROUP_SHIFT = ("rol", "ror", "rcl", "rcr", "shl", "shr", "sal", "sar")
+GROUP_F6 = ("test", "test", "not", "neg", "mul", "imul", "div", "idiv")
+GROUP_FE = ("inc", "dec", None, None, None, None, None, None)
+GROUP_FF = ("inc", "dec", "call", "call far", "jmp", "jmp far", "push", "push")
+GROUP_POP = ("pop", ) * 8
+GROUP_MOV = ("mov", ) * 8
+
+# Operands:
+#   Eb/Ew - ModRM r/m byte/word, Gb/Gw - ModRM reg byte/word, Sw - ModRM reg segment register
+#   M - ModRM memory only, Esc - ModRM for an ESC (8087) instruction
+#   Ib/Iw - immediate byte/word, Is - immediate byte sign extended to a word
+#   Jb/Jw - relative jump target, Ap - far pointer, Ob/Ow - memory offset
+# Anything else is written as it is (registers, 1).
+OPCODES = [None] * 256
+
+for __index, __mnemonic in enumerate(ALU_MNEMONICS):
+    OPCODES[(__index << 3) + 0] = (__mnemonic, ("Eb", "Gb"))
+    OPCODES[(__index << 3) + 1] = (__mnemonic, ("Ew", "Gw"))
+    OPCODES[(__index << 3) + 2] = (__mnemonic, ("Gb", "Eb"))
+    OPCODES[(__index << 3) + 3] = (__mnemonic, ("Gw", "Ew"))
+    OPCODES[(__index << 3) + 4] = (__mnemonic, ("al", "Ib"))
+    OPCODES[(__index << 3) + 5] = (__mnemonic, ("ax", "Iw"))
+    
+for __index, __segment in enumerate(SEGMENT_REG_NAMES[:4]):
+    OPCODES[(__index << 3) + 6] = ("push", (__segment, ))
+    OPCODES[(__index << 3) + 7] = ("pop", (__segment, ))
+    
+OPCODES[0x27] = ("daa", ())
+OPCODES[0x2F] = ("das", ())
+OPCODES[0x37] = ("aaa", ())
+OPCODES[0x3F] = ("aas", ())
+
+for __index, __register in enumerate(WORD_REG_NAMES):
+    OPCODES[0x40 + __index] = ("inc", (__register, ))
+    OPCODES[0x48 + __index] = ("dec", (__register, ))
+    OPCODES[0x50 + __index] = ("push", (__register, ))
+    OPCODES[0x58 + __index] = ("pop", (__register, ))
+    OPCODES[0x90 + __index] = ("xchg", ("ax", __register))
+    OPCODES[0xB8 + __index] = ("mov", (__register, "Iw"))
+    
+for __index, __register in enumerate(BYTE_REG_NAMES):
+    OPCODES[0xB0 + __index] = ("mov", (__register, "Ib"))
+    
+# The 8088 runs 0x60-0x6F as the conditional jumps.
+for __index, __mnemonic in enumerate(JCC_MNEMONICS):
+    OPCODES[0x60 + __index] = (__mnemonic, ("Jb", ))
+    OPCODES[0x70 + __index] = (__mnemonic, ("Jb", ))
+    
+OPCODES[0x80] = (GROUP_ALU, ("Eb", "Ib"))
+OPCODES[0x81] = (GROUP_ALU, ("Ew", "Iw"))
+OPCODES[0x82] = (GROUP_ALU, ("Eb", "Ib"))
+OPCODES[0x83] = (GROUP_ALU, ("Ew", "Is"))
+OPCODES[0x84] = ("test", ("Eb", "Gb"))
+OPCODES[0x85] = ("test", ("Ew", "Gw"))
+OPCODES[0x86] = ("xchg", ("Eb", "Gb"))
+OPCODES[0x87] = ("xchg", ("Ew", "Gw"))
+OPCODES[0x88] = ("mov", ("Eb", "Gb"))
+OPCODES[0x89] = ("mov", ("Ew", "Gw"))
+OPCODES[0x8A] = ("mov", ("Gb", "Eb"))
+OPCODES[0x8B] = ("mov", ("Gw", "Ew"))
+OPCODES[0x8C] = ("mov", ("Ew", "Sw"))
+OPCODES[0x8D] = ("lea", ("Gw", "M"))
+OPCODES[0x8E] = ("mov", ("Sw", "Ew"))
+OPCODES[0x8F] = (GROUP_POP, ("Ew", ))
+OPCODES[0x90] = ("nop", ())
+OPCODES[0x98] = ("cbw", ())
+OPCODES[0x99] = ("cwd", ())
+OPCODES[0x9A] = ("call", ("Ap", ))
+OPCODES[0x9B] = ("wait", ())
+OPCODES[0x9C] = ("pushf", ())
+OPCODES[0x9D] = ("popf", ())
+OPCODES[0x9E] = ("sahf", ())
+OPCODES[0x9F] = ("lahf", ())
+OPCODES[0xA0] = ("mov", ("al", "Ob"))
+OPCODES[0xA1] = ("mov", ("ax", "Ow"))
+OPCODES[0xA2] = ("mov", ("Ob", "al"))
+OPCODES[0xA3] = ("mov", ("Ow", "ax"))
+OPCODES[0xA4] = ("movsb", ())
+OPCODES[0xA5] = ("movsw", ())
+OPCODES[0xA6] = ("cmpsb", ())
+OPCODES[0xA7] = ("cmpsw", ())
+OPCODES[0xA8] = ("test", ("al", "Ib"))
+OPCODES[0xA9] = ("test", ("ax", "Iw"))
+OPCODES[0xAA] = ("stosb", ())
+OPCODES[0xAB] = ("stosw", ())
+OPCODES[0xAC] = ("lodsb", ())
+OPCODES[0xAD] = ("lodsw", ())
+OPCODES[0xAE] = ("scasb", ())
+OPCODES[0xAF] = ("scasw", ())
+
+# 0xC0, 0xC1, 0xC8 and 0xC9 are the 8088's aliases of the returns.
+OPCODES[0xC0] = OPCODES[0xC2] = ("ret", ("Iw", ))
+OPCODES[0xC1] = OPCODES[0xC3] = ("ret", ())
+OPCODES[0xC4] = ("les", ("Gw", "M"))
+OPCODES[0xC5] = ("lds", ("Gw", "M"))
+OPCODES[0xC6] = (GROUP_MOV, ("Eb", "Ib"))
+OPCODES[0xC7] = (GROUP_MOV, ("Ew", "Iw"))
+OPCODES[0xC8] = OPCODES[0xCA] = ("retf", ("Iw", ))
+OPCODES[0xC9] = OPCODES[0xCB] = ("retf", ())
+OPCODES[0xCC] = ("int3", ())
+OPCODES[0xCD] = ("int", ("Ib", ))
+OPCODES[0xCE] = ("into", ())
+OPCODES[0xCF] = ("iret", ())
+OPCODES[0xD0] = (GROUP_SHIFT, ("Eb", "1"))
+OPCODES[0xD1] = (GROUP_SHIFT, ("Ew", "1"))
+OPCODES[0xD2] = (GROUP_SHIFT, ("Eb", "cl"))
+OPCODES[0xD3] = (GROUP_SHIFT, ("Ew", "cl"))
+OPCODES[0xD4] = ("aam", ("Ib", ))
+OPCODES[0xD5] = ("aad", ("Ib", ))
+OPCODES[0xD6] = ("salc", ())
+OPCODES[0xD7] = ("xlatb", ())
+for __opcode in range(0xD8, 0xE0):
+    OPCODES[__opcode] = ("esc", ("Esc", ))
+OPCODES[0xE0] = ("loopnz", ("Jb", ))
+OPCODES[0xE1] = ("loopz", ("Jb", ))
+OPCODES[0xE2] = ("loop", ("Jb", ))
+OPCODES[0xE3] = ("jcxz", ("Jb", ))
+OPCODES[0xE4] = ("in", ("al", "Ib"))
+OPCODES[0xE5] = ("in", ("ax", "Ib"))
+OPCODES[0xE6] = ("out", ("Ib", "al"))
+OPCODES[0xE7] = ("out", ("Ib", "ax"))
+OPCODES[0xE8] = ("call", ("Jw", ))
+OPCODES[0xE9] = ("jmp", ("Jw", ))
+OPCODES[0xEA] = ("jmp", ("Ap", ))
+OPCODES[0xEB] = ("jmp short", ("Jb", ))
+OPCODES[0xEC] = ("in", ("al", "dx"))
+OPCODES[0xED] = ("in", ("ax", "dx"))
+OPCODES[0xEE] = ("out", ("dx", "al"))
+OPCODES[0xEF] = ("out", ("dx", "ax"))
+OPCODES[0xF4] = ("hlt", ())
+OPCODES[0xF5] = ("cmc", ())
+OPCODES[0xF6] = (GROUP_F6, ("Eb", ))
+OPCODES[0xF7] = (GROUP_F6, ("Ew", ))
+OPCODES[0xF8] = ("clc", ())
+OPCODES[0xF9] = ("stc", ())
+OPCODES[0xFA] = ("cli", ())
+OPCODES[0xFB] = ("sti", ())
+OPCODES[0xFC] = ("cld", ())
+OPCODES[0xFD] = ("std", ())
+OPCODES[0xFE] = (GROUP_FE, ("Eb", ))
+OPCODES[0xFF] = (GROUP_FF, ("Ew", ))
+
+# 0x0F is POP CS on the 8088, the CPU treats it as invalid like the later processors.
+OPCODES[0x0F] = None
+
+# Operands that give the size of the instruction, without one a memory operand says "byte" or "word".
+SIZED_OPERANDS = ("Gb", "Gw", "Sw")
+
+# Classes
+class InstructionReader(object):
+    """ Reads the bytes of one instruction from segment:offset, wrapping around the segment like the CPU. """
+    def __init__(self, read_byte, segment, offset):
+        self.read_byte = read_byte
+        self.segment = segment
+        self.offset = offset
+        self.data = []
+        
+    def byte(self):
+        """ Return the next byte of the instruction. """
+        value = self.read_byte(segment_offset_to_address(self.segment, (self.offset + len(self.data)) & 0xFFFF))
+        self.data.append(value)
+        return value
+        
+    def word(self):
+        """ Return the next word of the instruction. """
+        low = self.byte()
+        return (self.byte() << 8) | low
+        
+def decode(read_byte, segment, offset):
+    """
+    Decode the instruction at segment:offset, returning (bytes, text, displacement).
+    
+    For a relative jump or call the text has a %s for the target and displacement is the number to add to
+    the offset of the next instruction, otherwise it is None.  See format_instruction().
+    """
+    reader = InstructionReader(read_byte, segment, offset)
+    segment_override = None
+    prefixes = []
+    
+    opcode = reader.byte()
+    while len(reader.data) < MAX_INSTRUCTION_LENGTH:
+        if opcode in SEGMENT_PREFIXES:
+            segment_override = SEGMENT_PREFIXES[opcode]
+        elif opcode in REPEAT_PREFIXES:
+            prefixes.append(opcode)
+        elif opcode in LOCK_PREFIXES:
+            prefixes.append(opcode)
+        else:
+            break
+        opcode = reader.byte()
+        
+    entry = OPCODES[opcode]
+    if entry is None or len(reader.data) >= MAX_INSTRUCTION_LENGTH:
+        return reader.data[:1], "db 0x%02x" % reader.data[0], None
+        
+    mnemonic, operands = entry
+    modrm = None
+    if isinstance(mnemonic, tuple) or any(operand[0] in "EGSM" for operand in operands):
+        modrm = MODRM_LUT[reader.byte()]
+        
+    if isinstance(mnemonic, tuple):
+        mnemonic = mnemonic[modrm[1]]
+        if mnemonic is None:
+            return reader.data[:1], "db 0x%02x" % reader.data[0], None
+        if opcode in (0xF6, 0xF7) and modrm[1] < 2:
+            operands = operands + (("Ib", ) if opcode == 0xF6 else ("Iw", ))
+            
+    # A memory operand needs its size spelled out unless a register gives it.
+    sized = not mnemonic.endswith("far") and not any(operand in SIZED_OPERANDS for operand in operands)
+    
+    text = []
+    displacement = None
+    used_override = False
+    for operand in operands:
+        if operand in ("Eb", "Ew", "M", "Esc"):
+            if modrm[0] == MOD_RM_IS_REG:
+                text.append(BYTE_REG_NAMES[modrm[2]] if operand == "Eb" else WORD_REG_NAMES[modrm[2]])
+            else:
+                memory = memory_operand(reader, modrm, segment_override)
+                used_override = True
+                if sized and operand == "Eb":
+                    memory = "byte " + memory
+                elif sized and operand == "Ew":
+                    memory = "word " + memory
+                text.append(memory)
+            if operand == "Esc":
+                text[-1:] = ["0x%02x" % (((opcode & 0x07) << 3) | modrm[1]), text[-1]]
+                
+        elif operand == "Gb":
+            text.append(BYTE_REG_NAMES[modrm[1]])
+        elif operand == "Gw":
+            text.append(WORD_REG_NAMES[modrm[1]])
+        elif operand == "Sw":
+            text.append(SEGMENT_REG_NAMES[modrm[1]])
+        elif operand == "Ib":
+            text.append("0x%x" % reader.byte())
+        elif operand == "Iw":
+            text.append("0x%x" % reader.word())
+        elif operand == "Is":
+            text.append("0x%x" % (signed_byte(reader.byte()) & 0xFFFF))
+        elif operand == "Jb":
+            displacement = signed_byte(reader.byte())
+            text.append("%s")
+        elif operand == "Jw":
+            displacement = signed_word(reader.word())
+            text.append("%s")
+        elif operand == "Ap":
+            target_offset = reader.word()
+            text.append("0x%x:0x%x" % (reader.word(), target_offset))
+        elif operand in ("Ob", "Ow"):
+            used_override = True
+            text.append("[%s0x%x]" % (segment_override + ":" if segment_override else "", reader.word()))
+        else:
+            text.append(operand)
+            
+    words = []
+    for prefix in prefixes:
+        if prefix in LOCK_PREFIXES:
+            words.append("lock")
+        elif prefix == 0xF3 and opcode in COMPARE_STRING_OPCODES:
+            words.append("repe")
+        else:
+            words.append(REPEAT_PREFIXES[prefix])
+    if segment_override and not used_override:
+        words.append(segment_override)
+    words.append(mnemonic)
+    
+    line = " ".join(words)
+    if text:
+        line += " " + ",".join(text)
+    return reader.data, line, displacement
+    
+def memory_operand(reader, modrm, segment_override):
+    """ Read the displacement of a ModRM memory operand and return it as text, e.g. [es:bx+si+0x10]. """
+    mod, _, rm = modrm
+    prefix = segment_override + ":" if segment_override else ""
+    if mod == 0x00 and rm == 0x06:
+        return "[%s0x%x]" % (prefix, reader.word())
+        
+    base = MODRM_BASES[rm]
+    if mod == MOD_8_BIT:
+        value = signed_byte(reader.byte())
+        if value < 0:
+            return "[%s%s-0x%x]" % (prefix, base, -value)
+        return "[%s%s+0x%x]" % (prefix, base, value)
+    elif mod == MOD_16_BIT:
+        return "[%s%s+0x%x]" % (prefix, base, reader.word())
+    return "[%s%s]" % (prefix, base)
+    
+def format_instruction(text, displacement, offset, length):
+    """ Fill in the target of a relative jump in text decoded at offset. """
+    if displacement is None:
+        return text
+    return text % ("0x%x" % ((offset + length + displacement) & 0xFFFF))
+    
+def disassemble(read_byte, segment, offset):
+    """ Return the length and text of the instruction at segment:offset, read_byte() reads a physical address. """
+    data, text, displacement = decode(read_byte, segment, offset)
+    return len(data), format_instruction(text, displacement, offset, len(data))
+    
+class Disassembler(object):
+    """ Disassembles from the system bus, caching the decoded instructions by physical address. """
+    def __init__(self, bus, cache_size = DEFAULT_CACHE_SIZE):
+        self.bus = bus
+        self.cache_size = cache_size
+        
+        # Physical address to (bytes, text, displacement).
+        self.cache = {}
+        
+        self.hits = 0
+        self.misses = 0
+        
+    def instruction(self, segment, offset):
+        """ Return the bytes and text of the instruction at segment:offset. """
+        address = segment_offset_to_address(segment, offset)
+        read_byte = self.bus.mem_read_byte
+        entry = self.cache.get(address)
+        
+        # Checking the bytes is much cheaper than decoding them again.
+        if entry is not None:
+            data = entry[0]
+            for index, value in enumerate(data):
+                if read_byte(segment_offset_to_address(segment, (offset + index) & 0xFFFF)) != value:
+                    entry = None
+                    break
+                    
+        if entry is None:
+            self.misses += 1
+            entry = decode(read_byte, segment, offset)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[address] = entry
+        else:
+            self.hits += 1
+            
+        data, text, displacement = entry
+        return data, format_instruction(text, displacement, offset, len(data))
+        
+    def text(self, segment, offset):
+        """ Return the text of the instruction at segment:offset. """
+        return self.instruction(segment, offset)[1]
+        
+    def listing(self, segment, offset, count):
+        """
+        Disassemble count instructions starting at segment:offset.
+        
+        Returns a list of "SSSS:OOOO  bytes  text" lines and the offset of the instruction after the last one.
+        """
+        lines = []
+        for _ in range(count):
+            data, text = self.instruction(segment, offset)
+            lines.append("%04x:%04x  %-14s %s" % (segment, offset, "".join("%02x" % value for value in data), text))
+            offset = (offset + len(data)) & 0xFFFF
+        return lines, offset
+        
+    def invalidate(self, address = None):
+        """ Drop the cached instruction at a physical address, or everything. """
+        if address is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(address, None)
@@ -89,6 +89,9 @@ class DmaChannel(object):
         self.terminal_count_callback = None
         self.reached_terminal_count = False
         
+        # Bytes moved (or refresh cycles run) since power on, for pyxt.metrics.
+        self.transfer_count = 0
+        
 class DmaController(Device):
     """ A Device emulating an 8237 DMA controller. """
     
@@ -102,6 +105,11 @@ class DmaController(Device):
         # Configuration information for each DMA channel.
         self.channels = [DmaChannel() for _unused in range(4)]
         
+        # Ticks between the DRAM refresh cycles channel 0 runs while they are worked out from the elapsed time
+        # instead of requested by the timer (None if they aren't), and the ticks since it was brought up to date.
+        self.refresh_period = None
+        self.refresh_ticks = 0
+        
         # Create a dictionary lookup for the correct channel for each page register.
         if len(page_register_map) != 4:
             raise ValueError("Page register map length does not match number of channels!")
@@ -117,6 +125,7 @@ class DmaController(Device):
         
     def clock(self):
         if self.enable:
+            self.refresh_ticks += 1
             for index, channel in enumerate(self.channels):
                 if channel.requested:
                     # Prefix the address with the page register (not like segment+offset though).
@@ -124,15 +133,11 @@ class DmaController(Device):
                     
                     # Channel 0 is the RAM refresh, we can skip that here.
                     if index != 0:
-                        if channel.transfer_type == TYPE_WRITE:
-                            self.bus.mem_write_byte(full_address, self.bus.io_read_byte(channel.port))
-                        elif channel.transfer_type == TYPE_READ:
-                            self.bus.io_write_byte(channel.port, self.bus.mem_read_byte(full_address))
-                        else:
-                            raise RuntimeError("Unsupported transfer type: 0x%x" % channel.transfer_type)
-                            
+                        self.transfer_byte(channel, full_address)
+                        
                     channel.word_count = (channel.word_count - 1) & 0xFFFF
                     channel.address += channel.increment
+                    channel.transfer_count += 1
                     
                     if channel.word_count == 0xFFFF:
                         channel.requested = False
@@ -140,7 +145,45 @@ class DmaController(Device):
                         if callable(channel.terminal_count_callback):
                             channel.terminal_count_callback()
                             
+    def ticks_until_event(self):
+        """ Return the number of ticks until the next transfer (not counting RAM refresh) reaches terminal count. """
+        if not self.enable:
+            return None
+            
+        ticks = [channel.word_count + 1 for channel in self.channels[1:] if channel.requested]
+        return min(ticks) if ticks else None
+        
+    def fast_forward(self, ticks):
+        if not self.enable:
+            return
+            
+        # Channel 0 isn't requested while the refresh is computed, it catches up in update_refresh().
+        self.refresh_ticks += ticks
+        for index, channel in enumerate(self.channels):
+            if not channel.requested:
+                continue
+                
+            count = min(ticks, channel.word_count + 1)
+            if index != 0:
+                for _unused in range(count):
+                    self.transfer_byte(channel, (channel.page_register_value << 16) | channel.address)
+                    channel.address += channel.increment
+            else:
+                # RAM refresh doesn't transfer anything so the address can be moved all at once.
+                channel.address += channel.increment * count
+                
+            channel.word_count = (channel.word_count - count) & 0xFFFF
+            channel.transfer_count += count
+            if channel.word_count == 0xFFFF:
+                channel.requested = False
+                channel.reached_terminal_count = True
+                if callable(channel.terminal_count_callback):
+                    channel.terminal_count_callback()
+                    
     def io_read_byte(self, port):
+        if self.refresh_ticks:
+            self.update_refresh()
+            
         # If it was a page register read, do that and get out.
         if port in self.page_register_channel_lookup:
             return self.page_register_channel_lookup[port].page_register_value
@@ -175,6 +218,9 @@ class DmaController(Device):
             raise NotImplementedError("offset = 0x%02x" % offset)
             
     def io_write_byte(self, port, value):
+        if self.refresh_ticks:
+            self.update_refresh()
+            
         # If it was a page register write, do that and get out.
         if port in self.page_register_channel_lookup:
             self.page_register_channel_lookup[port].page_register_value = value
@@ -233,6 +279,15 @@ class DmaController(Device):
             raise NotImplementedError("offset = 0x%02x" % offset)
             
     # Local functions.
+    def transfer_byte(self, channel, full_address):
+        """ Move one byte between memory and the channel's I/O port. """
+        if channel.transfer_type == TYPE_WRITE:
+            self.bus.mem_write_byte(full_address, self.bus.io_read_byte(channel.port))
+        elif channel.transfer_type == TYPE_READ:
+            self.bus.io_write_byte(channel.port, self.bus.mem_read_byte(full_address))
+        else:
+            raise RuntimeError("Unsupported transfer type: 0x%x" % channel.transfer_type)
+            
     def write_low_high(self, word, value):
         if self.low_byte:
             self.low_byte = False
@@ -249,6 +304,34 @@ class DmaController(Device):
             self.low_byte = True
             return read_high(word)
             
+    def update_refresh(self):
+        """ Run the refresh cycles channel 0 would have run since it was last brought up to date. """
+        period = self.refresh_period
+        if period is None:
+            self.refresh_ticks = 0
+            return
+            
+        cycles, self.refresh_ticks = divmod(self.refresh_ticks, period)
+        if not cycles:
+            return
+            
+        channel = self.channels[0]
+        channel.transfer_count += cycles
+        if cycles > channel.word_count:
+            # Terminal count, auto-init starts again from the base address and count.
+            cycles -= channel.word_count + 1
+            channel.reached_terminal_count = True
+            if channel.auto_init:
+                channel.address = channel.base_address
+                channel.word_count = channel.base_word_count
+            else:
+                channel.address += channel.increment * (channel.word_count + 1)
+                channel.word_count = 0xFFFF
+            cycles %= channel.word_count + 1
+            
+        channel.address = (channel.address + channel.increment * cycles) & 0xFFFF
+        channel.word_count -= cycles
+        
     def print_dma_stats(self):
         for index, channel in enumerate(self.channels):
             print(self.enable, index, channel.word_count, channel.address)
@@ -260,4 +343,16 @@ class DmaController(Device):
         self.channels[channel].port = port
         # TODO: Proper DREQ/DACK handshaking.
         self.channels[channel].terminal_count_callback = terminal_count_callback
+        
+    def dma_refresh(self, period):
+        """
+        Signal from the bus that channel 0 runs a DRAM refresh every period ticks, or None to go back to the timer.
+        
+        While the period is set channel 0 isn't requested and clocked like the others, its address and count are
+        worked out from the elapsed time when the controller is next read or written.
+        """
+        self.update_refresh()
+        self.refresh_period = period
+        if period is not None:
+            self.channels[0].requested = False
         
\ No newline at end of file
@@ -7,7 +7,6 @@ import array
 from collections import namedtuple
 
 # Six imports
-import six
 from six.moves import range # pylint: disable=redefined-builtin
 
 # PyXT imports
@@ -313,6 +312,10 @@ class FloppyDisketteController(Device):
         self.buffer = []
         self.cursor = 0
         
+        # Sectors transferred since power on, for pyxt.metrics.
+        self.sectors_read = 0
+        self.sectors_written = 0
+        
     # Device interface.
     def get_ports_list(self):
         return [self.base + FDC_CONTROL, self.base + FDC_STATUS, self.base + FDC_DATA]
@@ -554,6 +557,8 @@ class FloppyDisketteController(Device):
                 self.state = ST_RDDATA_READ_STATUS_REG_0
                 return
                 
+            self.sectors_read += 1
+            
         # Do not setup DMA if this is a continuation of a previous read.
         if continuation:
             return
@@ -602,7 +607,7 @@ class FloppyDisketteController(Device):
         drive = self.drives[self.drive_select]
         if drive:
             _unused, length = calculate_parameters(drive.drive_info, self.parameters)
-            self.buffer = array.array("B", (0,) * length)
+            self.buffer = array.array("B", [0]) * length
             self.cursor = 0
             
             # If we don't have a diskette present, throw an interrupt and get out.
@@ -634,6 +639,7 @@ class FloppyDisketteController(Device):
             if drive:
                 drive.write(self.parameters, self.buffer)
                 drive.store_diskette()
+                self.sectors_written += 1
                 
             self.parameters.next_sector()
             self.begin_write_data(continuation = True)
@@ -672,7 +678,6 @@ class FloppyDisketteDrive(object):
         self.filename = filename
         
         if self.filename is not None:
-            self.contents = array.array("B", (0,) * self.size_in_bytes)
             with open(self.filename, "rb") as fileptr:
                 data = fileptr.read()
                 
@@ -681,8 +686,8 @@ class FloppyDisketteDrive(object):
                         len(data), self.size_in_bytes,
                     ))
                     
-            for index, byte in enumerate(six.iterbytes(data)):
-                self.contents[index] = byte
+            # Pad a short image out to the full size of the diskette.
+            self.contents = array.array("B", bytearray(data)) + array.array("B", [0]) * (self.size_in_bytes - len(data))
                 
     def store_diskette(self):
         """ Write the content of the virtual diskette back to an image file. """
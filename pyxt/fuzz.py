@@ -0,0 +1,373 @@
+"""
+pyxt.fuzz - Differential fuzzing of the CPU's optional fast paths.
+
+Random instruction sequences are run from random register and memory states, once on a plain CPU (the
+reference) and once with each variant's fast paths turned on, and the complete machine state is compared when
+the code is left.  Failing cases are shrunk to the fewest instructions and simplest state that still differ.
+
+Run "python -m pyxt.fuzz --cases 10000" to fuzz every variant across all of the CPU cores, a failing seed can
+be run again on its own with --seed.
+"""
+
+from __future__ import print_function
+
+# Standard library imports
+import sys
+import random
+import array
+import multiprocessing
+from optparse import OptionParser
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.helpers import segment_offset_to_address, random_bytes
+from pyxt.bus import SystemBus
+from pyxt.memory import RAM
+from pyxt.cpu import CPU, WordRegs
+from pyxt.disassembler import decode, format_instruction, COMPARE_STRING_OPCODES
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+REGISTER_NAMES = tuple(name for name, _ in WordRegs._fields_) # pylint: disable=protected-access
+
+# The code is always placed here, the other registers are random.
+CODE_SEGMENT = 0x1000
+
+DEFAULT_CASES = 1000
+DEFAULT_LENGTH = 16
+
+# Cases that run longer than this without leaving the code (tight loops, long REPs) aren't compared.
+DEFAULT_MAX_INSTRUCTIONS = 2000
+
+# HLTs written after the code, longer than any instruction, so superinstructions can't run past the end of it.
+GUARD_LENGTH = 8
+
+# Memory is filled with a random pattern this long repeated, rather than 1 MB of random numbers.
+PATTERN_SIZE = 4096
+
+# Opcodes the CPU doesn't implement, HLT which needs an interrupt, and I/O which needs devices.
+EXCLUDED_OPCODES = frozenset([
+    0x0F, 0x27, 0x2F, 0x37, 0x3F, 0x9B, 0xC0, 0xC1, 0xC8, 0xC9, 0xCC, 0xCE, 0xD4, 0xD6, 0xF1, 0xF4,
+    0xE4, 0xE5, 0xE6, 0xE7, 0xEC, 0xED, 0xEE, 0xEF,
+] + list(range(0x60, 0x70)))
+
+PREFIX_OPCODES = frozenset([0x26, 0x2E, 0x36, 0x3E, 0xF0, 0xF2, 0xF3])
+SEGMENT_PREFIX_OPCODES = (0x26, 0x2E, 0x36, 0x3E)
+STRING_OPCODES = frozenset([0xA4, 0xA5, 0xA6, 0xA7, 0xAA, 0xAB, 0xAC, 0xAD, 0xAE, 0xAF])
+
+# Relative branches are given short distances so they mostly stay in the code, far transfers always leave it
+# and end the case so they are only used occasionally.
+SHORT_BRANCH_OPCODES = frozenset(list(range(0x70, 0x80)) + [0xE0, 0xE1, 0xE2, 0xE3, 0xEB])
+NEAR_BRANCH_OPCODES = frozenset([0xE8, 0xE9])
+BRANCH_DISTANCE = 16
+FAR_TRANSFER_OPCODES = (0x9A, 0xC2, 0xC3, 0xCA, 0xCB, 0xCD, 0xCF, 0xEA)
+FAR_TRANSFER_CHANCE = 0.02
+
+OPCODE_CHOICES = tuple(opcode for opcode in range(256)
+                       if opcode not in EXCLUDED_OPCODES | PREFIX_OPCODES and opcode not in FAR_TRANSFER_OPCODES)
+                       
+# Filled by memory_blocks().
+RAM_BLOCKS = []
+
+# Functions
+def enable_collapse_delay_loops(cpu):
+    """ LOOP back to itself skips straight to CX = 0. """
+    cpu.collapse_delay_loops(True)
+    
+def enable_fuse_instructions(cpu):
+    """ Common instruction pairs run as one superinstruction. """
+    cpu.fuse_instructions(True)
+    
+# Each variant turns on some of the CPU's fast paths, they should never change what the code does.
+VARIANTS = {
+    "collapse-delay-loops" : enable_collapse_delay_loops,
+    "fuse-instructions" : enable_fuse_instructions,
+}
+
+def random_instruction(rng):
+    """ Return the bytes of one random instruction that the CPU implements. """
+    while True:
+        data = bytearray()
+        if rng.random() < FAR_TRANSFER_CHANCE:
+            opcode = rng.choice(FAR_TRANSFER_OPCODES)
+        else:
+            opcode = rng.choice(OPCODE_CHOICES)
+        if rng.random() < 0.15:
+            data.append(rng.choice(SEGMENT_PREFIX_OPCODES))
+        if opcode in STRING_OPCODES and rng.random() < 0.5:
+            data.append(rng.choice((0xF2, 0xF3)) if opcode in COMPARE_STRING_OPCODES else 0xF3)
+        data.append(opcode)
+        data.extend(rng.randrange(256) for _ in range(6))
+        
+        distance = rng.randrange(-BRANCH_DISTANCE, BRANCH_DISTANCE)
+        if opcode in SHORT_BRANCH_OPCODES:
+            data[-6] = distance & 0xFF
+        elif opcode in NEAR_BRANCH_OPCODES:
+            data[-6] = distance & 0xFF
+            data[-5] = (distance >> 8) & 0xFF
+            
+        # The disassembler knows how long it is, and which ModRM encodings of a group are invalid.
+        instruction, text, _displacement = decode(data.__getitem__, 0, 0)
+        if not text.startswith("db "):
+            return bytes(data[:len(instruction)])
+            
+def random_word(rng):
+    """ Random register value, small ones are common to keep counts and loops short. """
+    if rng.random() < 0.5:
+        return rng.randrange(16)
+    return rng.randrange(0x10000)
+    
+def generate_case(seed, length = DEFAULT_LENGTH):
+    """ Return the FuzzCase for a seed, the same seed always gives the same case. """
+    rng = random.Random(seed)
+    registers = dict((name, random_word(rng)) for name in REGISTER_NAMES)
+    registers["CS"] = CODE_SEGMENT
+    registers["IP"] = rng.randrange(0x100)
+    
+    # Keep the interrupt and trap flags clear, there is nothing to interrupt the CPU.
+    flags = rng.randrange(0x10000) & 0x0CD5
+    
+    instructions = [random_instruction(rng) for _ in range(length)]
+    return FuzzCase(seed, instructions, registers, flags, rng.randrange(1 << 32))
+    
+def memory_pattern(memory_seed):
+    """ Return the block of bytes that memory is filled with. """
+    if memory_seed is None:
+        return array.array("B", [0]) * PATTERN_SIZE
+    return array.array("B", random_bytes(random.Random(memory_seed), PATTERN_SIZE))
+    
+def memory_blocks():
+    """ Return the RAM for the 16 blocks of the bus, it's kept for the next run as it's slow to allocate. """
+    if not RAM_BLOCKS:
+        RAM_BLOCKS.extend(RAM(SIXTY_FOUR_KB) for _ in range(16))
+    return RAM_BLOCKS
+    
+def run_case(case, variant = None, max_instructions = DEFAULT_MAX_INSTRUCTIONS):
+    """
+    Run a case on a new machine with a variant's fast paths (or none, for the reference).
+    
+    Returns the machine state once the code is left or an exception is raised, or None if it didn't finish in
+    max_instructions.
+    """
+    bus = SystemBus()
+    pattern = memory_pattern(case.memory_seed) * (SIXTY_FOUR_KB // PATTERN_SIZE)
+    for block, memory in enumerate(memory_blocks()):
+        memory.contents[:] = pattern
+        bus.install_device(block * SIXTY_FOUR_KB, memory)
+        
+    cpu = CPU()
+    bus.install_cpu(cpu)
+    if variant is not None:
+        VARIANTS[variant](cpu)
+        
+    code = case.code()
+    start = segment_offset_to_address(CODE_SEGMENT, case.registers["IP"])
+    for index, value in enumerate(bytearray(code) + bytearray([0xF4]) * GUARD_LENGTH):
+        bus.mem_write_byte(start + index, value)
+    end = start + len(code)
+    
+    for name, value in case.registers.items():
+        setattr(cpu.regs, name, value)
+    cpu.flags.value = case.flags
+    
+    error = None
+    regs = cpu.regs
+    for _ in range(max_instructions):
+        if not start <= segment_offset_to_address(regs.CS, regs.IP) < end:
+            break
+            
+        try:
+            cpu.fetch()
+        except Exception as err: # pylint: disable=broad-except
+            error = "%s: %s" % (type(err).__name__, err)
+            break
+    else:
+        return None
+        
+    return MachineState(cpu, bus, error)
+    
+def compare_states(reference, state):
+    """ Return a list of the differences between two machine states. """
+    differences = []
+    for (name, expected), (_, actual) in zip(reference.values(), state.values()):
+        if expected != actual:
+            differences.append("%s: expected %r, got %r" % (name, expected, actual))
+            
+    if reference.memory != state.memory:
+        addresses = [address for address in range(len(reference.memory))
+                     if reference.memory[address] != state.memory[address]]
+        differences.append("memory: %d bytes differ, first at 0x%05x: expected 0x%02x, got 0x%02x" % (
+            len(addresses), addresses[0], reference.memory[addresses[0]], state.memory[addresses[0]]))
+            
+    return differences
+    
+def check_case(case, variant, max_instructions = DEFAULT_MAX_INSTRUCTIONS):
+    """ Return the differences between the reference and a variant running a case, None if it didn't finish. """
+    reference = run_case(case, None, max_instructions)
+    if reference is None:
+        return None
+        
+    state = run_case(case, variant, max_instructions)
+    if state is None:
+        return ["variant didn't leave the code within %d instructions" % max_instructions]
+        
+    return compare_states(reference, state)
+    
+def shrink_case(case, variant, max_instructions = DEFAULT_MAX_INSTRUCTIONS):
+    """ Return the simplest version of a failing case that still fails the same variant. """
+    def _fails(candidate):
+        return bool(check_case(candidate, variant, max_instructions))
+        
+    progress = True
+    while progress:
+        progress = False
+        
+        # Fewer instructions, trying the later ones first as they are often never reached.
+        for index in range(len(case.instructions) - 1, -1, -1):
+            candidate = case.replace(instructions = case.instructions[:index] + case.instructions[index + 1:])
+            if candidate.instructions and _fails(candidate):
+                case, progress = candidate, True
+                
+        if case.memory_seed is not None:
+            candidate = case.replace(memory_seed = None)
+            if _fails(candidate):
+                case, progress = candidate, True
+                
+        if case.flags != 0:
+            candidate = case.replace(flags = 0)
+            if _fails(candidate):
+                case, progress = candidate, True
+                
+        for name in REGISTER_NAMES:
+            if name not in ("CS", "IP") and case.registers[name] != 0:
+                registers = dict(case.registers)
+                registers[name] = 0
+                candidate = case.replace(registers = registers)
+                if _fails(candidate):
+                    case, progress = candidate, True
+                    
+    return case
+    
+def fuzz_seed(args):
+    """ Pool worker, check one seed against each variant and return a list of (variant, shrunk case, differences). """
+    seed, length, variants, max_instructions = args
+    case = generate_case(seed, length)
+    failures = []
+    for variant in variants:
+        if check_case(case, variant, max_instructions):
+            shrunk = shrink_case(case, variant, max_instructions)
+            failures.append((variant, shrunk, check_case(shrunk, variant, max_instructions)))
+    return seed, failures
+    
+def fuzz(seeds, length = DEFAULT_LENGTH, variants = None, max_instructions = DEFAULT_MAX_INSTRUCTIONS, jobs = None):
+    """ Check the cases for the seeds across a pool of processes, yielding (seed, failures) as each finishes. """
+    if variants is None:
+        variants = sorted(VARIANTS)
+        
+    work = ((seed, length, variants, max_instructions) for seed in seeds)
+    if jobs == 1:
+        for result in map(fuzz_seed, work):
+            yield result
+        return
+        
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(fuzz_seed, work, chunksize = 8):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+        
+def main():
+    """ Fuzz the CPU variants and report the failing cases. """
+    parser = OptionParser(usage = "%prog [options]")
+    parser.add_option("--cases", action = "store", type = "int", dest = "cases", default = DEFAULT_CASES,
+                      help = "Number of random cases to run, default: %d." % DEFAULT_CASES)
+    parser.add_option("--seed", action = "store", type = "int", dest = "seed", default = 0,
+                      help = "First seed, cases use consecutive seeds from here, default: 0.")
+    parser.add_option("--length", action = "store", type = "int", dest = "length", default = DEFAULT_LENGTH,
+                      help = "Instructions in each case, default: %d." % DEFAULT_LENGTH)
+    parser.add_option("--max-instructions", action = "store", type = "int", dest = "max_instructions",
+                      default = DEFAULT_MAX_INSTRUCTIONS,
+                      help = "Give up on cases that run longer than this, default: %d." % DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_option("--variant", action = "append", dest = "variants", choices = sorted(VARIANTS),
+                      help = "Only fuzz this variant, can be given more than once: %s." % ", ".join(sorted(VARIANTS)))
+    parser.add_option("--jobs", action = "store", type = "int", dest = "jobs", default = None,
+                      help = "Worker processes, default: one per CPU core.")
+    options, _args = parser.parse_args()
+    
+    # Many cases run into invalid opcodes, which the CPU logs as errors.
+    logging.disable(logging.ERROR)
+    
+    failed = 0
+    seeds = range(options.seed, options.seed + options.cases)
+    for seed, failures in fuzz(seeds, options.length, options.variants, options.max_instructions, options.jobs):
+        for variant, case, differences in failures:
+            failed += 1
+            print("Seed %d fails %s, shrunk to:\n%s" % (seed, variant, case))
+            for difference in differences:
+                print("    %s" % difference)
+            print()
+            
+    print("%d cases, %d failures." % (options.cases, failed))
+    sys.exit(1 if failed else 0)
+    
+# Classes
+class FuzzCase(object):
+    """ Code to run along with the registers, flags, and memory to start it from. """
+    def __init__(self, seed, instructions, registers, flags, memory_seed):
+        self.seed = seed
+        self.instructions = instructions
+        self.registers = registers
+        self.flags = flags
+        
+        # None leaves memory filled with zeros.
+        self.memory_seed = memory_seed
+        
+    def code(self):
+        """ Return the instructions as one block of bytes. """
+        return b"".join(self.instructions)
+        
+    def replace(self, **changes):
+        """ Return a copy of this case with some of its fields changed. """
+        fields = dict(vars(self))
+        fields.update(changes)
+        return FuzzCase(**fields)
+        
+    def __str__(self):
+        lines = ["    %s" % " ".join("%s=%04x" % (name, self.registers[name]) for name in REGISTER_NAMES),
+                 "    flags=%04x memory_seed=%r" % (self.flags, self.memory_seed)]
+        offset = self.registers["IP"]
+        for instruction in self.instructions:
+            data, text, displacement = decode(bytearray(instruction).__getitem__, 0, 0)
+            lines.append("    %04x:%04x  %-14s %s" % (CODE_SEGMENT, offset, "".join("%02x" % value for value in data),
+                                                    format_instruction(text, displacement, offset, len(data))))
+            offset += len(data)
+        return "\n".join(lines)
+        
+class MachineState(object):
+    """ Everything about the machine that a variant could get wrong. """
+    def __init__(self, cpu, bus, error = None):
+        self.error = error
+        self.hlt = cpu.hlt
+        self.cycles = cpu.cycles
+        self.flags = cpu.flags.value
+        self.registers = dict((name, getattr(cpu.regs, name)) for name in REGISTER_NAMES)
+        self.memory = bytearray()
+        for device in bus.devices:
+            self.memory.extend(bytearray(device.contents))
+            
+    def values(self):
+        """ Return (name, value) pairs for everything but memory. """
+        return ([("error", self.error), ("hlt", self.hlt), ("cycles", self.cycles), ("flags", self.flags)] +
+                [(name, self.registers[name]) for name in REGISTER_NAMES])
+                
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+pyxt.gdbstub - GDB remote serial protocol server for debugging the emulated machine.
+
+Start PyXT with "--gdb 1234" (or the path of a Unix socket) and connect with:
+
+    (gdb) set architecture i8086
+    (gdb) target remote localhost:1234
+    
+Registers are sent in GDB's i386 layout zero extended to 32 bits.  Addresses for memory, breakpoints and
+watchpoints are physical, so a breakpoint at F000:E05B is "break *0xfe05b".
+
+A thread waits for GDB to connect and sets a flag that the main loop checks between slices, nothing else is
+done until a client attaches.  While one is attached the main loop runs the stub's fetch() so its breakpoints
+are checked, and the machine is stopped inside that call while GDB has control.
+"""
+
+# Standard library imports
+import os
+import sys
+import socket
+import select
+import struct
+import threading
+from binascii import hexlify, unhexlify
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.breakpoints import BreakpointSet, WatchpointSet, WATCH_READ, WATCH_WRITE, WATCH_CHANGE
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+SIGINT = 2
+SIGTRAP = 5
+
+# Registers in the order of GDB's i386 "g" packet, there is no FS or GS on the 8088.
+GDB_REGISTERS = ("AX", "CX", "DX", "BX", "SP", "BP", "SI", "DI", "IP", "FLAGS", "CS", "SS", "DS", "ES", "FS", "GS")
+REGISTER_FORMAT = struct.Struct("<%dI" % len(GDB_REGISTERS))
+REGISTER_SIZE = 4
+
+# Largest packet GDB is told it can send, memory reads are limited to fit in one.
+PACKET_SIZE = 0x1000
+
+# Watchpoint kinds for the Z2, Z3 and Z4 packets, and how hits are reported in a stop reply.
+WATCHPOINT_TYPES = {
+    2 : (WATCH_WRITE, ),
+    3 : (WATCH_READ, ),
+    4 : (WATCH_READ, WATCH_WRITE),
+}
+WATCH_REASONS = {
+    WATCH_READ : "rwatch",
+    WATCH_WRITE : "watch",
+    WATCH_CHANGE : "watch",
+}
+
+# Functions
+def parse_address(text):
+    """ Return the address to listen on for a --gdb argument, a port on localhost or the path of a Unix socket. """
+    if text.isdigit():
+        return ("127.0.0.1", int(text))
+    return text
+    
+def checksum(data):
+    """ Return the modulo 256 checksum of a packet's data. """
+    return sum(bytearray(data)) & 0xFF
+    
+# Classes
+class GdbStub(object):
+    """ Serves one GDB client at a time over TCP or a Unix socket. """
+    def __init__(self, cpu, bus, fetch, address):
+        self.cpu = cpu
+        self.bus = bus
+        self.next_fetch = fetch
+        self.address = address
+        
+        self.breakpoints = BreakpointSet(cpu)
+        self.watchpoints = WatchpointSet(bus, self.watchpoint_hit)
+        
+        # Set by the listening thread when a client connects, the main loop then calls poll().
+        self.attention = False
+        self.pending_client = None
+        
+        self.client = None
+        self.buffer = b""
+        self.no_ack = False
+        
+        # Execution control, see fetch().
+        self.running = True
+        self.stepping = False
+        self.skip_breakpoint = False
+        self.last_signal = SIGTRAP
+        self.stop_reason = ""
+        
+        if isinstance(address, tuple):
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(address)
+        self.server.listen(1)
+        
+        self.thread = threading.Thread(target = self.listen)
+        self.thread.daemon = True
+        
+    @property
+    def attached(self):
+        """ True while a client is connected. """
+        return self.client is not None
+        
+    # Connections.
+    def start(self):
+        """ Start waiting for a client in the background. """
+        self.thread.start()
+        log.info("Waiting for GDB on %s", self.server.getsockname())
+        
+    def listen(self):
+        """ Accepts clients, runs in its own thread. """
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except (socket.error, OSError):
+                return
+                
+            if self.client is not None or self.pending_client is not None:
+                client.close()
+                continue
+                
+            self.pending_client = client
+            self.attention = True
+            
+    def close(self):
+        """ Stop listening and drop any client. """
+        if self.client is not None:
+            self.detach()
+        self.server.close()
+        if not isinstance(self.address, tuple):
+            os.unlink(self.address)
+            
+    def attach(self, client):
+        """ Take control of the machine for a client, GDB expects it to be stopped when it connects. """
+        log.info("GDB attached.")
+        self.client = client
+        self.buffer = b""
+        self.no_ack = False
+        self.stop(SIGTRAP, notify = False)
+        
+    def detach(self):
+        """ Drop the client and let the machine run on without its breakpoints. """
+        log.info("GDB detached.")
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self.client.close()
+        self.client = None
+        self.running = True
+        self.stepping = False
+        
+        # Let the main loop go back to its own fetch().
+        self.attention = True
+        
+    def poll(self):
+        """ Called from the main loop when attention is set, attaches new clients and checks for Control-C. """
+        if self.pending_client is not None:
+            client = self.pending_client
+            self.pending_client = None
+            self.attach(client)
+            
+        elif self.client is not None and select.select([self.client], [], [], 0)[0]:
+            data = self.client.recv(PACKET_SIZE)
+            if not data:
+                self.detach()
+            else:
+                self.buffer += data.replace(b"\x03", b"")
+                if b"\x03" in data:
+                    self.stop(SIGINT)
+                    
+        self.attention = self.client is not None or self.pending_client is not None
+        
+    # Execution.
+    def fetch(self):
+        """ Run one instruction with the supplied fetch(), stopping first for a breakpoint or single step. """
+        regs = self.cpu.regs
+        if self.skip_breakpoint:
+            self.skip_breakpoint = False
+        elif self.stepping or ((regs.CS << 4) + regs.IP) & 0xFFFFF in self.breakpoints.addresses:
+            if self.stepping or self.breakpoints.check():
+                self.stop(SIGTRAP)
+                
+                # The instruction it stopped at is the one run below.
+                self.skip_breakpoint = False
+                
+        self.next_fetch()
+        
+    def watchpoint_hit(self, watchpoint, address, _old_value, _new_value):
+        """ Called by the watchpoints, stops before the next instruction. """
+        self.stop_reason = "%s:%x;" % (WATCH_REASONS[watchpoint.kind], address)
+        self.stepping = True
+        
+    def stop(self, signal, notify = True):
+        """ Stop the machine and serve the client's packets until it continues, steps or detaches. """
+        self.running = False
+        self.stepping = False
+        self.last_signal = signal
+        if notify:
+            self.send_packet(self.stop_reply())
+        self.stop_reason = ""
+        
+        # GDB reading memory shouldn't set off its own watchpoints.
+        self.watchpoints.enabled = False
+        try:
+            while self.client is not None and not self.running:
+                packet = self.read_packet()
+                if packet is None:
+                    self.detach()
+                    break
+                    
+                reply = self.handle_packet(packet)
+                if reply is not None and self.client is not None:
+                    self.send_packet(reply)
+        finally:
+            self.watchpoints.enabled = True
+            
+    def resume(self, step):
+        """ Carry on from the stop, the current instruction is run even if there's a breakpoint on it. """
+        self.running = True
+        self.stepping = step
+        self.skip_breakpoint = True
+        
+    def stop_reply(self):
+        """ Return the reply to "?" or a stop, with the reason for a watchpoint. """
+        if self.stop_reason:
+            return "T%02x%s" % (self.last_signal, self.stop_reason)
+        return "S%02x" % self.last_signal
+        
+    # Packets.
+    def read_packet(self):
+        """ Return the data of the next packet from the client, or None if it disconnected. """
+        while True:
+            start = self.buffer.find(b"$")
+            end = self.buffer.find(b"#", start)
+            if start >= 0 and end >= 0 and len(self.buffer) >= end + 3:
+                data = self.buffer[start + 1:end]
+                received = self.buffer[end + 1:end + 3]
+                self.buffer = self.buffer[end + 3:]
+                
+                if not self.no_ack:
+                    if int(received, 16) != checksum(data):
+                        self.client.sendall(b"-")
+                        continue
+                    self.client.sendall(b"+")
+                return data.decode("latin-1")
+                
+            # Acks and Control-C while stopped can be thrown away.
+            if start < 0:
+                self.buffer = b""
+                
+            data = self.client.recv(PACKET_SIZE)
+            if not data:
+                return None
+            self.buffer += data
+            
+    def send_packet(self, data):
+        """ Send a packet to the client, its ack is skipped over by read_packet(). """
+        data = data.encode("latin-1")
+        self.client.sendall(b"$" + data + b"#" + ("%02x" % checksum(data)).encode("ascii"))
+        
+    def handle_packet(self, packet):
+        """ Carry out a command from the client, returning the reply or None if there isn't one yet. """
+        command, args = packet[:1], packet[1:]
+        
+        if command == "?":
+            return self.stop_reply()
+            
+        elif command == "g":
+            return self.read_registers()
+            
+        elif command == "G":
+            self.write_registers(args)
+            return "OK"
+            
+        elif command == "p":
+            index = int(args, 16)
+            if index >= len(GDB_REGISTERS):
+                return "E01"
+            return self.hex_register(index)
+            
+        elif command == "P":
+            index, value = args.split("=")
+            index = int(index, 16)
+            if index >= len(GDB_REGISTERS):
+                return "E01"
+            self.write_register(index, struct.unpack("<I", unhexlify(value))[0])
+            return "OK"
+            
+        elif command == "m":
+            address, length = [int(value, 16) for value in args.split(",")]
+            return self.read_memory(address, min(length, (PACKET_SIZE - 4) // 2))
+            
+        elif command == "M":
+            location, data = args.split(":")
+            address, length = [int(value, 16) for value in location.split(",")]
+            self.write_memory(address, bytearray(unhexlify(data))[:length])
+            return "OK"
+            
+        elif command == "c":
+            self.resume(False)
+            return None
+            
+        elif command == "s":
+            self.resume(True)
+            return None
+            
+        elif command in ("Z", "z"):
+            return self.change_breakpoint(command == "Z", *[int(value, 16) for value in args.split(",")[:3]])
+            
+        elif command == "D":
+            self.send_packet("OK")
+            self.detach()
+            return None
+            
+        elif command == "k":
+            self.detach()
+            sys.exit(0)
+            
+        elif command == "H" or command == "T":
+            return "OK"
+            
+        elif command == "q":
+            return self.handle_query(args)
+            
+        elif command == "Q" and args == "StartNoAckMode":
+            self.send_packet("OK")
+            self.no_ack = True
+            return None
+            
+        # Anything else isn't supported, GDB falls back to something simpler.
+        return ""
+        
+    def handle_query(self, query):
+        """ Reply to a "q" packet. """
+        if query.startswith("Supported"):
+            return "PacketSize=%x;QStartNoAckMode+" % PACKET_SIZE
+        elif query == "Attached":
+            return "1"
+        elif query == "C":
+            return "QC1"
+        elif query == "fThreadInfo":
+            return "m1"
+        elif query == "sThreadInfo":
+            return "l"
+        return ""
+        
+    # Machine state.
+    def read_register(self, index):
+        """ Return the value of a register by its GDB number. """
+        name = GDB_REGISTERS[index]
+        if name == "FLAGS":
+            return self.cpu.flags.value
+        elif name in ("FS", "GS"):
+            return 0
+        return self.cpu.regs[name]
+        
+    def write_register(self, index, value):
+        """ Set a register by its GDB number. """
+        name = GDB_REGISTERS[index]
+        if name == "FLAGS":
+            self.cpu.flags.value = value & 0xFFFF
+            self.cpu.attention = True
+        elif name not in ("FS", "GS"):
+            self.cpu.regs[name] = value & 0xFFFF
+            
+    def hex_register(self, index):
+        """ Return a register as GDB's hex. """
+        return hexlify(struct.pack("<I", self.read_register(index))).decode("ascii")
+        
+    def read_registers(self):
+        """ Return all of the registers for a "g" packet. """
+        values = [self.read_register(index) for index in range(len(GDB_REGISTERS))]
+        return hexlify(REGISTER_FORMAT.pack(*values)).decode("ascii")
+        
+    def write_registers(self, data):
+        """ Set the registers from a "G" packet, GDB may send more than the 8088 has. """
+        data = unhexlify(data)
+        for index in range(min(len(GDB_REGISTERS), len(data) // REGISTER_SIZE)):
+            self.write_register(index, struct.unpack_from("<I", data, index * REGISTER_SIZE)[0])
+            
+    def read_memory(self, address, length):
+        """ Return physical memory as hex. """
+        mem_read_byte = self.bus.mem_read_byte
+        data = bytearray(mem_read_byte((address + offset) & 0xFFFFF) for offset in range(length))
+        return hexlify(bytes(data)).decode("ascii")
+        
+    def write_memory(self, address, data):
+        """ Write bytes to physical memory. """
+        for offset, value in enumerate(data):
+            self.bus.mem_write_byte((address + offset) & 0xFFFFF, value)
+            
+    def change_breakpoint(self, insert, kind, address, length):
+        """ Insert or remove a breakpoint or watchpoint for a "Z" or "z" packet. """
+        if kind in (0, 1):
+            if insert:
+                self.breakpoints.add(address >> 4, address & 0x000F)
+            else:
+                self.breakpoints.remove(address >> 4, address & 0x000F)
+            return "OK"
+            
+        if kind not in WATCHPOINT_TYPES:
+            return ""
+            
+        if not insert:
+            self.watchpoints.remove(address)
+            return "OK"
+            
+        try:
+            for watch_kind in WATCHPOINT_TYPES[kind]:
+                self.watchpoints.add(address, length, watch_kind)
+        except ValueError:
+            return "E01"
+        return "OK"
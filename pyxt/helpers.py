@@ -4,6 +4,7 @@ pyxt.helpers - A collection of helper functions used throughout PyXT.
 
 # Standard library imports
 import array
+from binascii import unhexlify
 
 # Six imports
 from six.moves import range # pylint: disable=redefined-builtin
@@ -37,9 +38,26 @@ def count_bits(value):
         value = value >> 1
     return count
     
-HAMMING_WEIGHT_LUT = array.array("B", (0,) * 0x10000)
-for __value in range(0, 0x10000):
-    HAMMING_WEIGHT_LUT[__value] = count_bits(__value)
+def build_hamming_weight_lut(bits = 16):
+    """
+    Build the table of set bit counts for every value of the given width.
+    
+    Setting the next bit up adds one to every count in the table so far, so the table is built by doubling
+    with bytearray.translate() rather than calling count_bits() for every value.
+    """
+    table = bytearray(1)
+    plus_one = bytes(bytearray(range(1, 256)) + bytearray(1))
+    for _ in range(bits):
+        table += table.translate(plus_one)
+    return array.array("B", table)
+    
+HAMMING_WEIGHT_LUT = build_hamming_weight_lut()
+
+def random_bytes(rng, size):
+    """ Return a bytearray of size random bytes drawn from rng in one call. """
+    if size == 0:
+        return bytearray()
+    return bytearray(unhexlify("%0*x" % (size * 2, rng.getrandbits(size * 8))))
     
 def count_bits_fast(value):
     """ Very quickly count the number of set bits in a 16 bit value with no error checking. """
@@ -0,0 +1,196 @@
+"""
+pyxt.hle - High level emulation of ROM BIOS services.
+
+These handlers are installed as interrupt hooks on the CPU and service common BIOS calls natively
+instead of executing thousands of instructions in the ROM.  Anything they don't support is passed
+through to the ROM BIOS unchanged.
+
+http://www.ctyme.com/intr/int-10.htm
+"""
+
+# Standard library imports
+import array
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+BIOS_SEGMENT = 0xF000
+
+VIDEO_INTERRUPT = 0x10
+
+# BIOS data area locations used by the video services.
+BDA_VIDEO_MODE = 0x0449
+BDA_VIDEO_COLUMNS = 0x044A
+BDA_VIDEO_PAGE_SIZE = 0x044C
+BDA_VIDEO_PAGE_START = 0x044E
+BDA_CURSOR_POSITIONS = 0x0450
+BDA_ACTIVE_PAGE = 0x0462
+BDA_CRTC_BASE_PORT = 0x0463
+
+VIDEO_ROWS = 25
+TEXT_MODES = (0, 1, 2, 3, 7)
+
+CRTC_CURSOR_ADDRESS_HIGH = 14
+CRTC_CURSOR_ADDRESS_LOW = 15
+
+# Classes
+class VideoBiosHLE(object):
+    """ Native implementation of the INT 10h teletype and scroll functions for MDA/CGA text modes. """
+    def __init__(self, bus, video_card):
+        self.bus = bus
+        self.video_card = video_card
+        
+        self.functions = {
+            0x06 : self.scroll_up,
+            0x07 : self.scroll_down,
+            0x0E : self.teletype_output,
+        }
+        
+    def install(self, cpu):
+        """ Install this handler as the INT 10h hook on the supplied CPU. """
+        cpu.install_interrupt_hook(VIDEO_INTERRUPT, self)
+        
+    def __call__(self, cpu):
+        """ Service INT 10h, returns True if the call was handled or False to fall back to the ROM BIOS. """
+        function = self.functions.get(cpu.regs.AH)
+        if function is None:
+            return False
+            
+        # Don't bypass anything that has hooked the video interrupt (ANSI drivers, TSRs, etc).
+        if self.bus.mem_read_word((VIDEO_INTERRUPT * 4) + 2) < BIOS_SEGMENT:
+            return False
+            
+        # Graphics modes draw text as pixels, leave those to the ROM.
+        if self.bus.mem_read_byte(BDA_VIDEO_MODE) not in TEXT_MODES:
+            return False
+            
+        return function(cpu)
+        
+    # ********** Helpers. **********
+    def get_columns(self):
+        """ Return the number of character columns in the current video mode. """
+        return self.bus.mem_read_word(BDA_VIDEO_COLUMNS)
+        
+    def get_cursor_position(self, page):
+        """ Return the (row, column) of the cursor for a given video page. """
+        position = self.bus.mem_read_word(BDA_CURSOR_POSITIONS + (page << 1))
+        return position >> 8, position & 0xFF
+        
+    def set_cursor_position(self, page, row, column):
+        """ Update the cursor position for a page and move the hardware cursor if it is the active page. """
+        self.bus.mem_write_word(BDA_CURSOR_POSITIONS + (page << 1), (row << 8) | column)
+        
+        if page == self.bus.mem_read_byte(BDA_ACTIVE_PAGE):
+            address = (self.bus.mem_read_word(BDA_VIDEO_PAGE_START) >> 1) + (row * self.get_columns()) + column
+            crtc_port = self.bus.mem_read_word(BDA_CRTC_BASE_PORT)
+            self.bus.io_write_byte(crtc_port, CRTC_CURSOR_ADDRESS_HIGH)
+            self.bus.io_write_byte(crtc_port + 1, (address >> 8) & 0xFF)
+            self.bus.io_write_byte(crtc_port, CRTC_CURSOR_ADDRESS_LOW)
+            self.bus.io_write_byte(crtc_port + 1, address & 0xFF)
+            
+    def scroll_window(self, top, left, bottom, right, lines, attribute, up):
+        """ Scroll a window of the active page by a number of lines, blanking the lines scrolled in. """
+        columns = self.get_columns()
+        bottom = min(bottom, VIDEO_ROWS - 1)
+        right = min(right, columns - 1)
+        if top > bottom or left > right:
+            return
+            
+        height = bottom - top + 1
+        if lines == 0 or lines > height:
+            lines = height
+            
+        video_ram = self.video_card.video_ram
+        page_start = self.bus.mem_read_word(BDA_VIDEO_PAGE_START)
+        stride = columns << 1
+        width = (right - left + 1) << 1
+        window_start = page_start + (top * stride) + (left << 1)
+        window_end = page_start + (bottom * stride) + (right << 1) + 2
+        if window_end > len(video_ram):
+            return
+            
+        # Move the surviving text, full width windows are contiguous so they only need one slice.
+        kept = height - lines
+        if kept:
+            if width == stride:
+                length = kept * stride
+                if up:
+                    source = window_start + (lines * stride)
+                    video_ram[window_start:window_start + length] = video_ram[source:source + length]
+                else:
+                    video_ram[window_end - length:window_end] = video_ram[window_start:window_start + length]
+            else:
+                rows = range(kept) if up else range(kept - 1, -1, -1)
+                for row in rows:
+                    destination = window_start + ((row if up else row + lines) * stride)
+                    source = window_start + ((row + lines if up else row) * stride)
+                    video_ram[destination:destination + width] = video_ram[source:source + width]
+                    
+        # Blank the lines that were scrolled in.
+        blank = array.array("B", (0x20, attribute)) * (width >> 1)
+        first_blank = kept if up else 0
+        for row in range(first_blank, first_blank + lines):
+            destination = window_start + (row * stride)
+            video_ram[destination:destination + width] = blank
+            
+        self.video_card.redraw_region(window_start, window_end)
+        
+    # ********** INT 10h functions. **********
+    def scroll_up(self, cpu):
+        """ AH=06h - Scroll the window CH,CL to DH,DL up AL lines filling with attribute BH. """
+        regs = cpu.regs
+        self.scroll_window(regs.CH, regs.CL, regs.DH, regs.DL, regs.AL, regs.BH, True)
+        return True
+        
+    def scroll_down(self, cpu):
+        """ AH=07h - Scroll the window CH,CL to DH,DL down AL lines filling with attribute BH. """
+        regs = cpu.regs
+        self.scroll_window(regs.CH, regs.CL, regs.DH, regs.DL, regs.AL, regs.BH, False)
+        return True
+        
+    def teletype_output(self, cpu):
+        """ AH=0Eh - Write the character in AL to the active page and advance the cursor. """
+        character = cpu.regs.AL
+        
+        # The bell is done by the ROM with the speaker.
+        if character == 0x07:
+            return False
+            
+        columns = self.get_columns()
+        page = self.bus.mem_read_byte(BDA_ACTIVE_PAGE)
+        row, column = self.get_cursor_position(page)
+        
+        if character == 0x08:
+            if column > 0:
+                column -= 1
+        elif character == 0x0D:
+            column = 0
+        elif character == 0x0A:
+            row += 1
+        else:
+            # Write the character keeping the existing attribute.
+            offset = self.bus.mem_read_word(BDA_VIDEO_PAGE_START) + (((row * columns) + column) << 1)
+            if offset < len(self.video_card.video_ram):
+                self.video_card.video_ram[offset] = character
+                self.video_card.redraw_region(offset, offset + 2)
+                
+            column += 1
+            if column >= columns:
+                column = 0
+                row += 1
+                
+        # Scroll the whole screen using the attribute under the cursor for the new line.
+        if row >= VIDEO_ROWS:
+            row = VIDEO_ROWS - 1
+            offset = self.bus.mem_read_word(BDA_VIDEO_PAGE_START) + (((row * columns) + column) << 1)
+            attribute = self.video_card.video_ram[offset + 1] if offset + 1 < len(self.video_card.video_ram) else 0x07
+            self.scroll_window(0, 0, VIDEO_ROWS - 1, columns - 1, 1, attribute, True)
+            
+        self.set_cursor_position(page, row, column)
+        return True
@@ -16,6 +16,7 @@ from six.moves import range # pylint: disable=redefined-builtin
 
 # PyXT imports
 from pyxt.bus import Device
+from pyxt.crtc import RasterTiming, POLLING_LINES
 from pyxt.helpers import *
 from pyxt.constants import *
 from pyxt.chargen import CharacterGeneratorMDA_CGA_ROM
@@ -47,6 +48,13 @@ STATUS_REG_BASE = 0xF0
 STATUS_REG_PIXEL_ON = 0x08
 STATUS_REG_HORIZONTAL_RETRACE = 0x01
 
+# 6845 timing: 882 dot lines (98 characters of 9 dots) of the card's own 16.257 MHz dot clock and 370 line frames
+# (49.8 Hz).  Horizontal sync is 15 characters long from character 82.
+MDA_DOT_CLOCK = 16257000
+MDA_TIMING = RasterTiming(MDA_DOT_CLOCK, 882, 370)
+MDA_HSYNC_START = 82 * 9
+MDA_HSYNC_END = 97 * 9
+
 MDA_ATTR_UNDERLINE =  0x01
 MDA_ATTR_FOREGROUND = 0x07
 MDA_ATTR_INTENSITY =  0x08
@@ -127,7 +135,7 @@ class Cursor(object):
                 self.interval = self.SLOW_BLINK_RATE
                 
 class MonochromeDisplayAdapter(Device):
-    def __init__(self, char_generator, randomize = False, palette = PALETTE_GREEN):
+    def __init__(self, char_generator, randomize = False, palette = PALETTE_GREEN, seed = None):
         super(MonochromeDisplayAdapter, self).__init__()
         
         self.char_generator = char_generator
@@ -135,12 +143,11 @@ class MonochromeDisplayAdapter(Device):
         self.control_reg = 0x00
         self.data_reg_index = 0x00
         
-        self.video_ram = array.array("B", (0,) * MDA_RAM_SIZE)
+        self.video_ram = array.array("B", [0]) * MDA_RAM_SIZE
         
-        # If desired, randomize the contents of video memory at startup for effect.
+        # If desired, randomize the contents of video memory at startup for effect, a seed makes it repeatable.
         if randomize:
-            for index in range(MDA_RAM_SIZE):
-                self.video_ram[index] = random.randint(0, 255)
+            self.video_ram = array.array("B", random_bytes(random.Random(seed), MDA_RAM_SIZE))
                 
         # Handle to the Pygame display object.
         self.screen = None
@@ -148,8 +155,14 @@ class MonochromeDisplayAdapter(Device):
         # Flag to indicate if we have updated the bitmap and need to display it.
         self.needs_draw = True
         
-        # Every other call to the status register will flip the horizontal retrace bit.
-        self.horizontal_retrace = False
+        # Number of times the display has been updated, for pyxt.metrics.
+        self.redraw_count = 0
+        
+        # Ticks the card has been clocked for, the status register works the beam position out from these.
+        self.ticks = 0
+        
+        # When the status register was last read, see ticks_until_event().
+        self.status_read_ticks = None
         
         # Used to simulate the pixel on bit when the status register is being read.
         self.current_pixel = [0, 0]
@@ -168,6 +181,29 @@ class MonochromeDisplayAdapter(Device):
         # Now that we have a display draw whatever is currently in RAM.
         self.redraw()
         
+    def clock(self):
+        self.ticks += 1
+        
+    def fast_forward(self, ticks):
+        self.ticks += ticks
+        
+    def ticks_until_event(self):
+        """
+        Return the number of ticks until the horizontal retrace bit next changes if a program is polling it.
+        
+        Nothing else depends on the beam, this only lets time skip straight to the retrace a busy wait is after.
+        """
+        polling_ticks = POLLING_LINES * MDA_TIMING.line_ticks
+        if self.status_read_ticks is None or self.ticks - self.status_read_ticks > polling_ticks:
+            return None
+            
+        line, dot = MDA_TIMING.position(self.ticks)
+        if dot < MDA_HSYNC_START:
+            return MDA_TIMING.ticks_until(self.ticks, line, MDA_HSYNC_START)
+        elif dot < MDA_HSYNC_END:
+            return MDA_TIMING.ticks_until(self.ticks, line, MDA_HSYNC_END)
+        return MDA_TIMING.ticks_until(self.ticks, line + 1, MDA_HSYNC_START)
+        
     def get_memory_size(self):
         return 4096
         
@@ -214,13 +250,13 @@ class MonochromeDisplayAdapter(Device):
             return self.control_reg
             
         elif port == STATUS_REG_PORT:
+            self.status_read_ticks = self.ticks
+            _line, dot = MDA_TIMING.position(self.ticks)
             status = STATUS_REG_BASE
             if self.get_current_pixel():
                 status |= STATUS_REG_PIXEL_ON
-            if self.horizontal_retrace:
+            if MDA_HSYNC_START <= dot < MDA_HSYNC_END:
                 status |= STATUS_REG_HORIZONTAL_RETRACE
-                
-            self.horizontal_retrace = not self.horizontal_retrace
             return status
             
         else:
@@ -297,6 +333,7 @@ class MonochromeDisplayAdapter(Device):
         if self.needs_draw:
             pygame.display.flip()
             self.needs_draw = False
+            self.redraw_count += 1
             
     def redraw(self):
         """ Does a full redraw of the display from RAM. """
@@ -305,6 +342,13 @@ class MonochromeDisplayAdapter(Device):
             
         self.needs_draw = True
         
+    def redraw_region(self, start, end):
+        """ Redraws the characters in video RAM between the start and end offsets. """
+        for offset in range(start & ~1, end, 2):
+            self.blit_single_char(offset)
+            
+        self.needs_draw = True
+        
     def blit_single_char(self, offset):
         """ Blits a single character to the display given the offset of the character. """
         if offset >= MDA_RAM_SIZE:
@@ -5,9 +5,6 @@ pyxt.memory - Memory devices for PyXT.
 # Standard library imports
 import array
 
-# Six imports
-import six
-
 # PyXT imports
 from pyxt.bus import Device
 
@@ -18,7 +15,7 @@ class RAM(Device): # pylint:disable=abstract-method
     """ A device emulating a RAM storage device. """
     def __init__(self, size, **kwargs):
         super(RAM, self).__init__(**kwargs)
-        self.contents = array.array("B", (0,) * size)
+        self.contents = array.array("B", [0]) * size
         
         # Inline these calls directly to the array object for speed.
         self.mem_read_byte = self.contents.__getitem__
@@ -30,6 +27,12 @@ class RAM(Device): # pylint:disable=abstract-method
     def get_memory_size(self):
         return len(self.contents)
         
+    def get_code_window(self):
+        # Instruction fetches have to go through mem_read_byte while something is hooked into it.
+        if self.mem_read_byte != self.contents.__getitem__:
+            return None
+        return memoryview(self.contents)
+        
     # def mem_read_byte(self, offset):
         # return self.contents[offset]
         
@@ -57,8 +60,12 @@ class ROM(RAM): # pylint:disable=abstract-method
         with open(filename, "rb") as fileptr:
             data = fileptr.read()
             
-        for index, byte in enumerate(six.iterbytes(data), start = offset):
-            self.contents[index] = byte
+        if offset + len(data) > len(self.contents):
+            raise ValueError("ROM image (%d bytes) does not fit at offset 0x%x in a %d byte ROM!" % (
+                len(data), offset, len(self.contents),
+            ))
+            
+        self.contents[offset : offset + len(data)] = array.array("B", bytearray(data))
             
     def local_mem_write_byte(self, offset, value):
         pass
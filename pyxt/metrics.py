@@ -0,0 +1,164 @@
+"""
+pyxt.metrics - Periodic sampling of the guest's instruction rate and device activity.
+
+The devices keep plain integer counters as they run, this samples them every few seconds and turns them
+into rates.  A sample can be written to the log as one line and/or served as JSON over HTTP on localhost.
+"""
+
+# Standard library imports
+import json
+import time
+import threading
+
+# Six imports
+from six.moves import BaseHTTPServer
+
+# PyXT imports
+from pyxt.timer import TIMER_IRQ_LINE
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+DEFAULT_INTERVAL = 5.0
+
+# Only the busiest ports are included in the log line.
+LOG_LINE_PORTS = 4
+
+# Classes
+class Metrics(object):
+    """ Samples the activity counters of a PyXT machine. """
+    def __init__(self, cpu, bus, pic = None, dma = None, fdc = None, display = None, interval = DEFAULT_INTERVAL,
+                 log_samples = False, clock = time.time):
+        self.cpu = cpu
+        self.bus = bus
+        self.pic = pic
+        self.dma = dma
+        self.fdc = fdc
+        self.display = display
+        self.interval = interval
+        self.log_samples = log_samples
+        self.clock = clock
+        
+        self.last_time = clock()
+        self.last_instructions = cpu.instruction_count
+        self.last_cycles = cpu.cycles
+        self.last_io_reads = list(bus.io_read_counts)
+        self.last_io_writes = list(bus.io_write_counts)
+        
+        # Most recent sample, read by the HTTP server thread.
+        self.latest = {}
+        
+    def poll(self):
+        """ Called from the main loop, takes a sample once the interval has passed. """
+        if self.clock() - self.last_time >= self.interval:
+            sample = self.sample()
+            if self.log_samples:
+                log.info(self.format_sample(sample))
+                
+    def sample(self):
+        """ Return a dictionary of the counters and their rates since the previous sample. """
+        cpu = self.cpu
+        now = self.clock()
+        elapsed = (now - self.last_time) or 1.0
+        
+        io_read_counts = list(self.bus.io_read_counts)
+        io_write_counts = list(self.bus.io_write_counts)
+        
+        sample = {
+            "elapsed" : elapsed,
+            "instructions" : cpu.instruction_count,
+            "instructions_per_second" : (cpu.instruction_count - self.last_instructions) / elapsed,
+            "cycles" : cpu.cycles,
+            "mhz" : (cpu.cycles - self.last_cycles) / elapsed / 1000000.0,
+            "io_reads" : self.port_deltas(io_read_counts, self.last_io_reads),
+            "io_writes" : self.port_deltas(io_write_counts, self.last_io_writes),
+        }
+        
+        if self.pic is not None:
+            sample["interrupts"] = list(self.pic.interrupt_counts)
+        if self.dma is not None:
+            self.dma.update_refresh()
+            sample["dma_bytes"] = [channel.transfer_count for channel in self.dma.channels]
+        if self.fdc is not None:
+            sample["fdc_sectors_read"] = self.fdc.sectors_read
+            sample["fdc_sectors_written"] = self.fdc.sectors_written
+        if self.display is not None:
+            sample["display_redraws"] = self.display.redraw_count
+            
+        self.last_time = now
+        self.last_instructions = cpu.instruction_count
+        self.last_cycles = cpu.cycles
+        self.last_io_reads = io_read_counts
+        self.last_io_writes = io_write_counts
+        
+        self.latest = sample
+        return sample
+        
+    @staticmethod
+    def port_deltas(counts, last_counts):
+        """ Return {"0x3da" : accesses} for each port that was accessed since the last sample. """
+        return dict(("0x%03x" % port, count - last_counts[port])
+                    for port, count in enumerate(counts) if count != last_counts[port])
+                    
+    @staticmethod
+    def format_sample(sample):
+        """ Format a sample as a single log line. """
+        line = "%d IPS, %0.2f MHz" % (sample["instructions_per_second"], sample["mhz"])
+        
+        if "interrupts" in sample:
+            line += ", IRQ %s" % "/".join(str(count) for count in sample["interrupts"])
+            line += " (timer %d)" % sample["interrupts"][TIMER_IRQ_LINE]
+        if "dma_bytes" in sample:
+            line += ", DMA %s" % "/".join(str(count) for count in sample["dma_bytes"])
+        if "fdc_sectors_read" in sample:
+            line += ", FDC %d read %d written" % (sample["fdc_sectors_read"], sample["fdc_sectors_written"])
+        if "display_redraws" in sample:
+            line += ", %d redraws" % sample["display_redraws"]
+            
+        for name in ("io_reads", "io_writes"):
+            busiest = sorted(sample[name].items(), key = lambda item: item[1], reverse = True)[:LOG_LINE_PORTS]
+            if busiest:
+                line += ", %s %s" % (name.replace("_", " "), " ".join("%s:%d" % item for item in busiest))
+                
+        return line
+        
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the latest sample as JSON for any GET request. """
+    def do_GET(self): # pylint: disable=invalid-name
+        """ Handle a GET request. """
+        body = json.dumps(self.server.metrics.latest, sort_keys = True).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        """ Keep requests out of stderr. """
+        pass
+        
+class MetricsServer(object):
+    """ HTTP server on localhost for the metrics, runs in a daemon thread. """
+    def __init__(self, metrics, port, host = "127.0.0.1"):
+        self.server = BaseHTTPServer.HTTPServer((host, port), MetricsRequestHandler)
+        self.server.metrics = metrics
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        
+    @property
+    def port(self):
+        """ The port the server is listening on. """
+        return self.server.server_address[1]
+        
+    def start(self):
+        """ Start serving requests in the background. """
+        self.thread.start()
+        log.info("Serving metrics on http://%s:%d/", self.server.server_address[0], self.port)
+        
+    def stop(self):
+        """ Stop the server and close the socket. """
+        self.server.shutdown()
+        self.server.server_close()
@@ -15,6 +15,20 @@ import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# Constants
+NO_INTERRUPT = -1
+
+# Lowest set bit in each byte, the highest priority level in a mask when IR0 has top priority, -1 for none.
+LOWEST_SET_BIT = tuple((mask & -mask).bit_length() - 1 for mask in range(256))
+
+# PRIORITY_LUTS[highest][mask] is the highest priority IR level set in mask, when IR level highest has top priority.
+# These are tuples as they are shared, the PIC's state only ever points at one of them.
+PRIORITY_LUTS = tuple(
+    tuple((LOWEST_SET_BIT[((mask >> highest) | (mask << (8 - highest))) & 0xFF] + highest) & 0x07 if mask else NO_INTERRUPT
+          for mask in range(256))
+    for highest in range(8)
+)
+
 # Classes
 class ProgrammableInterruptController(Device):
     """ An IOComponent emulating an 8259 PIC controller. """
@@ -26,6 +40,20 @@ class ProgrammableInterruptController(Device):
     READ_IR_REGISTER = 0x02
     READ_IS_REGISTER = 0x03
     OCW3_READ_REGISTER_MASK = 0x03
+    OCW3_SET_SPECIAL_MASK = 0x40
+    OCW3_SPECIAL_MASK = 0x20
+    
+    # OCW2 commands, the R, SL and EOI bits.
+    OCW2_COMMAND_MASK = 0xE0
+    OCW2_CLEAR_ROTATE_IN_AUTO_EOI = 0x00
+    OCW2_NON_SPECIFIC_EOI = 0x20
+    OCW2_NOP = 0x40
+    OCW2_SPECIFIC_EOI = 0x60
+    OCW2_SET_ROTATE_IN_AUTO_EOI = 0x80
+    OCW2_ROTATE_ON_NON_SPECIFIC_EOI = 0xA0
+    OCW2_SET_PRIORITY = 0xC0
+    OCW2_ROTATE_ON_SPECIFIC_EOI = 0xE0
+    OCW2_LEVEL_MASK = 0x07
     
     def __init__(self, base, **kwargs):
         super(ProgrammableInterruptController, self).__init__(**kwargs)
@@ -35,13 +63,19 @@ class ProgrammableInterruptController(Device):
         self.cascade = False
         self.mask = 0x00
         self.trigger_mode = self.EDGE_TRIGGERED
-        self.priorities = [0, 1, 2, 3, 4, 5, 6, 7]
         self.vector_base = 0x00
         self.address_interval = 4
         self.i8086_8088_mode = False
         self.auto_eoi = False
+        self.rotate_in_auto_eoi = False
+        self.special_mask_mode = False
         self.slave_mode_address = 7
         
+        # The IR levels in priority order, highest first, and the table that resolves a mask of them in that order.
+        self.priorities = None
+        self.priority_lut = None
+        self.set_lowest_priority(7)
+        
         # ICWS (Initialization Commands Words) state machine, per the datasheet.
         # 0 indicates the idle state, 1-4 indicate what byte will be processed next.
         self.icws_state = 0
@@ -53,6 +87,9 @@ class ProgrammableInterruptController(Device):
         
         self.__interrupt_pending = False
         
+        # Number of interrupts serviced on each IRQ line, for pyxt.metrics.
+        self.interrupt_counts = [0] * 8
+        
     # Device interface.
     def get_ports_list(self):
         return [x for x in range(self.base, self.base + 2)]
@@ -78,6 +115,7 @@ class ProgrammableInterruptController(Device):
         else:
             if offset == 1:
                 self.mask = value
+                self.update_interrupt_signal()
             else:
                 if value & 0x08 == 0x08:
                     self.process_ocw3_byte(value)
@@ -89,12 +127,13 @@ class ProgrammableInterruptController(Device):
         """ Kick off the 8259 initialization sequence. """
         self.trigger_mode = self.EDGE_TRIGGERED
         self.mask = 0x00
-        self.priorities[7] = 7
+        self.set_lowest_priority(7)
+        self.special_mask_mode = False
         self.slave_mode_address = 7
-        # TODO: Clear special mask mode?
         # TODO: Set status read to IRR?
         self.icws_state = 1
         self.icw4_needed = False
+        self.update_interrupt_signal()
         
     def process_icws_byte(self, value):
         """ Run a byte through the initialization state machine. """
@@ -137,13 +176,64 @@ class ProgrammableInterruptController(Device):
             self.icws_state = 0
             
     def process_ocw2_byte(self, value):
-        command = (value & 0xE0) >> 5
-        interrupt = value & 0x07
-        # print("command = %r, interrupt = %r" % (command, interrupt))
+        """ Handle the end of interrupt and priority rotation commands. """
+        command = value & self.OCW2_COMMAND_MASK
+        level = value & self.OCW2_LEVEL_MASK
+        
+        # A non-specific EOI applies to the highest priority level in service.
+        if command in (self.OCW2_NON_SPECIFIC_EOI, self.OCW2_ROTATE_ON_NON_SPECIFIC_EOI):
+            level = self.priority_lut[self.interrupt_in_service_register]
+            if level == NO_INTERRUPT:
+                return
+                
+        if command in (self.OCW2_NON_SPECIFIC_EOI, self.OCW2_SPECIFIC_EOI,
+                       self.OCW2_ROTATE_ON_NON_SPECIFIC_EOI, self.OCW2_ROTATE_ON_SPECIFIC_EOI):
+            self.interrupt_in_service_register &= ~(0x01 << level)
+            
+        # The level just serviced, or the one given, becomes the lowest priority.
+        if command in (self.OCW2_ROTATE_ON_NON_SPECIFIC_EOI, self.OCW2_ROTATE_ON_SPECIFIC_EOI, self.OCW2_SET_PRIORITY):
+            self.set_lowest_priority(level)
+        elif command == self.OCW2_SET_ROTATE_IN_AUTO_EOI:
+            self.rotate_in_auto_eoi = True
+        elif command == self.OCW2_CLEAR_ROTATE_IN_AUTO_EOI:
+            self.rotate_in_auto_eoi = False
+            
+        self.update_interrupt_signal()
         
     def process_ocw3_byte(self, value):
         self.read_register = value & self.OCW3_READ_REGISTER_MASK
         
+        if value & self.OCW3_SET_SPECIAL_MASK:
+            self.special_mask_mode = value & self.OCW3_SPECIAL_MASK == self.OCW3_SPECIAL_MASK
+            self.update_interrupt_signal()
+            
+    def set_lowest_priority(self, level):
+        """ Rotate the priorities so the given IR level is the lowest and the one after it the highest. """
+        highest = (level + 1) & 0x07
+        self.priorities = [(highest + rank) & 0x07 for rank in range(8)]
+        self.priority_lut = PRIORITY_LUTS[highest]
+        
+    def deliverable_level(self):
+        """
+        Return the IR level the CPU would get if it acknowledged now, or NO_INTERRUPT.
+        
+        In the fully nested mode a request has to have a higher priority than every level in service, in the
+        special mask mode the masked levels in service don't hold up anything else.
+        """
+        requests = self.interrupt_request_register & ~self.mask
+        in_service = self.interrupt_in_service_register
+        if self.special_mask_mode:
+            in_service &= ~self.mask
+            
+        level = self.priority_lut[(requests | in_service) & 0xFF]
+        if level == NO_INTERRUPT or in_service & (0x01 << level):
+            return NO_INTERRUPT
+        return level
+        
+    def update_interrupt_signal(self):
+        """ Raise the INT line to the CPU if there is a request it can be given, otherwise drop it. """
+        self.set_interrupt_signal(self.deliverable_level() != NO_INTERRUPT)
+        
     def interrupt_request(self, irq):
         """ Called when an interrupt is requested from a device. """
         irq_mask = 0x01 << irq
@@ -152,28 +242,27 @@ class ProgrammableInterruptController(Device):
         if irq_mask & self.mask == irq_mask:
             return
             
-        # Log that the interrupt is pending service.
+        # Log that the interrupt is pending service and signal the CPU if it can be serviced now.
         self.interrupt_request_register |= irq_mask
-        
-        # Signal the CPU that an interrupt has occured.
-        self.set_interrupt_signal(True)
+        self.update_interrupt_signal()
         
     def interrupt_acknowledge(self):
         """ Acknowledges the highest priority interrupt and returns the vector number. """
-        # TODO: Proper priority handling.
-        for irq in range(8):
-            irq_mask = 0x01 << irq
-            if irq_mask & self.interrupt_request_register == irq_mask:
-                self.interrupt_request_register &= ~irq_mask
-                self.interrupt_in_service_register |= irq_mask
-                
-                # If this was the only bit set, clear the interrupt line.
-                if self.interrupt_request_register == 0x00 and self.bus:
-                    self.set_interrupt_signal(False)
-                    
-                return self.vector_base + irq
+        irq = self.deliverable_level()
+        if irq == NO_INTERRUPT:
+            raise RuntimeError("interrupt_acknowledge() called with no pending interrupts!")
+            
+        irq_mask = 0x01 << irq
+        self.interrupt_request_register &= ~irq_mask
+        if not self.auto_eoi:
+            self.interrupt_in_service_register |= irq_mask
+        elif self.rotate_in_auto_eoi:
+            self.set_lowest_priority(irq)
+        self.interrupt_counts[irq] += 1
         
-        raise RuntimeError("interrupt_acknowledge() called with no pending interrupts!")
+        # Drop the interrupt line unless another request can be serviced.
+        self.update_interrupt_signal()
+        return self.vector_base + irq
         
     def interrupt_pending(self):
         """ Returns the state of the INT line to the CPU for unit testing. """
@@ -0,0 +1,172 @@
+"""
+pyxt.profiler - Sampling profiler for the guest program.
+
+Every so many emulated cycles the guest's CS:IP is recorded along with the call stack found by walking the
+BP chain, the usual "push bp / mov bp, sp" frames left by compilers.  Addresses can be resolved to names
+using linker MAP files and the result is written as collapsed stacks for flamegraph.pl and friends.
+
+The profiler is a clocked device that is only given to the scheduler when profiling was asked for, so it
+doesn't cost anything otherwise.
+"""
+
+# Standard library imports
+import re
+import bisect
+from collections import Counter
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.bus import Device
+from pyxt.helpers import segment_offset_to_address
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# About 1000 samples per emulated second.
+DEFAULT_INTERVAL = 4773
+
+# Deepest call stack that will be followed, this also stops a corrupt BP chain from looping.
+DEFAULT_MAX_DEPTH = 32
+
+# Frame used for samples taken while the CPU was halted.
+IDLE_FRAME = "[idle]"
+
+# Public symbols from MS LINK/TLINK MAP files, or simple "SSSS:OOOO name" symbol files.
+SYMBOL_REGEX = re.compile("^\\s*([0-9A-Fa-f]{4}):([0-9A-Fa-f]{4})\\s+(?:Abs\\s+|Imp\\s+)?([^\\s]+)\\s*$")
+
+# Classes
+class SymbolMap(object):
+    """ Resolves physical addresses to the nearest preceding public symbol. """
+    def __init__(self):
+        self.addresses = []
+        self.names = []
+        
+    def add_symbol(self, address, name):
+        """ Add a symbol at the given physical address. """
+        index = bisect.bisect_left(self.addresses, address)
+        if index < len(self.addresses) and self.addresses[index] == address:
+            self.names[index] = name
+        else:
+            self.addresses.insert(index, address)
+            self.names.insert(index, name)
+            
+    def load(self, filename, load_segment = 0):
+        """
+        Load the public symbols from a MAP file, returning the number of new symbols.
+        
+        Segments in a MAP file are relative to where the program was loaded, for a DOS program this is
+        the segment of the PSP plus 0x10.
+        """
+        count = len(self.addresses)
+        with open(filename, "r") as fileptr:
+            for line in fileptr:
+                match = SYMBOL_REGEX.match(line)
+                if match:
+                    segment = (int(match.group(1), 16) + load_segment) & 0xFFFF
+                    self.add_symbol(segment_offset_to_address(segment, int(match.group(2), 16)), match.group(3))
+                    
+        count = len(self.addresses) - count
+        log.info("Loaded %d symbols from %s.", count, filename)
+        return count
+        
+    def lookup(self, address):
+        """ Return the name of the symbol containing the physical address, or None. """
+        index = bisect.bisect_right(self.addresses, address) - 1
+        if index < 0:
+            return None
+        return self.names[index]
+        
+class SamplingProfiler(Device):
+    """ Samples the guest's call stack every interval cycles. """
+    def __init__(self, cpu, interval = DEFAULT_INTERVAL, symbols = None, max_depth = DEFAULT_MAX_DEPTH,
+                 far_frames = False, disassembler = None):
+        super(SamplingProfiler, self).__init__()
+        self.cpu = cpu
+        self.interval = interval
+        self.symbols = symbols
+        self.max_depth = max_depth
+        
+        # Large model code saves CS:IP above BP rather than just IP.
+        self.far_frames = far_frames
+        
+        # With a disassembler the instruction being run is added below the innermost frame.
+        self.disassembler = disassembler
+        
+        self.countdown = interval
+        self.stacks = Counter()
+        
+    # Device interface.
+    def ticks_until_event(self):
+        return self.countdown
+        
+    def fast_forward(self, ticks):
+        if ticks < self.countdown:
+            self.countdown -= ticks
+            return
+            
+        # Idle time can skip over several sample points, they all see the same state.
+        ticks -= self.countdown
+        self.countdown = self.interval - (ticks % self.interval)
+        self.stacks[self.call_stack()] += 1 + (ticks // self.interval)
+        
+    # Sampling.
+    def call_stack(self):
+        """ Return the current call stack as a tuple of frame names, outermost first. """
+        if self.cpu.hlt:
+            return (IDLE_FRAME, )
+            
+        regs = self.cpu.regs
+        mem_read_word = self.cpu.bus.mem_read_word
+        ss = regs.SS
+        cs = regs.CS
+        frames = [self.frame_name(cs, regs.IP)]
+        
+        bp = regs.BP
+        for _ in range(self.max_depth):
+            if bp == 0 or bp >= 0xFFFA:
+                break
+                
+            ip = mem_read_word(segment_offset_to_address(ss, bp + 2))
+            if self.far_frames:
+                cs = mem_read_word(segment_offset_to_address(ss, bp + 4))
+            frames.append(self.frame_name(cs, ip))
+            
+            # Callers' frames are always higher up the stack, anything else is the end of the chain.
+            next_bp = mem_read_word(segment_offset_to_address(ss, bp))
+            if next_bp <= bp:
+                break
+            bp = next_bp
+            
+        frames.reverse()
+        if self.disassembler is not None:
+            frames.append("%04x:%04x %s" % (regs.CS, regs.IP, self.disassembler.text(regs.CS, regs.IP)))
+        return tuple(frames)
+        
+    def frame_name(self, segment, offset):
+        """ Return the symbol name for an address, or SSSS:OOOO if there isn't one. """
+        if self.symbols is not None:
+            name = self.symbols.lookup(segment_offset_to_address(segment, offset))
+            if name is not None:
+                return name
+        return "%04x:%04x" % (segment, offset)
+        
+    @property
+    def sample_count(self):
+        """ Total number of samples taken. """
+        return sum(self.stacks.values())
+        
+    def write_collapsed(self, fileptr):
+        """ Write the samples as collapsed stacks, one "outer;inner;leaf count" line per unique stack. """
+        for stack, count in sorted(self.stacks.items()):
+            fileptr.write("%s %d\n" % (";".join(stack), count))
+            
+    def save(self, filename):
+        """ Write the collapsed stacks to a file. """
+        with open(filename, "w") as fileptr:
+            self.write_collapsed(fileptr)
+        log.info("Wrote %d profile samples to %s.", self.sample_count, filename)
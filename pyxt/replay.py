@@ -0,0 +1,192 @@
+"""
+pyxt.replay - Deterministic record and replay of a whole machine run.
+
+Everything the emulated machine does follows from its CPU cycle count except for its inputs from the host:
+key presses, the keyboard's self test timer and the display refresh (which blinks the cursor).  These are
+recorded along with the cycle and instruction count they were delivered at.  Given the same diskette images
+and video RAM seed a replay delivers them at the same points and the run comes out the same, which is checked
+against a digest of the machine state written at the end of the recording.
+
+A log is JSON lines, a header object followed by [cycles, instructions, event, args] for each event.
+"""
+
+# Standard library imports
+import json
+import zlib
+import hashlib
+from ctypes import string_at, addressof, sizeof
+
+# PyXT imports
+from pyxt.memory import RAM
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+REPLAY_LOG_VERSION = 1
+
+EVENT_KEY = "key"
+EVENT_SELF_TEST = "self_test"
+EVENT_DRAW = "draw"
+EVENT_END = "end"
+
+# Functions
+def file_digest(filename):
+    """ Return the SHA-1 of a file as hex, or None if there is no file. """
+    if filename is None:
+        return None
+        
+    digest = hashlib.sha1()
+    with open(filename, "rb") as fileptr:
+        for chunk in iter(lambda: fileptr.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+    
+def machine_digest(cpu):
+    """ Return a CRC of the CPU registers, flags and RAM, enough to tell if two runs ended up the same. """
+    crc = zlib.crc32(string_at(addressof(cpu.regs), sizeof(cpu.regs)))
+    crc = zlib.crc32(bytearray([cpu.flags.value & 0xFF, cpu.flags.value >> 8]), crc)
+    
+    seen = set()
+    for device in cpu.bus.devices:
+        if isinstance(device, RAM) and id(device) not in seen:
+            seen.add(id(device))
+            crc = zlib.crc32(device.contents, crc)
+            
+    return "%08x" % (crc & 0xFFFFFFFF)
+    
+def read_replay_log(fileptr):
+    """ Read a replay log from a file, returning the header and the list of events. """
+    header = json.loads(fileptr.readline())
+    if header.get("version") != REPLAY_LOG_VERSION:
+        raise ValueError("Unsupported replay log version: %r" % header.get("version"))
+    events = [json.loads(line) for line in fileptr if line.strip()]
+    
+    return header, events
+    
+# Classes
+class InputSession(object):
+    """
+    Base class for recording and replaying, sits between the Pygame manager and the devices it feeds.
+    
+    The Pygame manager is given a SessionKeyboard and SessionDisplay in place of the real devices.
+    """
+    def __init__(self, cpu, keyboard, display):
+        self.cpu = cpu
+        self.keyboard = keyboard
+        self.display = display
+        
+    def deliver(self, event, args):
+        """ Pass an input on to the machine. """
+        if event == EVENT_KEY:
+            self.keyboard.key_pressed(tuple(args))
+        elif event == EVENT_SELF_TEST:
+            self.keyboard.self_test_complete()
+        elif event == EVENT_DRAW:
+            self.display.draw()
+            
+    def input(self, event, args = None):
+        """ Called with each input from the host. """
+        raise NotImplementedError
+        
+    def poll(self):
+        """ Called from the main loop before the Pygame manager. """
+        pass
+        
+class InputRecorder(InputSession):
+    """ Records the inputs delivered to the machine to a replay log. """
+    def __init__(self, cpu, keyboard, display, fileptr, **header):
+        super(InputRecorder, self).__init__(cpu, keyboard, display)
+        self.fileptr = fileptr
+        self.event_count = 0
+        
+        header["version"] = REPLAY_LOG_VERSION
+        fileptr.write(json.dumps(header, sort_keys = True) + "\n")
+        
+    def write(self, event, args):
+        """ Write an event to the log at the current point in the run. """
+        self.fileptr.write(json.dumps([self.cpu.cycles, self.cpu.instruction_count, event, args]) + "\n")
+        self.event_count += 1
+        
+    def input(self, event, args = None):
+        self.write(event, args)
+        self.deliver(event, args)
+        
+    def close(self):
+        """ Mark the end of the recording with the machine's state and close the log. """
+        self.write(EVENT_END, machine_digest(self.cpu))
+        self.fileptr.close()
+        log.info("Recorded %d input events over %d instructions.", self.event_count, self.cpu.instruction_count)
+        
+class InputReplayer(InputSession):
+    """
+    Delivers the inputs from a replay log at the points they were recorded.
+    
+    Inputs from the host are ignored until the end of the log, then the machine carries on live.
+    """
+    def __init__(self, cpu, keyboard, display, events):
+        super(InputReplayer, self).__init__(cpu, keyboard, display)
+        self.events = events
+        self.index = 0
+        self.diverged = False
+        
+    @property
+    def finished(self):
+        """ True once every event in the log has been delivered. """
+        return self.index >= len(self.events)
+        
+    def input(self, event, args = None):
+        if self.finished:
+            self.deliver(event, args)
+            
+    def poll(self):
+        cpu = self.cpu
+        while self.index < len(self.events) and self.events[self.index][0] <= cpu.cycles:
+            cycles, instructions, event, args = self.events[self.index]
+            self.index += 1
+            
+            if not self.diverged and (cycles != cpu.cycles or instructions != cpu.instruction_count):
+                log.warning("Replay diverged: event %d was recorded at %d cycles/%d instructions, delivered at %d/%d.",
+                            self.index, cycles, instructions, cpu.cycles, cpu.instruction_count)
+                self.diverged = True
+                
+            if event == EVENT_END:
+                self.check_end(args)
+            else:
+                self.deliver(event, args)
+                
+    def check_end(self, digest):
+        """ Compare the machine state at the end of the log with the recording. """
+        if digest == machine_digest(self.cpu):
+            log.info("Replay complete, machine state matches the recording.")
+        else:
+            log.warning("Replay complete, machine state does NOT match the recording.")
+            self.diverged = True
+            
+class SessionKeyboard(object):
+    """ Stands in for the keyboard in the Pygame manager and routes its input through a session. """
+    def __init__(self, session):
+        self.session = session
+        
+    def key_pressed(self, scancodes):
+        """ A key was pressed or released on the host. """
+        self.session.input(EVENT_KEY, list(scancodes))
+        
+    def self_test_complete(self):
+        """ The keyboard reset timer fired on the host. """
+        self.session.input(EVENT_SELF_TEST)
+        
+class SessionDisplay(object):
+    """ Stands in for the display in the Pygame manager and routes its refresh timer through a session. """
+    def __init__(self, session):
+        self.session = session
+        
+    def reset(self):
+        """ Reset the real display. """
+        self.session.display.reset()
+        
+    def draw(self):
+        """ The display refresh timer fired on the host. """
+        self.session.input(EVENT_DRAW)
@@ -0,0 +1,116 @@
+"""
+pyxt.scheduler - Keeps the clocked devices in step with the CPU's cycle count.
+"""
+
+# PyXT imports
+from pyxt.timer import ProgrammableIntervalTimer, PIT_FREQUENCY
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# Rate of the scheduler's ticks, one per CPU clock, the PIT's input clock is divided down from this.
+TICK_FREQUENCY = PIT_FREQUENCY * ProgrammableIntervalTimer.CLOCK_DIVISOR
+
+# Classes
+class Scheduler(object):
+    """
+    Runs the CPU in slices of cycles and catches the clocked devices up to it.
+    
+    Devices are only advanced when the CPU reaches the next device event, when it touches the I/O bus
+    (so a port read sees the current time) and at the end of each slice.  While the CPU is halted or
+    busy waiting they are fast-forwarded to their next event instead.
+    """
+    def __init__(self, cpu, devices):
+        self.cpu = cpu
+        self.devices = list(devices)
+        
+        # CPU cycle count the devices have been advanced to.
+        self.ticks = cpu.cycles
+        
+        # Cycle count to stop the CPU at for the next device event or the end of the slice.
+        self.slice_end = cpu.cycles
+        self.deadline = cpu.cycles
+        
+    def ticks_until_event(self):
+        """ Return the number of ticks until the next device event, or None if nothing is scheduled. """
+        ticks = None
+        for device in self.devices:
+            device_ticks = device.ticks_until_event()
+            if device_ticks is not None and (ticks is None or device_ticks < ticks):
+                ticks = device_ticks
+                
+        return ticks
+        
+    def fast_forward(self, ticks):
+        """ Advance all of the clocked devices by a number of ticks. """
+        # Count the ticks first, a DMA transfer touches the I/O bus which syncs the scheduler again.
+        self.ticks += ticks
+        
+        for device in self.devices:
+            device.fast_forward(ticks)
+        
+    def sync(self):
+        """ Advance the devices to the CPU's current cycle count. """
+        ticks = self.cpu.cycles - self.ticks
+        if ticks > 0:
+            self.fast_forward(ticks)
+            
+    def reschedule(self):
+        """ Recalculate the deadline, this needs to be called after anything that may have moved the next event. """
+        deadline = self.slice_end
+        ticks = self.ticks_until_event()
+        if ticks is not None and self.ticks + ticks < deadline:
+            deadline = self.ticks + ticks
+            
+        # The CPU needs it too, so superinstructions don't run past it.
+        self.deadline = self.cpu.deadline = deadline
+        
+    def run(self, fetch, cycles):
+        """
+        Run the CPU for about the given number of cycles using fetch(), returning the number of cycles run.
+        
+        This stops early if the CPU halts, the caller should idle() to move time on in that case.
+        """
+        cpu = self.cpu
+        start = cpu.cycles
+        self.slice_end = start + cycles
+        
+        # A halted CPU takes an interrupt that arrived while it was idle at the start of its next fetch().
+        if cpu.hlt:
+            fetch()
+            
+        while cpu.cycles < self.slice_end and not cpu.hlt:
+            self.reschedule()
+            while cpu.cycles < self.deadline and not cpu.hlt:
+                fetch()
+            self.sync()
+            
+        return cpu.cycles - start
+        
+    def idle(self, max_ticks):
+        """
+        Skip ahead while the CPU is halted, returning the number of ticks skipped.
+        
+        This stops at the next device event or after max_ticks, whichever comes first, so the caller can
+        keep the host side (keyboard, display) serviced and sleep for the time that was skipped.
+        """
+        if not self.cpu.hlt:
+            return 0
+            
+        self.sync()
+        ticks = self.ticks_until_event()
+        if ticks is None or ticks > max_ticks:
+            ticks = max_ticks
+            
+        self.fast_forward(ticks)
+        self.cpu.cycles += ticks
+        
+        # A busy wait only needed time to pass, let the CPU poll the device again.
+        if self.cpu.busy_wait:
+            self.cpu.busy_wait = False
+            self.cpu.hlt = False
+            
+        return ticks
@@ -36,7 +36,7 @@ pygame.mixer.pre_init(SAMPLE_RATE, SIZE, CHANNELS)
 class PCSpeaker(object):
     """ Class for generating PC-speaker style sounds with Pygame. """
     def __init__(self):
-        self.data = array.array("h", (0,) * SAMPLE_RATE)
+        self.data = array.array("h", [0]) * SAMPLE_RATE
         self.frequency = 0
         self.needs_replay = False
         self.sound = None
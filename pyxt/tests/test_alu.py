@@ -0,0 +1,106 @@
+import array
+import unittest
+
+from six.moves import range # pylint: disable=redefined-builtin
+
+from pyxt.alu import *
+from pyxt.helpers import count_bits
+from pyxt.cpu import FLAGS
+
+def reference_flags(operand_a, operand_b, carry_in, subtract):
+    """ Work out (carry, parity, adjust, zero, sign, overflow) the long way. """
+    if subtract:
+        result = operand_a - operand_b - carry_in
+        overflow = operand_a & 0x80 != operand_b & 0x80 and operand_b & 0x80 == result & 0x80
+        adjust = (operand_a & 0x0F) < (operand_b & 0x0F) + carry_in
+    else:
+        result = operand_a + operand_b + carry_in
+        overflow = operand_a & 0x80 == operand_b & 0x80 and operand_a & 0x80 != result & 0x80
+        adjust = (operand_a & 0x0F) + (operand_b & 0x0F) + carry_in > 0x0F
+    return (
+        result & 0x100 == 0x100,
+        count_bits(result & 0xFF) % 2 == 0,
+        adjust,
+        result & 0xFF == 0,
+        result & 0x80 == 0x80,
+        overflow,
+    )
+    
+class PackedFlagsTests(unittest.TestCase):
+    def test_layout_matches_flags_register(self):
+        self.assertEqual(PACKED_CARRY, FLAGS.CARRY)
+        self.assertEqual(PACKED_PARITY, FLAGS.PARITY)
+        self.assertEqual(PACKED_ADJUST, FLAGS.ADJUST)
+        self.assertEqual(PACKED_ZERO, FLAGS.ZERO)
+        self.assertEqual(PACKED_SIGN, FLAGS.SIGN)
+        self.assertEqual(PACKED_OVERFLOW, FLAGS.OVERFLOW)
+        
+    def test_flag_values(self):
+        self.assertEqual(FLAG_VALUES[0], (False, False, False, False, False, False))
+        self.assertEqual(FLAG_VALUES[PACKED_CARRY | PACKED_ZERO], (True, False, False, True, False, False))
+        self.assertEqual(FLAG_VALUES[PACKED_OVERFLOW | PACKED_ADJUST], (False, False, True, False, False, True))
+        
+    def test_result_flags(self):
+        self.assertEqual(RESULT_FLAGS_8[0x000], PACKED_ZERO | PACKED_PARITY)
+        self.assertEqual(RESULT_FLAGS_8[0x100], PACKED_CARRY | PACKED_ZERO | PACKED_PARITY)
+        self.assertEqual(RESULT_FLAGS_8[0x080], PACKED_SIGN)
+        self.assertEqual(RESULT_FLAGS_8[-1 & 0x1FF], PACKED_CARRY | PACKED_SIGN | PACKED_PARITY)
+        
+    def test_lanes_round_trip(self):
+        words = array.array("H", [0x0000, 0x1234, 0xFFFF, 0x8001])
+        self.assertEqual(words_to_lanes(words), 0x00001234FFFF8001)
+        self.assertEqual(lanes_to_words(0x00001234FFFF8001, 4), words)
+        
+class ArithmeticFlagsTests(unittest.TestCase):
+    def check_table(self, table, subtract):
+        self.assertEqual(len(table), 0x20000)
+        for carry_in in (0, 1):
+            for operand_a in list(range(0, 0x100, 7)) + [0x7F, 0x80, 0xFF]:
+                for operand_b in range(0x100):
+                    self.assertEqual(
+                        FLAG_VALUES[table[carry_in << 16 | operand_a << 8 | operand_b]],
+                        reference_flags(operand_a, operand_b, carry_in, subtract),
+                    )
+                    
+    def test_add(self):
+        self.check_table(ADD_FLAGS_8, False)
+        
+    def test_sub(self):
+        self.check_table(SUB_FLAGS_8, True)
+        
+    def test_add_overflow(self):
+        self.assertEqual(ADD_FLAGS_8[0x7F << 8 | 0x01], PACKED_ADJUST | PACKED_SIGN | PACKED_OVERFLOW)
+        
+    def test_sub_borrow(self):
+        self.assertEqual(SUB_FLAGS_8[0x00 << 8 | 0x01], PACKED_CARRY | PACKED_ADJUST | PACKED_SIGN | PACKED_PARITY)
+        
+class ShiftTableTests(unittest.TestCase):
+    def test_matches_shift_8(self):
+        for operation in (SHIFT_ROL, SHIFT_ROR, SHIFT_RCL, SHIFT_RCR, SHIFT_SHL, SHIFT_SHR, SHIFT_SAR):
+            for count in (1, 2, 7, 8, 9, 17, 255):
+                table = get_shift_table_8(operation, count)
+                for carry_in in (0, 1):
+                    for value in range(0x100):
+                        result, carry = shift_8(operation, value, carry_in, count)
+                        entry = table[carry_in << 8 | value]
+                        self.assertEqual(entry >> SHIFT_RESULT_SHIFT, result)
+                        self.assertEqual(entry & PACKED_CARRY == PACKED_CARRY, bool(carry))
+                        self.assertEqual(entry & ~PACKED_CARRY & SHIFT_FLAGS_MASK & ~PACKED_OVERFLOW,
+                                         RESULT_FLAGS_8[result] & ~PACKED_CARRY)
+                                         
+    def test_built_once(self):
+        self.assertIs(get_shift_table_8(SHIFT_SHR, 3), get_shift_table_8(SHIFT_SHR, 3))
+        
+    def test_shl_1_overflow(self):
+        table = get_shift_table_8(SHIFT_SHL, 1)
+        self.assertEqual(table[0x40], 0x80 << SHIFT_RESULT_SHIFT | PACKED_SIGN | PACKED_OVERFLOW)
+        self.assertEqual(table[0xC0], 0x80 << SHIFT_RESULT_SHIFT | PACKED_CARRY | PACKED_SIGN)
+        self.assertFalse(get_shift_table_8(SHIFT_SHL, 2)[0x20] & PACKED_OVERFLOW)
+        
+    def test_rcl_uses_carry_in(self):
+        table = get_shift_table_8(SHIFT_RCL, 1)
+        self.assertEqual(table[0x100 | 0x80], 0x01 << SHIFT_RESULT_SHIFT | PACKED_CARRY)
+        
+    def test_no_table(self):
+        with self.assertRaises(ValueError):
+            shift_8(0x06, 0x01, 0, 1)
@@ -0,0 +1,159 @@
+import os
+import json
+import tempfile
+import unittest
+
+from pyxt.bench.runner import *
+from pyxt.bench.micro import get_benchmarks, make_machine, load_code, CODE_SEGMENT, INSTRUCTIONS, INSTRUCTION_COUNT
+from pyxt.bench.macro import HeadlessMachine, run_codegolf, run_test_bios, workload_available, KEY_CYCLES
+from pyxt.scheduler import TICK_FREQUENCY
+from pyxt.bench.testbios import *
+
+class RunnerTests(unittest.TestCase):
+    def test_time_per_operation(self):
+        calls = []
+        benchmark = Benchmark("test.sleepless", lambda: lambda: calls.append(None), operations = 10)
+        seconds = time_benchmark(benchmark, repeat = 2, min_time = 0.001)
+        self.assertGreater(seconds, 0.0)
+        
+        # The loops double until a repetition takes long enough, then repeat once more.
+        self.assertGreater(len(calls), 2)
+        
+    def test_run_benchmarks(self):
+        names = []
+        document = run_benchmarks([Benchmark("test.nothing", lambda: lambda: None)], repeat = 1, min_time = 0.001,
+                                  progress = lambda name, seconds: names.append(name))
+        self.assertEqual(names, ["test.nothing"])
+        self.assertEqual(list(document["results"]), ["test.nothing"])
+        self.assertEqual(document["format"], RESULTS_FORMAT)
+        
+    def test_save_and_load(self):
+        document = {"format" : RESULTS_FORMAT, "results" : {"test.nothing" : 12.5}}
+        handle, filename = tempfile.mkstemp(suffix = ".json")
+        os.close(handle)
+        try:
+            save_results(document, filename)
+            self.assertEqual(load_results(filename), document)
+            
+            with open(filename, "w") as fileptr:
+                json.dump({"results" : {}}, fileptr)
+            with self.assertRaises(ValueError):
+                load_results(filename)
+        finally:
+            os.remove(filename)
+            
+    def test_compare(self):
+        baseline = {"results" : {"a" : 100.0, "b" : 100.0, "c" : 100.0}}
+        document = {"results" : {"a" : 105.0, "b" : 125.0, "d" : 1.0}}
+        comparison, regressions = compare_results(baseline, document, threshold = 0.10)
+        self.assertEqual(comparison, [("a", 100.0, 105.0, 0.05), ("b", 100.0, 125.0, 0.25)])
+        self.assertEqual(regressions, ["b"])
+        
+    def test_compare_rates(self):
+        baseline = {"results" : {"a.instructions_per_second" : 100.0, "b.instructions_per_second" : 100.0}}
+        document = {"results" : {"a.instructions_per_second" : 200.0, "b.instructions_per_second" : 50.0}}
+        comparison, regressions = compare_results(baseline, document, threshold = 0.10)
+        self.assertEqual([change for _name, _old, _new, change in comparison], [-0.5, 1.0])
+        self.assertEqual(regressions, ["b.instructions_per_second"])
+        
+class MicroBenchmarkTests(unittest.TestCase):
+    def test_names_are_unique(self):
+        names = [benchmark.name for benchmark in get_benchmarks()]
+        self.assertEqual(len(names), len(set(names)))
+        
+    def test_each_runs(self):
+        for benchmark in get_benchmarks():
+            run = benchmark.setup()
+            run()
+            run()
+            
+    def test_instructions_run_straight_through(self):
+        for name, code in INSTRUCTIONS:
+            cpu, bus = make_machine()
+            load_code(bus, code, INSTRUCTION_COUNT)
+            for _ in range(INSTRUCTION_COUNT):
+                cpu.fetch()
+                
+            # Each copy only goes on to the next one, branches included.
+            self.assertEqual((cpu.regs.CS, cpu.regs.IP), (CODE_SEGMENT, len(code) // 2 * INSTRUCTION_COUNT), name)
+            
+class AssemblerTests(unittest.TestCase):
+    def test_labels(self):
+        asm = Assembler(0x0100)
+        asm.label("top")
+        asm.short("eb", "bottom")
+        asm.near("e8", "top")
+        asm.address("be", "bottom")
+        asm.label("bottom")
+        asm.short("e2", "top")
+        self.assertEqual(asm.assemble(), bytearray([0xEB, 0x06, 0xE8, 0xFB, 0xFF, 0xBE, 0x08, 0x01, 0xE2, 0xF6]))
+        
+    def test_errors(self):
+        asm = Assembler()
+        asm.short("eb", "nowhere")
+        with self.assertRaises(ValueError):
+            asm.assemble()
+            
+        asm.label("nowhere")
+        with self.assertRaises(ValueError):
+            asm.label("nowhere")
+            
+        asm.data(bytearray(200))
+        asm.short("eb", "nowhere")
+        with self.assertRaises(ValueError):
+            asm.assemble()
+            
+class MacroBenchmarkTests(unittest.TestCase):
+    def test_test_bios(self):
+        machine = run_test_bios(None, memory_segments = 1, timer_ticks = 2)
+        self.assertFalse(machine.cpu.flags.interrupt_enable)
+        self.assertEqual(machine.bus.mem_read_byte(RESULT_ADDRESS), RESULT_PASSED)
+        self.assertEqual(machine.bus.mem_read_word(TIMER_COUNT_ADDRESS), 2)
+        self.assertEqual(machine.bus.mem_read_word(CHECKSUM_ADDRESS), diskette_checksum(machine.drives[0].contents))
+        self.assertTrue(machine.screen_text().startswith(MESSAGE))
+        
+    def test_test_bios_reset_vector(self):
+        image = build_test_bios()
+        self.assertEqual(len(image), 0x10000)
+        self.assertEqual(image[RESET_VECTOR_OFFSET:RESET_VECTOR_OFFSET + 5], bytearray([0xEA, 0x00, 0xE0, 0x00, 0xF0]))
+        
+        with self.assertRaises(ValueError):
+            build_test_bios(memory_segments = 5)
+            
+    def test_codegolf_repeats(self):
+        once = run_codegolf(None, runs = 1).cpu.instruction_count
+        self.assertGreater(once, 0)
+        self.assertEqual(run_codegolf(None, runs = 2).cpu.instruction_count, once * 2)
+        
+    def test_type_text(self):
+        machine = HeadlessMachine()
+        machine.type_text("v\r")
+        self.assertEqual(len(machine.keyboard_events), 4)
+        
+        machine.cpu.cycles += KEY_CYCLES
+        machine.deliver_keyboard_events()
+        self.assertEqual(machine.ppi.last_scancode, 0x2F)
+        self.assertEqual(len(machine.keyboard_events), 3)
+        
+        with self.assertRaises(ValueError):
+            machine.type_text("\x01")
+            
+    def test_keyboard_reset(self):
+        machine = HeadlessMachine()
+        machine.ppi.signal_keyboard_reset()
+        machine.deliver_keyboard_events()
+        self.assertEqual(machine.ppi.last_scancode, 0x00)
+        
+        machine.cpu.cycles += TICK_FREQUENCY
+        machine.deliver_keyboard_events()
+        self.assertEqual(machine.ppi.last_scancode, 0xAA)
+        
+    def test_workload_available(self):
+        class Options(object):
+            bios = None
+            diskette = None
+            
+        self.assertTrue(workload_available("codegolf", Options))
+        self.assertFalse(workload_available("freedos", Options))
+        Options.bios = Options.diskette = "image"
+        self.assertTrue(workload_available("freedos", Options))
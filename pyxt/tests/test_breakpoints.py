@@ -0,0 +1,185 @@
+import unittest
+
+from pyxt.breakpoints import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+from pyxt.debugger import Debugger
+from pyxt.tests.utils import SystemBusTestable
+
+class BreakpointSetTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.breakpoints = BreakpointSet(self.cpu)
+        
+    def at(self, cs, ip):
+        self.cpu.regs.CS = cs
+        self.cpu.regs.IP = ip
+        return self.breakpoints.check()
+        
+    def test_empty(self):
+        self.assertEqual(len(self.breakpoints), 0)
+        self.assertFalse(self.at(0xF000, 0xE05B))
+        
+    def test_keyed_by_physical_address(self):
+        self.breakpoints.add(0x0070, 0x0100)
+        self.assertIn(0x00800, self.breakpoints.addresses)
+        self.assertTrue(self.at(0x0070, 0x0100))
+        self.assertTrue(self.at(0x0080, 0x0000))
+        self.assertFalse(self.at(0x0070, 0x0101))
+        
+    def test_remove(self):
+        self.breakpoints.add(0x0070, 0x0100)
+        addresses = self.breakpoints.addresses
+        self.assertFalse(self.breakpoints.remove(0x0080, 0x0000))
+        self.assertTrue(self.breakpoints.remove(0x0070, 0x0100))
+        self.assertEqual(len(self.breakpoints), 0)
+        self.assertFalse(self.at(0x0070, 0x0100))
+        
+        # Debugger.armed() holds on to the dictionary.
+        self.assertIs(self.breakpoints.addresses, addresses)
+        
+    def test_condition(self):
+        self.breakpoints.add(0x0000, 0x0010, "ax == 0x1234 and not zf")
+        self.cpu.regs.AX = 0x1233
+        self.assertFalse(self.at(0x0000, 0x0010))
+        self.cpu.regs.AX = 0x1234
+        self.assertTrue(self.at(0x0000, 0x0010))
+        self.cpu.flags.zero = True
+        self.assertFalse(self.at(0x0000, 0x0010))
+        
+    def test_condition_reads_memory(self):
+        self.breakpoints.add(0x0000, 0x0010, "byte(0x472) == 0x34 and word(0x472) == 0x1234")
+        self.assertFalse(self.at(0x0000, 0x0010))
+        self.bus.mem_write_word(0x472, 0x1234)
+        self.assertTrue(self.at(0x0000, 0x0010))
+        
+    def test_condition_compiled_when_set(self):
+        with self.assertRaises(SyntaxError):
+            self.breakpoints.add(0x0000, 0x0010, "ax ==")
+            
+    def test_condition_error_stops(self):
+        self.breakpoints.add(0x0000, 0x0010, "nonsense == 1")
+        self.assertTrue(self.at(0x0000, 0x0010))
+        
+    def test_str(self):
+        self.assertEqual(str(self.breakpoints.add(0xF000, 0xE05B)), "f000:e05b")
+        self.assertEqual(str(self.breakpoints.add(0x0000, 0x0010, "cx == 0")), "0000:0010 if cx == 0")
+        
+class WatchpointSetTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.other_memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x00000, self.memory)
+        self.bus.install_device(0x10000, self.other_memory)
+        self.hits = []
+        self.watchpoints = WatchpointSet(self.bus, lambda *args: self.hits.append(args[1:]))
+        
+    def test_only_watched_blocks_are_hooked(self):
+        self.watchpoints.add(0x00472)
+        self.assertIn("mem_write_word", vars(self.memory))
+        self.assertNotIn("mem_write_word", vars(self.other_memory))
+        self.assertIs(self.other_memory.mem_write_byte.__self__, self.other_memory.contents)
+        
+    def test_write(self):
+        self.watchpoints.add(0x00472, kind = WATCH_WRITE)
+        self.bus.mem_write_byte(0x00471, 0x12)
+        self.assertEqual(self.hits, [])
+        self.bus.mem_write_byte(0x00472, 0x34)
+        self.bus.mem_write_word(0x00471, 0x0000)
+        self.assertEqual(self.hits, [(0x00472, 0x00, 0x34), (0x00472, 0x34, 0x00)])
+        self.assertEqual(self.bus.mem_read_byte(0x00471), 0x00)
+        
+    def test_change(self):
+        self.watchpoints.add(0x00472)
+        self.bus.mem_write_byte(0x00472, 0x00)
+        self.assertEqual(self.hits, [])
+        self.bus.mem_write_word(0x00472, 0x1234)
+        self.bus.mem_write_word(0x00472, 0x5634)
+        self.assertEqual(self.hits, [(0x00472, 0x00, 0x34)])
+        
+    def test_read(self):
+        self.watchpoints.add(0x10001, 2, WATCH_READ)
+        self.bus.mem_write_word(0x10001, 0xABCD)
+        self.assertEqual(self.hits, [])
+        self.assertEqual(self.bus.mem_read_word(0x10000), 0xCD00)
+        self.assertEqual(self.bus.mem_read_byte(0x10002), 0xAB)
+        self.assertEqual(self.hits, [(0x10001, 0xCD, 0xCD), (0x10002, 0xAB, 0xAB)])
+        
+    def test_spans_blocks(self):
+        self.watchpoints.add(0x0FFFF, 2, WATCH_WRITE)
+        self.bus.mem_write_byte(0x0FFFF, 0x01)
+        self.bus.mem_write_byte(0x10000, 0x02)
+        self.assertEqual(self.hits, [(0x0FFFF, 0x00, 0x01), (0x10000, 0x00, 0x02)])
+        
+    def test_disabled(self):
+        self.watchpoints.add(0x00472, kind = WATCH_WRITE)
+        self.watchpoints.enabled = False
+        self.bus.mem_write_byte(0x00472, 0x34)
+        self.assertEqual(self.hits, [])
+        self.assertEqual(self.bus.mem_read_byte(0x00472), 0x34)
+        
+    def test_remove_restores_device(self):
+        self.watchpoints.add(0x00472, kind = WATCH_WRITE)
+        self.watchpoints.add(0x00473, kind = WATCH_WRITE)
+        self.assertTrue(self.watchpoints.remove(0x00472))
+        self.assertFalse(self.watchpoints.remove(0x00472))
+        self.bus.mem_write_word(0x00472, 0x1234)
+        self.assertEqual(self.hits, [(0x00473, 0x00, 0x12)])
+        
+        self.watchpoints.clear()
+        self.assertEqual(len(self.watchpoints), 0)
+        self.assertNotIn("mem_write_word", vars(self.memory))
+        self.assertIs(self.memory.mem_write_byte.__self__, self.memory.contents)
+        self.bus.mem_write_word(0x00472, 0x5678)
+        self.assertEqual(len(self.hits), 1)
+        
+    def test_no_memory(self):
+        with self.assertRaises(ValueError):
+            self.watchpoints.add(0x20000)
+            
+    def test_bad_kind(self):
+        with self.assertRaises(ValueError):
+            self.watchpoints.add(0x00472, kind = "execute")
+            
+class DebuggerArmedTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.cpu.regs.CS = 0x0000
+        self.cpu.regs.IP = 0x0000
+        
+        # INC AX, MOV [0472], AL, JMP 0000
+        for index, value in enumerate([0x40, 0xA2, 0x72, 0x04, 0xEB, 0xFA]):
+            self.memory.mem_write_byte(index, value)
+            
+        self.debugger = Debugger(self.cpu, self.bus)
+        self.stops = []
+        self.debugger.enter_debugger = lambda: self.stops.append(self.cpu.regs.IP)
+        self.fetch = self.debugger.armed(self.cpu.fetch)
+        
+    def run_instructions(self, count):
+        for _ in range(count):
+            self.fetch()
+            
+    def test_breakpoint(self):
+        self.debugger.breakpoints.add(0x0000, 0x0004, "ax == 2")
+        self.run_instructions(9)
+        self.assertEqual(self.stops, [0x0004])
+        
+    def test_watchpoint_stops_before_next_instruction(self):
+        self.debugger.watchpoints.add(0x00472, kind = WATCH_WRITE)
+        self.run_instructions(3)
+        self.assertEqual(self.stops, [0x0004])
+        
+        # Single stepping from here on until continued.
+        self.run_instructions(2)
+        self.assertEqual(self.stops, [0x0004, 0x0000, 0x0001])
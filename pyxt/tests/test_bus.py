@@ -2,6 +2,9 @@ import unittest
 
 from pyxt.tests.utils import InterruptControllerSpy
 from pyxt.bus import *
+from pyxt.memory import RAM
+from pyxt.cpu import CPU
+from pyxt.constants import SIXTY_FOUR_KB
 
 class DeviceTests(unittest.TestCase):
     def setUp(self):
@@ -20,6 +23,15 @@ class DeviceTests(unittest.TestCase):
     def test_clock_not_pure_virtual(self):
         self.device.clock()
         
+    def test_no_events_scheduled(self):
+        self.assertIsNone(self.device.ticks_until_event())
+        
+    def test_fast_forward_calls_clock(self):
+        ticks = []
+        self.device.clock = lambda: ticks.append(1)
+        self.device.fast_forward(5)
+        self.assertEqual(len(ticks), 5)
+        
         
     def test_memory_size_zero(self):
         self.assertEqual(self.device.get_memory_size(), 0)
@@ -56,6 +68,17 @@ class DeviceTests(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             self.device.io_write_word(0, 0)
             
+class SchedulerSpy(object):
+    """ Logs the calls the bus makes to the scheduler. """
+    def __init__(self):
+        self.calls = []
+        
+    def sync(self):
+        self.calls.append("sync")
+        
+    def reschedule(self):
+        self.calls.append("reschedule")
+        
 class SystemBusTests(unittest.TestCase):
     def setUp(self):
         self.pic = InterruptControllerSpy()
@@ -69,6 +92,49 @@ class SystemBusTests(unittest.TestCase):
         self.bus.interrupt_request(8)
         self.assertEqual(self.pic.irq_log, [])
         
+    def test_install_device_invalidates_code_window(self):
+        cpu = CPU()
+        self.bus.install_cpu(cpu)
+        self.bus.install_device(0x00000, RAM(SIXTY_FOUR_KB))
+        cpu.regs.CS = 0x0000
+        cpu.fetch()
+        self.assertEqual(cpu.code_window_limit, SIXTY_FOUR_KB)
+        
+        self.bus.install_device(0x00000, RAM(SIXTY_FOUR_KB))
+        self.assertIsNone(cpu.code_window)
+        
     def test_unmapped_io_port_returns_0xff(self):
         self.assertEqual(self.bus.io_read_byte(5643), 0xFF)
-        
\ No newline at end of file
+        
+    def test_activity_counters(self):
+        self.bus.mem_write_byte(0x0000, 0x00)
+        self.bus.mem_write_word(0x0000, 0x0000)
+        self.bus.io_read_byte(5643)
+        self.bus.io_write_byte(5643, 0x00)
+        self.assertEqual(self.bus.mem_write_count, 2)
+        self.assertEqual(self.bus.io_read_count, 1)
+        self.assertEqual(self.bus.io_write_count, 1)
+        self.assertEqual(self.bus.io_read_counts[5643], 1)
+        self.assertEqual(self.bus.io_write_counts[5643], 1)
+        
+        
+    def test_io_syncs_scheduler(self):
+        self.bus.scheduler = SchedulerSpy()
+        self.bus.io_read_byte(5643)
+        self.assertEqual(self.bus.scheduler.calls, ["sync"])
+        self.bus.io_write_byte(5643, 0x00)
+        self.assertEqual(self.bus.scheduler.calls, ["sync", "sync", "reschedule"])
+        
+    def test_dirty_pages_off_by_default(self):
+        self.bus.mem_write_byte(0x1234, 0x00)
+        self.assertIsNone(self.bus.dirty_pages)
+        
+    def test_track_dirty_pages(self):
+        self.bus.install_device(0x00000, RAM(SIXTY_FOUR_KB))
+        self.bus.track_dirty_pages()
+        self.bus.mem_write_byte(0x1234, 0x56)
+        self.bus.mem_write_word(0x2FFF, 0xABCD)
+        self.assertEqual(self.bus.dirty_pages, set([0x1, 0x2, 0x3]))
+        self.assertEqual(self.bus.mem_read_byte(0x1234), 0x56)
+        self.assertEqual(self.bus.mem_read_word(0x2FFF), 0xABCD)
+        self.assertEqual(self.bus.mem_write_count, 2)
@@ -37,4 +37,56 @@ class CRTC6845Tests(unittest.TestCase):
         self.cga.io_write_byte(0x3D4, 0x06)
         self.cga.io_write_byte(0x3D5, 43)
         self.assertEqual(self.cga.rows, 43)
-        
\ No newline at end of file
+        
+class StatusRegisterTests(unittest.TestCase):
+    def setUp(self):
+        self.chargen = CharacterGeneratorMock(width = 8, height = 8)
+        self.cga = ColorGraphicsAdapter(self.chargen)
+        
+    def test_display_enable(self):
+        # Three dots per tick, 640 of the 912 dots in a line are displayed.
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x00)
+        self.cga.fast_forward(213)
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x00)
+        self.cga.clock()
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x01)
+        self.cga.fast_forward(304 - 214)
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x00)
+        
+    def test_vertical_retrace(self):
+        self.cga.fast_forward(200 * 304)
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x01)
+        self.cga.fast_forward(24 * 304)
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x09)
+        self.cga.fast_forward(16 * 304 - 1)
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x09)
+        self.cga.clock()
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x01)
+        
+        # The next frame, 262 lines after the first.
+        self.cga.fast_forward(22 * 304)
+        self.assertEqual(self.cga.io_read_byte(0x3DA), 0x00)
+        self.assertEqual(self.cga.ticks, 262 * 304)
+        
+    def test_no_event_unless_polled(self):
+        self.assertIsNone(self.cga.ticks_until_event())
+        self.cga.io_read_byte(0x3DA)
+        self.assertEqual(self.cga.ticks_until_event(), 214)
+        self.cga.fast_forward(214)
+        self.assertEqual(self.cga.ticks_until_event(), 304 - 214)
+        self.cga.fast_forward(CGA_TIMING.line_ticks * POLLING_LINES + 1)
+        self.assertIsNone(self.cga.ticks_until_event())
+        
+    def test_events_through_the_frame(self):
+        # Skipping from event to event finds every change of the status register.
+        changes = []
+        status = self.cga.io_read_byte(0x3DA)
+        while self.cga.ticks < 262 * 304:
+            self.cga.fast_forward(self.cga.ticks_until_event())
+            new_status = self.cga.io_read_byte(0x3DA)
+            self.assertNotEqual(new_status, status)
+            changes.append((self.cga.ticks, new_status))
+            status = new_status
+            
+        self.assertEqual(len(changes), (200 * 2 - 1) + 3)
+        self.assertEqual(changes[-3:], [(224 * 304, 0x09), (240 * 304, 0x01), (262 * 304, 0x00)])
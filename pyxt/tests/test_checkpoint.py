@@ -0,0 +1,209 @@
+import array
+import unittest
+
+from pyxt.checkpoint import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.bus import SystemBus
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+from pyxt.pic import ProgrammableInterruptController
+from pyxt.timer import ProgrammableIntervalTimer
+from pyxt.scheduler import Scheduler
+from pyxt.fdc import FloppyDisketteController, FloppyDisketteDrive, FIVE_INCH_360_KB
+from pyxt.replay import machine_digest
+
+# MOV AX, 1000h; loop: INC AX; MOV [2000h], AX; MOV BX, AX; ADD [3000h], BX; JMP loop
+PROGRAM = "b80010" "40" "a30020" "89c3" "011e0030" "ebf4"
+LOOP_START = 0x0003
+
+class Owned(object):
+    def __init__(self):
+        self.value = 1
+        self.items = [1, 2, 3]
+        
+class Holder(object):
+    def __init__(self):
+        self.number = 5
+        self.table = {"a" : [1, 2]}
+        self.owned = Owned()
+        self.callback = self.__init__
+        self.owned_list = [Owned(), Owned()]
+        
+# Make the test classes look like they belong to PyXT.
+Owned.__module__ = Holder.__module__ = "pyxt.tests.test_checkpoint"
+
+def saved_bytes(value):
+    """ Return the number of bytes of arrays copied into a checkpoint. """
+    if isinstance(value, array.array):
+        return len(value) * value.itemsize
+    if isinstance(value, tuple) and len(value) == 2 and value[0] == STATE_BUFFER:
+        return 0
+    if isinstance(value, (list, tuple)):
+        return sum(saved_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(saved_bytes(item) for item in value.values())
+    return 0
+
+class CaptureStateTests(unittest.TestCase):
+    def test_round_trip(self):
+        holder = Holder()
+        items = holder.owned.items
+        state = capture_state(holder)
+        self.assertNotIn("callback", state)
+        
+        holder.number = 6
+        holder.table["a"].append(3)
+        holder.owned.value = 2
+        holder.owned.items.append(4)
+        holder.owned_list[1].value = 7
+        restore_state(holder, state)
+        
+        self.assertEqual(holder.number, 5)
+        self.assertEqual(holder.table, {"a" : [1, 2]})
+        self.assertEqual(holder.owned.value, 1)
+        self.assertEqual(holder.owned_list[1].value, 1)
+        
+        # Lists are put back in place.
+        self.assertIs(holder.owned.items, items)
+        self.assertEqual(items, [1, 2, 3])
+        
+    def test_state_is_a_copy(self):
+        holder = Holder()
+        state = capture_state(holder)
+        holder.owned.items.append(4)
+        restore_state(holder, state)
+        holder.owned.items.append(5)
+        restore_state(holder, state)
+        self.assertEqual(holder.owned.items, [1, 2, 3])
+        
+class CheckpointManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.pic = ProgrammableInterruptController(0x020)
+        self.bus = SystemBus(self.pic)
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x00000, self.memory)
+        self.bus.install_device(None, self.pic)
+        self.pit = ProgrammableIntervalTimer(0x0040)
+        self.pit.channels[0].gate = True
+        self.bus.install_device(None, self.pit)
+        
+        self.diskette_controller = FloppyDisketteController(0x3F0)
+        self.bus.install_device(None, self.diskette_controller)
+        self.drives = [FloppyDisketteDrive(FIVE_INCH_360_KB), FloppyDisketteDrive(FIVE_INCH_360_KB)]
+        for number, drive in enumerate(self.drives):
+            drive.contents = array.array("B", [0]) * drive.size_in_bytes
+            self.diskette_controller.attach_drive(drive, number)
+            
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.cpu.regs.CS = 0x0000
+        self.cpu.regs.IP = 0x0000
+        for index, value in enumerate(bytearray.fromhex(PROGRAM)):
+            self.memory.mem_write_byte(index, value)
+            
+        self.scheduler = Scheduler(self.cpu, [self.pit])
+        self.bus.scheduler = self.scheduler
+        
+        # Channel 0 as a rate generator so the timer has state that changes.
+        self.bus.io_write_byte(0x43, 0x34)
+        self.bus.io_write_byte(0x40, 0x00)
+        self.bus.io_write_byte(0x40, 0x01)
+        
+        self.manager = CheckpointManager(self.cpu, self.bus, self.scheduler, 1000, interval = 50)
+        
+    def state(self):
+        self.scheduler.sync()
+        channel = self.pit.channels[0]
+        return (machine_digest(self.cpu), self.cpu.cycles, channel.value, channel.output)
+        
+    def run_instructions(self, count):
+        """ Run the machine forward, returning its state after each instruction. """
+        states = {}
+        target = self.cpu.instruction_count + count
+        while self.cpu.instruction_count < target:
+            self.manager.run_to(self.cpu.instruction_count + 1)
+            states[self.cpu.instruction_count] = self.state()
+        return states
+        
+    def test_tracks_dirty_pages(self):
+        self.assertEqual(self.bus.dirty_pages, set())
+        self.run_instructions(5)
+        self.assertEqual(self.bus.dirty_pages, set([0x2000 >> PAGE_SHIFT, 0x3000 >> PAGE_SHIFT]))
+        
+    def test_first_checkpoint_has_all_ram(self):
+        self.assertEqual(len(self.manager.checkpoints[0].pages), SIXTY_FOUR_KB // PAGE_SIZE)
+        
+    def test_checkpoints_at_interval(self):
+        self.run_instructions(120)
+        self.assertEqual([checkpoint.instruction_count for checkpoint in self.manager.checkpoints], [0, 50, 100])
+        self.assertEqual(sorted(self.manager.checkpoints[1].pages), [0x2000 >> PAGE_SHIFT, 0x3000 >> PAGE_SHIFT])
+        
+    def test_seek_restores_exact_state(self):
+        states = self.run_instructions(180)
+        for target in (175, 150, 149, 101, 37, 1):
+            self.assertTrue(self.manager.seek(target))
+            self.assertEqual(self.cpu.instruction_count, target)
+            self.assertEqual(self.state(), states[target])
+            
+    def test_seek_then_run_forward_matches(self):
+        states = self.run_instructions(120)
+        self.manager.seek(60)
+        self.assertEqual(self.run_instructions(60), dict((count, states[count]) for count in range(61, 121)))
+        
+    def test_oldest_checkpoints_are_merged(self):
+        self.manager.max_checkpoints = 2
+        states = self.run_instructions(160)
+        self.assertEqual([checkpoint.instruction_count for checkpoint in self.manager.checkpoints], [100, 150])
+        self.assertEqual(len(self.manager.checkpoints[0].pages), SIXTY_FOUR_KB // PAGE_SIZE)
+        self.assertFalse(self.manager.seek(99))
+        self.assertTrue(self.manager.seek(120))
+        self.assertEqual(self.state(), states[120])
+        
+    def test_unchanged_buffers_are_not_saved(self):
+        diskettes = 2 * self.drives[0].size_in_bytes
+        self.assertGreater(saved_bytes(vars(self.manager.checkpoints[0])), diskettes)
+        
+        # Only the two pages of RAM the program writes.
+        self.run_instructions(120)
+        for checkpoint in self.manager.checkpoints[1:]:
+            self.assertEqual(checkpoint.buffer_pages, {})
+            self.assertLess(saved_bytes(vars(checkpoint)), 3 * PAGE_SIZE)
+            
+    def test_seek_restores_buffers(self):
+        contents = self.drives[1].contents
+        self.run_instructions(60)
+        contents[PAGE_SIZE + 5] = 0xAA
+        self.run_instructions(60)
+        self.assertEqual(list(self.manager.checkpoints[2].buffer_pages), [(id(contents), 1)])
+        
+        # A new diskette has all of its pages saved.
+        self.drives[1].contents = array.array("B", [0xFF]) * self.drives[1].size_in_bytes
+        self.run_instructions(40)
+        self.assertEqual(sorted(self.manager.checkpoints[3].buffer_pages),
+                         sorted((id(self.drives[1].contents), page) for page in range(len(contents) // PAGE_SIZE)))
+                         
+        self.drives[0].contents[0] = 0x55
+        self.assertTrue(self.manager.seek(110))
+        self.assertIs(self.drives[1].contents, contents)
+        self.assertEqual(contents[PAGE_SIZE + 5], 0xAA)
+        self.assertEqual(self.drives[0].contents[0], 0x00)
+        
+        self.assertTrue(self.manager.seek(60))
+        self.assertEqual(contents[PAGE_SIZE + 5], 0x00)
+        self.assertEqual(list(self.manager.buffers), [id(self.drives[0].contents), id(contents)])
+        
+    def test_reverse_continue(self):
+        states = self.run_instructions(130)
+        
+        # The loop starts every 5 instructions after the first MOV, at counts 1, 6, ... 126.
+        self.assertTrue(self.manager.reverse_continue(lambda: self.cpu.regs.IP == LOOP_START))
+        self.assertEqual(self.cpu.instruction_count, 126)
+        self.assertEqual(self.state(), states[126])
+        
+        self.assertTrue(self.manager.reverse_continue(lambda: self.cpu.regs.IP == LOOP_START))
+        self.assertEqual(self.cpu.instruction_count, 121)
+        
+    def test_reverse_continue_not_found(self):
+        self.run_instructions(70)
+        self.assertFalse(self.manager.reverse_continue(lambda: False))
+        self.assertEqual(self.cpu.instruction_count, 0)
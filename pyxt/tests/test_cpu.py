@@ -1,5 +1,6 @@
 import unittest
 import binascii
+from ctypes import memmove, string_at, addressof, sizeof
 
 import six
 from six.moves import range # pylint: disable=redefined-builtin 
@@ -213,6 +214,25 @@ class FlagsRegisterTest(unittest.TestCase):
         changed_flags = original_flags ^ self.flags.value
         self.assertEqual(changed_flags, FLAGS.CARRY | FLAGS.OVERFLOW)
         
+    def test_set_from_packed(self):
+        self.flags.set_from_packed(FLAGS.CARRY | FLAGS.ADJUST | FLAGS.SIGN | FLAGS.OVERFLOW)
+        self.assertEqual(self.flags.value & 0x0FFF, FLAGS.CARRY | FLAGS.ADJUST | FLAGS.SIGN | FLAGS.OVERFLOW)
+        
+    def test_set_from_packed_no_carry(self):
+        self.flags.carry = True
+        self.flags.set_from_packed_no_carry(FLAGS.ZERO | FLAGS.PARITY)
+        self.assertEqual(self.flags.value & 0x0FFF, FLAGS.CARRY | FLAGS.ZERO | FLAGS.PARITY)
+        
+    def test_set_from_packed_logical(self):
+        self.flags.adjust = self.flags.overflow = True
+        self.flags.set_from_packed_logical(FLAGS.SIGN)
+        self.assertEqual(self.flags.value & 0x0FFF, FLAGS.ADJUST | FLAGS.SIGN)
+        
+    def test_set_from_packed_shift(self):
+        self.flags.adjust = self.flags.overflow = True
+        self.flags.set_from_packed_shift(FLAGS.CARRY)
+        self.assertEqual(self.flags.value & 0x0FFF, FLAGS.ADJUST | FLAGS.OVERFLOW | FLAGS.CARRY)
+        
     def test_808x_reserved_bits(self):
         # Try to clear all flags.
         self.flags.value = 0x0000
@@ -233,6 +253,50 @@ class HelperFunctionTest(unittest.TestCase):
         self.assertEqual(decode_seg_reg(0xFE), "SS")
         self.assertEqual(decode_seg_reg(0xFF), "DS")
         
+    def test_signed_byte(self):
+        self.assertEqual(signed_byte(0x00), 0)
+        self.assertEqual(signed_byte(0x7F), 127)
+        self.assertEqual(signed_byte(0x80), -128)
+        self.assertEqual(signed_byte(0xFF), -1)
+        
+    def test_signed_word(self):
+        self.assertEqual(signed_word(0x7FFF), 32767)
+        self.assertEqual(signed_word(0x8000), -32768)
+        self.assertEqual(signed_word(0xFFFE), -2)
+        
+    def test_signed_dword(self):
+        self.assertEqual(signed_dword(0x7FFFFFFF), 2147483647)
+        self.assertEqual(signed_dword(0x80000000), -2147483648)
+        self.assertEqual(signed_dword(0xFFFFFFFF), -1)
+        
+    def test_signed_bytes_table(self):
+        self.assertEqual(len(SIGNED_BYTES), 0x100)
+        for value in range(0x100):
+            self.assertEqual(SIGNED_BYTES[value], signed_byte(value))
+            
+    def test_condition_taken(self):
+        self.assertTrue(condition_taken(0x4, False, True, False, False, False)) # JZ
+        self.assertFalse(condition_taken(0x5, False, True, False, False, False)) # JNZ
+        self.assertTrue(condition_taken(0xC, False, False, True, False, False)) # JL
+        self.assertFalse(condition_taken(0xC, False, False, True, True, False))
+        self.assertTrue(condition_taken(0xE, False, True, False, False, False)) # JLE
+        
+    def test_condition_table(self):
+        for condition in range(0x10):
+            for flags in range(1 << CONDITION_FLAGS_BITS):
+                carry = flags & CONDITION_CARRY != 0
+                zero = flags & CONDITION_ZERO != 0
+                sign = flags & CONDITION_SIGN != 0
+                overflow = flags & CONDITION_OVERFLOW != 0
+                parity = flags & CONDITION_PARITY != 0
+                taken = [
+                    overflow, carry, zero, carry or zero, sign, parity, sign != overflow, zero or sign != overflow,
+                ][condition >> 1]
+                if condition & 0x01:
+                    taken = not taken
+                self.assertEqual(CONDITION_TAKEN[condition << CONDITION_FLAGS_BITS | flags], int(taken),
+                                 "condition 0x%X flags 0x%02X" % (condition, flags))
+            
 class UnionRegsTest(unittest.TestCase):
     def setUp(self):
         self.regs = UnionRegs()
@@ -346,6 +410,23 @@ class UnionRegsTest(unittest.TestCase):
         self.regs.AX = 115200
         self.assertEqual(self.regs.AX, 49664)
         
+    def test_segment_bases(self):
+        self.assertEqual(self.regs.segment_bases, [0x00000, 0xFFFF0, 0x00000, 0x00000])
+        self.regs.ES = 0x1234
+        self.regs["SS"] = 0x5678
+        self.regs.DS = 0x1FFFF
+        self.assertEqual(self.regs.DS, 0xFFFF)
+        self.assertEqual(self.regs.segment_bases, [0x12340, 0xFFFF0, 0x56780, 0xFFFF0])
+        
+    def test_update_segment_bases(self):
+        other = UnionRegs()
+        other.CS = 0xF000
+        other.DS = 0x0040
+        memmove(addressof(self.regs), string_at(addressof(other), sizeof(other)), sizeof(other))
+        self.assertEqual(self.regs.segment_bases[SEGMENT_CS], 0xFFFF0)
+        self.regs.update_segment_bases()
+        self.assertEqual(self.regs.segment_bases, [0x00000, 0xF0000, 0x00000, 0x00400])
+        
 class BaseOpcodeAcceptanceTests(unittest.TestCase):
     """
     Basic acceptance testing framework for the CPU class.
@@ -664,6 +745,29 @@ class AddOpcodeTests(BaseOpcodeAcceptanceTests):
         # Carry is set from the sign extension.
         self.assert_flags("oszPC") # ODITSZAPC
         
+    def test_add_8x_8_bit_overflow(self):
+        """
+        add al, byte 0x7F
+        hlt
+        """
+        self.cpu.regs.AL = 1
+        self.load_code_string("80 C0 7F F4")
+        self.assertEqual(self.run_to_halt(), 2)
+        self.assertEqual(self.cpu.regs.AL, 0x80)
+        self.assert_flags("OSzpc") # ODITSZAPC
+        self.assertTrue(self.cpu.flags.adjust)
+        
+    def test_add_8x_16_bit_overflow(self):
+        """
+        add ax, word 0x7FFF
+        hlt
+        """
+        self.cpu.regs.AX = 1
+        self.load_code_string("81 C0 FF 7F F4")
+        self.assertEqual(self.run_to_halt(), 2)
+        self.assertEqual(self.cpu.regs.AX, 0x8000)
+        self.assert_flags("OSzPc") # ODITSZAPC
+        
 class AdcOpcodeTests(BaseOpcodeAcceptanceTests):
     def test_adc_operator_carry_clear(self):
         self.assertFalse(self.cpu.flags.carry)
@@ -3063,6 +3167,18 @@ class IncOpcodeTests(BaseOpcodeAcceptanceTests):
             self.assertEqual(self.memory.mem_read_word(5), after)
             self.assertFalse(self.cpu.flags.carry) # Should be unmodified.
             
+    def test_inc_rm8_overflow_keeps_carry(self):
+        """
+        inc al
+        hlt
+        """
+        self.cpu.regs.AL = 0x7F
+        self.cpu.flags.carry = True
+        self.load_code_string("FE C0 F4")
+        self.assertEqual(self.run_to_halt(), 2)
+        self.assertEqual(self.cpu.regs.AL, 0x80)
+        self.assert_flags("OSzpC") # ODITSZAPC
+        
 class DecOpcodeTests(BaseOpcodeAcceptanceTests):
     def run_dec_16_bit_test(self, code_string, register):
         """
@@ -4009,15 +4125,33 @@ class SegmentOverrideTests(BaseOpcodeAcceptanceTests):
         self.cpu.segment_override = None
         self.assertEqual(self.cpu.get_data_segment(), 0x1122)
         
-        self.cpu.segment_override = "DS"
+        self.cpu.segment_override = SEGMENT_DS
         self.assertEqual(self.cpu.get_data_segment(), 0x1122)
-        self.cpu.segment_override = "ES"
+        self.cpu.segment_override = SEGMENT_ES
         self.assertEqual(self.cpu.get_data_segment(), 0x3344)
-        self.cpu.segment_override = "CS"
+        self.cpu.segment_override = SEGMENT_CS
         self.assertEqual(self.cpu.get_data_segment(), 0x5566)
-        self.cpu.segment_override = "SS"
+        self.cpu.segment_override = SEGMENT_SS
         self.assertEqual(self.cpu.get_data_segment(), 0x7788)
         
+    def test_get_data_address(self):
+        self.cpu.regs.DS = 0x1122
+        self.cpu.regs.ES = 0xFFFF
+        
+        self.cpu.segment_override = None
+        self.assertEqual(self.cpu.get_data_address(0x0004), 0x11224)
+        self.cpu.segment_override = SEGMENT_ES
+        self.assertEqual(self.cpu.get_data_address(0x0004), 0xFFFF4)
+        self.assertEqual(self.cpu.get_data_address(0x0010), 0x00000) # Wraps at 1MB.
+        
+    def test_effective_address_vector_default_segments(self):
+        vector = self.cpu.effective_address_vector
+        self.assertEqual(len(vector), 0xC0)
+        for modrm, (_function, default_segment) in enumerate(vector):
+            mod, _reg, rm = MODRM_LUT[modrm]
+            uses_bp = rm in (0x02, 0x03) or (rm == 0x06 and mod != 0x00)
+            self.assertEqual(default_segment, SEGMENT_SS if uses_bp else None)
+            
     def test_es_override(self):
         """
         mov [es:bx], al
@@ -4731,8 +4865,8 @@ class ModRMTests(BaseOpcodeAcceptanceTests):
     def test_mod_00_all_modes_no_displacement(self):
         self.run_address_test("F7 10", 0x1200) # not word [bx + si]
         self.run_address_test("F7 11", 0x1400) # not word [bx + di]
-        self.run_address_test("F7 12", 0x8200, "SS") # not word [bp + si]
-        self.run_address_test("F7 13", 0x8400, "SS") # not word [bp + di]
+        self.run_address_test("F7 12", 0x8200, SEGMENT_SS) # not word [bp + si]
+        self.run_address_test("F7 13", 0x8400, SEGMENT_SS) # not word [bp + di]
         self.run_address_test("F7 14", 0x0200) # not word [si]
         self.run_address_test("F7 15", 0x0400) # not word [di]
         # This is not a mod 00 test, mod 00 rm 110 is handled above.
@@ -4742,41 +4876,41 @@ class ModRMTests(BaseOpcodeAcceptanceTests):
     def test_mod_01_all_modes_byte_displacement(self):
         self.run_address_test("F7 50 01", 0x1200 + 1) # not word [bx + si + 1]
         self.run_address_test("F7 51 01", 0x1400 + 1) # not word [bx + di + 1]
-        self.run_address_test("F7 52 01", 0x8200 + 1, "SS") # not word [bp + si + 1]
-        self.run_address_test("F7 53 01", 0x8400 + 1, "SS") # not word [bp + di + 1]
+        self.run_address_test("F7 52 01", 0x8200 + 1, SEGMENT_SS) # not word [bp + si + 1]
+        self.run_address_test("F7 53 01", 0x8400 + 1, SEGMENT_SS) # not word [bp + di + 1]
         self.run_address_test("F7 54 01", 0x0200 + 1) # not word [si + 1]
         self.run_address_test("F7 55 01", 0x0400 + 1) # not word [di + 1]
-        self.run_address_test("F7 56 01", 0x8000 + 1, "SS") # not word [bp + 1]
+        self.run_address_test("F7 56 01", 0x8000 + 1, SEGMENT_SS) # not word [bp + 1]
         self.run_address_test("F7 57 01", 0x1000 + 1) # not word [bx + 1]
         
     def test_mod_01_all_modes_byte_negative_displacement(self):
         self.run_address_test("F7 50 FF", 0x1200 - 1) # not word [bx + si - 1]
         self.run_address_test("F7 51 FF", 0x1400 - 1) # not word [bx + di - 1]
-        self.run_address_test("F7 52 FF", 0x8200 - 1, "SS") # not word [bp + si - 1]
-        self.run_address_test("F7 53 FF", 0x8400 - 1, "SS") # not word [bp + di - 1]
+        self.run_address_test("F7 52 FF", 0x8200 - 1, SEGMENT_SS) # not word [bp + si - 1]
+        self.run_address_test("F7 53 FF", 0x8400 - 1, SEGMENT_SS) # not word [bp + di - 1]
         self.run_address_test("F7 54 FF", 0x0200 - 1) # not word [si - 1]
         self.run_address_test("F7 55 FF", 0x0400 - 1) # not word [di - 1]
-        self.run_address_test("F7 56 FF", 0x8000 - 1, "SS") # not word [bp - 1]
+        self.run_address_test("F7 56 FF", 0x8000 - 1, SEGMENT_SS) # not word [bp - 1]
         self.run_address_test("F7 57 FF", 0x1000 - 1) # not word [bx - 1]
         
     def test_mod_10_all_modes_word_displacement(self):
         self.run_address_test("F7 90 00 01", 0x1200 + 0x100) # not word [bx + si]
         self.run_address_test("F7 91 00 01", 0x1400 + 0x100) # not word [bx + di]
-        self.run_address_test("F7 92 00 01", 0x8200 + 0x100, "SS") # not word [bp + si]
-        self.run_address_test("F7 93 00 01", 0x8400 + 0x100, "SS") # not word [bp + di]
+        self.run_address_test("F7 92 00 01", 0x8200 + 0x100, SEGMENT_SS) # not word [bp + si]
+        self.run_address_test("F7 93 00 01", 0x8400 + 0x100, SEGMENT_SS) # not word [bp + di]
         self.run_address_test("F7 94 00 01", 0x0200 + 0x100) # not word [si]
         self.run_address_test("F7 95 00 01", 0x0400 + 0x100) # not word [di]
-        self.run_address_test("F7 96 00 01", 0x8000 + 0x100, "SS") # not word [bp]
+        self.run_address_test("F7 96 00 01", 0x8000 + 0x100, SEGMENT_SS) # not word [bp]
         self.run_address_test("F7 97 00 01", 0x1000 + 0x100) # not word [bx]
         
     def test_mod_10_all_modes_word_negative_displacement(self):
         self.run_address_test("F7 90 00 FF", 0x1200 - 0x100) # not word [bx + si]
         self.run_address_test("F7 91 00 FF", 0x1400 - 0x100) # not word [bx + di]
-        self.run_address_test("F7 92 00 FF", 0x8200 - 0x100, "SS") # not word [bp + si]
-        self.run_address_test("F7 93 00 FF", 0x8400 - 0x100, "SS") # not word [bp + di]
+        self.run_address_test("F7 92 00 FF", 0x8200 - 0x100, SEGMENT_SS) # not word [bp + si]
+        self.run_address_test("F7 93 00 FF", 0x8400 - 0x100, SEGMENT_SS) # not word [bp + di]
         self.run_address_test("F7 94 00 FF", 0x0200 - 0x100) # not word [si]
         self.run_address_test("F7 95 00 FF", 0x0400 - 0x100) # not word [di]
-        self.run_address_test("F7 96 00 FF", 0x8000 - 0x100, "SS") # not word [bp]
+        self.run_address_test("F7 96 00 FF", 0x8000 - 0x100, SEGMENT_SS) # not word [bp]
         self.run_address_test("F7 97 00 FF", 0x1000 - 0x100) # not word [bx]
         
     def test_bp_doesnt_override_existing_override(self):
@@ -4850,7 +4984,42 @@ class IntOpcodeTests(BaseOpcodeAcceptanceTests):
         self.assertEqual(self.memory.mem_read_word(0x10FE), 0xF301) # Should contain original FLAGS.
         self.assertEqual(self.memory.mem_read_word(0x10FC), 0x0040) # Should contain original CS.
         self.assertEqual(self.memory.mem_read_word(0x10FA), 0x0002) # Should contain original IP.
-    
+        
+    def test_int_hook_not_handled_runs_vector(self):
+        """
+        int 0x10
+        """
+        calls = []
+        def hook(cpu):
+            calls.append(cpu.regs.IP)
+            return False
+            
+        self.cpu.install_interrupt_hook(0x10, hook)
+        self.memory.mem_write_byte(0x42, 0x50)
+        self.memory.mem_write_byte(0x400, 0xCD)
+        self.memory.mem_write_byte(0x401, 0x10)
+        self.cpu.fetch()
+        self.assertEqual(calls, [0x0002])
+        self.assertEqual(self.cpu.regs.CS, 0x0050)
+        self.assertEqual(self.cpu.regs.SP, 0xFA)
+        
+    def test_int_hook_handled_skips_vector(self):
+        """
+        int 0x10
+        """
+        self.cpu.install_interrupt_hook(0x10, lambda cpu: True)
+        self.memory.mem_write_byte(0x42, 0x50)
+        self.memory.mem_write_byte(0x400, 0xCD)
+        self.memory.mem_write_byte(0x401, 0x10)
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.CS, 0x0040)
+        self.assertEqual(self.cpu.regs.IP, 0x0002)
+        self.assertEqual(self.cpu.regs.SP, 0x0100)
+        
+        # Removing the hook goes back to the vector.
+        self.cpu.install_interrupt_hook(0x10, None)
+        self.assertEqual(self.cpu.interrupt_hooks, {})
+        
 class JmpOpcodeTests(BaseOpcodeAcceptanceTests):
     def test_jmp_r16(self):
         """
@@ -8241,4 +8410,526 @@ class BcdOpcodeTests(BaseOpcodeAcceptanceTests):
         self.assertEqual(self.run_to_halt(), 2)
         self.assertEqual(self.cpu.regs.AH, 0x00)
         self.assertEqual(self.cpu.regs.AL, 0x11) # Intel CPU honors imm8, V20 assumes 0x0A.
-        
\ No newline at end of file
+        
+class InterruptAcknowledgeStub(object):
+    """ Stands in for the PIC, always acknowledges with the same vector. """
+    def __init__(self, vector):
+        self.vector = vector
+        
+    def interrupt_acknowledge(self):
+        return self.vector
+        
+class HltOpcodeTests(BaseOpcodeAcceptanceTests):
+    def setUp(self):
+        super(HltOpcodeTests, self).setUp()
+        self.cpu.regs.CS = 0x0040
+        self.cpu.regs.SS = 0x0100
+        self.cpu.regs.SP = 0x0100
+        self.bus.pic = InterruptAcknowledgeStub(0x08)
+        
+        # INT 08h handler at 0050:0000 just does IRET.
+        self.memory.mem_write_word(0x20, 0x0000)
+        self.memory.mem_write_word(0x22, 0x0050)
+        self.memory.mem_write_byte(0x500, 0xCF)
+        
+    def test_hlt_stays_halted(self):
+        """
+        hlt
+        inc ax
+        """
+        self.memory.mem_write_byte(0x400, 0xF4)
+        self.memory.mem_write_byte(0x401, 0x40)
+        self.cpu.flags.interrupt_enable = True
+        for _unused in range(10):
+            self.cpu.fetch()
+            
+        self.assertTrue(self.cpu.hlt)
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        self.assertEqual(self.cpu.regs.AX, 0x0000)
+        
+    def test_interrupt_resumes_after_hlt(self):
+        """
+        hlt
+        inc ax
+        """
+        self.memory.mem_write_byte(0x400, 0xF4)
+        self.memory.mem_write_byte(0x401, 0x40)
+        self.cpu.flags.interrupt_enable = True
+        self.cpu.fetch()
+        self.assertTrue(self.cpu.hlt)
+        
+        self.cpu.interrupt_signaled = True
+        self.cpu.fetch() # Services the interrupt and runs the IRET.
+        self.cpu.interrupt_signaled = False
+        self.assertFalse(self.cpu.hlt)
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.AX, 0x0001)
+        
+    def test_masked_interrupt_does_not_resume(self):
+        self.memory.mem_write_byte(0x400, 0xF4)
+        self.cpu.fetch()
+        self.cpu.interrupt_signaled = True
+        self.cpu.fetch()
+        self.assertTrue(self.cpu.hlt)
+        
+class AttentionTests(BaseOpcodeAcceptanceTests):
+    def setUp(self):
+        super(AttentionTests, self).setUp()
+        self.cpu.regs.SS = 0x0100
+        self.cpu.regs.SP = 0x0100
+        self.bus.pic = InterruptAcknowledgeStub(0x08)
+        
+        # INT 01h and INT 08h handlers at 0050:0000 just do HLT.
+        for vector in (0x01, 0x08):
+            self.memory.mem_write_word(vector * 4, 0x0000)
+            self.memory.mem_write_word((vector * 4) + 2, 0x0050)
+        self.memory.mem_write_byte(0x500, 0xF4)
+        
+    def test_clear_while_running(self):
+        self.load_code_string("90 90")
+        self.cpu.fetch()
+        self.assertFalse(self.cpu.attention)
+        
+    def test_interrupt_signaled_sets_attention(self):
+        self.cpu.interrupt_signaled = True
+        self.assertTrue(self.cpu.attention)
+        self.cpu.interrupt_signaled = False
+        self.assertFalse(self.cpu.interrupt_signaled)
+        
+    def test_sti_takes_waiting_interrupt(self):
+        """
+        nop
+        sti
+        nop
+        """
+        self.load_code_string("90 FB 90")
+        self.cpu.interrupt_signaled = True
+        self.cpu.fetch()
+        self.assertFalse(self.cpu.attention) # Nothing to do until interrupts are enabled.
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        
+        self.cpu.fetch()
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.CS, 0x0050)
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        self.assertEqual(self.memory.mem_read_word(0x10FA), 0x0002)
+        
+    def test_single_step_trap(self):
+        """
+        popf
+        nop
+        nop
+        """
+        self.load_code_string("9D 90 90")
+        self.memory.mem_write_word(0x1100, FLAGS.TRAP)
+        self.cpu.regs.SP = 0x0100
+        self.cpu.fetch()
+        self.assertTrue(self.cpu.flags.trap)
+        
+        # The instruction after POPF runs, then the trap is taken.
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.IP, 0x0002)
+        start = self.cpu.cycles
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.CS, 0x0050)
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        self.assertEqual(self.cpu.cycles - start, TRAP_CYCLES + INSTRUCTION_CYCLES[0xF4][0])
+        self.assertFalse(self.cpu.flags.trap)
+        self.assertEqual(self.memory.mem_read_word(0x10FC), 0x0002)
+        self.assertTrue(self.memory.mem_read_word(0x1100) & FLAGS.TRAP)
+        
+    def test_request_break(self):
+        calls = []
+        self.cpu.break_handler = lambda: calls.append(self.cpu.regs.IP)
+        self.load_code_string("90 90 90")
+        self.cpu.fetch()
+        self.cpu.request_break()
+        self.cpu.fetch()
+        self.cpu.fetch()
+        self.assertEqual(calls, [0x0001])
+        self.assertEqual(self.cpu.regs.IP, 0x0003)
+        
+class CodeWindowTests(BaseOpcodeAcceptanceTests):
+    def setUp(self):
+        super(CodeWindowTests, self).setUp()
+        self.high_memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x10000, self.high_memory)
+        
+    def test_fetch_opens_window(self):
+        self.load_code_string("90 F4")
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.code_window_base, 0x00000)
+        self.assertEqual(self.cpu.code_window_limit, SIXTY_FOUR_KB)
+        self.assertEqual(self.cpu.code_window[1], 0xF4)
+        
+    def test_sees_writes(self):
+        self.load_code_string("90 90 F4")
+        self.cpu.fetch()
+        self.memory.mem_write_byte(0x0001, 0xF4)
+        self.cpu.fetch()
+        self.assertTrue(self.cpu.hlt)
+        self.assertEqual(self.cpu.regs.IP, 0x0002)
+        
+    def test_moves_to_next_block(self):
+        """
+        mov ax, 0x1234 (crossing from 0FFFF to 10000)
+        hlt
+        """
+        self.cpu.regs.CS = 0x0FFF
+        self.memory.mem_write_byte(0xFFFF, 0xB8)
+        self.high_memory.mem_write_byte(0x0000, 0x34)
+        self.high_memory.mem_write_byte(0x0001, 0x12)
+        self.high_memory.mem_write_byte(0x0002, 0xF4)
+        self.assertEqual(self.run_to_halt(starting_ip = 0x000F), 2)
+        self.assertEqual(self.cpu.regs.AX, 0x1234)
+        self.assertEqual(self.cpu.code_window_base, 0x10000)
+        
+    def test_word_immediate_ip_wraps(self):
+        """
+        mov ax, 0x1234 (the immediate wraps from CS:FFFF to CS:0000)
+        """
+        self.cpu.regs.CS = 0x0100
+        self.high_memory.mem_write_byte(0x0FFE, 0xB8)
+        self.high_memory.mem_write_byte(0x0FFF, 0x34)
+        self.high_memory.mem_write_byte(0x1000, 0xCC) # Not part of the segment at this IP.
+        self.memory.mem_write_byte(0x1000, 0x12)
+        self.cpu.regs.IP = 0xFFFE
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.AX, 0x1234)
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        
+    def test_invalidate(self):
+        self.load_code_string("90 F4")
+        self.cpu.fetch()
+        self.cpu.invalidate_code_window()
+        self.assertIsNone(self.cpu.code_window)
+        self.assertEqual(self.cpu.code_window_limit, 0)
+        self.cpu.fetch()
+        self.assertTrue(self.cpu.hlt)
+        
+    def test_hooked_memory_read_through_bus(self):
+        fetched = []
+        read_byte = self.memory.mem_read_byte
+        def _mem_read_byte(offset):
+            fetched.append(offset)
+            return read_byte(offset)
+        self.memory.mem_read_byte = _mem_read_byte
+        
+        self.load_code_string("90 F4")
+        self.assertEqual(self.run_to_halt(), 2)
+        self.assertEqual(fetched, [0x0000, 0x0001])
+        self.assertIsNone(self.cpu.code_window)
+        
+class IdleLoopTests(BaseOpcodeAcceptanceTests):
+    def setUp(self):
+        super(IdleLoopTests, self).setUp()
+        self.cpu.flags.interrupt_enable = True
+        self.cpu.detect_idle_loops(True)
+        
+    def test_polling_loop_halts(self):
+        """
+        again:
+            cmp byte [0x100], 0
+            jz again
+        hlt
+        """
+        self.load_code_string("80 3E 00 01 00 74 F9 F4")
+        self.cpu.regs.IP = 0
+        for _unused in range(4):
+            self.cpu.fetch()
+            
+        # Halted at the top of the loop so an interrupt returns there.
+        self.assertTrue(self.cpu.hlt)
+        self.assertEqual(self.cpu.regs.IP, 0x0000)
+        
+    def test_jmp_short_loop_halts(self):
+        """
+        again:
+            jmp again
+        """
+        self.load_code_string("EB FE")
+        self.cpu.regs.IP = 0
+        self.cpu.fetch()
+        self.cpu.fetch()
+        self.assertTrue(self.cpu.hlt)
+        
+    def test_loop_with_side_effects_does_not_halt(self):
+        """
+        again:
+            inc byte [0x100]
+            jmp again
+        """
+        self.load_code_string("FE 06 00 01 EB FA")
+        self.cpu.regs.IP = 0
+        for _unused in range(20):
+            self.cpu.fetch()
+        self.assertFalse(self.cpu.hlt)
+        
+    def test_loop_with_changing_registers_does_not_halt(self):
+        """
+        again:
+            inc ax
+            jnz again
+        """
+        self.load_code_string("40 75 FD")
+        self.cpu.regs.IP = 0
+        for _unused in range(20):
+            self.cpu.fetch()
+        self.assertFalse(self.cpu.hlt)
+        
+    def test_interrupts_disabled_does_not_halt(self):
+        self.cpu.flags.interrupt_enable = False
+        self.load_code_string("EB FE")
+        self.cpu.regs.IP = 0
+        for _unused in range(4):
+            self.cpu.fetch()
+        self.assertFalse(self.cpu.hlt)
+        
+    def test_detection_disabled(self):
+        self.cpu.detect_idle_loops(False)
+        self.load_code_string("EB FE")
+        self.cpu.regs.IP = 0
+        for _unused in range(4):
+            self.cpu.fetch()
+        self.assertFalse(self.cpu.hlt)
+        
+class BusyWaitTests(BaseOpcodeAcceptanceTests):
+    def setUp(self):
+        super(BusyWaitTests, self).setUp()
+        self.port_tester = IOPortTester()
+        self.bus.install_device(None, self.port_tester)
+        self.cpu.collapse_busy_waits(True)
+        
+    def run_polling_loop(self, code):
+        self.load_code_string(code)
+        self.cpu.regs.IP = 0
+        for _unused in range(12):
+            self.cpu.fetch()
+            
+    def test_status_polling_loop_halts(self):
+        """
+        again:
+            in al, 0x40
+            test al, 1
+            jz again
+        """
+        self.run_polling_loop("E4 40 A8 01 74 FA")
+        self.assertTrue(self.cpu.hlt)
+        self.assertTrue(self.cpu.busy_wait)
+        self.assertEqual(self.cpu.regs.IP, 0x0000)
+        
+    def test_interrupts_disabled_still_halts(self):
+        self.cpu.flags.interrupt_enable = False
+        self.run_polling_loop("E4 40 A8 01 74 FA")
+        self.assertTrue(self.cpu.busy_wait)
+        
+    def test_loop_with_port_writes_does_not_halt(self):
+        """
+        again:
+            out 0x41, al
+            in al, 0x40
+            test al, 1
+            jz again
+        """
+        self.run_polling_loop("E6 41 E4 40 A8 01 74 F8")
+        self.assertFalse(self.cpu.hlt)
+        
+    def test_detection_disabled(self):
+        self.cpu.collapse_busy_waits(False)
+        self.run_polling_loop("E4 40 A8 01 74 FA")
+        self.assertFalse(self.cpu.hlt)
+        
+    def test_idle_loop_without_reads_is_not_a_busy_wait(self):
+        self.cpu.flags.interrupt_enable = True
+        self.cpu.detect_idle_loops(True)
+        self.run_polling_loop("EB FE")
+        self.assertTrue(self.cpu.hlt)
+        self.assertFalse(self.cpu.busy_wait)
+        
+    def test_interrupt_clears_busy_wait(self):
+        self.run_polling_loop("E4 40 A8 01 74 FA")
+        self.cpu.flags.interrupt_enable = True
+        self.cpu.regs.SP = 0x1000
+        self.bus.pic = InterruptAcknowledgeStub(0x08)
+        self.cpu.interrupt_signaled = True
+        self.cpu.process_interrupts()
+        self.assertFalse(self.cpu.hlt)
+        self.assertFalse(self.cpu.busy_wait)
+        
+class CycleCountTests(BaseOpcodeAcceptanceTests):
+    def run_one(self, code):
+        """ Run a single instruction and return the number of cycles it took. """
+        self.load_code_string(code)
+        self.cpu.regs.IP = 0
+        start = self.cpu.cycles
+        self.cpu.fetch()
+        return self.cpu.cycles - start
+        
+    def test_register_form(self):
+        self.assertEqual(self.run_one("01 D8"), 3) # add ax, bx
+        
+    def test_memory_form_includes_ea(self):
+        self.assertEqual(self.run_one("01 00"), 24 + 7) # add [bx+si], ax
+        self.assertEqual(self.run_one("01 47 10"), 24 + 9) # add [bx+0x10], ax
+        self.assertEqual(self.run_one("01 06 00 01"), 24 + 6) # add [0x100], ax
+        
+    def test_no_modrm(self):
+        self.assertEqual(self.run_one("B8 34 12"), 4) # mov ax, 0x1234
+        
+    def test_no_modrm_ignores_previous_modrm(self):
+        self.run_one("01 00")
+        self.assertEqual(self.run_one("F8"), 2) # clc
+        
+    def test_group_sub_opcode(self):
+        self.assertEqual(self.run_one("F7 D0"), 3) # not ax
+        self.cpu.regs.BX = 1
+        self.assertEqual(self.run_one("F7 F3"), 153) # div bx
+        
+    def test_segment_override_prefix(self):
+        self.assertEqual(self.run_one("26 01 00"), 2 + 24 + 7) # add [es:bx+si], ax
+        
+    def test_jump_taken(self):
+        self.cpu.flags.zero = True
+        self.assertEqual(self.run_one("74 10"), 16) # jz
+        self.cpu.flags.zero = False
+        self.assertEqual(self.run_one("74 10"), 4)
+        
+    def test_shift_by_cl(self):
+        self.cpu.regs.CL = 3
+        self.assertEqual(self.run_one("D3 E0"), 8 + (3 * 4)) # shl ax, cl
+        
+    def test_rep_string(self):
+        self.cpu.regs.CX = 3
+        self.cpu.regs.DI = 0x100
+        self.assertEqual(self.run_one("F3 AA"), 9 + (3 * 10)) # rep stosb
+        
+    def test_repz_string_stops_early(self):
+        self.cpu.regs.CX = 5
+        self.cpu.regs.SI = 0x100
+        self.cpu.regs.DI = 0x200
+        self.memory.mem_write_byte(0x101, 0xFF)
+        self.assertEqual(self.run_one("F3 A6"), 9 + (2 * 22)) # repz cmpsb
+        self.assertEqual(self.cpu.regs.CX, 3)
+        
+    def test_collapsed_delay_loop_charges_iterations(self):
+        self.cpu.collapse_delay_loops(True)
+        self.cpu.regs.CX = 10
+        self.assertEqual(self.run_one("E2 FE"), 5 + (9 * 17)) # loop $
+        
+    def test_hardware_interrupt(self):
+        self.cpu.regs.SP = 0x1000
+        self.cpu.flags.interrupt_enable = True
+        self.cpu.interrupt_signaled = True
+        self.bus.pic = InterruptAcknowledgeStub(0x08)
+        self.memory.mem_write_word(0x20, 0x0000)
+        self.memory.mem_write_word(0x22, 0x0050)
+        self.memory.mem_write_byte(0x500, 0xF8) # clc
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.cycles, 61 + 2)
+        
+class FusionTests(BaseOpcodeAcceptanceTests):
+    def setUp(self):
+        super(FusionTests, self).setUp()
+        self.port_tester = IOPortTester()
+        self.bus.install_device(None, self.port_tester)
+        
+    def run_fused_and_unfused(self, code, **registers):
+        """ Run code to HLT with and without fusion, checking both end the same, and return the fusion counts. """
+        results = []
+        for fused in (False, True):
+            self.setUp()
+            self.load_code_string(code)
+            for name, value in registers.items():
+                setattr(self.cpu.regs, name, value)
+            self.cpu.fuse_instructions(fused)
+            self.run_to_halt()
+            results.append((
+                self.cpu.regs.AX, self.cpu.regs.BX, self.cpu.regs.CX, self.cpu.regs.SI, self.cpu.regs.DI,
+                self.cpu.regs.IP, self.cpu.flags.value, self.cpu.cycles, self.cpu.instruction_count,
+            ))
+        self.assertEqual(results[0], results[1])
+        return self.cpu.fusion_counts
+        
+    def test_cmp_jcc_taken(self):
+        """
+            cmp al, 5
+            jz done
+            mov bl, 1
+        done:
+            hlt
+        """
+        counts = self.run_fused_and_unfused("3C 05 74 02 B3 01 F4", AX = 5)
+        self.assertEqual(counts["cmp-jcc"], 1)
+        self.assertEqual(self.cpu.regs.BL, 0)
+        
+    def test_cmp_jcc_not_taken(self):
+        counts = self.run_fused_and_unfused("3C 05 74 02 B3 01 F4", AX = 4)
+        self.assertEqual(counts["cmp-jcc"], 1)
+        self.assertEqual(self.cpu.regs.BL, 1)
+        
+    def test_cmp_jcc_sign_and_overflow(self):
+        # cmp al, 0xFF with AL = 0x7F sets SF and OF, 127 isn't less than -1.
+        for opcode, taken in ((0x7C, False), (0x7D, True), (0x7E, False), (0x7F, True)):
+            counts = self.run_fused_and_unfused("3C FF %02X 02 B3 01 F4" % opcode, AX = 0x7F)
+            self.assertEqual(counts["cmp-jcc"], 1)
+            self.assert_flags("SO")
+            self.assertEqual(self.cpu.regs.BL, 0 if taken else 1)
+            
+    def test_dec_jnz(self):
+        """
+            mov cx, 5
+        again:
+            dec cx
+            jnz again
+            hlt
+        """
+        counts = self.run_fused_and_unfused("B9 05 00 49 75 FD F4")
+        self.assertEqual(counts["dec-jnz"], 5)
+        self.assertEqual(self.cpu.regs.CX, 0)
+        
+    def test_lodsb_stosb(self):
+        self.memory.mem_write_byte(0x100, 0x42)
+        counts = self.run_fused_and_unfused("AC AA F4", SI = 0x100, DI = 0x200)
+        self.assertEqual(counts["lodsb-stosb"], 1)
+        
+    def test_in_test_jcc(self):
+        """
+            in al, 0x60
+            test al, 0x80
+            jnz done
+            mov bl, 1
+        done:
+            hlt
+        """
+        counts = self.run_fused_and_unfused("E4 60 A8 80 75 02 B3 01 F4")
+        self.assertEqual(counts["in-test-jcc"], 1)
+        self.assertEqual(self.cpu.regs.BL, 1)
+        
+    def test_not_fused_single_stepping(self):
+        # The trap flag keeps attention set, so the trap is taken after the CMP.
+        self.load_code_string("3C 05 74 02 B3 01 F4")
+        self.cpu.fuse_instructions(True)
+        self.cpu.flags.trap = True
+        self.cpu.attention = True
+        self.cpu.regs.IP = 0
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.IP, 2)
+        self.assertEqual(self.cpu.fusion_counts["cmp-jcc"], 0)
+        
+    def test_not_fused_past_deadline(self):
+        self.load_code_string("3C 05 74 02 B3 01 F4")
+        self.cpu.fuse_instructions(True)
+        self.cpu.deadline = self.cpu.cycles + 4
+        self.cpu.regs.IP = 0
+        self.cpu.fetch()
+        self.assertEqual(self.cpu.regs.IP, 2)
+        self.assertEqual(self.cpu.instruction_count, 1)
+        
+    def test_disable_restores_handlers(self):
+        handler = self.cpu.opcode_vector[0x3C]
+        self.cpu.fuse_instructions(True)
+        self.assertIsNot(self.cpu.opcode_vector[0x3C], handler)
+        self.cpu.fuse_instructions(False)
+        self.assertIs(self.cpu.opcode_vector[0x3C], handler)
@@ -0,0 +1,34 @@
+import unittest
+
+from pyxt.crtc import *
+from pyxt.scheduler import TICK_FREQUENCY
+
+class RasterTimingTests(unittest.TestCase):
+    def setUp(self):
+        # Two dots per tick, 10 dot lines and 5 line frames.
+        self.timing = RasterTiming(TICK_FREQUENCY * 2, 10, 5)
+        
+    def test_position(self):
+        self.assertEqual(self.timing.position(0), (0, 0))
+        self.assertEqual(self.timing.position(4), (0, 8))
+        self.assertEqual(self.timing.position(5), (1, 0))
+        self.assertEqual(self.timing.position(24), (4, 8))
+        self.assertEqual(self.timing.position(25), (0, 0))
+        
+    def test_ticks_until(self):
+        self.assertEqual(self.timing.ticks_until(0, 1, 0), 5)
+        self.assertEqual(self.timing.ticks_until(0, 0, 3), 2)
+        self.assertEqual(self.timing.ticks_until(6, 1, 0), 24)
+        self.assertEqual(self.timing.ticks_until(6, 5, 0), 19)
+        
+    def test_ticks_until_uneven_clock(self):
+        # The MDA's dot clock isn't a multiple of the tick rate, the first tick at or past the dot is returned.
+        timing = RasterTiming(16257000, 882, 370)
+        for ticks in (0, 1, 1000, 95829):
+            line, dot = timing.position(ticks)
+            until = timing.ticks_until(ticks, line, dot + 100)
+            self.assertGreaterEqual(timing.position(ticks + until)[1], dot + 100)
+            self.assertLess(timing.position(ticks + until - 1)[1], dot + 100)
+            
+    def test_line_ticks(self):
+        self.assertEqual(self.timing.line_ticks, 5)
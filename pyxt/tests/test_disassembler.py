@@ -0,0 +1,87 @@
+import unittest
+
+from pyxt.disassembler import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.memory import RAM
+from pyxt.tests.utils import SystemBusTestable
+
+class DisassembleTests(unittest.TestCase):
+    def disassemble(self, data, segment = 0x0000, offset = 0x0000):
+        memory = bytearray(SIXTY_FOUR_KB)
+        memory[offset:offset + len(data)] = bytearray(data)
+        return disassemble(memory.__getitem__, segment, offset)
+        
+    def assertDisassembles(self, data, text, offset = 0x0000):
+        self.assertEqual(self.disassemble(data, offset = offset), (len(data), text))
+        
+    def test_register_operands(self):
+        self.assertDisassembles([0x89, 0xD8], "mov ax,bx")
+        self.assertDisassembles([0x88, 0xE0], "mov al,ah")
+        self.assertDisassembles([0x8E, 0xD8], "mov ds,ax")
+        self.assertDisassembles([0x90], "nop")
+        
+    def test_memory_operands(self):
+        self.assertDisassembles([0x8B, 0x46, 0x10], "mov ax,[bp+0x10]")
+        self.assertDisassembles([0x8B, 0x40, 0xFE], "mov ax,[bx+si-0x2]")
+        self.assertDisassembles([0x26, 0xA1, 0x34, 0x12], "mov ax,[es:0x1234]")
+        self.assertDisassembles([0xF0, 0xFE, 0x07], "lock inc byte [bx]")
+        
+    def test_immediates(self):
+        self.assertDisassembles([0xB8, 0x34, 0x12], "mov ax,0x1234")
+        self.assertDisassembles([0x83, 0xC3, 0xFB], "add bx,0xfffb")
+        
+    def test_string_prefixes(self):
+        self.assertDisassembles([0xF3, 0xA4], "rep movsb")
+        self.assertDisassembles([0xF3, 0xA6], "repe cmpsb")
+        self.assertDisassembles([0x26, 0xA4], "es movsb")
+        
+    def test_branches(self):
+        self.assertDisassembles([0xEB, 0xFE], "jmp short 0x100", offset = 0x0100)
+        self.assertDisassembles([0xEA, 0x5B, 0xE0, 0x00, 0xF0], "jmp 0xf000:0xe05b")
+        self.assertDisassembles([0xFF, 0x1E, 0x34, 0x12], "call far [0x1234]")
+        
+    def test_unknown(self):
+        self.assertDisassembles([0x0F], "db 0x0f")
+        self.assertDisassembles([0xDC, 0x07], "esc 0x20,[bx]")
+        
+class DisassemblerTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.disassembler = Disassembler(self.bus)
+        
+        # MOV AX, 1234 / INC AX / JMP 0100
+        for index, value in enumerate([0xB8, 0x34, 0x12, 0x40, 0xEB, 0xFA]):
+            self.memory.mem_write_byte(0x0100 + index, value)
+            
+    def test_cached_by_physical_address(self):
+        self.assertEqual(self.disassembler.text(0x0000, 0x0100), "mov ax,0x1234")
+        self.assertEqual(self.disassembler.text(0x0010, 0x0000), "mov ax,0x1234")
+        self.assertEqual((self.disassembler.misses, self.disassembler.hits), (1, 1))
+        
+    def test_relative_target_follows_offset(self):
+        self.assertEqual(self.disassembler.text(0x0000, 0x0104), "jmp short 0x100")
+        self.assertEqual(self.disassembler.text(0x0010, 0x0004), "jmp short 0x0")
+        self.assertEqual(self.disassembler.hits, 1)
+        
+    def test_changed_code_decoded_again(self):
+        self.assertEqual(self.disassembler.text(0x0000, 0x0103), "inc ax")
+        self.memory.mem_write_byte(0x0103, 0x48)
+        self.assertEqual(self.disassembler.text(0x0000, 0x0103), "dec ax")
+        self.assertEqual(self.disassembler.misses, 2)
+        
+    def test_invalidate(self):
+        self.disassembler.text(0x0000, 0x0100)
+        self.disassembler.invalidate(0x0100)
+        self.disassembler.text(0x0000, 0x0100)
+        self.assertEqual(self.disassembler.misses, 2)
+        
+    def test_listing(self):
+        lines, offset = self.disassembler.listing(0x0000, 0x0100, 3)
+        self.assertEqual(lines, [
+            "0000:0100  b83412         mov ax,0x1234",
+            "0000:0103  40             inc ax",
+            "0000:0104  ebfa           jmp short 0x100",
+        ])
+        self.assertEqual(offset, 0x0106)
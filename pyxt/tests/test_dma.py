@@ -281,4 +281,103 @@ class DMATests(unittest.TestCase):
         self.assertEqual(self.dma.channels[0].address, 4)
         self.assertTrue(self.terminal_count)
         
+    def test_ticks_until_event(self):
+        self.assertIsNone(self.dma.ticks_until_event())
+        
+        self.dma.enable = True
+        self.assertIsNone(self.dma.ticks_until_event())
+        
+        # RAM refresh doesn't count as an event.
+        self.dma.channels[0].word_count = 3
+        self.dma.dma_request(0, 0)
+        self.assertIsNone(self.dma.ticks_until_event())
+        
+        self.dma.channels[2].word_count = 511
+        self.dma.dma_request(2, 5643)
+        self.assertEqual(self.dma.ticks_until_event(), 512)
+        
+    def test_fast_forward_refresh(self):
+        self.dma.enable = True
+        self.dma.channels[0].word_count = 0x1000
+        self.dma.channels[0].address = 0
+        self.dma.dma_request(0, 0)
+        
+        self.dma.fast_forward(0x800)
+        self.assertEqual(self.dma.channels[0].word_count, 0x0800)
+        self.assertEqual(self.dma.channels[0].address, 0x0800)
+        self.assertEqual(self.dma.channels[0].transfer_count, 0x0800)
+        self.assertTrue(self.dma.channels[0].requested)
+        
+        self.dma.fast_forward(0x10000)
+        self.assertEqual(self.dma.channels[0].word_count, 0xFFFF)
+        self.assertEqual(self.dma.channels[0].address, 0x1001)
+        self.assertFalse(self.dma.channels[0].requested)
+        self.assertTrue(self.dma.channels[0].reached_terminal_count)
+        
+    def test_computed_refresh(self):
+        self.dma.enable = True
+        self.dma.channels[0].word_count = self.dma.channels[0].base_word_count = 0x1000
+        self.dma.dma_request(0, 0)
+        self.dma.dma_refresh(72)
+        self.assertFalse(self.dma.channels[0].requested)
+        
+        # Nothing moves until the controller is read.
+        self.dma.fast_forward(72 * 0x800 + 10)
+        self.assertEqual(self.dma.channels[0].address, 0)
+        self.assertEqual(self.dma.io_read_byte(0x00), 0x00)
+        self.assertEqual(self.dma.io_read_byte(0x00), 0x08)
+        self.assertEqual(self.dma.channels[0].word_count, 0x0800)
+        self.assertEqual(self.dma.channels[0].transfer_count, 0x0800)
+        self.assertEqual(self.dma.refresh_ticks, 10)
+        
+    def test_computed_refresh_terminal_count(self):
+        self.dma.enable = True
+        self.dma.channels[0].address = 0x0010
+        self.dma.channels[0].word_count = 0x0010
+        self.dma.dma_refresh(4)
+        
+        # Without auto-init the count wraps like it does when the timer requests each cycle.
+        self.dma.fast_forward(4 * 0x13)
+        self.dma.update_refresh()
+        self.assertEqual(self.dma.channels[0].word_count, 0xFFFD)
+        self.assertEqual(self.dma.channels[0].address, 0x0023)
+        self.assertTrue(self.dma.channels[0].reached_terminal_count)
+        
+    def test_computed_refresh_auto_init(self):
+        self.dma.io_write_byte(0x0B, 0x58) # Channel 0 single mode, auto-init, read.
+        self.dma.channels[0].address = self.dma.channels[0].base_address = 0x0100
+        self.dma.channels[0].word_count = self.dma.channels[0].base_word_count = 0x000F
+        self.dma.enable = True
+        self.dma.dma_refresh(4)
+        
+        self.dma.fast_forward(4 * 0x35)
+        self.dma.update_refresh()
+        self.assertEqual(self.dma.channels[0].word_count, 0x000A)
+        self.assertEqual(self.dma.channels[0].address, 0x0105)
+        self.assertTrue(self.dma.channels[0].reached_terminal_count)
+        
+    def test_computed_refresh_stopped(self):
+        self.dma.enable = True
+        self.dma.dma_refresh(4)
+        self.dma.fast_forward(8)
+        self.dma.dma_refresh(None)
+        self.dma.fast_forward(8)
+        self.dma.update_refresh()
+        self.assertEqual(self.dma.channels[0].word_count, 0xFFFE)
+        self.assertEqual(self.dma.refresh_ticks, 0)
+        
+    def test_fast_forward_transfer(self):
+        transferred = []
+        self.dma.transfer_byte = lambda channel, address: transferred.append(address)
+        self.dma.enable = True
+        self.dma.channels[2].word_count = 3
+        self.dma.channels[2].address = 0x10
+        self.dma.channels[2].page_register_value = 0x01
+        self.dma.dma_request(2, 5643, self.signal_terminal_count)
+        
+        self.dma.fast_forward(100)
+        self.assertEqual(transferred, [0x10010, 0x10011, 0x10012, 0x10013])
+        self.assertEqual(self.dma.channels[2].word_count, 0xFFFF)
+        self.assertEqual(self.dma.channels[2].transfer_count, 4)
+        self.assertTrue(self.terminal_count)
         
\ No newline at end of file
@@ -622,6 +622,7 @@ class FDCAcceptanceTests(unittest.TestCase):
         self.fdc.cursor = 511 # TODO: Was 9215, which is right?!
         self.assertEqual(self.bus.get_irq_log(), [6, 6, 6]) # Assume there would have been one for all bytes ready to have been read.
         self.assertEqual(self.fdc.io_read_byte(0x3F5), 0xFE)
+        self.assertEqual(self.fdc.sectors_read, 2) # Reading the last byte loaded the next sector.
         
         self.fdc.terminal_count()
         
@@ -645,6 +646,7 @@ class FDCAcceptanceTests(unittest.TestCase):
         self.assertEqual(self.bus.get_irq_log(), [6]) # Abnormal termination... IRQ!
         self.assertEqual(self.fdc.state, ST_RDDATA_READ_STATUS_REG_0)
         self.assertEqual(self.fdc.io_read_byte(0x3F5), 0x48) # Abnormal exit, not ready.
+        self.assertEqual(self.fdc.sectors_read, 0)
         
     def test_sense_drive_status(self):
         self.fdc.io_write_byte(0x3F5, 0x04) # Sense drive status.
@@ -0,0 +1,100 @@
+import unittest
+
+from pyxt.fuzz import *
+
+def break_inc(cpu):
+    """ INC reg16 that adds two. """
+    inc = cpu.opcode_vector[0x40]
+    def _inc(opcode):
+        inc(opcode)
+        inc(opcode)
+    for opcode in range(0x40, 0x48):
+        cpu.opcode_vector[opcode] = _inc
+        
+class FuzzCaseTests(unittest.TestCase):
+    def test_generate_is_repeatable(self):
+        self.assertEqual(str(generate_case(1234)), str(generate_case(1234)))
+        self.assertNotEqual(str(generate_case(1234)), str(generate_case(1235)))
+        
+    def test_generate_length(self):
+        case = generate_case(1, length = 5)
+        self.assertEqual(len(case.instructions), 5)
+        self.assertEqual(case.registers["CS"], CODE_SEGMENT)
+        
+    def test_replace(self):
+        case = generate_case(1)
+        copy = case.replace(memory_seed = None)
+        self.assertIsNone(copy.memory_seed)
+        self.assertIsNotNone(case.memory_seed)
+        self.assertEqual(copy.instructions, case.instructions)
+        
+class RunCaseTests(unittest.TestCase):
+    def make_case(self, instructions, **registers):
+        values = dict((name, 0) for name in REGISTER_NAMES)
+        values.update(CS = CODE_SEGMENT, IP = 0x0100, SP = 0x1000)
+        values.update(registers)
+        return FuzzCase(0, instructions, values, 0, None)
+        
+    def test_runs_until_code_is_left(self):
+        # MOV AX, 1234 / PUSH AX
+        state = run_case(self.make_case([b"\xB8\x34\x12", b"\x50"]))
+        self.assertIsNone(state.error)
+        self.assertEqual(state.registers["AX"], 0x1234)
+        self.assertEqual(state.registers["IP"], 0x0104)
+        self.assertEqual(state.memory[0x0FFE:0x1000], b"\x34\x12")
+        
+    def test_error_is_state(self):
+        state = run_case(self.make_case([b"\x0F"]))
+        self.assertTrue(state.error.startswith("InvalidOpcodeException"))
+        
+    def test_unfinished(self):
+        # JMP $
+        self.assertIsNone(run_case(self.make_case([b"\xEB\xFE"]), max_instructions = 100))
+        
+    def test_memory_reset_between_runs(self):
+        case = self.make_case([b"\xA2\x00\x00"], AX = 0x00FF, DS = 0x2000)
+        self.assertEqual(run_case(case).memory[0x20000], 0xFF)
+        self.assertEqual(run_case(case.replace(instructions = [b"\x90"])).memory[0x20000], 0x00)
+        
+    def test_collapsed_delay_loop_matches(self):
+        # LOOP $
+        case = self.make_case([b"\xE2\xFE"], CX = 100)
+        self.assertEqual(check_case(case, "collapse-delay-loops"), [])
+        
+    def test_fused_instructions_match(self):
+        # CMP AL, 5 / JZ +0 / DEC CX / JNZ -3
+        case = self.make_case([b"\x3C\x05", b"\x74\x00", b"\x49", b"\x75\xFD"], CX = 3)
+        self.assertEqual(check_case(case, "fuse-instructions"), [])
+        
+    def test_difference_found(self):
+        VARIANTS["broken-inc"] = break_inc
+        try:
+            # MOV AX, FFFF / INC AX
+            differences = check_case(self.make_case([b"\xB8\xFF\xFF", b"\x40"]), "broken-inc")
+        finally:
+            del VARIANTS["broken-inc"]
+            
+        self.assertEqual(differences, ["flags: expected 61524, got 61440", "AX: expected 0, got 1"])
+        
+class FuzzTests(unittest.TestCase):
+    def setUp(self):
+        VARIANTS["broken-inc"] = break_inc
+        
+    def tearDown(self):
+        del VARIANTS["broken-inc"]
+        
+    def test_shrinks_failures(self):
+        failures = []
+        for seed, seed_failures in fuzz(range(50), variants = ["broken-inc"], jobs = 1):
+            failures.extend((seed, case) for _variant, case, _differences in seed_failures)
+            
+        self.assertTrue(failures)
+        for seed, case in failures:
+            self.assertEqual(case.seed, seed)
+            self.assertTrue(any(0x40 <= value <= 0x47 for value in bytearray(case.code())))
+            self.assertIsNone(case.memory_seed)
+            
+    def test_pool(self):
+        results = dict(fuzz(range(4), variants = ["collapse-delay-loops"], jobs = 2))
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertEqual(list(results.values()), [[]] * 4)
@@ -0,0 +1,154 @@
+import socket
+import unittest
+from binascii import hexlify
+
+from pyxt.gdbstub import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+from pyxt.tests.utils import SystemBusTestable
+
+def make_packet(data):
+    return ("$%s#%02x" % (data, checksum(data.encode("latin-1")))).encode("latin-1")
+    
+class GdbStubTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.cpu.regs.CS = 0x0000
+        self.cpu.regs.IP = 0x0000
+        
+        # INC AX, MOV [0472], AL, JMP 0000
+        for index, value in enumerate([0x40, 0xA2, 0x72, 0x04, 0xEB, 0xFA]):
+            self.memory.mem_write_byte(index, value)
+            
+        self.stub = GdbStub(self.cpu, self.bus, self.cpu.fetch, ("127.0.0.1", 0))
+        
+    def tearDown(self):
+        self.stub.close()
+        
+    def test_parse_address(self):
+        self.assertEqual(parse_address("1234"), ("127.0.0.1", 1234))
+        self.assertEqual(parse_address("/tmp/pyxt.sock"), "/tmp/pyxt.sock")
+        
+    def test_checksum(self):
+        self.assertEqual(make_packet("OK"), b"$OK#9a")
+        
+    def test_read_registers(self):
+        self.cpu.regs.AX = 0x1234
+        self.cpu.regs.CS = 0xF000
+        self.cpu.regs.IP = 0xE05B
+        data = self.stub.handle_packet("g")
+        self.assertEqual(len(data), len(GDB_REGISTERS) * REGISTER_SIZE * 2)
+        self.assertEqual(data[:8], "34120000")
+        self.assertEqual(data[8 * 8:9 * 8], "5be00000")
+        self.assertEqual(data[10 * 8:11 * 8], "00f00000")
+        self.assertEqual(self.stub.handle_packet("p9"), hexlify(struct.pack("<I", self.cpu.flags.value)).decode("ascii"))
+        self.assertEqual(self.stub.handle_packet("p20"), "E01")
+        
+    def test_write_registers(self):
+        data = self.stub.handle_packet("g")
+        self.assertEqual(self.stub.handle_packet("G" + "ffff0000" + data[8:]), "OK")
+        self.assertEqual(self.cpu.regs.AX, 0xFFFF)
+        self.assertEqual(self.stub.handle_packet("P3=cdab0000"), "OK")
+        self.assertEqual(self.cpu.regs.BX, 0xABCD)
+        self.assertEqual(self.stub.handle_packet("P9=01000000"), "OK")
+        self.assertTrue(self.cpu.flags.carry)
+        
+    def test_memory(self):
+        self.assertEqual(self.stub.handle_packet("m0,4"), "40a27204")
+        self.assertEqual(self.stub.handle_packet("M470,2:3412"), "OK")
+        self.assertEqual(self.bus.mem_read_word(0x470), 0x1234)
+        
+    def test_breakpoints(self):
+        self.assertEqual(self.stub.handle_packet("Z0,4,1"), "OK")
+        self.assertIn(0x00004, self.stub.breakpoints.addresses)
+        self.assertEqual(self.stub.handle_packet("z0,4,1"), "OK")
+        self.assertEqual(len(self.stub.breakpoints), 0)
+        
+    def test_watchpoints(self):
+        self.assertEqual(self.stub.handle_packet("Z4,472,2"), "OK")
+        self.assertEqual([str(watchpoint) for watchpoint in self.stub.watchpoints],
+                         ["read 0x00472-0x00473", "write 0x00472-0x00473"])
+        self.assertEqual(self.stub.handle_packet("z4,472,2"), "OK")
+        self.assertEqual(len(self.stub.watchpoints), 0)
+        self.assertEqual(self.stub.handle_packet("Z2,20000,1"), "E01")
+        
+    def test_unsupported(self):
+        self.assertEqual(self.stub.handle_packet("vMustReplyEmpty"), "")
+        self.assertEqual(self.stub.handle_packet("qSymbol::"), "")
+        
+class GdbStubSessionTests(GdbStubTests):
+    def setUp(self):
+        super(GdbStubSessionTests, self).setUp()
+        self.gdb, client = socket.socketpair()
+        self.stub.client = client
+        
+    def tearDown(self):
+        self.gdb.close()
+        super(GdbStubSessionTests, self).tearDown()
+        
+    def received(self):
+        data = b""
+        while select.select([self.gdb], [], [], 0)[0]:
+            chunk = self.gdb.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+        
+    def test_attach_and_continue_to_breakpoint(self):
+        self.gdb.sendall(make_packet("?") + b"+" + make_packet("Z0,4,1") + b"+" + make_packet("c"))
+        self.stub.attach(self.stub.client)
+        self.assertEqual(self.received(), b"+" + make_packet("S05") + b"+" + make_packet("OK") + b"+")
+        
+        # Run up to the breakpoint, where the stub waits for the next command.
+        self.gdb.sendall(make_packet("s"))
+        for _ in range(3):
+            self.stub.fetch()
+        self.assertEqual(self.received(), make_packet("S05") + b"+")
+        self.assertEqual(self.cpu.regs.IP, 0x0000)
+        self.assertEqual(self.cpu.regs.AX, 1)
+        
+        # Stepped over the JMP, the next stop waits for a detach.
+        self.gdb.sendall(make_packet("D"))
+        self.stub.fetch()
+        self.assertEqual(self.received(), make_packet("S05") + b"+" + make_packet("OK"))
+        self.assertFalse(self.stub.attached)
+        self.assertEqual(len(self.stub.breakpoints), 0)
+        self.assertEqual(self.cpu.regs.IP, 0x0001)
+        
+    def test_watchpoint_stop(self):
+        self.gdb.sendall(make_packet("Z2,472,1") + make_packet("c"))
+        self.stub.attach(self.stub.client)
+        self.received()
+        
+        self.gdb.sendall(make_packet("D"))
+        for _ in range(3):
+            self.stub.fetch()
+        self.assertEqual(self.received(), make_packet("T05watch:472;") + b"+" + make_packet("OK"))
+        
+        # Stopped before the JMP, which runs once GDB has detached.
+        self.assertEqual(self.cpu.regs.IP, 0x0000)
+        
+    def test_interrupt(self):
+        self.stub.attention = True
+        self.gdb.sendall(b"\x03" + make_packet("c"))
+        self.stub.poll()
+        self.assertEqual(self.received(), make_packet("S02") + b"+")
+        self.assertTrue(self.stub.attached)
+        self.assertTrue(self.stub.attention)
+        
+    def test_disconnect(self):
+        self.gdb.close()
+        self.stub.attention = True
+        self.stub.poll()
+        self.assertFalse(self.stub.attached)
+        
+    def test_bad_checksum(self):
+        self.gdb.sendall(b"$g#00" + make_packet("D"))
+        self.stub.attach(self.stub.client)
+        self.assertEqual(self.received(), b"-+" + make_packet("OK"))
@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from pyxt.helpers import *
@@ -76,6 +77,21 @@ class CountBitsFastTests(unittest.TestCase):
     def test_word(self):
         self.assertEqual(count_bits_fast(0xF00D), 7)
         
+    def test_lut_matches_count_bits(self):
+        for value in range(0, 0x10000, 0x101):
+            self.assertEqual(HAMMING_WEIGHT_LUT[value], count_bits(value))
+        self.assertEqual(len(HAMMING_WEIGHT_LUT), 0x10000)
+        self.assertEqual(list(build_hamming_weight_lut(3)), [0, 1, 1, 2, 1, 2, 2, 3])
+        
+class RandomBytesTests(unittest.TestCase):
+    def test_size(self):
+        self.assertEqual(len(random_bytes(random.Random(0), 4096)), 4096)
+        self.assertEqual(len(random_bytes(random.Random(0), 0)), 0)
+        
+    def test_seed_is_repeatable(self):
+        self.assertEqual(random_bytes(random.Random(42), 64), random_bytes(random.Random(42), 64))
+        self.assertNotEqual(random_bytes(random.Random(42), 64), random_bytes(random.Random(43), 64))
+        
 class RotateTests(unittest.TestCase):
     # Rotate left 8 bits.
     def test_rotate_left_8_bits_by_1(self):
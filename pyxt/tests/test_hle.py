@@ -0,0 +1,163 @@
+import unittest
+
+from pyxt.constants import *
+from pyxt.hle import *
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+from pyxt.mda import MonochromeDisplayAdapter, MDA_START_ADDRESS
+from pyxt.chargen import CharacterGeneratorMock
+from pyxt.tests.utils import SystemBusTestable
+
+class VideoBiosHLETests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.mda = MonochromeDisplayAdapter(CharacterGeneratorMock(width = 9, height = 14))
+        self.bus.install_device(MDA_START_ADDRESS, self.mda)
+        
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        
+        # INT 10h points at the ROM and the BIOS data area is set up for 80x25 mono.
+        self.memory.mem_write_word(0x40, 0xF065)
+        self.memory.mem_write_word(0x42, 0xF000)
+        self.memory.mem_write_byte(BDA_VIDEO_MODE, 7)
+        self.memory.mem_write_word(BDA_VIDEO_COLUMNS, 80)
+        self.memory.mem_write_word(BDA_VIDEO_PAGE_SIZE, 4096)
+        self.memory.mem_write_word(BDA_VIDEO_PAGE_START, 0)
+        self.memory.mem_write_byte(BDA_ACTIVE_PAGE, 0)
+        self.memory.mem_write_word(BDA_CRTC_BASE_PORT, 0x3B4)
+        
+        self.hle = VideoBiosHLE(self.bus, self.mda)
+        
+    def set_cursor(self, row, column):
+        self.memory.mem_write_word(BDA_CURSOR_POSITIONS, (row << 8) | column)
+        
+    def get_cursor(self):
+        return self.hle.get_cursor_position(0)
+        
+    def fill_rows(self):
+        """ Fill each row with a character and attribute unique to that row. """
+        for row in range(VIDEO_ROWS):
+            for column in range(80):
+                offset = ((row * 80) + column) << 1
+                self.mda.video_ram[offset] = 0x41 + row
+                self.mda.video_ram[offset + 1] = row
+                
+    def teletype(self, character):
+        self.cpu.regs.AH = 0x0E
+        self.cpu.regs.AL = character
+        return self.hle(self.cpu)
+        
+    def test_install(self):
+        self.hle.install(self.cpu)
+        self.assertIs(self.cpu.interrupt_hooks[VIDEO_INTERRUPT], self.hle)
+        
+    def test_unsupported_function_falls_back(self):
+        self.cpu.regs.AH = 0x00
+        self.assertFalse(self.hle(self.cpu))
+        
+    def test_hooked_vector_falls_back(self):
+        self.memory.mem_write_word(0x42, 0x1234)
+        self.assertFalse(self.teletype(0x41))
+        self.assertEqual(self.mda.video_ram[0], 0x00)
+        
+    def test_graphics_mode_falls_back(self):
+        self.memory.mem_write_byte(BDA_VIDEO_MODE, 6)
+        self.assertFalse(self.teletype(0x41))
+        
+    def test_teletype_bell_falls_back(self):
+        self.assertFalse(self.teletype(0x07))
+        
+    def test_teletype_writes_character(self):
+        self.mda.video_ram[(5 * 160) + 20 + 1] = 0x70
+        self.set_cursor(5, 10)
+        self.assertTrue(self.teletype(0x41))
+        self.assertEqual(self.mda.video_ram[(5 * 160) + 20], 0x41)
+        self.assertEqual(self.mda.video_ram[(5 * 160) + 21], 0x70) # Attribute is untouched.
+        self.assertEqual(self.get_cursor(), (5, 11))
+        self.assertEqual(self.mda.cursor.addr, (5 * 80) + 11)
+        
+    def test_teletype_control_characters(self):
+        self.set_cursor(5, 10)
+        self.teletype(0x08)
+        self.assertEqual(self.get_cursor(), (5, 9))
+        self.teletype(0x0D)
+        self.assertEqual(self.get_cursor(), (5, 0))
+        self.teletype(0x08)
+        self.assertEqual(self.get_cursor(), (5, 0))
+        self.teletype(0x0A)
+        self.assertEqual(self.get_cursor(), (6, 0))
+        
+    def test_teletype_wraps_line(self):
+        self.set_cursor(3, 79)
+        self.teletype(0x41)
+        self.assertEqual(self.get_cursor(), (4, 0))
+        
+    def test_teletype_scrolls_at_bottom(self):
+        self.fill_rows()
+        self.set_cursor(24, 3)
+        self.teletype(0x0A)
+        self.assertEqual(self.get_cursor(), (24, 3))
+        self.assertEqual(self.mda.video_ram[0], 0x42)
+        self.assertEqual(self.mda.video_ram[23 * 160], 0x41 + 24)
+        self.assertEqual(self.mda.video_ram[24 * 160], 0x20)
+        self.assertEqual(self.mda.video_ram[(24 * 160) + 1], 24) # Attribute from under the cursor.
+        
+    def test_scroll_up_full_width(self):
+        self.fill_rows()
+        self.cpu.regs.AX = 0x0602
+        self.cpu.regs.BH = 0x07
+        self.cpu.regs.CX = 0x0000
+        self.cpu.regs.DX = 0x184F
+        self.assertTrue(self.hle(self.cpu))
+        self.assertEqual(self.mda.video_ram[0], 0x43)
+        self.assertEqual(self.mda.video_ram[22 * 160], 0x41 + 24)
+        self.assertEqual(self.mda.video_ram[23 * 160], 0x20)
+        self.assertEqual(self.mda.video_ram[(24 * 160) + 159], 0x07)
+        
+    def test_scroll_down_window(self):
+        self.fill_rows()
+        self.cpu.regs.AX = 0x0701
+        self.cpu.regs.BH = 0x70
+        self.cpu.regs.CX = 0x0205 # Row 2, column 5.
+        self.cpu.regs.DX = 0x0409 # Row 4, column 9.
+        self.assertTrue(self.hle(self.cpu))
+        
+        # Outside the window is untouched.
+        self.assertEqual(self.mda.video_ram[(2 * 160) + 8], 0x43)
+        self.assertEqual(self.mda.video_ram[(3 * 160) + 20], 0x44)
+        
+        # Inside the window rows moved down by one and the top was blanked.
+        self.assertEqual(self.mda.video_ram[(2 * 160) + 10], 0x20)
+        self.assertEqual(self.mda.video_ram[(2 * 160) + 11], 0x70)
+        self.assertEqual(self.mda.video_ram[(3 * 160) + 10], 0x43)
+        self.assertEqual(self.mda.video_ram[(4 * 160) + 18], 0x44)
+        self.assertEqual(self.mda.video_ram[(5 * 160) + 10], 0x46)
+        
+    def test_scroll_zero_lines_clears_window(self):
+        self.fill_rows()
+        self.cpu.regs.AX = 0x0600
+        self.cpu.regs.BH = 0x07
+        self.cpu.regs.CX = 0x0000
+        self.cpu.regs.DX = 0x184F
+        self.hle(self.cpu)
+        self.assertTrue(all(byte == 0x20 for byte in self.mda.video_ram[0:4000:2]))
+        
+    def test_int_instruction_uses_hook(self):
+        self.hle.install(self.cpu)
+        self.cpu.regs.CS = 0x0100
+        self.cpu.regs.IP = 0x0000
+        self.cpu.regs.SS = 0x0200
+        self.cpu.regs.SP = 0x0100
+        self.cpu.regs.AX = 0x0E41
+        self.memory.mem_write_byte(0x1000, 0xCD)
+        self.memory.mem_write_byte(0x1001, 0x10)
+        self.cpu.fetch()
+        
+        # The call was serviced without running the vector.
+        self.assertEqual(self.cpu.regs.CS, 0x0100)
+        self.assertEqual(self.cpu.regs.IP, 0x0002)
+        self.assertEqual(self.cpu.regs.SP, 0x0100)
+        self.assertEqual(self.mda.video_ram[0], 0x41)
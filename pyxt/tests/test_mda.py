@@ -23,6 +23,12 @@ class MDATests(unittest.TestCase):
     def test_get_memory_size(self):
         self.assertEqual(self.mda.get_memory_size(), 4096)
         
+    def test_randomize_with_seed_is_repeatable(self):
+        first = MonochromeDisplayAdapter(self.cg, randomize = True, seed = 42)
+        second = MonochromeDisplayAdapter(self.cg, randomize = True, seed = 42)
+        self.assertEqual(first.video_ram, second.video_ram)
+        self.assertNotEqual(first.video_ram, self.mda.video_ram)
+        
     def test_initial_state(self):
         self.assertEqual(self.mda.control_reg, 0x00)
         self.assertEqual(self.mda.control_reg, 0x00)
@@ -104,11 +110,29 @@ class MDATests(unittest.TestCase):
         self.mda.video_ram[3999] = 0x34
         self.assertEqual(self.mda.mem_read_word(3999), 0x0034)
         
-    def test_horizontal_retrace_toggles(self):
+    def test_horizontal_retrace_follows_ticks(self):
+        self.assertEqual(self.mda.io_read_byte(0x3BA), 0xF0)
         self.assertEqual(self.mda.io_read_byte(0x3BA), 0xF0)
+        self.mda.fast_forward(216)
+        self.assertEqual(self.mda.io_read_byte(0x3BA), 0xF0)
+        self.mda.clock()
         self.assertEqual(self.mda.io_read_byte(0x3BA), 0xF1)
+        self.mda.fast_forward(40)
         self.assertEqual(self.mda.io_read_byte(0x3BA), 0xF0)
         
+        # The next line, 882 dots of the 16.257 MHz dot clock later.
+        self.mda.fast_forward(259 - 40)
+        self.assertEqual(self.mda.io_read_byte(0x3BA), 0xF1)
+        
+    def test_no_event_unless_polled(self):
+        self.assertIsNone(self.mda.ticks_until_event())
+        self.mda.io_read_byte(0x3BA)
+        self.assertEqual(self.mda.ticks_until_event(), 217)
+        self.mda.fast_forward(217)
+        self.assertEqual(self.mda.ticks_until_event(), 257 - 217)
+        self.mda.fast_forward(MDA_TIMING.line_ticks * POLLING_LINES)
+        self.assertIsNone(self.mda.ticks_until_event())
+        
     def test_current_pixel_updates_on_status_read(self):
         self.assertEqual(self.mda.current_pixel, [0, 0])
         self.mda.io_read_byte(0x3BA)
@@ -1,5 +1,6 @@
 import unittest
 
+import six
 from six.moves import range
 
 from pyxt.tests.utils import get_test_file
@@ -31,6 +32,16 @@ class RandomAccessMemoryTests(unittest.TestCase):
     def test_get_memory_size(self):
         self.assertEqual(self.obj.get_memory_size(), 0x8000)
         
+    def test_code_window(self):
+        window = self.obj.get_code_window()
+        self.assertEqual(len(window), 0x8000)
+        self.obj.mem_write_byte(56, 43)
+        self.assertEqual(window[56], 43)
+        
+    def test_no_code_window_when_hooked(self):
+        self.obj.mem_read_byte = lambda offset: 0
+        self.assertIsNone(self.obj.get_code_window())
+        
 class ReadOnlyMemoryTests(unittest.TestCase):
     def setUp(self):
         self.rom = ROM(16, init_file = get_test_file(self, "romtest.bin"))
@@ -65,4 +76,14 @@ class ReadOnlyMemoryTests(unittest.TestCase):
         self.assertEqual(self.rom.contents[1], 0x61)
         
     def test_get_memory_size(self):
-        self.assertEqual(self.rom.get_memory_size(), 16)
\ No newline at end of file
+        self.assertEqual(self.rom.get_memory_size(), 16)
+        
+    def test_load_from_file_offset(self):
+        self.rom.load_from_file(get_test_file(self, "romtest.bin"), offset = 5)
+        self.assertEqual(self.rom.mem_read_byte(4), six.byte2int(b"a"))
+        self.assertEqual(self.rom.mem_read_byte(5), six.byte2int(b"e"))
+        self.assertEqual(self.rom.mem_read_byte(15), six.byte2int(b"k"))
+        
+    def test_load_from_file_too_large(self):
+        with self.assertRaises(ValueError):
+            self.rom.load_from_file(get_test_file(self, "romtest.bin"), offset = 6)
\ No newline at end of file
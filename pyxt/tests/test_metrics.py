@@ -0,0 +1,91 @@
+import json
+import unittest
+
+from six.moves.urllib.request import urlopen
+
+from pyxt.metrics import *
+from pyxt.bus import SystemBus
+from pyxt.cpu import CPU
+from pyxt.pic import ProgrammableInterruptController
+from pyxt.dma import DmaController
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        
+    def __call__(self):
+        return self.now
+        
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pic = ProgrammableInterruptController(0x020)
+        self.dma = DmaController(0x0000, (0x087, 0x083, 0x081, 0x082))
+        self.bus = SystemBus(self.pic, self.dma)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.metrics = Metrics(self.cpu, self.bus, self.pic, self.dma, clock = self.clock)
+        
+    def test_sample_rates(self):
+        self.cpu.instruction_count = 2000
+        self.cpu.cycles = 9000000
+        self.clock.now += 2.0
+        sample = self.metrics.sample()
+        self.assertEqual(sample["instructions"], 2000)
+        self.assertEqual(sample["instructions_per_second"], 1000)
+        self.assertEqual(sample["mhz"], 4.5)
+        
+        # Rates are since the previous sample.
+        self.cpu.instruction_count = 2500
+        self.clock.now += 1.0
+        self.assertEqual(self.metrics.sample()["instructions_per_second"], 500)
+        
+    def test_sample_devices(self):
+        self.pic.interrupt_counts[0] = 18
+        self.dma.channels[2].transfer_count = 512
+        sample = self.metrics.sample()
+        self.assertEqual(sample["interrupts"], [18, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(sample["dma_bytes"], [0, 0, 512, 0])
+        self.assertNotIn("fdc_sectors_read", sample)
+        
+    def test_sample_ports(self):
+        self.bus.io_read_byte(0x3DA)
+        self.bus.io_read_byte(0x3DA)
+        self.bus.io_write_byte(0x3D4, 0x0E)
+        sample = self.metrics.sample()
+        self.assertEqual(sample["io_reads"], {"0x3da" : 2})
+        self.assertEqual(sample["io_writes"], {"0x3d4" : 1})
+        self.assertEqual(self.metrics.sample()["io_reads"], {})
+        
+    def test_poll_waits_for_interval(self):
+        self.metrics.poll()
+        self.assertEqual(self.metrics.latest, {})
+        self.clock.now += DEFAULT_INTERVAL
+        self.metrics.poll()
+        self.assertIn("instructions", self.metrics.latest)
+        
+    def test_format_sample(self):
+        self.bus.io_read_byte(0x3DA)
+        self.pic.interrupt_counts[0] = 18
+        line = Metrics.format_sample(self.metrics.sample())
+        self.assertIn("IRQ 18/0/0/0/0/0/0/0", line)
+        self.assertIn("io reads 0x3da:1", line)
+        
+class MetricsServerTests(unittest.TestCase):
+    def test_serves_latest_sample(self):
+        bus = SystemBus()
+        cpu = CPU()
+        bus.install_cpu(cpu)
+        metrics = Metrics(cpu, bus)
+        metrics.sample()
+        
+        server = MetricsServer(metrics, 0)
+        server.start()
+        try:
+            response = urlopen("http://127.0.0.1:%d/" % server.port)
+            data = json.loads(response.read().decode("utf-8"))
+            response.close()
+        finally:
+            server.stop()
+            
+        self.assertEqual(data["instructions"], 0)
@@ -158,8 +158,85 @@ class PICTests(unittest.TestCase):
         self.assertEqual(self.obj.mask, 0x00)
         
     # ***** OCW2 Tests *****
+    def acknowledge_all(self, *irqs):
+        """ Request and acknowledge some IRQs in turn, leaving them in service. """
+        for irq in irqs:
+            self.obj.interrupt_request(irq)
+            self.assertEqual(self.obj.interrupt_acknowledge(), irq)
+            
+    def test_non_specific_eoi(self):
+        self.acknowledge_all(3, 1)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x0A)
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x08)
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x00)
+        
+    def test_non_specific_eoi_nothing_in_service(self):
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x00)
+        
+    def test_specific_eoi(self):
+        self.acknowledge_all(3, 1)
+        self.obj.io_write_byte(0x0A0, 0x63)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x02)
+        
+    def test_rotate_on_non_specific_eoi(self):
+        self.acknowledge_all(2)
+        self.obj.io_write_byte(0x0A0, 0xA0)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x00)
+        self.assertEqual(self.obj.priorities, [3, 4, 5, 6, 7, 0, 1, 2])
+        
+    def test_rotate_on_specific_eoi(self):
+        self.acknowledge_all(6, 2)
+        self.obj.io_write_byte(0x0A0, 0xE6)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x04)
+        self.assertEqual(self.obj.priorities, [7, 0, 1, 2, 3, 4, 5, 6])
+        
+    def test_set_priority(self):
+        self.obj.io_write_byte(0x0A0, 0xC4)
+        self.assertEqual(self.obj.priorities, [5, 6, 7, 0, 1, 2, 3, 4])
+        self.obj.interrupt_request(2)
+        self.obj.interrupt_request(6)
+        self.assertEqual(self.obj.interrupt_acknowledge(), 6)
+        
+    def test_rotate_in_auto_eoi(self):
+        self.obj.auto_eoi = True
+        self.obj.io_write_byte(0x0A0, 0x80)
+        self.acknowledge_all(0)
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x00)
+        self.assertEqual(self.obj.priorities, [1, 2, 3, 4, 5, 6, 7, 0])
+        
+        self.obj.io_write_byte(0x0A0, 0x00)
+        self.acknowledge_all(4)
+        self.assertEqual(self.obj.priorities, [1, 2, 3, 4, 5, 6, 7, 0])
+        
+    def test_icw1_resets_priority(self):
+        self.obj.io_write_byte(0x0A0, 0xC2)
+        self.obj.io_write_byte(0x0A0, 0x13)
+        self.assertEqual(self.obj.priorities, [0, 1, 2, 3, 4, 5, 6, 7])
+        
     
     # ***** OCW3 Tests *****
+    def test_ocw3_special_mask_mode(self):
+        self.obj.io_write_byte(0x0A0, 0x68)
+        self.assertTrue(self.obj.special_mask_mode)
+        self.obj.io_write_byte(0x0A0, 0x48)
+        self.assertFalse(self.obj.special_mask_mode)
+        self.obj.io_write_byte(0x0A0, 0x28) # Without ESMM the mode is left alone.
+        self.assertFalse(self.obj.special_mask_mode)
+        
+    def test_special_mask_mode_allows_lower_priority(self):
+        self.obj.interrupt_request(2)
+        self.obj.interrupt_acknowledge()
+        self.obj.io_write_byte(0x0A1, 0x04)
+        self.obj.interrupt_request(5)
+        self.assertFalse(self.obj.interrupt_pending())
+        
+        self.obj.io_write_byte(0x0A0, 0x68)
+        self.assertTrue(self.obj.interrupt_pending())
+        self.assertEqual(self.obj.interrupt_acknowledge(), 5)
+        
     def test_ocw3_read_register(self):
         self.obj.interrupt_request_register = 0xAA
         self.obj.interrupt_in_service_register = 0x55
@@ -207,4 +284,63 @@ class PICTests(unittest.TestCase):
         self.assertEqual(self.obj.interrupt_request_register, 0x10)
         self.assertEqual(self.obj.interrupt_acknowledge(), 0x0C)
         self.assertEqual(self.obj.interrupt_request_register, 0x00)
+        self.assertEqual(self.obj.interrupt_counts, [0, 0, 0, 0, 1, 0, 0, 0])
+        
+    def test_interrupt_acknowledge_highest_priority(self):
+        self.obj.interrupt_request(6)
+        self.obj.interrupt_request(1)
+        self.assertEqual(self.obj.interrupt_acknowledge(), 1)
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertEqual(self.obj.interrupt_acknowledge(), 6)
+        
+    def test_in_service_blocks_lower_priority(self):
+        self.obj.interrupt_request(3)
+        self.obj.interrupt_acknowledge()
+        self.obj.interrupt_request(5)
+        self.obj.interrupt_request(3)
+        self.assertFalse(self.obj.interrupt_pending())
+        
+        # A higher priority request still gets through.
+        self.obj.interrupt_request(0)
+        self.assertTrue(self.obj.interrupt_pending())
+        self.assertEqual(self.obj.interrupt_acknowledge(), 0)
+        self.assertFalse(self.obj.interrupt_pending())
+        
+        # Each EOI lets the next one through.
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertFalse(self.obj.interrupt_pending())
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertEqual(self.obj.interrupt_acknowledge(), 3)
+        self.obj.io_write_byte(0x0A0, 0x20)
+        self.assertEqual(self.obj.interrupt_acknowledge(), 5)
+        
+    def test_auto_eoi(self):
+        self.obj.auto_eoi = True
+        self.obj.interrupt_request(3)
+        self.obj.interrupt_acknowledge()
+        self.assertEqual(self.obj.interrupt_in_service_register, 0x00)
+        self.obj.interrupt_request(5)
+        self.assertTrue(self.obj.interrupt_pending())
+        
+    def test_mask_holds_pending_request(self):
+        self.obj.interrupt_request(4)
+        self.obj.io_write_byte(0x0A1, 0x10)
+        self.assertFalse(self.obj.interrupt_pending())
+        self.obj.io_write_byte(0x0A1, 0x00)
+        self.assertTrue(self.obj.interrupt_pending())
+        
+class PriorityLookupTests(unittest.TestCase):
+    def test_no_interrupt(self):
+        for lut in PRIORITY_LUTS:
+            self.assertEqual(lut[0x00], NO_INTERRUPT)
+            
+    def test_fixed_priority(self):
+        self.assertEqual(PRIORITY_LUTS[0][0x01], 0)
+        self.assertEqual(PRIORITY_LUTS[0][0xF0], 4)
+        self.assertEqual(PRIORITY_LUTS[0][0x80], 7)
+        
+    def test_rotated(self):
+        self.assertEqual(PRIORITY_LUTS[3][0x05], 0)
+        self.assertEqual(PRIORITY_LUTS[3][0x0D], 3)
+        self.assertEqual(PRIORITY_LUTS[7][0x81], 7)
         
\ No newline at end of file
@@ -0,0 +1,134 @@
+import unittest
+
+from six.moves import StringIO
+
+from pyxt.profiler import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.cpu import CPU
+from pyxt.disassembler import Disassembler
+from pyxt.memory import RAM
+from pyxt.tests.utils import SystemBusTestable, get_test_file
+
+class SymbolMapTests(unittest.TestCase):
+    def setUp(self):
+        self.symbols = SymbolMap()
+        
+    def test_lookup_nearest_preceding(self):
+        self.symbols.add_symbol(0x100, "first")
+        self.symbols.add_symbol(0x200, "second")
+        self.assertEqual(self.symbols.lookup(0x100), "first")
+        self.assertEqual(self.symbols.lookup(0x1FF), "first")
+        self.assertEqual(self.symbols.lookup(0x200), "second")
+        self.assertEqual(self.symbols.lookup(0x12345), "second")
+        
+    def test_lookup_below_first_symbol(self):
+        self.symbols.add_symbol(0x100, "first")
+        self.assertIsNone(self.symbols.lookup(0xFF))
+        
+    def test_add_symbol_replaces_duplicate_address(self):
+        self.symbols.add_symbol(0x100, "first")
+        self.symbols.add_symbol(0x100, "again")
+        self.assertEqual(self.symbols.addresses, [0x100])
+        self.assertEqual(self.symbols.lookup(0x100), "again")
+        
+    def test_load_map_file(self):
+        self.assertEqual(self.symbols.load(get_test_file(self, "test.map")), 3)
+        self.assertEqual(self.symbols.lookup(0x0000), "_main")
+        self.assertEqual(self.symbols.lookup(0x0015), "_helper")
+        self.assertEqual(self.symbols.lookup(0x0030), "_buffer")
+        
+    def test_load_map_file_relocated(self):
+        self.symbols.load(get_test_file(self, "test.map"), load_segment = 0x1000)
+        self.assertIsNone(self.symbols.lookup(0x0000))
+        self.assertEqual(self.symbols.lookup(0x10000), "_main")
+        self.assertEqual(self.symbols.lookup(0x10010), "_helper")
+        
+class SamplingProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        
+        self.cpu.regs.CS = 0x0100
+        self.cpu.regs.IP = 0x0020
+        self.cpu.regs.SS = 0x0800
+        self.cpu.regs.BP = 0x0000
+        
+        self.profiler = SamplingProfiler(self.cpu, interval = 100)
+        
+    def push_frame(self, bp, saved_bp, return_ip, return_cs = None):
+        """ Lay out a stack frame at SS:bp as left by PUSH BP / MOV BP, SP. """
+        self.memory.mem_write_word(0x8000 + bp, saved_bp)
+        self.memory.mem_write_word(0x8000 + bp + 2, return_ip)
+        if return_cs is not None:
+            self.memory.mem_write_word(0x8000 + bp + 4, return_cs)
+            
+    def test_ticks_until_event(self):
+        self.assertEqual(self.profiler.ticks_until_event(), 100)
+        self.profiler.fast_forward(30)
+        self.assertEqual(self.profiler.ticks_until_event(), 70)
+        self.assertEqual(self.profiler.sample_count, 0)
+        
+    def test_sample_at_interval(self):
+        self.profiler.fast_forward(100)
+        self.assertEqual(self.profiler.stacks, {("0100:0020", ) : 1})
+        self.assertEqual(self.profiler.ticks_until_event(), 100)
+        
+    def test_long_fast_forward_weights_sample(self):
+        self.profiler.fast_forward(350)
+        self.assertEqual(self.profiler.sample_count, 3)
+        self.assertEqual(self.profiler.ticks_until_event(), 50)
+        
+    def test_idle_frame_while_halted(self):
+        self.cpu.hlt = True
+        self.profiler.fast_forward(100)
+        self.assertEqual(self.profiler.stacks, {(IDLE_FRAME, ) : 1})
+        
+    def test_walks_bp_chain(self):
+        self.cpu.regs.BP = 0x0F00
+        self.push_frame(0x0F00, 0x0F10, 0x0040)
+        self.push_frame(0x0F10, 0x0000, 0x0060)
+        self.assertEqual(self.profiler.call_stack(), ("0100:0060", "0100:0040", "0100:0020"))
+        
+    def test_stops_at_non_increasing_bp(self):
+        self.cpu.regs.BP = 0x0F00
+        self.push_frame(0x0F00, 0x0E00, 0x0040)
+        self.assertEqual(self.profiler.call_stack(), ("0100:0040", "0100:0020"))
+        
+    def test_max_depth(self):
+        self.profiler.max_depth = 2
+        self.cpu.regs.BP = 0x0F00
+        self.push_frame(0x0F00, 0x0F10, 0x0040)
+        self.push_frame(0x0F10, 0x0F20, 0x0060)
+        self.push_frame(0x0F20, 0x0000, 0x0080)
+        self.assertEqual(len(self.profiler.call_stack()), 3)
+        
+    def test_far_frames(self):
+        self.profiler.far_frames = True
+        self.cpu.regs.BP = 0x0F00
+        self.push_frame(0x0F00, 0x0000, 0x0040, 0x0200)
+        self.assertEqual(self.profiler.call_stack(), ("0200:0040", "0100:0020"))
+        
+    def test_symbol_names(self):
+        symbols = SymbolMap()
+        symbols.add_symbol(0x1000, "_main")
+        symbols.add_symbol(0x1030, "_helper")
+        self.profiler.symbols = symbols
+        self.cpu.regs.IP = 0x0034
+        self.cpu.regs.BP = 0x0F00
+        self.push_frame(0x0F00, 0x0000, 0x0008)
+        self.assertEqual(self.profiler.call_stack(), ("_main", "_helper"))
+        
+    def test_instruction_frame(self):
+        self.profiler.disassembler = Disassembler(self.bus)
+        self.memory.mem_write_byte(0x1020, 0x40)
+        self.assertEqual(self.profiler.call_stack(), ("0100:0020", "0100:0020 inc ax"))
+        
+    def test_write_collapsed(self):
+        self.profiler.stacks[("_main", "_helper")] = 3
+        self.profiler.stacks[("_main", )] = 2
+        output = StringIO()
+        self.profiler.write_collapsed(output)
+        self.assertEqual(output.getvalue(), "_main 2\n_main;_helper 3\n")
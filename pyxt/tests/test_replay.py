@@ -0,0 +1,171 @@
+import json
+import unittest
+
+from six.moves import StringIO
+
+from pyxt.replay import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+from pyxt.tests.utils import SystemBusTestable, get_test_file
+
+class KeyboardSpy(object):
+    def __init__(self):
+        self.log = []
+        
+    def key_pressed(self, scancodes):
+        self.log.append(scancodes)
+        
+    def self_test_complete(self):
+        self.log.append("self_test")
+        
+class DisplaySpy(object):
+    def __init__(self):
+        self.draw_count = 0
+        self.reset_count = 0
+        
+    def reset(self):
+        self.reset_count += 1
+        
+    def draw(self):
+        self.draw_count += 1
+        
+class LogFile(StringIO):
+    """ Keeps its contents after being closed. """
+    def close(self):
+        pass
+        
+class ReplayTestBase(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.keyboard = KeyboardSpy()
+        self.display = DisplaySpy()
+        
+    def advance(self, cycles, instructions):
+        self.cpu.cycles += cycles
+        self.cpu.instruction_count += instructions
+        
+class DigestTests(ReplayTestBase):
+    def test_file_digest(self):
+        self.assertIsNone(file_digest(None))
+        self.assertEqual(len(file_digest(get_test_file(self, "romtest.bin"))), 40)
+        
+    def test_machine_digest_covers_registers_and_ram(self):
+        digest = machine_digest(self.cpu)
+        self.assertEqual(machine_digest(self.cpu), digest)
+        
+        self.cpu.regs.AX = 0x1234
+        self.assertNotEqual(machine_digest(self.cpu), digest)
+        digest = machine_digest(self.cpu)
+        
+        self.memory.mem_write_byte(0x1000, 0x55)
+        self.assertNotEqual(machine_digest(self.cpu), digest)
+        
+class InputRecorderTests(ReplayTestBase):
+    def setUp(self):
+        super(InputRecorderTests, self).setUp()
+        self.fileptr = LogFile()
+        self.recorder = InputRecorder(self.cpu, self.keyboard, self.display, self.fileptr, seed = 1234)
+        
+    def lines(self):
+        return [json.loads(line) for line in self.fileptr.getvalue().splitlines()]
+        
+    def test_header(self):
+        self.assertEqual(self.lines()[0], {"version" : REPLAY_LOG_VERSION, "seed" : 1234})
+        
+    def test_records_and_delivers_inputs(self):
+        keyboard = SessionKeyboard(self.recorder)
+        display = SessionDisplay(self.recorder)
+        
+        self.advance(1000, 300)
+        keyboard.key_pressed((0x1E, ))
+        self.advance(500, 100)
+        keyboard.self_test_complete()
+        display.draw()
+        
+        self.assertEqual(self.keyboard.log, [(0x1E, ), "self_test"])
+        self.assertEqual(self.display.draw_count, 1)
+        self.assertEqual(self.lines()[1:], [
+            [1000, 300, EVENT_KEY, [0x1E]],
+            [1500, 400, EVENT_SELF_TEST, None],
+            [1500, 400, EVENT_DRAW, None],
+        ])
+        
+    def test_close_writes_end_digest(self):
+        self.recorder.close()
+        self.assertEqual(self.lines()[-1], [0, 0, EVENT_END, machine_digest(self.cpu)])
+        
+    def test_display_reset_passes_through(self):
+        SessionDisplay(self.recorder).reset()
+        self.assertEqual(self.display.reset_count, 1)
+        
+class InputReplayerTests(ReplayTestBase):
+    def make_replayer(self, events):
+        return InputReplayer(self.cpu, self.keyboard, self.display, events)
+        
+    def test_delivers_events_when_reached(self):
+        replayer = self.make_replayer([[1000, 300, EVENT_KEY, [0x1E]], [2000, 600, EVENT_DRAW, None]])
+        replayer.poll()
+        self.assertEqual(self.keyboard.log, [])
+        
+        self.advance(1000, 300)
+        replayer.poll()
+        self.assertEqual(self.keyboard.log, [(0x1E, )])
+        self.assertEqual(self.display.draw_count, 0)
+        
+        self.advance(1000, 300)
+        replayer.poll()
+        self.assertEqual(self.display.draw_count, 1)
+        self.assertTrue(replayer.finished)
+        self.assertFalse(replayer.diverged)
+        
+    def test_ignores_live_input_until_finished(self):
+        replayer = self.make_replayer([[100, 10, EVENT_DRAW, None]])
+        SessionKeyboard(replayer).key_pressed((0x1E, ))
+        SessionDisplay(replayer).draw()
+        self.assertEqual(self.keyboard.log, [])
+        self.assertEqual(self.display.draw_count, 0)
+        
+        self.advance(100, 10)
+        replayer.poll()
+        SessionKeyboard(replayer).key_pressed((0x9E, ))
+        self.assertEqual(self.keyboard.log, [(0x9E, )])
+        
+    def test_divergence(self):
+        replayer = self.make_replayer([[100, 10, EVENT_KEY, [0x1E]]])
+        self.advance(120, 10)
+        replayer.poll()
+        self.assertTrue(replayer.diverged)
+        self.assertEqual(self.keyboard.log, [(0x1E, )])
+        
+    def test_end_digest_matches(self):
+        replayer = self.make_replayer([[0, 0, EVENT_END, machine_digest(self.cpu)]])
+        replayer.poll()
+        self.assertFalse(replayer.diverged)
+        
+    def test_end_digest_mismatch(self):
+        replayer = self.make_replayer([[0, 0, EVENT_END, machine_digest(self.cpu)]])
+        self.cpu.regs.BX = 0x5555
+        replayer.poll()
+        self.assertTrue(replayer.diverged)
+        
+class ReplayRoundTripTests(ReplayTestBase):
+    def test_record_then_replay(self):
+        fileptr = LogFile()
+        recorder = InputRecorder(self.cpu, self.keyboard, self.display, fileptr, seed = 7, machine = {})
+        self.advance(50, 5)
+        SessionKeyboard(recorder).key_pressed((0x1C, ))
+        recorder.close()
+        
+        header, events = read_replay_log(StringIO(fileptr.getvalue()))
+        self.assertEqual(header["seed"], 7)
+        self.assertEqual(events[0], [50, 5, EVENT_KEY, [0x1C]])
+        self.assertEqual(events[-1][2], EVENT_END)
+        
+    def test_bad_version(self):
+        with self.assertRaises(ValueError):
+            read_replay_log(StringIO('{"version" : 0}\n'))
@@ -0,0 +1,150 @@
+import unittest
+
+from pyxt.bus import Device
+from pyxt.scheduler import *
+
+class ClockedDeviceSpy(Device):
+    """ Device with a single event at a fixed time that logs fast forwards. """
+    def __init__(self, event):
+        super(ClockedDeviceSpy, self).__init__()
+        self.event = event
+        self.ticks = 0
+        
+    def ticks_until_event(self):
+        if self.event is None or self.ticks >= self.event:
+            return None
+        return self.event - self.ticks
+        
+    def fast_forward(self, ticks):
+        self.ticks += ticks
+        
+class CpuSpy(object):
+    """ Stands in for the CPU, each instruction takes 7 cycles. """
+    def __init__(self):
+        self.hlt = False
+        self.busy_wait = False
+        self.cycles = 0
+        self.fetch_log = []
+        self.devices = []
+        
+    def fetch(self):
+        self.fetch_log.append((self.cycles, [device.ticks for device in self.devices]))
+        self.cycles += 7
+        
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.cpu = CpuSpy()
+        self.devices = [ClockedDeviceSpy(None), ClockedDeviceSpy(500), ClockedDeviceSpy(300)]
+        self.scheduler = Scheduler(self.cpu, self.devices)
+        self.cpu.devices = self.devices
+        
+    def test_ticks_until_event(self):
+        self.assertEqual(self.scheduler.ticks_until_event(), 300)
+        
+    def test_ticks_until_event_nothing_scheduled(self):
+        self.assertIsNone(Scheduler(self.cpu, [ClockedDeviceSpy(None)]).ticks_until_event())
+        
+    def test_idle_does_nothing_while_running(self):
+        self.assertEqual(self.scheduler.idle(1000), 0)
+        self.assertEqual([device.ticks for device in self.devices], [0, 0, 0])
+        
+    def test_idle_skips_to_next_event(self):
+        self.cpu.hlt = True
+        self.assertEqual(self.scheduler.idle(1000), 300)
+        self.assertEqual([device.ticks for device in self.devices], [300, 300, 300])
+        
+    def test_idle_limited_to_max_ticks(self):
+        self.cpu.hlt = True
+        self.assertEqual(self.scheduler.idle(100), 100)
+        self.assertEqual([device.ticks for device in self.devices], [100, 100, 100])
+        
+    def test_idle_nothing_scheduled(self):
+        self.cpu.hlt = True
+        scheduler = Scheduler(self.cpu, [ClockedDeviceSpy(None)])
+        self.assertEqual(scheduler.idle(100), 100)
+        
+    def test_idle_wakes_busy_wait(self):
+        self.cpu.hlt = True
+        self.cpu.busy_wait = True
+        self.assertEqual(self.scheduler.idle(1000), 300)
+        self.assertFalse(self.cpu.hlt)
+        self.assertFalse(self.cpu.busy_wait)
+        
+    def test_idle_leaves_halt_alone(self):
+        self.cpu.hlt = True
+        self.scheduler.idle(1000)
+        self.assertTrue(self.cpu.hlt)
+        
+    def test_idle_advances_cpu_cycles(self):
+        self.cpu.hlt = True
+        self.scheduler.idle(1000)
+        self.assertEqual(self.cpu.cycles, 300)
+        
+    def test_sync(self):
+        self.cpu.cycles = 50
+        self.scheduler.sync()
+        self.assertEqual([device.ticks for device in self.devices], [50, 50, 50])
+        self.scheduler.sync()
+        self.assertEqual([device.ticks for device in self.devices], [50, 50, 50])
+        
+    def test_run(self):
+        self.assertEqual(self.scheduler.run(self.cpu.fetch, 1000), 1001)
+        self.assertEqual(len(self.cpu.fetch_log), 143)
+        
+        # The devices are caught up at the end of the slice.
+        self.assertEqual([device.ticks for device in self.devices], [1001, 1001, 1001])
+        
+    def test_run_syncs_at_device_events(self):
+        self.scheduler.run(self.cpu.fetch, 1000)
+        
+        # The first instruction after each event sees the devices up to date.
+        self.assertIn((301, [301, 301, 301]), self.cpu.fetch_log)
+        self.assertIn((504, [504, 504, 504]), self.cpu.fetch_log)
+        
+        # Between events the devices aren't touched.
+        self.assertIn((294, [0, 0, 0]), self.cpu.fetch_log)
+        
+    def test_run_stops_when_halted(self):
+        def fetch():
+            self.cpu.cycles += 10
+            self.cpu.hlt = self.cpu.cycles >= 100
+            
+        self.assertEqual(self.scheduler.run(fetch, 1000), 100)
+        self.assertEqual(self.devices[1].ticks, 100)
+        
+    def test_run_wakes_halted_cpu(self):
+        def fetch():
+            # An interrupt is pending, the CPU takes it and carries on.
+            self.cpu.hlt = False
+            self.cpu.cycles += 10
+            
+        self.cpu.hlt = True
+        self.assertEqual(self.scheduler.run(fetch, 100), 100)
+        
+    def test_run_stays_halted(self):
+        calls = []
+        self.cpu.hlt = True
+        self.assertEqual(self.scheduler.run(lambda: calls.append(None), 100), 0)
+        self.assertEqual(len(calls), 1)
+        
+    def test_fast_forward_reentered(self):
+        # A DMA transfer reads an I/O port which syncs the scheduler again, that mustn't advance anything twice.
+        def fast_forward(ticks):
+            self.devices[1].ticks += ticks
+            self.scheduler.sync()
+            
+        self.devices[1].fast_forward = fast_forward
+        self.cpu.cycles = 50
+        self.scheduler.sync()
+        self.assertEqual([device.ticks for device in self.devices], [50, 50, 50])
+        
+    def test_reschedule(self):
+        self.scheduler.slice_end = 1000
+        self.scheduler.reschedule()
+        self.assertEqual(self.scheduler.deadline, 300)
+        self.assertEqual(self.cpu.deadline, 300)
+        
+        # Something that happens sooner than the end of the slice moves the deadline.
+        self.devices[0].event = 100
+        self.scheduler.reschedule()
+        self.assertEqual(self.scheduler.deadline, 100)
@@ -0,0 +1,118 @@
+import os
+import sys
+import array
+import unittest
+import subprocess
+
+import pyxt.helpers
+import pyxt.memory
+import pyxt.timing
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.helpers import build_hamming_weight_lut
+from pyxt.memory import RAM
+from pyxt.timing import build_instruction_cycles
+
+# The root of the source tree, so the child interpreters import this copy of pyxt.
+SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules pyxt.__main__ only needs when the matching option is given.
+OPTIONAL_MODULES = ("pyxt.gdbstub", "pyxt.metrics", "pyxt.replay", "pyxt.hle", "pyxt.cga", "pyxt.cpi", "pyxt.trace",
+                    "pyxt.disassembler", "pyxt.profiler", "http.server")
+
+# Prints how many times each of the functions that work out a table entry at a time was called getting to the
+# first instruction, the tables are built in bulk so count_bits() shouldn't be at all.
+FIRST_INSTRUCTION = """
+import sys
+calls = {"count_bits" : 0, "effective_address_cycles" : 0}
+def profile(frame, event, argument):
+    if event == "call" and frame.f_code.co_name in calls:
+        calls[frame.f_code.co_name] += 1
+sys.setprofile(profile)
+
+import pyxt.__main__
+from pyxt.bench.macro import HeadlessMachine
+from pyxt.bench.testbios import build_test_bios
+machine = HeadlessMachine(build_test_bios())
+machine.cpu.fetch()
+assert machine.cpu.instruction_count == 1
+
+sys.setprofile(None)
+print("%d %d" % (calls["count_bits"], calls["effective_address_cycles"]))
+"""
+
+class ArraySpy(object):
+    """ Stands in for the array module, noting the length of each initializer passed to array.array(). """
+    def __init__(self):
+        self.initializers = []
+        
+    def array(self, typecode, initializer = ()):
+        self.initializers.append(len(initializer))
+        return array.array(typecode, initializer)
+
+def run_python(script):
+    """ Run a script in a fresh interpreter and return the last line it printed. """
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = SOURCE_ROOT
+    output = subprocess.check_output([sys.executable, "-c", script], env = environment, cwd = SOURCE_ROOT)
+    return output.decode("ascii").strip().splitlines()[-1]
+    
+class StartupTests(unittest.TestCase):
+    def test_optional_subsystems_not_imported(self):
+        loaded = run_python("import sys\nimport pyxt.__main__\nprint(' '.join(sorted(sys.modules)))").split()
+        for module in OPTIONAL_MODULES:
+            self.assertNotIn(module, loaded)
+            
+    def test_default_intervals_match(self):
+        import pyxt.__main__
+        from pyxt.metrics import DEFAULT_INTERVAL as DEFAULT_METRICS_INTERVAL
+        from pyxt.profiler import DEFAULT_INTERVAL as DEFAULT_PROFILE_INTERVAL
+        self.assertEqual(pyxt.__main__.DEFAULT_METRICS_INTERVAL, DEFAULT_METRICS_INTERVAL)
+        self.assertEqual(pyxt.__main__.DEFAULT_PROFILE_INTERVAL, DEFAULT_PROFILE_INTERVAL)
+        
+    def test_first_instruction_without_per_entry_tables(self):
+        count_bits_calls, effective_address_calls = run_python(FIRST_INSTRUCTION).split()
+        self.assertEqual(int(count_bits_calls), 0)
+        
+        # Once for each ModRM byte in the instruction clocks table.
+        self.assertEqual(int(effective_address_calls), 256)
+        
+    def test_lut_does_not_count_bits(self):
+        def count_bits(value):
+            self.fail("count_bits(%d) called" % value)
+            
+        original = pyxt.helpers.count_bits
+        pyxt.helpers.count_bits = count_bits
+        try:
+            build_hamming_weight_lut()
+        finally:
+            pyxt.helpers.count_bits = original
+            
+    def test_instruction_cycles_share_rows(self):
+        calls = []
+        def effective_address_cycles(modrm):
+            calls.append(modrm)
+            return original(modrm)
+            
+        original = pyxt.timing.effective_address_cycles
+        pyxt.timing.effective_address_cycles = effective_address_cycles
+        try:
+            table = build_instruction_cycles()
+        finally:
+            pyxt.timing.effective_address_cycles = original
+            
+        self.assertEqual(calls, list(range(256)))
+        
+        # ADD r/m8, reg8 and OR r/m8, reg8 take the same clocks so have the same row.
+        self.assertIs(table[0x00], table[0x08])
+        
+    def test_ram_built_in_bulk(self):
+        spy = ArraySpy()
+        pyxt.memory.array = spy
+        try:
+            memory = RAM(SIXTY_FOUR_KB)
+        finally:
+            pyxt.memory.array = array
+            
+        self.assertEqual(memory.get_memory_size(), SIXTY_FOUR_KB)
+        self.assertEqual(spy.initializers, [1])
+        
@@ -0,0 +1,54 @@
+import unittest
+
+from pyxt.throttle import *
+from pyxt.timing import CPU_FREQUENCY
+
+class FakeClock(object):
+    """ Wall clock that only moves when told to, sleeping moves it forward. """
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+        
+    def __call__(self):
+        return self.now
+        
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        
+class ThrottleTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttle = Throttle(1.0, clock = self.clock, sleep = self.clock.sleep)
+        
+    def test_sleeps_when_ahead(self):
+        # One emulated second has run in no time at all.
+        self.assertAlmostEqual(self.throttle.pace(CPU_FREQUENCY), 1.0)
+        self.assertAlmostEqual(self.clock.now, 101.0)
+        
+    def test_speed_multiple(self):
+        self.throttle.speed = 2.0
+        self.assertAlmostEqual(self.throttle.pace(CPU_FREQUENCY), 0.5)
+        
+    def test_small_lead_does_not_sleep(self):
+        self.assertEqual(self.throttle.pace(CPU_FREQUENCY // 1000), 0.0)
+        self.assertEqual(self.clock.sleeps, [])
+        
+    def test_turbo_never_sleeps(self):
+        self.throttle.speed = None
+        self.assertTrue(self.throttle.turbo)
+        self.assertEqual(self.throttle.pace(CPU_FREQUENCY * 10), 0.0)
+        self.assertEqual(self.clock.sleeps, [])
+        
+    def test_falling_behind_resets(self):
+        self.clock.now += 1.0
+        self.throttle.pace(CPU_FREQUENCY // 10)
+        
+        # Only the time since the reset counts, it doesn't try to run fast to catch up.
+        self.assertAlmostEqual(self.throttle.pace(CPU_FREQUENCY // 10 + CPU_FREQUENCY // 20), 0.05, places = 3)
+        
+    def test_report(self):
+        self.throttle.speed = None
+        self.clock.now += REPORT_INTERVAL
+        self.throttle.pace(int(CPU_FREQUENCY * REPORT_INTERVAL))
+        self.assertAlmostEqual(self.throttle.mhz, CPU_FREQUENCY / 1000000.0, places = 3)
@@ -1,5 +1,7 @@
 import unittest
 
+from pyxt.bus import SystemBus
+from pyxt.dma import DmaController
 from pyxt.timer import *
 
 class PITDeviceTests(unittest.TestCase):
@@ -345,4 +347,167 @@ class PITCounterTests(unittest.TestCase):
         
         self.counter.output = True
         self.assertIsNone(self.last_callback)
-        
\ No newline at end of file
+        
+class PITCounterFastForwardTests(unittest.TestCase):
+    def setUp(self):
+        self.edges = []
+        self.counter = Counter(self.edges.append)
+        self.reference_edges = []
+        self.reference = Counter(self.reference_edges.append)
+        
+    def configure(self, mode, count):
+        for counter in (self.counter, self.reference):
+            counter.reconfigure(PIT_READ_WRITE_BOTH, mode, 0)
+            counter.write(count & 0xFF)
+            counter.write(count >> 8)
+            counter.gate = True
+            
+    def assert_fast_forward_matches_clock(self, clocks):
+        for _unused in range(clocks):
+            self.reference.clock()
+        self.counter.fast_forward(clocks)
+        
+        self.assertEqual(self.counter.value, self.reference.value)
+        self.assertEqual(self.counter.output, self.reference.output)
+        self.assertEqual(True in self.edges, True in self.reference_edges)
+        
+    def assert_rising_edge_after(self, clocks):
+        self.assertEqual(self.counter.clocks_until_rising_edge(), clocks)
+        rising_edges = self.edges.count(True)
+        for _unused in range(clocks - 1):
+            self.counter.clock()
+        self.assertEqual(self.edges.count(True), rising_edges)
+        self.counter.clock()
+        self.assertEqual(self.edges.count(True), rising_edges + 1)
+        
+    def test_mode_0(self):
+        self.configure(0, 100)
+        self.assert_fast_forward_matches_clock(99)
+        self.assertFalse(self.counter.output)
+        self.assert_fast_forward_matches_clock(1000)
+        self.assertTrue(self.counter.output)
+        self.assertIsNone(self.counter.clocks_until_rising_edge())
+        
+    def test_mode_2(self):
+        self.configure(2, 18)
+        self.assert_fast_forward_matches_clock(17)
+        self.assertFalse(self.counter.output)
+        self.assert_fast_forward_matches_clock(1)
+        self.assert_fast_forward_matches_clock(12345)
+        
+    def test_mode_3_even(self):
+        self.configure(3, 0)
+        self.assert_fast_forward_matches_clock(5)
+        self.assert_fast_forward_matches_clock(100000)
+        self.assert_fast_forward_matches_clock(65536)
+        
+    def test_mode_3_odd(self):
+        self.configure(3, 1001)
+        self.assert_fast_forward_matches_clock(3)
+        self.assert_fast_forward_matches_clock(20000)
+        
+    def test_disabled_does_nothing(self):
+        self.counter.fast_forward(100)
+        self.assertEqual(self.counter.value, 0)
+        self.assertIsNone(self.counter.clocks_until_rising_edge())
+        
+    def test_rising_edge_mode_0(self):
+        self.configure(0, 100)
+        self.assert_rising_edge_after(100)
+        
+    def test_rising_edge_mode_2(self):
+        self.configure(2, 18)
+        self.assert_rising_edge_after(18)
+        
+    def test_rising_edge_mode_3(self):
+        self.configure(3, 0)
+        self.counter.clock()
+        self.assert_rising_edge_after(32767)
+        
+        # From high it has to go through the low half of the cycle first.
+        self.assert_rising_edge_after(65536)
+        
+class PITFastForwardTests(unittest.TestCase):
+    def setUp(self):
+        self.pit = ProgrammableIntervalTimer(0x0040)
+        self.irqs = []
+        self.pit.counter_0_callback = lambda value: self.irqs.append(value)
+        self.pit.channels[0].output_changed_callback = self.pit.counter_0_callback
+        
+        # Channel 0 as set up by the BIOS, mode 3 with a count of 65536.
+        self.pit.io_write_byte(0x43, 0x36)
+        self.pit.io_write_byte(0x40, 0x00)
+        self.pit.io_write_byte(0x40, 0x00)
+        self.pit.channels[0].gate = True
+        
+    def test_ticks_until_event(self):
+        ticks = self.pit.ticks_until_event()
+        self.assertEqual(ticks, 32768 * self.pit.CLOCK_DIVISOR)
+        
+        for _unused in range(ticks - 1):
+            self.pit.clock()
+        self.assertNotIn(True, self.irqs)
+        self.pit.clock()
+        self.assertIn(True, self.irqs)
+        
+    def test_no_event_when_disabled(self):
+        self.pit.channels[0].enabled = False
+        self.assertIsNone(self.pit.ticks_until_event())
+        
+    def test_fast_forward_to_event(self):
+        self.pit.clock()
+        self.pit.fast_forward(self.pit.ticks_until_event() - 1)
+        self.assertNotIn(True, self.irqs)
+        self.pit.fast_forward(1)
+        self.assertIn(True, self.irqs)
+        
+    def test_fast_forward_keeps_divisor_phase(self):
+        self.pit.fast_forward(self.pit.CLOCK_DIVISOR + 1)
+        self.assertEqual(self.pit.divisor, self.pit.CLOCK_DIVISOR - 1)
+        self.assertEqual(self.pit.channels[0].value, 0xFFFE)
+        
+class PITRefreshTests(unittest.TestCase):
+    def setUp(self):
+        self.dma = DmaController(0x0000, (0x087, 0x083, 0x081, 0x082))
+        self.dma.enable = True
+        self.bus = SystemBus(None, self.dma)
+        self.pit = ProgrammableIntervalTimer(0x0040)
+        self.pit.channels[1].gate = True
+        self.bus.install_device(None, self.pit)
+        self.pit.elide_refresh(True)
+        
+        # Channel 1 as set up by the BIOS, mode 2 with a count of 18.
+        self.pit.io_write_byte(0x43, 0x54)
+        self.pit.io_write_byte(0x41, 18)
+        
+    def test_period_given_to_dma(self):
+        self.assertEqual(self.dma.refresh_period, 18 * self.pit.CLOCK_DIVISOR)
+        self.pit.elide_refresh(False)
+        self.assertIsNone(self.dma.refresh_period)
+        
+    def test_channel_1_not_clocked(self):
+        self.pit.fast_forward(400)
+        self.assertEqual(self.pit.channels[1].value, 0)
+        self.assertEqual(self.pit.refresh_clocks, 100)
+        self.assertFalse(self.dma.channels[0].requested)
+        
+    def test_channel_1_caught_up_when_read(self):
+        clocked = ProgrammableIntervalTimer(0x0040)
+        clocked.channels[1].gate = True
+        clocked.counter_1_callback = lambda value: None
+        clocked.channels[1].output_changed_callback = clocked.counter_1_callback
+        clocked.io_write_byte(0x43, 0x54)
+        clocked.io_write_byte(0x41, 18)
+        
+        for ticks in (5, 400, 1, 70000):
+            self.pit.fast_forward(ticks)
+            clocked.fast_forward(ticks)
+            self.pit.io_write_byte(0x43, 0x40)
+            clocked.io_write_byte(0x43, 0x40)
+            self.assertEqual(self.pit.io_read_byte(0x41), clocked.io_read_byte(0x41))
+            
+    def test_refresh_computed(self):
+        self.pit.fast_forward(18 * self.pit.CLOCK_DIVISOR * 10)
+        self.dma.fast_forward(18 * self.pit.CLOCK_DIVISOR * 10)
+        self.dma.update_refresh()
+        self.assertEqual(self.dma.channels[0].transfer_count, 10)
@@ -0,0 +1,41 @@
+import unittest
+
+from pyxt.timing import *
+
+class EffectiveAddressCyclesTests(unittest.TestCase):
+    def test_register(self):
+        self.assertEqual(effective_address_cycles(0xC0), 0)
+        
+    def test_base_index(self):
+        self.assertEqual(effective_address_cycles(0x00), 7) # [bx+si]
+        self.assertEqual(effective_address_cycles(0x01), 8) # [bx+di]
+        
+    def test_direct(self):
+        self.assertEqual(effective_address_cycles(0x06), 6) # [disp16]
+        
+    def test_displacement(self):
+        self.assertEqual(effective_address_cycles(0x46), 9) # [bp+disp8]
+        self.assertEqual(effective_address_cycles(0x81), 12) # [bx+di+disp16]
+        
+class InstructionCyclesTests(unittest.TestCase):
+    def test_table_size(self):
+        self.assertEqual(len(INSTRUCTION_CYCLES), 256)
+        for row in INSTRUCTION_CYCLES:
+            self.assertEqual(len(row), 256)
+            
+    def test_simple_opcode_same_for_every_modrm(self):
+        self.assertEqual(set(INSTRUCTION_CYCLES[0xB8]), set([4]))
+        
+    def test_modrm_opcode(self):
+        self.assertEqual(INSTRUCTION_CYCLES[0x8B][0xC3], 2) # mov ax, bx
+        self.assertEqual(INSTRUCTION_CYCLES[0x8B][0x07], 12 + 5) # mov ax, [bx]
+        
+    def test_group_opcode(self):
+        self.assertEqual(INSTRUCTION_CYCLES[0x80][0xC0], 4) # add al, imm8
+        self.assertEqual(INSTRUCTION_CYCLES[0x80][0x3F], 10 + 5) # cmp byte [bx], imm8
+        self.assertEqual(INSTRUCTION_CYCLES[0xF6][0xE0], 74) # mul al
+        
+    def test_rep_cycles(self):
+        start, per_iteration = REP_CYCLES[0xA4]
+        self.assertEqual(PREFIX_CYCLES + INSTRUCTION_CYCLES[0xA4][0] + start, REP_START_CYCLES)
+        self.assertEqual(per_iteration, 17)
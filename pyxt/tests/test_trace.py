@@ -0,0 +1,108 @@
+import io
+import unittest
+
+from pyxt.trace import *
+from pyxt.constants import SIXTY_FOUR_KB
+from pyxt.cpu import CPU
+from pyxt.memory import RAM
+from pyxt.tests.utils import SystemBusTestable
+
+class TraceEncodingTests(unittest.TestCase):
+    def make_record(self, opcode, **registers):
+        values = [registers.get(name, 0) for name in REGISTER_NAMES]
+        return RAW_REGISTERS.pack(*values) + bytearray([opcode])
+        
+    def test_record_layout_matches_registers(self):
+        self.assertEqual(REGISTER_NAMES[:4], ("AX", "BX", "CX", "DX"))
+        self.assertEqual(RECORD_SIZE, (REGISTER_COUNT * 2) + 1)
+        
+    def test_unchanged_registers_encode_as_zeros(self):
+        first = self.make_record(0x90, AX = 0x1234, CS = 0xF000, IP = 0xE05B)
+        second = self.make_record(0x90, AX = 0x1234, CS = 0xF000, IP = 0xE05C)
+        data = encode_block(bytearray(first + second), 2 * RECORD_SIZE)
+        self.assertEqual(data[:RECORD_SIZE], first)
+        
+        delta = bytearray(data[RECORD_SIZE:])
+        self.assertEqual(delta.count(0), RECORD_SIZE - 1)
+        self.assertEqual(delta[REGISTER_INDEX["IP"] * 2], 0x5B ^ 0x5C)
+        
+    def test_round_trip(self):
+        records = [
+            self.make_record(0xEA, CS = 0xFFFF, IP = 0x0000),
+            self.make_record(0xFA, CS = 0xF000, IP = 0xE05B),
+            self.make_record(0xB4, CS = 0xF000, IP = 0xE05C, AX = 0xD500),
+        ]
+        data = encode_block(bytearray(b"".join(records)), len(records) * RECORD_SIZE)
+        decoded = list(decode_block(data, len(records)))
+        self.assertEqual([opcode for _, opcode in decoded], [0xEA, 0xFA, 0xB4])
+        self.assertEqual(decoded[2][0][REGISTER_INDEX["AX"]], 0xD500)
+        self.assertEqual(decoded[2][0][REGISTER_INDEX["IP"]], 0xE05C)
+        
+    def test_format_text_line(self):
+        registers = [0] * REGISTER_COUNT
+        registers[REGISTER_INDEX["CS"]] = 0xF000
+        registers[REGISTER_INDEX["IP"]] = 0xE05B
+        registers[REGISTER_INDEX["AX"]] = 0x0E41
+        registers[REGISTER_INDEX["BX"]] = 0x0007
+        registers[REGISTER_INDEX["DS"]] = 0x0040
+        self.assertEqual(
+            format_text_line(registers),
+            "f000:e05b\t0x0e\t0x41\tA\t0x0007\t0x0000\t0x0000\t0x0000\t0x0000\t0xf000\t0x0040\t0x0000\r\n",
+        )
+        
+    def test_format_text_line_unprintable(self):
+        self.assertIn("\t???\t", format_text_line([0] * REGISTER_COUNT))
+        
+    def test_bad_magic(self):
+        with self.assertRaises(ValueError):
+            list(read_trace(io.BytesIO(b"NOTATRACE")))
+            
+class BinaryTracerTests(unittest.TestCase):
+    def setUp(self):
+        self.bus = SystemBusTestable()
+        self.memory = RAM(SIXTY_FOUR_KB)
+        self.bus.install_device(0x0000, self.memory)
+        self.cpu = CPU()
+        self.bus.install_cpu(self.cpu)
+        self.cpu.regs.CS = 0x0000
+        self.cpu.regs.IP = 0x0000
+        
+        # INC AX, INC BX, JMP 0000
+        for index, value in enumerate([0x40, 0x43, 0xEB, 0xFC]):
+            self.memory.mem_write_byte(index, value)
+            
+        self.fileptr = io.BytesIO()
+        
+    def run_traced(self, count, **kwargs):
+        tracer = BinaryTracer(self.cpu, self.fileptr, **kwargs)
+        fetch = tracer.traced(self.cpu.fetch)
+        for _ in range(count):
+            fetch()
+        tracer.flush()
+        self.fileptr.seek(0)
+        return tracer
+        
+    def test_trace_round_trip(self):
+        tracer = self.run_traced(7)
+        self.assertEqual(tracer.record_count, 7)
+        
+        records = list(read_trace(self.fileptr))
+        self.assertEqual([opcode for _, opcode in records], [0x40, 0x43, 0xEB] * 2 + [0x40])
+        self.assertEqual([registers[REGISTER_INDEX["IP"]] for registers, _ in records], [0, 1, 2] * 2 + [0])
+        self.assertEqual(records[-1][0][REGISTER_INDEX["AX"]], 2)
+        self.assertEqual(records[-1][0][REGISTER_INDEX["BX"]], 2)
+        
+    def test_flushes_when_buffer_fills(self):
+        tracer = self.run_traced(10, buffer_records = 4)
+        self.assertEqual(tracer.record_count, 10)
+        self.assertEqual(len(list(read_trace(self.fileptr))), 10)
+        
+    def test_uncompressed(self):
+        tracer = self.run_traced(3, compress = False)
+        self.assertEqual(tracer.bytes_written, len(TRACE_MAGIC) + BLOCK_HEADER.size + (3 * RECORD_SIZE))
+        self.assertEqual(len(list(read_trace(self.fileptr))), 3)
+        
+    def test_truncated_block(self):
+        self.run_traced(3, compress = False)
+        with self.assertRaises(ValueError):
+            list(read_trace(io.BytesIO(self.fileptr.getvalue()[:-1])))
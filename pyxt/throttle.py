@@ -0,0 +1,88 @@
+"""
+pyxt.throttle - Paces emulated time against the wall clock.
+"""
+
+# Standard library imports
+import time
+
+# PyXT imports
+from pyxt.timing import CPU_FREQUENCY
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# Don't bother sleeping for less than this, the host's sleep isn't accurate enough and it costs throughput.
+MIN_SLEEP = 0.010
+
+# If the emulator falls further behind than this it doesn't try to catch up, it just carries on from now.
+MAX_LAG = 0.250
+
+# How often the achieved speed is reported.
+REPORT_INTERVAL = 5.0
+
+# Classes
+class Throttle(object):
+    """
+    Holds the emulated machine at a multiple of the 4.77 MHz 8088 clock.
+    
+    A speed of 1.0 is a stock PC/XT, 2.0 twice as fast and so on.  A speed of None runs unthrottled (turbo).
+    """
+    def __init__(self, speed = 1.0, clock = time.time, sleep = time.sleep):
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        
+        # Point that emulated time is measured from.
+        self.start_time = clock()
+        self.start_cycles = 0
+        
+        # Speed measured over the last reporting interval.
+        self.report_time = self.start_time
+        self.report_cycles = 0
+        self.mhz = 0.0
+        
+    @property
+    def turbo(self):
+        """ True if the machine is running unthrottled. """
+        return not self.speed
+        
+    def pace(self, cycles):
+        """
+        Called from the main loop with the CPU's cycle count.
+        
+        If the emulated machine is ahead of the wall clock this sleeps until it isn't, but only once it is
+        at least MIN_SLEEP ahead so the sleeps are few and coarse.  Returns the time slept in seconds.
+        """
+        now = self.clock()
+        if now - self.report_time >= REPORT_INTERVAL:
+            self.report(now, cycles)
+            
+        if self.turbo:
+            return 0.0
+            
+        emulated = float(cycles - self.start_cycles) / (CPU_FREQUENCY * self.speed)
+        ahead = emulated - (now - self.start_time)
+        
+        if ahead >= MIN_SLEEP:
+            self.sleep(ahead)
+            return ahead
+            
+        if ahead < -MAX_LAG:
+            log.debug("Fell %0.3f seconds behind, resetting the throttle.", -ahead)
+            self.start_time = now
+            self.start_cycles = cycles
+            
+        return 0.0
+        
+    def report(self, now, cycles):
+        """ Measure and log the speed achieved since the last report. """
+        elapsed = now - self.report_time
+        if elapsed > 0:
+            self.mhz = (cycles - self.report_cycles) / elapsed / 1000000.0
+            log.info("Emulated CPU speed: %0.2f MHz (%d%%).", self.mhz, round(self.mhz * 100000000.0 / CPU_FREQUENCY))
+            
+        self.report_time = now
+        self.report_cycles = cycles
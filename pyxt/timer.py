@@ -25,6 +25,9 @@ PIT_READ_WRITE_BOTH = 0x03
 
 TIMER_IRQ_LINE = 0
 
+# Input clock of the 8253, 14.31818 MHz / 12.
+PIT_FREQUENCY = 1193182
+
 # Classes
 class Counter(object):
     """ Class containing the configuration for a single PIT channel. """
@@ -109,6 +112,95 @@ class Counter(object):
                 self.output = not self.output
                 self.value = self.count
                 
+    def clocks_until_reload(self, value, output):
+        """ Return the number of clocks until a mode 2 or 3 counter starting at value reloads. """
+        if self.mode == 2:
+            return value or 0x10000
+            
+        # Mode 3 takes one clock to get from an odd value to an even one, then counts down by two.
+        if value & 0x0001:
+            return 1 + (((value - (1 if output else 3)) & 0xFFFF) >> 1)
+        return (value or 0x10000) >> 1
+        
+    def clocks_until_rising_edge(self):
+        """ Return the number of clocks until the output next goes high, or None if it won't on its own. """
+        if not self.enabled:
+            return None
+            
+        if self.mode == 0:
+            if self.output or not self.gate:
+                return None
+            return self.value or 0x10000
+            
+        elif self.mode == 2:
+            return self.clocks_until_reload(self.value, self.output)
+            
+        elif self.mode == 3:
+            clocks = self.clocks_until_reload(self.value, self.output)
+            if self.output:
+                # The next reload takes the output low, it goes high again on the one after that.
+                clocks += self.clocks_until_reload(self.count, False)
+            return clocks
+            
+        return None
+        
+    def fast_forward(self, clocks):
+        """
+        Advance the counter by a number of clocks, ending in the same state as calling clock() that many times.
+        
+        The output callback is called for every output change except those in whole periods that are skipped,
+        those would only repeat the same edges.
+        """
+        if not self.enabled or clocks <= 0:
+            return
+            
+        if self.mode == 0:
+            if self.gate:
+                if clocks >= (self.value or 0x10000):
+                    self.output = True
+                self.value = (self.value - clocks) & 0xFFFF
+            return
+            
+        if self.mode != 2 and self.mode != 3:
+            return
+            
+        # Once the counter reloads its state repeats every period.
+        if self.mode == 2:
+            period = self.count or 0x10000
+        else:
+            period = self.clocks_until_reload(self.count, True) + self.clocks_until_reload(self.count, False)
+            
+        while clocks > 0:
+            remaining = self.clocks_until_reload(self.value, self.output)
+            if clocks < remaining:
+                break
+                
+            # Run up to the clock before the reload and let clock() handle the edge.
+            self.advance_without_reload(remaining - 1)
+            self.clock()
+            clocks -= remaining
+            
+            # Always run at least one whole period so none of the edges are lost.
+            if clocks >= period * 2:
+                clocks = period + (clocks % period)
+                
+        self.advance_without_reload(clocks)
+        
+    def advance_without_reload(self, clocks):
+        """ Advance a mode 2 or 3 counter by fewer clocks than it takes to reload. """
+        if clocks <= 0:
+            return
+            
+        if self.mode == 2:
+            self.value = (self.value - clocks) & 0xFFFF
+            if self.value == 1:
+                self.output = False
+        else:
+            if self.value & 0x0001:
+                self.clock()
+                clocks -= 1
+            self.value = (self.value - (clocks << 1)) & 0xFFFF
+            
     def latch(self):
         """ Latch the running counter into the holding register. """
         self.latched_value = self.value
@@ -211,9 +303,8 @@ class SpeakerChannel(Counter):
                 
 class ProgrammableIntervalTimer(Device):
     """ An IOComponent emulating an 8253 PIT timer. """
-    # This is intentionally not 4 so that it is misaligned with the CPU which currenly assumes 1
-    # clock cycle per instruction.
-    CLOCK_DIVISOR = 2
+    # The PIT input clock is the 8088 clock divided by 4, the scheduler clocks it once per CPU cycle.
+    CLOCK_DIVISOR = 4
     
     def __init__(self, base, **kwargs):
         super(ProgrammableIntervalTimer, self).__init__(**kwargs)
@@ -221,18 +312,55 @@ class ProgrammableIntervalTimer(Device):
         self.channels = [Counter(self.counter_0_callback), Counter(self.counter_1_callback), SpeakerChannel()]
         self.divisor = self.CLOCK_DIVISOR
         
+        # Channel 1 only requests DRAM refresh, while that is elided it is left alone until a program uses it and
+        # this counts the clocks it has missed.  See elide_refresh().
+        self.refresh_elided = False
+        self.refresh_clocks = 0
+        
     # Device interface.
     def clock(self):
         self.divisor -= 1
         if self.divisor == 0:
             self.divisor = self.CLOCK_DIVISOR
-            for channel in self.channels:
-                channel.clock()
+            channels = self.channels
+            channels[0].clock()
+            if self.refresh_elided:
+                self.refresh_clocks += 1
+            else:
+                channels[1].clock()
+            channels[2].clock()
                 
+    def ticks_until_event(self):
+        """ Return the number of ticks until channel 0 raises IRQ0. """
+        clocks = self.channels[0].clocks_until_rising_edge()
+        if clocks is None:
+            return None
+            
+        return self.divisor + ((clocks - 1) * self.CLOCK_DIVISOR)
+        
+    def fast_forward(self, ticks):
+        if ticks < self.divisor:
+            self.divisor -= ticks
+            return
+            
+        ticks -= self.divisor
+        clocks = 1 + (ticks // self.CLOCK_DIVISOR)
+        self.divisor = self.CLOCK_DIVISOR - (ticks % self.CLOCK_DIVISOR)
+        channels = self.channels
+        channels[0].fast_forward(clocks)
+        if self.refresh_elided:
+            self.refresh_clocks += clocks
+        else:
+            channels[1].fast_forward(clocks)
+        channels[2].fast_forward(clocks)
+            
     def get_ports_list(self):
         return [x for x in range(self.base, self.base + 4)]
         
     def io_read_byte(self, port):
+        if self.refresh_clocks:
+            self.sync_refresh_counter()
+            
         offset = port - self.base
         if offset < 3:
             value = self.channels[offset].read()
@@ -244,6 +372,9 @@ class ProgrammableIntervalTimer(Device):
         
     def io_write_byte(self, port, value):
         log.debug("PIT write: port 0x%03x, 0x%02x", port, value)
+        if self.refresh_clocks:
+            self.sync_refresh_counter()
+            
         offset = port - self.base
         if offset < 3:
             self.channels[offset].write(value)
@@ -254,6 +385,37 @@ class ProgrammableIntervalTimer(Device):
             else:
                 self.channels[counter].reconfigure(command, mode, bcd)
                 
+        # Channel 1 may have been given a new count or mode.
+        if self.refresh_elided:
+            self.bus.dma_refresh(self.refresh_period())
+            
+    # DRAM refresh.
+    def elide_refresh(self, value):
+        """
+        API to enable/disable working the DRAM refresh out from the elapsed time instead of clocking it.
+        
+        Channel 1 is only brought up to date when a program reads or programs the timer, and instead of it
+        requesting each refresh cycle the DMA controller is told how often they happen so it can work out
+        channel 0's address and count when they are read.  The timer has to be installed on a bus first.
+        """
+        self.sync_refresh_counter()
+        self.refresh_elided = value
+        self.bus.dma_refresh(self.refresh_period() if value else None)
+        
+    def refresh_period(self):
+        """ Return the number of ticks between channel 1's refresh requests, or None if it isn't making any. """
+        channel = self.channels[1]
+        if not channel.enabled or (channel.mode != 2 and channel.mode != 3):
+            return None
+            
+        return (channel.count or 0x10000) * self.CLOCK_DIVISOR
+        
+    def sync_refresh_counter(self):
+        """ Run channel 1 for the clocks it missed while the refresh was elided. """
+        clocks = self.refresh_clocks
+        self.refresh_clocks = 0
+        self.channels[1].fast_forward(clocks)
+        
     # Local functions.
     @classmethod
     def decode_control_word(cls, value):
@@ -283,7 +445,7 @@ class ProgrammableIntervalTimer(Device):
         """
         Called back when channel 1 reaches terminal count.
         """
-        # We only care about a positive going transition.
-        if value:
+        # We only care about a positive going transition, the DMA controller works these out itself when elided.
+        if value and not self.refresh_elided:
             self.bus.dma_request(0, 0, None)
             
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+pyxt.timing - 8088 instruction timing tables.
+
+Clock counts are from the iAPX 86/88 User's Manual, using the 8088 figures where word memory operands
+take an extra 4 clocks per bus cycle.  Instructions with a data dependent time (MUL, DIV, etc) use the
+middle of the documented range.  Prefetch queue effects and wait states are not modelled.
+
+The tables are indexed by [opcode][modrm] so the CPU can charge an instruction, including the register
+or memory form, the sub-opcode for groups and the effective address calculation, with one lookup.
+Opcodes without a ModRM byte have the same value in every column.
+"""
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+# 8088 clock in a 5150/5160, 14.31818 MHz / 3.
+CPU_FREQUENCY = 4772727
+
+# Each prefix byte (segment override, REP, LOCK) costs 2 clocks.
+PREFIX_CYCLES = 2
+
+# Extra clocks when a conditional jump, LOOP or JCXZ is taken (16 vs 4 for Jcc).
+BRANCH_TAKEN_CYCLES = 12
+
+# Clocks for one iteration of LOOP that jumps back.
+LOOP_ITERATION_CYCLES = 17
+
+# Extra clocks per bit when shifting or rotating by CL.
+SHIFT_COUNT_CYCLES = 4
+
+# Acknowledging and servicing a hardware interrupt.
+INTERRUPT_CYCLES = 61
+
+# Servicing the single-step trap.
+TRAP_CYCLES = 50
+
+# Effective address calculation by r/m for mod 00 and for mod 01/10 (with a displacement).
+EA_CYCLES = (7, 8, 8, 7, 5, 5, 5, 5)
+EA_DISPLACEMENT_CYCLES = (11, 12, 12, 11, 9, 9, 9, 9)
+
+# Mod 00 r/m 110 is a direct 16 bit address.
+EA_DIRECT_CYCLES = 6
+
+# Opcodes without a ModRM byte.
+SIMPLE_OPCODE_CYCLES = {
+    0x06 : 14, 0x07 : 12, 0x0E : 14, 0x0F : 12, 0x16 : 14, 0x17 : 12, 0x1E : 14, 0x1F : 12, # PUSH/POP seg
+    0x27 : 4, 0x2F : 4, 0x37 : 8, 0x3F : 8, # DAA, DAS, AAA, AAS
+    0x90 : 3, # NOP
+    0x98 : 2, 0x99 : 5, # CBW, CWD
+    0x9A : 36, # CALL far
+    0x9B : 4, # WAIT
+    0x9C : 14, 0x9D : 12, # PUSHF, POPF
+    0x9E : 4, 0x9F : 4, # SAHF, LAHF
+    0xA0 : 10, 0xA1 : 14, 0xA2 : 10, 0xA3 : 14, # MOV acc <-> moffs
+    0xA4 : 18, 0xA5 : 26, # MOVS
+    0xA6 : 22, 0xA7 : 30, # CMPS
+    0xA8 : 4, 0xA9 : 4, # TEST acc, imm
+    0xAA : 11, 0xAB : 15, # STOS
+    0xAC : 12, 0xAD : 16, # LODS
+    0xAE : 15, 0xAF : 19, # SCAS
+    0xC0 : 24, 0xC1 : 20, 0xC2 : 24, 0xC3 : 20, # RET (C0/C1 are undocumented aliases)
+    0xC8 : 33, 0xC9 : 34, 0xCA : 33, 0xCB : 34, # RETF (C8/C9 are undocumented aliases)
+    0xCC : 72, 0xCD : 71, 0xCE : 4, 0xCF : 44, # INT 3, INT, INTO, IRET
+    0xD4 : 83, 0xD5 : 60, 0xD6 : 4, 0xD7 : 11, # AAM, AAD, SALC, XLAT
+    0xE0 : 5, 0xE1 : 6, 0xE2 : 5, 0xE3 : 6, # LOOPNZ, LOOPZ, LOOP, JCXZ (not taken)
+    0xE4 : 10, 0xE5 : 14, 0xE6 : 10, 0xE7 : 14, # IN/OUT imm8
+    0xE8 : 23, 0xE9 : 15, 0xEA : 15, 0xEB : 15, # CALL, JMP near, JMP far, JMP short
+    0xEC : 8, 0xED : 12, 0xEE : 8, 0xEF : 12, # IN/OUT DX
+    0xF0 : 2, 0xF1 : 2, 0xF2 : 2, 0xF3 : 2, # Prefixes
+    0xF4 : 2, 0xF5 : 2, # HLT, CMC
+    0xF8 : 2, 0xF9 : 2, 0xFA : 2, 0xFB : 2, 0xFC : 2, 0xFD : 2, # CLC, STC, CLI, STI, CLD, STD
+}
+for __opcode in range(0x40, 0x50):
+    SIMPLE_OPCODE_CYCLES[__opcode] = 3 # INC/DEC reg16
+for __opcode in range(0x50, 0x58):
+    SIMPLE_OPCODE_CYCLES[__opcode] = 15 # PUSH reg16
+for __opcode in range(0x58, 0x60):
+    SIMPLE_OPCODE_CYCLES[__opcode] = 12 # POP reg16
+for __opcode in range(0x60, 0x80):
+    SIMPLE_OPCODE_CYCLES[__opcode] = 4 # Jcc not taken (60-6F alias 70-7F on the 8088)
+for __opcode in range(0x91, 0x98):
+    SIMPLE_OPCODE_CYCLES[__opcode] = 3 # XCHG AX, reg16
+for __opcode in range(0xB0, 0xC0):
+    SIMPLE_OPCODE_CYCLES[__opcode] = 4 # MOV reg, imm
+    
+# Opcodes with a ModRM byte as (register form, memory form excluding the EA calculation).
+MODRM_OPCODE_CYCLES = {
+    0x84 : (3, 9), 0x85 : (3, 13), # TEST r/m, reg
+    0x86 : (4, 17), 0x87 : (4, 25), # XCHG r/m, reg
+    0x88 : (2, 9), 0x89 : (2, 13), 0x8A : (2, 8), 0x8B : (2, 12), # MOV
+    0x8C : (2, 13), 0x8D : (2, 2), 0x8E : (2, 12), # MOV r/m, seg; LEA; MOV seg, r/m
+    0x8F : (12, 25), # POP r/m
+    0xC4 : (24, 24), 0xC5 : (24, 24), # LES, LDS
+    0xC6 : (4, 10), 0xC7 : (4, 14), # MOV r/m, imm
+}
+for __opcode in range(0x00, 0x40, 0x08):
+    MODRM_OPCODE_CYCLES[__opcode] = (3, 16) # ALU r/m8, r8
+    MODRM_OPCODE_CYCLES[__opcode + 1] = (3, 24) # ALU r/m16, r16
+    MODRM_OPCODE_CYCLES[__opcode + 2] = (3, 9) # ALU r8, r/m8
+    MODRM_OPCODE_CYCLES[__opcode + 3] = (3, 13) # ALU r16, r/m16
+    SIMPLE_OPCODE_CYCLES[__opcode + 4] = 4 # ALU AL, imm8
+    SIMPLE_OPCODE_CYCLES[__opcode + 5] = 4 # ALU AX, imm16
+    
+# CMP doesn't write the result back.
+MODRM_OPCODE_CYCLES[0x38] = (3, 9)
+MODRM_OPCODE_CYCLES[0x39] = (3, 13)
+
+for __opcode in range(0xD8, 0xE0):
+    MODRM_OPCODE_CYCLES[__opcode] = (2, 8) # ESC
+    
+# Group opcodes where the reg field selects the operation, (register form, memory form) for each sub-opcode.
+GROUP_OPCODE_CYCLES = {
+    0x80 : [(4, 17)] * 7 + [(4, 10)],
+    0x81 : [(4, 25)] * 7 + [(4, 14)],
+    0x82 : [(4, 17)] * 7 + [(4, 10)],
+    0x83 : [(4, 25)] * 7 + [(4, 14)],
+    0xD0 : [(2, 15)] * 8,
+    0xD1 : [(2, 23)] * 8,
+    0xD2 : [(8, 20)] * 8,
+    0xD3 : [(8, 28)] * 8,
+    # TEST, TEST, NOT, NEG, MUL, IMUL, DIV, IDIV
+    0xF6 : [(5, 11), (5, 11), (3, 16), (3, 16), (74, 80), (89, 95), (85, 91), (107, 113)],
+    0xF7 : [(5, 15), (5, 15), (3, 24), (3, 24), (126, 136), (141, 151), (153, 163), (175, 185)],
+    # INC, DEC
+    0xFE : [(3, 15)] * 8,
+    # INC, DEC, CALL near, CALL far, JMP near, JMP far, PUSH, PUSH
+    0xFF : [(3, 23), (3, 23), (20, 29), (53, 53), (11, 22), (24, 32), (15, 24), (15, 24)],
+}
+
+# String instructions under REP as (clocks to start, clocks per iteration).
+REP_START_CYCLES = 9
+REP_ITERATION_CYCLES = {
+    0xA4 : 17, 0xA5 : 25, # MOVS
+    0xA6 : 22, 0xA7 : 30, # CMPS
+    0xAA : 10, 0xAB : 14, # STOS
+    0xAC : 13, 0xAD : 17, # LODS
+    0xAE : 15, 0xAF : 19, # SCAS
+}
+
+# Functions
+def effective_address_cycles(modrm):
+    """ Return the clocks to calculate the effective address for a ModRM byte, zero for a register operand. """
+    mod = modrm >> 6
+    rm = modrm & 0x07
+    if mod == 3:
+        return 0
+    elif mod == 0 and rm == 6:
+        return EA_DIRECT_CYCLES
+    elif mod == 0:
+        return EA_CYCLES[rm]
+    else:
+        return EA_DISPLACEMENT_CYCLES[rm]
+        
+def build_instruction_cycles():
+    """
+    Build the [opcode][modrm] table of instruction clocks.
+    
+    Many opcodes with a ModRM byte share the same timings, so their rows are only built once and shared, the table
+    is never written to.
+    """
+    ea_cycles = [effective_address_cycles(modrm) for modrm in range(256)]
+    rows = {}
+    
+    def modrm_row(timings):
+        """ Return the row for a list of (register, memory) clocks indexed by the ModRM reg field. """
+        timings = tuple(timings)
+        if timings not in rows:
+            rows[timings] = [timings[(modrm >> 3) & 0x07][0] if modrm >= 0xC0
+                             else timings[(modrm >> 3) & 0x07][1] + ea_cycles[modrm] for modrm in range(256)]
+        return rows[timings]
+        
+    table = []
+    for opcode in range(256):
+        if opcode in GROUP_OPCODE_CYCLES:
+            row = modrm_row(GROUP_OPCODE_CYCLES[opcode])
+        elif opcode in MODRM_OPCODE_CYCLES:
+            row = modrm_row([MODRM_OPCODE_CYCLES[opcode]] * 8)
+        else:
+            row = [SIMPLE_OPCODE_CYCLES.get(opcode, 4)] * 256
+        table.append(row)
+        
+    return table
+    
+def build_rep_cycles():
+    """
+    Build the table of (start, per iteration) clocks for REP string instructions.
+    
+    The start value is adjusted for the prefix and single instruction clocks that are charged anyway,
+    so the total for a repeated instruction comes out as start + (iterations * per iteration).
+    """
+    table = [(0, 0)] * 256
+    for opcode, per_iteration in REP_ITERATION_CYCLES.items():
+        start = REP_START_CYCLES - PREFIX_CYCLES - SIMPLE_OPCODE_CYCLES[opcode]
+        table[opcode] = (start, per_iteration)
+        
+    return table
+    
+INSTRUCTION_CYCLES = build_instruction_cycles()
+REP_CYCLES = build_rep_cycles()
@@ -0,0 +1,225 @@
+"""
+pyxt.trace - Compact binary instruction trace.
+
+While tracing the registers are copied as they are into a preallocated ring buffer before each instruction,
+along with the first opcode byte.  When the buffer fills it is encoded as a block of deltas
+(each record XORed with the previous one, so unchanged registers are zeros), optionally compressed,
+and written out in one go.
+
+Run "python -m pyxt.trace trace.bin" to decode a trace into the text format of the debugger's old trace.log.
+Traces only hold the registers, so to show each instruction disassembled the code has to be given as memory
+images with --image, e.g. "--image bios.bin@fe000" for the BIOS ROM.
+"""
+
+from __future__ import print_function
+
+# Standard library imports
+import sys
+import zlib
+import struct
+from binascii import hexlify, unhexlify
+from ctypes import c_char, memmove, addressof, sizeof
+from optparse import OptionParser
+
+# Six imports
+from six.moves import range # pylint: disable=redefined-builtin
+
+# PyXT imports
+from pyxt.cpu import WordRegs
+from pyxt.disassembler import disassemble
+
+# Logging setup
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Constants
+TRACE_MAGIC = b"PYXTTRC1"
+
+# Registers in the order they are laid out in memory (and in each record).
+REGISTER_NAMES = tuple(name for name, _ in WordRegs._fields_) # pylint: disable=protected-access
+REGISTER_COUNT = len(REGISTER_NAMES)
+REGISTER_INDEX = dict((name, index) for index, name in enumerate(REGISTER_NAMES))
+
+# Raw records in the ring buffer are the register block followed by the opcode byte.
+REGS_SIZE = sizeof(WordRegs)
+RECORD_SIZE = REGS_SIZE + 1
+
+# About 1.7 MB of buffer, so blocks are written a few times a second at full speed.
+DEFAULT_BUFFER_RECORDS = 65536
+
+# Block header: flags, record count, stored size.
+BLOCK_HEADER = struct.Struct("<BII")
+BLOCK_COMPRESSED = 0x01
+
+# zlib's default level, the faster levels cost nearly twice the space for little saving in time.
+COMPRESSION_LEVEL = 6
+
+RAW_REGISTERS = struct.Struct("<%dH" % REGISTER_COUNT)
+
+# Size of the memory images are loaded into for disassembly.
+IMAGE_SIZE = 0x100000
+
+# Functions
+def encode_block(buffer, length):
+    """
+    Encode length bytes of raw records as deltas, each record is XORed with the one before it.
+    
+    Registers that didn't change come out as runs of zeros for the compressor.  The whole block is
+    handled as one big integer so the work is done in C rather than a Python loop per record.
+    """
+    current = int(hexlify(bytes(buffer[:length])), 16)
+    return unhexlify("%0*x" % (length * 2, current ^ (current >> (RECORD_SIZE * 8))))
+    
+def decode_block(data, count):
+    """ Generate (registers, opcode) for each of count records in an encoded block. """
+    state = 0
+    for offset in range(0, count * RECORD_SIZE, RECORD_SIZE):
+        state ^= int(hexlify(data[offset:offset + RECORD_SIZE]), 16)
+        record = unhexlify("%0*x" % (RECORD_SIZE * 2, state))
+        yield RAW_REGISTERS.unpack_from(record, 0), bytearray(record)[REGS_SIZE]
+        
+def read_trace(fileptr):
+    """ Generate (registers, opcode) for every record in a binary trace file. """
+    if fileptr.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        raise ValueError("Not a PyXT binary trace.")
+        
+    while True:
+        header = fileptr.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return
+            
+        flags, count, stored_size = BLOCK_HEADER.unpack(header)
+        data = fileptr.read(stored_size)
+        if flags & BLOCK_COMPRESSED:
+            data = zlib.decompress(data)
+        if len(data) != count * RECORD_SIZE:
+            raise ValueError("Truncated trace block.")
+            
+        for record in decode_block(data, count):
+            yield record
+            
+def format_text_line(registers):
+    """ Format a record's registers as a line of the debugger's text trace. """
+    ax = registers[REGISTER_INDEX["AX"]]
+    al = ax & 0xFF
+    return "\t".join([
+        "%04x:%04x" % (registers[REGISTER_INDEX["CS"]], registers[REGISTER_INDEX["IP"]]),
+        "0x%02x" % (ax >> 8),
+        "0x%02x" % al,
+        "%s" % (chr(al) if al >= 0x20 and al < 0x7F else "???"),
+        "0x%04x" % registers[REGISTER_INDEX["BX"]],
+        "0x%04x" % registers[REGISTER_INDEX["CX"]],
+        "0x%04x" % registers[REGISTER_INDEX["DX"]],
+        "0x%04x" % registers[REGISTER_INDEX["SI"]],
+        "0x%04x" % registers[REGISTER_INDEX["DI"]],
+        "0x%04x" % registers[REGISTER_INDEX["CS"]],
+        "0x%04x" % registers[REGISTER_INDEX["DS"]],
+        "0x%04x" % registers[REGISTER_INDEX["ES"]],
+    ]) + "\r\n"
+    
+def load_images(images):
+    """ Load FILE or FILE@ADDRESS (hex) images into a bytearray of the 1 MB address space. """
+    memory = bytearray(IMAGE_SIZE)
+    for image in images:
+        filename, _, address = image.partition("@")
+        address = int(address, 16) if address else 0
+        with open(filename, "rb") as fileptr:
+            data = bytearray(fileptr.read())[:IMAGE_SIZE - address]
+        memory[address:address + len(data)] = data
+    return memory
+    
+def main():
+    """ Decode a binary trace to text on stdout. """
+    parser = OptionParser(usage = "%prog [options] TRACE_FILE")
+    parser.add_option("--min-segment", action = "store", dest = "min_segment", default = "0",
+                      help = "Only output instructions with CS at or above this segment (hex), default: 0.")
+    parser.add_option("--image", action = "append", dest = "images", default = [],
+                      help = "Memory image to disassemble the traced code from, as FILE or FILE@ADDRESS (hex).")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("A trace file is required.")
+        
+    min_segment = int(options.min_segment, 16)
+    cs_index = REGISTER_INDEX["CS"]
+    ip_index = REGISTER_INDEX["IP"]
+    read_byte = load_images(options.images).__getitem__ if options.images else None
+    with open(args[0], "rb") as fileptr:
+        for registers, _opcode in read_trace(fileptr):
+            if registers[cs_index] >= min_segment:
+                line = format_text_line(registers)
+                if read_byte is not None:
+                    _length, text = disassemble(read_byte, registers[cs_index], registers[ip_index])
+                    line = line[:-2] + "\t" + text + "\r\n"
+                sys.stdout.write(line)
+                
+# Classes
+class BinaryTracer(object):
+    """ Records every instruction the CPU runs to a binary trace file. """
+    def __init__(self, cpu, fileptr, compress = True, buffer_records = DEFAULT_BUFFER_RECORDS):
+        self.cpu = cpu
+        self.fileptr = fileptr
+        self.compress = compress
+        
+        # The registers are copied straight out of the CPU's ctypes structure into the buffer.
+        self.regs_address = addressof(cpu.regs)
+        self.buffer_size = buffer_records * RECORD_SIZE
+        self.buffer = bytearray(self.buffer_size)
+        self.buffer_address = addressof((c_char * self.buffer_size).from_buffer(self.buffer))
+        self.offset = 0
+        
+        self.record_count = 0
+        self.bytes_written = len(TRACE_MAGIC)
+        fileptr.write(TRACE_MAGIC)
+        
+    def record(self, opcode):
+        """ Record the current registers and the opcode about to be run. """
+        offset = self.offset
+        memmove(self.buffer_address + offset, self.regs_address, REGS_SIZE)
+        self.buffer[offset + REGS_SIZE] = opcode
+        offset += RECORD_SIZE
+        if offset == self.buffer_size:
+            self.offset = offset
+            self.flush()
+        else:
+            self.offset = offset
+            
+    def traced(self, fetch):
+        """ Return a fetch() that records each instruction before running it with the supplied one. """
+        regs = self.cpu.regs
+        mem_read_byte = self.cpu.bus.mem_read_byte
+        record = self.record
+        
+        def _fetch():
+            record(mem_read_byte(((regs.CS << 4) + regs.IP) & 0xFFFFF))
+            fetch()
+            
+        return _fetch
+        
+    def flush(self):
+        """ Encode and write out the records in the buffer. """
+        if self.offset == 0:
+            return
+            
+        count = self.offset // RECORD_SIZE
+        data = encode_block(self.buffer, self.offset)
+        flags = 0
+        if self.compress:
+            data = zlib.compress(data, COMPRESSION_LEVEL)
+            flags |= BLOCK_COMPRESSED
+            
+        self.fileptr.write(BLOCK_HEADER.pack(flags, count, len(data)))
+        self.fileptr.write(data)
+        
+        self.record_count += count
+        self.bytes_written += BLOCK_HEADER.size + len(data)
+        self.offset = 0
+        
+    def close(self):
+        """ Flush the remaining records and close the file. """
+        self.flush()
+        self.fileptr.close()
+        log.info("Traced %d instructions in %d bytes.", self.record_count, self.bytes_written)
+        
+if __name__ == "__main__":
+    main()